@@ -1,18 +1,31 @@
-from fastapi import APIRouter, HTTPException, Depends
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Dict, Any, Literal, Optional, Tuple
+import asyncio
+import json
 import logging
-from datetime import datetime
+import time
+from datetime import datetime, timezone
 
-from app.services.claude_service import ClaudeService
+from app.services.claude_service import ClaudeService, get_claude_service
+from app.services.conversation_store import (
+    CONVERSATION_ID_PATTERN,
+    ConversationStore,
+    get_conversation_store,
+    new_conversation_id
+)
+from app.services.persistence import PersistenceWriter, get_persistence_writer
+from app.services.rate_limiter import RateLimitExceeded
+from app.services.resilience import ClaudeServiceError
+from app.services.suggestion_store import SuggestionStore, get_suggestion_store
+from app.services.token_budget import current_user_id
+from app.services.upstream_scheduler import UpstreamScheduler, get_upstream_scheduler
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
-# Initialize Claude service (will be properly injected in production)
-claude_service = ClaudeService()
-
 # Pydantic models
 class ChatMessage(BaseModel):
     role: str
@@ -22,8 +35,13 @@ class ChatMessage(BaseModel):
 class ChatRequest(BaseModel):
     message: str
     context: Optional[Dict[str, Any]] = None
+    # With a known conversation_id only the new message is needed; the history is kept server-side.
+    # conversation_history is used to start a conversation, or to re-seed one that has expired.
+    conversation_id: Optional[str] = Field(default=None, pattern=CONVERSATION_ID_PATTERN)
     conversation_history: Optional[List[ChatMessage]] = None
     system_prompt: Optional[str] = None
+    # "interactive" trades depth for speed, "batch" the other way round
+    latency_slo: Optional[Literal["interactive", "standard", "batch"]] = None
 
 class ChatResponse(BaseModel):
     content: str
@@ -32,67 +50,183 @@ class ChatResponse(BaseModel):
     usage: Dict[str, int]
     context_used: bool
     suggestions: Optional[List[str]] = None
+    suggestions_id: Optional[str] = None
+    conversation_id: Optional[str] = None
 
 class ProactiveSuggestionsRequest(BaseModel):
     context: Dict[str, Any]
 
 @router.post("/message", response_model=ChatResponse)
-async def send_message(request: ChatRequest):
+async def send_message(
+    request: ChatRequest,
+    claude_service: ClaudeService = Depends(get_claude_service),
+    suggestion_store: SuggestionStore = Depends(get_suggestion_store),
+    conversation_store: ConversationStore = Depends(get_conversation_store),
+    persistence: PersistenceWriter = Depends(get_persistence_writer)
+):
     """Send a message to Claude and get a response"""
     
     try:
         if not request.message.strip():
             raise HTTPException(status_code=400, detail="Message cannot be empty")
         
-        # Convert conversation history to dict format
-        history = None
-        if request.conversation_history:
-            history = [
-                {
-                    "role": msg.role,
-                    "content": msg.content,
-                    "timestamp": msg.timestamp or datetime.utcnow().isoformat()
-                }
-                for msg in request.conversation_history
-            ]
+        conversation_id, history, seed = await _resolve_conversation(request, conversation_store)
+        
+        # Generate proactive suggestions concurrently with the response if context is available
+        started = time.perf_counter()
+        started_at = datetime.now(timezone.utc)
+        suggestions_task = None
+        if request.context:
+            suggestions_task = asyncio.create_task(
+                claude_service.generate_proactive_suggestions(request.context)
+            )
         
         # Generate response using Claude
-        response = await claude_service.generate_response(
-            message=request.message,
+        try:
+            response = await claude_service.generate_response(
+                message=request.message,
+                context=request.context,
+                conversation_history=history,
+                system_prompt=request.system_prompt,
+                slo=request.latency_slo
+            )
+        except BaseException:
+            if suggestions_task:
+                suggestions_task.cancel()
+            raise
+        
+        suggestions, suggestions_id = None, None
+        if suggestions_task:
+            suggestions, suggestions_id = await suggestion_store.resolve(suggestions_task, started)
+        
+        if conversation_id:
+            await _save_turn(conversation_store, conversation_id, seed, request.message, response["content"])
+        
+        persistence.record_turn(
+            conversation_id,
+            request.message,
+            response["content"],
+            model=response["model"],
+            processing_time=time.perf_counter() - started,
             context=request.context,
-            conversation_history=history,
-            system_prompt=request.system_prompt
+            started_at=started_at,
+            user_id=current_user_id()
         )
         
-        # Generate proactive suggestions if context is available
-        suggestions = []
-        if request.context:
-            try:
-                suggestions = await claude_service.generate_proactive_suggestions(request.context)
-            except Exception as e:
-                logger.warning(f"Failed to generate suggestions: {str(e)}")
-        
         return ChatResponse(
             content=response["content"],
             model=response["model"],
             timestamp=response["timestamp"],
             usage=response["usage"],
             context_used=response["context_used"],
-            suggestions=suggestions if suggestions else None
+            suggestions=suggestions if suggestions else None,
+            suggestions_id=suggestions_id,
+            conversation_id=conversation_id
         )
         
-    except HTTPException:
+    except (HTTPException, RateLimitExceeded, ClaudeServiceError):
         raise
     except Exception as e:
         logger.error(f"Chat message error: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to process message: {str(e)}")
 
+@router.post("/message/stream")
+async def stream_message(
+    request: ChatRequest,
+    claude_service: ClaudeService = Depends(get_claude_service),
+    suggestion_store: SuggestionStore = Depends(get_suggestion_store),
+    conversation_store: ConversationStore = Depends(get_conversation_store),
+    persistence: PersistenceWriter = Depends(get_persistence_writer)
+):
+    """Send a message to Claude and stream the response as Server-Sent Events"""
+    
+    if not request.message.strip():
+        raise HTTPException(status_code=400, detail="Message cannot be empty")
+    
+    if not claude_service.is_available():
+        raise HTTPException(status_code=503, detail="Claude service is not available")
+    
+    # Resolved before the stream starts so an unknown conversation is a plain 404
+    conversation_id, history, seed = await _resolve_conversation(request, conversation_store)
+    
+    async def event_stream():
+        started = time.perf_counter()
+        started_at = datetime.now(timezone.utc)
+        suggestions_task, suggestions_id = None, None
+        parts: List[str] = []
+        if request.context:
+            suggestions_task = asyncio.create_task(
+                claude_service.generate_proactive_suggestions(request.context)
+            )
+        
+        try:
+            async for event in claude_service.stream_response(
+                message=request.message,
+                context=request.context,
+                conversation_history=history,
+                system_prompt=request.system_prompt,
+                slo=request.latency_slo
+            ):
+                if event["type"] == "delta":
+                    parts.append(event["text"])
+                    yield _sse("token", {"text": event["text"]})
+                    continue
+                
+                # Stored before the final frame, so a follow-up sent on receiving it sees this turn
+                reply = "".join(parts)
+                if conversation_id:
+                    await _save_turn(conversation_store, conversation_id, seed, request.message, reply)
+                persistence.record_turn(
+                    conversation_id,
+                    request.message,
+                    reply,
+                    model=event["model"],
+                    processing_time=time.perf_counter() - started,
+                    context=request.context,
+                    started_at=started_at,
+                    user_id=current_user_id()
+                )
+                
+                # Suggestions are sent with the final frame so they never delay the first token
+                suggestions = None
+                if suggestions_task:
+                    suggestions, suggestions_id = await suggestion_store.resolve(suggestions_task, started)
+                
+                event.pop("type")
+                event["suggestions"] = suggestions if suggestions else None
+                event["suggestions_id"] = suggestions_id
+                event["conversation_id"] = conversation_id
+                yield _sse("done", event)
+                
+        except RateLimitExceeded as e:
+            yield _sse("error", {"detail": str(e), "status": 429, "retry_after": e.retry_after_header()})
+        except ClaudeServiceError as e:
+            yield _sse("error", {"detail": str(e), "status": e.status_code, "retry_after": e.retry_after})
+        except Exception as e:
+            logger.error(f"Chat stream error: {str(e)}", exc_info=True)
+            yield _sse("error", {"detail": f"Failed to process message: {str(e)}"})
+        finally:
+            # Suggestions still belong to this stream unless they were parked in the store
+            if suggestions_task and suggestions_id is None:
+                suggestions_task.cancel()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/suggestions")
-async def get_proactive_suggestions(request: ProactiveSuggestionsRequest):
+async def get_proactive_suggestions(
+    request: ProactiveSuggestionsRequest,
+    http_request: Request,
+    claude_service: ClaudeService = Depends(get_claude_service),
+    scheduler: UpstreamScheduler = Depends(get_upstream_scheduler)
+):
     """Get proactive suggestions based on context"""
     
     try:
-        suggestions = await claude_service.generate_proactive_suggestions(request.context)
+        suggestions = await scheduler.run(http_request, claude_service.generate_proactive_suggestions(request.context))
         
         return {
             "suggestions": suggestions,
@@ -100,25 +234,125 @@ async def get_proactive_suggestions(request: ProactiveSuggestionsRequest):
             "context_url": request.context.get("url", "unknown")
         }
         
+    except ClaudeServiceError:
+        raise
     except Exception as e:
         logger.error(f"Proactive suggestions error: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to generate suggestions: {str(e)}")
 
+@router.get("/suggestions/{suggestions_id}")
+async def get_pending_suggestions(
+    suggestions_id: str,
+    suggestion_store: SuggestionStore = Depends(get_suggestion_store)
+):
+    """Get suggestions that were not ready when their response was sent"""
+    
+    result = await suggestion_store.get(suggestions_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Suggestions not found or expired")
+    
+    return {
+        "suggestions_id": suggestions_id,
+        "status": result["status"],
+        "suggestions": result["suggestions"],
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+@router.get("/conversations/{conversation_id}")
+async def get_conversation(
+    conversation_id: str,
+    conversation_store: ConversationStore = Depends(get_conversation_store)
+):
+    """Get the stored history of a conversation"""
+    
+    messages = await conversation_store.load(conversation_id) if conversation_store.valid_id(conversation_id) else None
+    if messages is None:
+        raise HTTPException(status_code=404, detail="Conversation not found or expired")
+    
+    return {
+        "conversation_id": conversation_id,
+        "messages": messages,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+@router.delete("/conversations/{conversation_id}")
+async def delete_conversation(
+    conversation_id: str,
+    conversation_store: ConversationStore = Depends(get_conversation_store)
+):
+    """Forget a conversation"""
+    
+    if not conversation_store.valid_id(conversation_id):
+        raise HTTPException(status_code=404, detail="Conversation not found or expired")
+    
+    await conversation_store.delete(conversation_id)
+    return {"conversation_id": conversation_id, "deleted": True}
+
 @router.get("/models")
-async def get_available_models():
-    """Get information about available AI models"""
+async def get_available_models(claude_service: ClaudeService = Depends(get_claude_service)):
+    """Get the models in use and the routing table that picks between them per task and latency SLO"""
+    
+    table = claude_service.router.get_table()
+    available = claude_service.is_available()
     
     return {
         "models": [
             {
-                "id": settings.CLAUDE_MODEL,
-                "name": "Claude 3.5 Sonnet",
+                "id": tier["model"],
+                "tier": name,
                 "provider": "Anthropic",
-                "max_tokens": settings.CLAUDE_MAX_TOKENS,
-                "temperature": settings.CLAUDE_TEMPERATURE,
-                "available": claude_service.is_available()
+                "available": available and tier["available"]
             }
+            for name, tier in table["tiers"].items()
         ],
         "default_model": settings.CLAUDE_MODEL,
+        "routing": table["routes"],
+        "routing_stats": table["stats"],
         "timestamp": datetime.utcnow().isoformat()
-    }
\ No newline at end of file
+    }
+
+def _history_to_dicts(request: ChatRequest) -> Optional[List[Dict[str, str]]]:
+    """Convert conversation history to dict format"""
+    if not request.conversation_history:
+        return None
+    
+    return [{"role": msg.role, "content": msg.content} for msg in request.conversation_history]
+
+async def _resolve_conversation(
+    request: ChatRequest,
+    store: ConversationStore
+) -> Tuple[Optional[str], Optional[List[Dict[str, str]]], Optional[List[Dict[str, str]]]]:
+    """Find the conversation a message belongs to: its id, the history to send, and the messages that start it (None if it already exists)"""
+    history = _history_to_dicts(request)
+    if not store.enabled:
+        return None, history, None
+    
+    if request.conversation_id:
+        stored = await store.load(request.conversation_id)
+        if stored is not None:
+            return request.conversation_id, stored, None
+        if not history:
+            raise HTTPException(status_code=404, detail="Conversation not found or expired")
+        # Expired, or kept by another worker without a shared store: the client's copy takes over
+        return request.conversation_id, history, history
+    
+    return new_conversation_id(), history, history or []
+
+async def _save_turn(
+    store: ConversationStore,
+    conversation_id: str,
+    seed: Optional[List[Dict[str, str]]],
+    message: str,
+    reply: str
+):
+    """Store the new exchange, after the seed history when the conversation is new"""
+    turn = [{"role": "user", "content": message}, {"role": "assistant", "content": reply}]
+    try:
+        await store.append(conversation_id, (seed or []) + turn, created=seed is not None)
+    except Exception as e:
+        # The reply is still good; the client can re-seed the conversation from its own copy
+        logger.warning(f"Failed to store conversation turn: {str(e)}")
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    """Format a Server-Sent Event frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
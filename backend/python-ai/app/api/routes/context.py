@@ -1,18 +1,29 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Literal, Tuple
+import asyncio
+import json
 import logging
+import time
 from datetime import datetime
 
-from app.services.claude_service import ClaudeService
+from app.services.claude_service import ClaudeService, get_claude_service
+from app.services.context_monitor import MonitorSession, PageState, monitor_registry
+from app.services.page_analysis import PageAnalysis
+from app.services.page_classifier import GENERAL, page_classifier
+from app.services.persistence import PersistenceWriter, get_persistence_writer
+from app.services.rate_limiter import RateLimitExceeded, get_client_id, rate_limiter
+from app.services.resilience import CircuitOpenError, ClaudeServiceError, deadline_scope
+from app.services.content_extractor import ExtractedContent, extract_content_async, looks_like_html
+from app.services.suggestion_store import SuggestionStore, get_suggestion_store
+from app.services.token_budget import current_user_id
+from app.services.upstream_scheduler import UpstreamScheduler, get_upstream_scheduler, priority_scope
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
-# Initialize Claude service
-claude_service = ClaudeService()
-
 # Pydantic models
 class ContextAnalysisRequest(BaseModel):
     url: str
@@ -21,11 +32,51 @@ class ContextAnalysisRequest(BaseModel):
     metadata: Optional[Dict[str, Any]] = None
 
 class ContextAnalysisResponse(BaseModel):
-    analysis: str
+    analysis: PageAnalysis
     url: str
     timestamp: str
     model: str
     suggestions: Optional[List[str]] = None
+    suggestions_id: Optional[str] = None
+
+class BatchAnalysisRequest(BaseModel):
+    items: List[ContextAnalysisRequest]
+    mode: Literal["stream", "async"] = "stream"
+    max_concurrency: Optional[int] = None
+
+# Suggestions used instead of an LLM call when the page type is known with confidence
+PAGE_TYPE_SUGGESTIONS: Dict[str, List[str]] = {
+    "e-commerce": [
+        "Compare this product with similar alternatives",
+        "Summarize the customer reviews",
+        "Check shipping, returns and warranty details",
+    ],
+    "social-media": [
+        "Summarize the main discussions in this feed",
+        "Draft a reply to a post",
+        "Find the most relevant posts for a topic",
+    ],
+    "developer-tools": [
+        "Summarize this issue or pull request",
+        "Explain the code or error shown here",
+        "Suggest next steps to resolve the problem",
+    ],
+    "documentation": [
+        "Explain this section in simpler terms",
+        "Show an example of how to use this",
+        "Find the part of the docs that answers a question",
+    ],
+    "content": [
+        "Summarize this article",
+        "List the key points and takeaways",
+        "Find related background on this topic",
+    ],
+    "form-page": [
+        "Help me fill out this form",
+        "Explain what each field is asking for",
+        "Check the form for missing required fields",
+    ],
+}
 
 class PageInsight(BaseModel):
     type: str
@@ -41,86 +92,421 @@ class EnhancedContextRequest(BaseModel):
     dom_elements: Optional[List[Dict[str, str]]] = None
 
 @router.post("/analyze", response_model=ContextAnalysisResponse)
-async def analyze_context(request: ContextAnalysisRequest):
+async def analyze_context(
+    request: ContextAnalysisRequest,
+    http_request: Request,
+    claude_service: ClaudeService = Depends(get_claude_service),
+    suggestion_store: SuggestionStore = Depends(get_suggestion_store),
+    persistence: PersistenceWriter = Depends(get_persistence_writer),
+    scheduler: UpstreamScheduler = Depends(get_upstream_scheduler)
+):
     """Analyze page context and provide insights"""
     
     try:
         if not request.url or not request.page_content:
             raise HTTPException(status_code=400, detail="URL and page content are required")
         
-        # Analyze context using Claude
-        analysis = await claude_service.analyze_context(
-            url=request.url,
-            page_content=request.page_content,
-            user_intent=request.user_intent
-        )
+        page_content, extracted = await _extract_page_content(request.page_content)
         
-        # Generate contextual suggestions
+        # Generate contextual suggestions concurrently with the analysis
         context_for_suggestions = {
             "url": request.url,
-            "content": request.page_content[:1000],  # Truncate for efficiency
+            "title": extracted.title if extracted else None,
+            "content": page_content,
             "userIntent": request.user_intent,
             "metadata": request.metadata
         }
         
-        suggestions = await claude_service.generate_proactive_suggestions(context_for_suggestions)
+        started = time.perf_counter()
+        suggestions_task = asyncio.create_task(
+            claude_service.generate_proactive_suggestions(context_for_suggestions)
+        )
+        
+        # Analyze context using Claude, stopping if the client leaves or its tab moves on
+        try:
+            analysis = await scheduler.run(http_request, claude_service.analyze_context(
+                url=request.url,
+                page_content=page_content,
+                user_intent=request.user_intent
+            ))
+        except CircuitOpenError:
+            # Fail fast with a local analysis while Claude is unhealthy
+            analysis = _heuristic_analysis(request.url, page_content, extracted)
+        except BaseException:
+            suggestions_task.cancel()
+            raise
+        
+        suggestions, suggestions_id = await suggestion_store.resolve(suggestions_task, started)
+        
+        persistence.record_context(
+            request.url,
+            analysis["analysis"],
+            title=extracted.title if extracted else None,
+            user_intent=request.user_intent,
+            metadata=request.metadata,
+            model=analysis["model"],
+            user_id=current_user_id()
+        )
         
         return ContextAnalysisResponse(
             analysis=analysis["analysis"],
             url=analysis["url"],
             timestamp=analysis["timestamp"],
             model=analysis["model"],
-            suggestions=suggestions
+            suggestions=suggestions,
+            suggestions_id=suggestions_id
         )
         
-    except HTTPException:
+    except (HTTPException, RateLimitExceeded, ClaudeServiceError):
         raise
     except Exception as e:
         logger.error(f"Context analysis error: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to analyze context: {str(e)}")
 
+@router.post("/analyze/stream")
+async def stream_context_analysis(
+    request: ContextAnalysisRequest,
+    claude_service: ClaudeService = Depends(get_claude_service),
+    suggestion_store: SuggestionStore = Depends(get_suggestion_store),
+    persistence: PersistenceWriter = Depends(get_persistence_writer)
+):
+    """Analyze page context, streaming each analysis field as Server-Sent Events as soon as it is complete"""
+    
+    if not request.url or not request.page_content:
+        raise HTTPException(status_code=400, detail="URL and page content are required")
+    
+    if not claude_service.is_available():
+        raise HTTPException(status_code=503, detail="Claude service is not available")
+    
+    page_content, extracted = await _extract_page_content(request.page_content)
+    
+    async def event_stream():
+        started = time.perf_counter()
+        suggestions_task = asyncio.create_task(
+            claude_service.generate_proactive_suggestions({
+                "url": request.url,
+                "title": extracted.title if extracted else None,
+                "content": page_content,
+                "userIntent": request.user_intent,
+                "metadata": request.metadata
+            })
+        )
+        suggestions_id = None
+        
+        try:
+            try:
+                async for event in claude_service.stream_analysis(
+                    url=request.url,
+                    page_content=page_content,
+                    user_intent=request.user_intent
+                ):
+                    if event["type"] == "field":
+                        yield _sse("field", {"name": event["name"], "value": event["value"]})
+                        continue
+                    
+                    done = event
+            except CircuitOpenError:
+                # Fail fast with a local analysis while Claude is unhealthy
+                done = _heuristic_analysis(request.url, page_content, extracted)
+                for name, value in done["analysis"].items():
+                    yield _sse("field", {"name": name, "value": value})
+            
+            suggestions, suggestions_id = await suggestion_store.resolve(suggestions_task, started)
+            persistence.record_context(
+                request.url,
+                done["analysis"],
+                title=extracted.title if extracted else None,
+                user_intent=request.user_intent,
+                metadata=request.metadata,
+                model=done["model"],
+                user_id=current_user_id()
+            )
+            yield _sse("done", {
+                "analysis": done["analysis"],
+                "url": done["url"],
+                "timestamp": done["timestamp"],
+                "model": done["model"],
+                "suggestions": suggestions,
+                "suggestions_id": suggestions_id
+            })
+            
+        except RateLimitExceeded as e:
+            yield _sse("error", {"detail": str(e), "status": 429, "retry_after": e.retry_after_header()})
+        except ClaudeServiceError as e:
+            yield _sse("error", {"detail": str(e), "status": e.status_code, "retry_after": e.retry_after})
+        except Exception as e:
+            logger.error(f"Context analysis stream error: {str(e)}", exc_info=True)
+            yield _sse("error", {"detail": f"Failed to analyze context: {str(e)}"})
+        finally:
+            # Suggestions still belong to this stream unless they were parked in the store
+            if suggestions_id is None:
+                suggestions_task.cancel()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/analyze/batch")
+async def analyze_context_batch(
+    request: BatchAnalysisRequest,
+    claude_service: ClaudeService = Depends(get_claude_service)
+):
+    """Analyze many pages: stream NDJSON results as they finish, or submit a discounted batch job"""
+    
+    if not request.items:
+        raise HTTPException(status_code=400, detail="At least one item is required")
+    
+    if len(request.items) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batches are limited to {settings.BATCH_MAX_ITEMS} items")
+    
+    if any(not item.url or not item.page_content for item in request.items):
+        raise HTTPException(status_code=400, detail="URL and page content are required for every item")
+    
+    if request.mode == "async":
+        try:
+            items = []
+            for item in request.items:
+                page_content, _ = await _extract_page_content(item.page_content)
+                items.append({"url": item.url, "page_content": page_content, "user_intent": item.user_intent})
+            
+            job = await claude_service.submit_analysis_batch(items)
+            job["poll_url"] = f"/context/analyze/batch/{job['job_id']}"
+            return JSONResponse(status_code=202, content=job)
+            
+        except ClaudeServiceError:
+            raise
+        except Exception as e:
+            logger.error(f"Batch submission error: {str(e)}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"Failed to submit batch: {str(e)}")
+    
+    concurrency = min(request.max_concurrency or settings.BATCH_MAX_CONCURRENCY, settings.BATCH_MAX_CONCURRENCY)
+    
+    return StreamingResponse(
+        _stream_batch_results(request.items, max(concurrency, 1), claude_service),
+        media_type="application/x-ndjson"
+    )
+
+@router.get("/analyze/batch/{job_id}")
+async def get_analysis_batch(
+    job_id: str,
+    claude_service: ClaudeService = Depends(get_claude_service)
+):
+    """Poll an asynchronous batch analysis job"""
+    
+    try:
+        return await claude_service.get_analysis_batch(job_id)
+    except ClaudeServiceError:
+        raise
+    except Exception as e:
+        logger.error(f"Batch status error: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Failed to get batch status: {str(e)}")
+
 @router.post("/insights")
-async def get_page_insights(request: EnhancedContextRequest):
+async def get_page_insights(
+    request: EnhancedContextRequest,
+    http_request: Request,
+    claude_service: ClaudeService = Depends(get_claude_service),
+    scheduler: UpstreamScheduler = Depends(get_upstream_scheduler)
+):
     """Get detailed page insights and recommendations"""
     
     try:
-        insights = []
+        return await scheduler.run(http_request, _build_page_insights(request, claude_service))
         
-        # Determine page type
-        page_type = _determine_page_type(request.url, request.content)
+    except ClaudeServiceError:
+        raise
+    except Exception as e:
+        logger.error(f"Page insights error: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Failed to generate insights: {str(e)}")
+
+@router.get("/monitor")
+async def monitor_status():
+    """Describe the context monitoring channel and its current load"""
+    
+    return {
+        "websocket": "/context/monitor/ws",
+        "debounce_seconds": settings.MONITOR_DEBOUNCE_SECONDS,
+        "min_change_ratio": settings.MONITOR_MIN_CHANGE_RATIO,
+        **monitor_registry.get_stats(),
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+@router.websocket("/monitor/ws")
+async def monitor_context(
+    websocket: WebSocket,
+    claude_service: ClaudeService = Depends(get_claude_service)
+):
+    """Real-time context monitoring: clients send a snapshot, then diffs; insights are pushed back"""
+    
+    client_id = get_client_id(websocket)
+    
+    async def compute_insights(state: PageState) -> Dict[str, Any]:
+        # Sockets skip the per-request limit, so every recompute is charged to the client instead
+        await rate_limiter.check_client(client_id)
+        request = EnhancedContextRequest(
+            url=state.url,
+            title=state.title,
+            content=state.content,
+            user_activity=state.user_activity(),
+            dom_elements=state.elements()
+        )
+        # Nobody asked for these insights yet, so they wait behind every request someone is waiting on
+        with deadline_scope(settings.REQUEST_TIMEOUT_SECONDS), priority_scope("prefetch"):
+            return await _build_page_insights(request, claude_service)
+    
+    session = MonitorSession(
+        compute_insights,
+        websocket.send_json,
+        settings.MONITOR_DEBOUNCE_SECONDS,
+        settings.MONITOR_MAX_WAIT_SECONDS,
+        settings.MONITOR_MIN_CHANGE_RATIO
+    )
+    
+    await websocket.accept()
+    refused = monitor_registry.try_add(session, client_id)
+    if refused:
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason=refused)
+        return
+    
+    try:
+        while True:
+            raw = await websocket.receive_text()
+            if len(raw) > settings.MONITOR_MAX_MESSAGE_BYTES:
+                await websocket.close(code=status.WS_1009_MESSAGE_TOO_BIG)
+                return
+            
+            try:
+                message = json.loads(raw)
+            except ValueError:
+                await websocket.send_json({"type": "error", "detail": "Messages must be JSON objects"})
+                continue
+            
+            if not isinstance(message, dict):
+                await websocket.send_json({"type": "error", "detail": "Messages must be JSON objects"})
+                continue
+            
+            await session.handle(message)
+            
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await session.close()
+        monitor_registry.remove(session)
+
+async def _stream_batch_results(
+    items: List[ContextAnalysisRequest],
+    concurrency: int,
+    claude_service: ClaudeService
+):
+    """Analyze items with a fixed pool of workers and yield NDJSON lines in completion order"""
+    
+    pending: asyncio.Queue = asyncio.Queue()
+    for index, item in enumerate(items):
+        pending.put_nowait((index, item))
+    finished: asyncio.Queue = asyncio.Queue()
+    
+    async def worker():
+        while True:
+            try:
+                index, item = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            
+            try:
+                # Each item gets its own budget; the batch as a whole may run far longer, behind interactive traffic
+                with deadline_scope(settings.REQUEST_TIMEOUT_SECONDS, replace=True), priority_scope("prefetch"):
+                    page_content, _ = await _extract_page_content(item.page_content)
+                    analysis = await claude_service.analyze_context(
+                        url=item.url,
+                        page_content=page_content,
+                        user_intent=item.user_intent
+                    )
+                finished.put_nowait({"index": index, "url": item.url, "status": "ok", "analysis": analysis})
+            except Exception as e:
+                logger.warning(f"Batch item {index} failed: {str(e)}")
+                finished.put_nowait({"index": index, "url": item.url, "status": "error", "error": str(e)})
+    
+    workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(items)))]
+    try:
+        for _ in range(len(items)):
+            result = await finished.get()
+            yield json.dumps(result) + "\n"
+    finally:
+        # Stop outstanding work if the client goes away mid-stream
+        for task in workers:
+            task.cancel()
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    """Format a Server-Sent Event frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def _extract_page_content(content: str) -> Tuple[str, Optional[ExtractedContent]]:
+    """Reduce submitted HTML to main-content text; plain text passes through unchanged"""
+    if not looks_like_html(content):
+        return content, None
+    
+    extracted = await extract_content_async(content)
+    logger.debug(
+        f"Extracted {len(extracted.text)} of {extracted.chars_in} chars, "
+        f"{extracted.duplicate_blocks} duplicate blocks dropped"
+    )
+    return extracted.text, extracted
+
+async def _build_page_insights(request: EnhancedContextRequest, claude_service: ClaudeService) -> Dict[str, Any]:
+    """Build page insights; shared by the insights endpoint and the monitoring channel"""
+    insights = []
+    
+    content, extracted = await _extract_page_content(request.content)
+    has_forms = bool(extracted and extracted.forms) or any(
+        el.get("tag") == "form" for el in request.dom_elements or []
+    )
+    
+    title = request.title or (extracted.title if extracted else None)
+    
+    # Determine page type
+    classification = page_classifier.classify(
+        request.url,
+        title,
+        content,
+        forms=extracted.forms if extracted else None,
+        has_forms=has_forms
+    )
+    page_type = classification.label
+    insights.append(PageInsight(
+        type="page_classification",
+        confidence=classification.confidence,
+        description=f"This appears to be a {page_type} page",
+        actionable=False
+    ))
+    
+    # Check for common elements
+    if has_forms:
         insights.append(PageInsight(
-            type="page_classification",
-            confidence=0.9,
-            description=f"This appears to be a {page_type} page",
-            actionable=False
+            type="form_detected",
+            confidence=0.95,
+            description="Forms detected on this page - I can help you fill them out",
+            actionable=True
         ))
-        
-        # Check for common elements
-        if request.dom_elements:
-            form_elements = [el for el in request.dom_elements if el.get("tag") == "form"]
-            if form_elements:
-                insights.append(PageInsight(
-                    type="form_detected",
-                    confidence=0.95,
-                    description="Forms detected on this page - I can help you fill them out",
-                    actionable=True
-                ))
-        
-        # Analyze user activity if provided
-        if request.user_activity:
-            if request.user_activity.get("scrollDepth", 0) > 0.8:
-                insights.append(PageInsight(
-                    type="content_engagement",
-                    confidence=0.8,
-                    description="You've read most of this content - would you like a summary?",
-                    actionable=True
-                ))
-        
-        # Generate AI-powered insights
+    
+    # Analyze user activity if provided
+    if request.user_activity:
+        if request.user_activity.get("scrollDepth", 0) > 0.8:
+            insights.append(PageInsight(
+                type="content_engagement",
+                confidence=0.8,
+                description="You've read most of this content - would you like a summary?",
+                actionable=True
+            ))
+    
+    # A confidently classified page gets suggestions for its type without an LLM call
+    llm_suggestions = page_type == GENERAL or classification.confidence < settings.CLASSIFIER_SKIP_LLM_CONFIDENCE
+    if llm_suggestions:
         context = {
             "url": request.url,
-            "title": request.title,
-            "content": request.content[:1000],
+            "title": title,
+            "content": content,
             "userActivity": request.user_activity,
             "pageType": page_type
         }
@@ -128,65 +514,57 @@ async def get_page_insights(request: EnhancedContextRequest):
         ai_suggestions = await claude_service.generate_proactive_suggestions(context)
         
         # Convert AI suggestions to insights
-        for i, suggestion in enumerate(ai_suggestions):
+        for suggestion in ai_suggestions:
             insights.append(PageInsight(
                 type="ai_suggestion",
                 confidence=0.7,
                 description=suggestion,
                 actionable=True
             ))
-        
-        return {
-            "insights": [insight.dict() for insight in insights],
-            "page_type": page_type,
-            "url": request.url,
-            "timestamp": datetime.utcnow().isoformat(),
-            "total_insights": len(insights)
-        }
-        
-    except Exception as e:
-        logger.error(f"Page insights error: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Failed to generate insights: {str(e)}")
-
-@router.post("/monitor")
-async def monitor_context():
-    """Endpoint for real-time context monitoring"""
+    else:
+        for suggestion in PAGE_TYPE_SUGGESTIONS[page_type]:
+            insights.append(PageInsight(
+                type="suggestion",
+                confidence=classification.confidence,
+                description=suggestion,
+                actionable=True
+            ))
     
     return {
-        "message": "Context monitoring endpoint - WebSocket implementation needed for real-time features",
-        "status": "placeholder",
-        "timestamp": datetime.utcnow().isoformat()
+        "insights": [insight.dict() for insight in insights],
+        "page_type": page_type,
+        "page_type_confidence": classification.confidence,
+        "llm_suggestions": llm_suggestions,
+        "url": request.url,
+        "timestamp": datetime.utcnow().isoformat(),
+        "total_insights": len(insights)
     }
 
-def _determine_page_type(url: str, content: str) -> str:
-    """Determine the type of page based on URL and content"""
-    
-    url_lower = url.lower()
-    content_lower = content.lower()
-    
-    # E-commerce
-    if any(keyword in url_lower for keyword in ['shop', 'store', 'cart', 'checkout', 'product']):
-        return "e-commerce"
-    
-    # Social media
-    if any(keyword in url_lower for keyword in ['facebook', 'twitter', 'instagram', 'linkedin']):
-        return "social-media"
+def _heuristic_analysis(url: str, content: str, extracted: Optional[ExtractedContent]) -> Dict[str, Any]:
+    """Build a local analysis from page structure, used when Claude cannot be called"""
+    has_forms = bool(extracted and extracted.forms)
+    key_actions = []
+    if has_forms:
+        key_actions.append("Fill out the form on this page")
+    if extracted:
+        key_actions.extend(f"Read the section \"{heading['text']}\"" for heading in extracted.headings[:3])
     
-    # Developer/code
-    if any(keyword in url_lower for keyword in ['github', 'gitlab', 'stackoverflow', 'dev']):
-        return "developer-tools"
+    analysis = PageAnalysis(
+        page_type=page_classifier.classify(
+            url,
+            extracted.title if extracted else None,
+            content,
+            forms=extracted.forms if extracted else None
+        ).label,
+        purpose=extracted.title if extracted and extracted.title else "",
+        key_actions=key_actions,
+        suggestions=[],
+        insights=["Detailed AI analysis is temporarily unavailable"],
+    )
     
-    # Documentation
-    if any(keyword in url_lower for keyword in ['docs', 'documentation', 'api', 'guide']):
-        return "documentation"
-    
-    # News/blog
-    if any(keyword in url_lower for keyword in ['news', 'blog', 'article']):
-        return "content"
-    
-    # Forms
-    if '<form' in content_lower or 'input' in content_lower:
-        return "form-page"
-    
-    # Default
-    return "general"
\ No newline at end of file
+    return {
+        "analysis": analysis.model_dump(),
+        "url": url,
+        "timestamp": datetime.utcnow().isoformat(),
+        "model": "heuristic"
+    }
@@ -2,6 +2,16 @@ from fastapi import APIRouter, Depends
 from datetime import datetime
 import logging
 from app.core.config import settings
+from app.core.logging_config import get_logging_stats
+from app.services.cache import result_cache
+from app.services.claude_service import claude_service
+from app.services.conversation_store import conversation_store
+from app.services.persistence import persistence_writer
+from app.services.rate_limiter import rate_limiter
+from app.services.resilience import claude_breaker
+from app.services.similarity_cache import similarity_index
+from app.services.token_budget import token_budgets
+from app.services.upstream_scheduler import upstream_scheduler
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -16,8 +26,24 @@ async def health_check():
         "timestamp": datetime.utcnow().isoformat(),
         "environment": settings.ENVIRONMENT,
         "claude_configured": bool(settings.ANTHROPIC_API_KEY),
+        "cache": result_cache.get_stats(),
+        "conversations": conversation_store.get_stats(),
+        "similarity_cache": similarity_index.get_stats(),
+        "single_flight": claude_service.single_flight.get_stats(),
+        "rate_limiter": rate_limiter.get_stats(),
+        "persistence": await _persistence_status(),
+        "token_budgets": token_budgets.get_stats(),
+        "upstream_scheduler": upstream_scheduler.get_stats(),
+        "logging": get_logging_stats(),
     }
 
+async def _persistence_status():
+    """Writer backlog and database reachability; writes are buffered, so an unreachable database does not gate readiness"""
+    status = persistence_writer.get_stats()
+    if persistence_writer.enabled:
+        status["database"] = await persistence_writer.ping()
+    return status
+
 @router.get("/ready")
 async def readiness_check():
     """Readiness check endpoint"""
@@ -29,8 +55,13 @@ async def readiness_check():
     
     all_ready = all(checks.values())
     
+    # An open breaker means degraded, not unready: cached and heuristic fallbacks still serve traffic
+    circuit = claude_breaker.get_state()
+    
     return {
         "ready": all_ready,
+        "degraded": circuit["state"] != "closed",
         "checks": checks,
+        "circuit_breaker": circuit,
         "timestamp": datetime.utcnow().isoformat(),
     }
\ No newline at end of file
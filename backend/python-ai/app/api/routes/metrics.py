@@ -0,0 +1,12 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+import logging
+from app.services.metrics import CONTENT_TYPE, WorkerMetrics, get_worker_metrics
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+@router.get("", response_class=PlainTextResponse)
+async def prometheus_metrics(worker_metrics: WorkerMetrics = Depends(get_worker_metrics)):
+    """Prometheus scrape endpoint; with several workers, samples carry a worker label"""
+    return PlainTextResponse(worker_metrics.render(), media_type=CONTENT_TYPE)
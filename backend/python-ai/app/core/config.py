@@ -13,15 +13,42 @@ class Settings(BaseSettings):
     
     # AI Services
     ANTHROPIC_API_KEY: Optional[str] = None
+    # Override the API endpoint, e.g. a proxy or the fake upstream used by the load tests
+    ANTHROPIC_BASE_URL: Optional[str] = None
     OPENAI_API_KEY: Optional[str] = None
     
     # Database
     SUPABASE_URL: Optional[str] = None
     SUPABASE_SERVICE_ROLE_KEY: Optional[str] = None
+    # Postgres DSN for write-behind persistence of chat turns and analyzed contexts (unset disables it)
+    DATABASE_URL: Optional[str] = None
+    
+    # Persistence (rows buffered in memory and written in batches, never on the request path)
+    PERSISTENCE_ENABLED: bool = True
+    PERSISTENCE_BATCH_SIZE: int = 500
+    PERSISTENCE_FLUSH_INTERVAL_SECONDS: float = 1.0
+    # Rows waiting to be written; further rows are dropped while it is full
+    PERSISTENCE_MAX_PENDING: int = 50000
+    PERSISTENCE_POOL_SIZE: int = 2
+    PERSISTENCE_RETRY_MAX_SECONDS: float = 30.0
+    PERSISTENCE_SHUTDOWN_TIMEOUT_SECONDS: float = 10.0
     
     # Redis
     REDIS_URL: str = "redis://localhost:6379"
     
+    # Result cache (in-process LRU with an optional shared Redis tier)
+    CACHE_ENABLED: bool = True
+    CACHE_TTL_SECONDS: int = 3600
+    CACHE_MAX_ENTRIES: int = 5000
+    CACHE_REDIS_ENABLED: bool = False
+    CACHE_REDIS_TIMEOUT: float = 0.25
+    
+    # Near-duplicate cache (SimHash of extracted page text, matched within a domain)
+    SIMILARITY_CACHE_ENABLED: bool = True
+    SIMILARITY_MAX_DISTANCE: int = 5
+    SIMILARITY_MAX_ENTRIES: int = 200000
+    SIMILARITY_MIN_TOKENS: int = 50
+    
     # CORS
     ALLOWED_ORIGINS: List[str] = [
         "http://localhost:3000",
@@ -34,12 +61,162 @@ class Settings(BaseSettings):
     CLAUDE_MODEL: str = "claude-3-5-sonnet-20241022"
     CLAUDE_MAX_TOKENS: int = 4096
     CLAUDE_TEMPERATURE: float = 0.7
+    CLAUDE_STARTUP_PROBE: bool = True
+    CLAUDE_PROMPT_CACHING: bool = True
+    
+    # Model routing (CLAUDE_MODEL is the standard tier; set both to the same model to disable)
+    CLAUDE_FAST_MODEL: str = "claude-3-5-haiku-20241022"
+    ANALYSIS_MAX_TOKENS: int = 1000
+    SUGGESTIONS_MAX_TOKENS: int = 500
+    ADAPTIVE_OUTPUT_BUDGETS: bool = True
+    
+    # Claude HTTP connection pool (shared by the whole process)
+    CLAUDE_HTTP2: bool = True
+    CLAUDE_MAX_CONNECTIONS: int = 200
+    CLAUDE_MAX_KEEPALIVE_CONNECTIONS: int = 50
+    CLAUDE_KEEPALIVE_EXPIRY: float = 30.0
+    CLAUDE_CONNECT_TIMEOUT: float = 5.0
+    CLAUDE_READ_TIMEOUT: float = 120.0
+    CLAUDE_WRITE_TIMEOUT: float = 10.0
+    CLAUDE_POOL_TIMEOUT: float = 10.0
+    
+    # Upstream resilience (request deadlines, retries, circuit breaker)
+    REQUEST_TIMEOUT_SECONDS: float = 30.0
+    # Non-streaming calls get at least max_tokens at this rate (up to CLAUDE_READ_TIMEOUT), so a long
+    # chat reply is not cut off by the request deadline; 0 keeps REQUEST_TIMEOUT_SECONDS for every call
+    CLAUDE_MIN_OUTPUT_TOKENS_PER_SECOND: float = 50.0
+    CLAUDE_MAX_RETRIES: int = 2
+    CLAUDE_RETRY_BASE_DELAY: float = 0.5
+    CLAUDE_RETRY_MAX_DELAY: float = 8.0
+    CIRCUIT_FAILURE_THRESHOLD: int = 5
+    CIRCUIT_RESET_SECONDS: float = 30.0
+    
+    # Page content extraction
+    EXTRACTION_MAX_TEXT_CHARS: int = 200000
+    EXTRACTION_THREAD_THRESHOLD: int = 262144
+    
+    # Context packing (token budgets per request)
+    CONTEXT_TOKEN_BUDGET: int = 6000
+    CONTEXT_PAGE_SHARE: float = 0.5
+    CONTEXT_ACTIVITY_SHARE: float = 0.05
+    ANALYSIS_CONTENT_TOKENS: int = 1500
+    SUGGESTIONS_CONTENT_TOKENS: int = 600
+    
+    # Page classification
+    CLASSIFIER_MAX_CONTENT_CHARS: int = 8000
+    # Insights skip the LLM suggestion call when the local classifier is at least this confident
+    CLASSIFIER_SKIP_LLM_CONFIDENCE: float = 0.85
+    
+    # Batch analysis
+    BATCH_MAX_ITEMS: int = 10000
+    BATCH_MAX_CONCURRENCY: int = 8
+    BATCH_JOB_TTL_SECONDS: int = 7 * 24 * 3600
     
-    # Rate Limiting
+    # Proactive suggestions
+    SUGGESTIONS_DEADLINE_SECONDS: float = 1.5
+    SUGGESTIONS_RESULT_TTL_SECONDS: float = 300.0
+    SUGGESTIONS_MAX_PENDING: int = 10000
+    
+    # Chat conversations (history kept server-side per conversation_id; Redis shares it across workers)
+    CONVERSATIONS_ENABLED: bool = True
+    CONVERSATION_TTL_SECONDS: int = 24 * 3600
+    CONVERSATION_MAX_CONVERSATIONS: int = 10000
+    CONVERSATION_MAX_MESSAGES: int = 100
+    CONVERSATION_REDIS_ENABLED: bool = False
+    CONVERSATION_REDIS_TIMEOUT: float = 0.25
+    
+    # Context monitoring (WebSocket)
+    MONITOR_MAX_CONNECTIONS: int = 10000
+    # Open sockets per client (0 disables the cap); each insights recompute also takes a request from
+    # the client's rate limit bucket
+    MONITOR_MAX_CONNECTIONS_PER_CLIENT: int = 10
+    MONITOR_DEBOUNCE_SECONDS: float = 0.5
+    MONITOR_MAX_WAIT_SECONDS: float = 3.0
+    MONITOR_MIN_CHANGE_RATIO: float = 0.15
+    MONITOR_MAX_CONTENT_CHARS: int = 50000
+    MONITOR_MAX_DOM_ELEMENTS: int = 200
+    MONITOR_MAX_MESSAGE_BYTES: int = 262144
+    
+    # Rate Limiting (per client, token bucket)
+    RATE_LIMIT_ENABLED: bool = True
     REQUESTS_PER_MINUTE: int = 60
+    RATE_LIMIT_BURST: int = 20
+    RATE_LIMIT_MAX_CLIENTS: int = 100000
+    # Header set by a trusted gateway to identify clients; the peer address is used otherwise
+    RATE_LIMIT_CLIENT_HEADER: Optional[str] = None
+    RATE_LIMIT_REDIS_ENABLED: bool = False
+    RATE_LIMIT_REDIS_TIMEOUT: float = 0.25
+    
+    # Upstream admission control (global budget for Claude calls; 0 disables a limit)
+    UPSTREAM_REQUESTS_PER_MINUTE: int = 1000
+    UPSTREAM_TOKENS_PER_MINUTE: int = 400000
+    UPSTREAM_MAX_QUEUE: int = 500
+    UPSTREAM_MAX_WAIT_SECONDS: float = 5.0
+    
+    # Upstream scheduling (Claude calls running at once per worker, taken in priority order)
+    # Priorities: interactive (chat), background (analysis, suggestions), prefetch (monitoring, batches); 0 disables the limit
+    UPSTREAM_MAX_CONCURRENCY: int = 64
+    # Calls waiting for a slot; when full, a newcomer displaces the newest waiter of a lower priority or is shed
+    UPSTREAM_SCHEDULER_MAX_QUEUE: int = 1000
+    # Header identifying the browser tab a request comes from; a newer request from the same tab to the
+    # same endpoint cancels the one still running
+    TAB_ID_HEADER: Optional[str] = "X-Tab-ID"
     
-    # Logging
+    # Token accounting (every Claude call is estimated locally before it is sent)
+    # Calls estimated above this many input tokens are refused (0 disables the check)
+    REQUEST_MAX_INPUT_TOKENS: int = 20000
+    # Monthly (UTC) token budgets per user by users.subscription_tier; 0 is unlimited
+    TOKEN_BUDGETS_ENABLED: bool = True
+    TOKEN_BUDGET_FREE: int = 200000
+    TOKEN_BUDGET_PRO: int = 5000000
+    TOKEN_BUDGET_ENTERPRISE: int = 0
+    TOKEN_BUDGET_DEFAULT_TIER: str = "free"
+    # Replies are shortened to fit what is left of a budget, but never below this
+    TOKEN_BUDGET_MIN_OUTPUT_TOKENS: int = 256
+    # Header set by a trusted gateway carrying the caller's users.id; budgets only apply to identified users
+    USAGE_USER_HEADER: Optional[str] = None
+    # Optional header carrying the caller's tier, otherwise read from the users table
+    USAGE_TIER_HEADER: Optional[str] = None
+    # How often usage is added to users.usage_stats, and how long a loaded tier and total are trusted
+    USAGE_FLUSH_INTERVAL_SECONDS: float = 10.0
+    USAGE_REFRESH_SECONDS: float = 300.0
+    USAGE_MAX_ACCOUNTS: int = 100000
+    
+    # Logging (records are formatted and written on a background thread)
     LOG_LEVEL: str = "INFO"
+    LOG_FILE: Optional[str] = "app.log"
+    # Records waiting for the logging thread; further records are dropped while it is full
+    LOG_QUEUE_SIZE: int = 10000
+    # Share of INFO/DEBUG records kept, and a cap on them per second (0 disables the cap)
+    LOG_SAMPLE_RATE: float = 1.0
+    LOG_MAX_RECORDS_PER_SECOND: int = 2000
+    
+    # Metrics (Prometheus text format at /metrics)
+    METRICS_ENABLED: bool = True
+    # How often event loop lag is sampled, in seconds (0 disables sampling)
+    METRICS_LOOP_LAG_INTERVAL: float = 0.5
+    # With several workers, how often each one publishes its metrics for scrapes answered by the others
+    METRICS_WORKER_SNAPSHOT_SECONDS: float = 5.0
+    
+    # Serving (`python main.py`): one reloading process in development, worker processes otherwise
+    HOST: str = "0.0.0.0"
+    PORT: int = 8001
+    # 0 starts one worker per available CPU. More than one worker needs conversations and the result cache
+    # (which carries pending suggestions and batch jobs) in Redis, so follow-up requests work on any worker
+    WORKERS: int = 1
+    # Start several workers anyway, for deployments that never use follow-up endpoints (and benchmarks)
+    ALLOW_UNSHARED_WORKER_STATE: bool = False
+    # Seconds a worker gets to finish in-flight requests on shutdown, or on a rolling restart (SIGHUP)
+    GRACEFUL_SHUTDOWN_SECONDS: int = 30
+    
+    # Shared memory (result cache and rate limits shared by the workers on a host)
+    SHARED_MEMORY_ENABLED: bool = True
+    # Set by `python main.py` for its workers; set it yourself when starting several workers another way
+    SHARED_MEMORY_NAME: Optional[str] = None
+    # Where the store files live, /dev/shm when available
+    SHARED_MEMORY_DIR: Optional[str] = None
+    SHARED_CACHE_SLOTS: int = 4096
+    SHARED_CACHE_SLOT_BYTES: int = 8192
     
     # Security
     SECRET_KEY: str = "your-secret-key-here"
@@ -1,11 +1,34 @@
+import atexit
 import logging
 import logging.config
+import logging.handlers
+import queue
+import random
+import re
 import sys
-from datetime import datetime
-from typing import Dict, Any
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Dict, Any, Optional
 import json
 from app.core.config import settings
 
+try:
+    import orjson
+except ImportError:  # optional, json is used without it
+    orjson = None
+
+# Correlation ID of the request being handled, added to every record logged while serving it
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+# Attributes every LogRecord has; anything else on a record came from `extra=`
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message", "asctime", "request_id", "taskName",
+}
+
 class ColoredFormatter(logging.Formatter):
     """Custom formatter with colors for console output"""
     
@@ -20,18 +43,26 @@ class ColoredFormatter(logging.Formatter):
     RESET = '\033[0m'
     
     def format(self, record):
-        # Add color to levelname
-        if record.levelname in self.COLORS:
-            record.levelname = f"{self.COLORS[record.levelname]}{record.levelname}{self.RESET}"
-        
-        return super().format(record)
+        # Color levelname for this output only; the record is shared with the other handlers
+        levelname = record.levelname
+        if levelname in self.COLORS:
+            record.levelname = f"{self.COLORS[levelname]}{levelname}{self.RESET}"
+        try:
+            return super().format(record)
+        finally:
+            record.levelname = levelname
 
 class JSONFormatter(logging.Formatter):
     """JSON formatter for structured logging"""
     
+    def __init__(self):
+        super().__init__()
+        self._second = -1
+        self._second_text = ""
+    
     def format(self, record: logging.LogRecord) -> str:
         log_entry: Dict[str, Any] = {
-            'timestamp': datetime.utcnow().isoformat(),
+            'timestamp': self._timestamp(record.created),
             'level': record.levelname,
             'logger': record.name,
             'message': record.getMessage(),
@@ -40,67 +71,250 @@ class JSONFormatter(logging.Formatter):
             'line': record.lineno,
         }
         
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            log_entry['request_id'] = request_id
+        
         # Add exception info if present
         if record.exc_info:
-            log_entry['exception'] = self.formatException(record.exc_info)
+            if not record.exc_text:
+                record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            log_entry['exception'] = record.exc_text
         
         # Add extra fields
-        for key, value in record.__dict__.items():
-            if key not in ['name', 'msg', 'args', 'levelname', 'levelno', 'pathname',
-                          'filename', 'module', 'lineno', 'funcName', 'created',
-                          'msecs', 'relativeCreated', 'thread', 'threadName',
-                          'processName', 'process', 'getMessage', 'exc_info',
-                          'exc_text', 'stack_info']:
-                log_entry[key] = value
+        for key in record.__dict__.keys() - _RECORD_ATTRIBUTES:
+            log_entry[key] = record.__dict__[key]
         
-        return json.dumps(log_entry)
+        if orjson is not None:
+            return orjson.dumps(log_entry, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+        return json.dumps(log_entry, default=str)
+    
+    def _timestamp(self, created: float) -> str:
+        # Records are formatted after the fact on the logging thread, so use the record's own time;
+        # the date part only changes once a second
+        second = int(created)
+        if second != self._second:
+            self._second = second
+            self._second_text = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+        return f"{self._second_text}.{int((created - second) * 1_000_000):06d}"
+
+class RequestContextFilter(logging.Filter):
+    """Adds the current request ID to records; runs on the calling thread, where the request context is"""
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Keeps a share of records below WARNING and caps how many of them pass per second"""
+    
+    def __init__(self, sample_rate: float = 1.0, max_per_second: int = 0):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.max_per_second = max_per_second
+        self._window = 0
+        self._window_count = 0
+        self.sampled_out = 0
+        self.rate_limited = 0
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return False
+        
+        if self.max_per_second:
+            window = int(record.created)
+            if window != self._window:
+                self._window = window
+                self._window_count = 0
+            if self._window_count >= self.max_per_second:
+                self.rate_limited += 1
+                return False
+            self._window_count += 1
+        return True
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that never blocks the caller: records are dropped and counted when the queue is full
+    
+    The last tenth of the queue is kept for WARNING and above, so a flood of INFO records does not
+    crowd out errors.
+    """
+    
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.queued = 0
+        self.dropped = 0
+        self._low_priority_limit = log_queue.maxsize - log_queue.maxsize // 10 if log_queue.maxsize > 0 else 0
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only render the message now, since args may change after the call; exception text and
+        # JSON are left to the logging thread. The queue is in-process, so nothing is pickled.
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+    
+    def enqueue(self, record: logging.LogRecord):
+        if record.levelno < logging.WARNING and self._low_priority_limit and self.queue.qsize() >= self._low_priority_limit:
+            self.dropped += 1
+            return
+        try:
+            self.queue.put_nowait(record)
+            self.queued += 1
+        except queue.Full:
+            self.dropped += 1
+
+class LogQueueListener(logging.handlers.QueueListener):
+    """Queue listener whose stop waits for room in a full queue instead of failing"""
+    
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+_queue_handler: Optional[BoundedQueueHandler] = None
+_sampling_filter: Optional[SamplingFilter] = None
+_listener: Optional[LogQueueListener] = None
+_setup_lock = threading.Lock()
 
 def setup_logging():
-    """Setup logging configuration"""
-    
-    # Determine log level
-    log_level = getattr(logging, settings.LOG_LEVEL.upper(), logging.INFO)
-    
-    # Console handler with colored output
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(log_level)
-    
-    if settings.ENVIRONMENT == "development":
-        # Use colored formatter for development
-        console_formatter = ColoredFormatter(
-            fmt='%(asctime)s | %(levelname)-8s | %(name)-20s | %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S'
-        )
-    else:
-        # Use JSON formatter for production
-        console_formatter = JSONFormatter()
-    
-    console_handler.setFormatter(console_formatter)
-    
-    # File handler for errors
-    if settings.ENVIRONMENT != "development":
-        file_handler = logging.FileHandler('app.log')
-        file_handler.setLevel(logging.ERROR)
-        file_handler.setFormatter(JSONFormatter())
-    
-    # Configure root logger
-    root_logger = logging.getLogger()
-    root_logger.setLevel(log_level)
-    root_logger.addHandler(console_handler)
-    
-    if settings.ENVIRONMENT != "development":
-        root_logger.addHandler(file_handler)
-    
-    # Configure third-party loggers
-    logging.getLogger("uvicorn").setLevel(logging.WARNING)
-    logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
-    logging.getLogger("anthropic").setLevel(logging.WARNING)
-    logging.getLogger("httpx").setLevel(logging.WARNING)
+    """Setup logging configuration
+    
+    Records are queued by the logging call and formatted and written by a background thread, so
+    request handlers never wait on serialization or disk.
+    """
+    global _queue_handler, _sampling_filter, _listener
+    
+    with _setup_lock:
+        if _listener is not None:
+            return
+        
+        # Determine log level
+        log_level = getattr(logging, settings.LOG_LEVEL.upper(), logging.INFO)
+        
+        # Console handler with colored output
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setLevel(log_level)
+        
+        if settings.ENVIRONMENT == "development":
+            # Use colored formatter for development
+            console_formatter = ColoredFormatter(
+                fmt='%(asctime)s | %(levelname)-8s | %(name)-20s | %(message)s',
+                datefmt='%Y-%m-%d %H:%M:%S'
+            )
+        else:
+            # Use JSON formatter for production
+            console_formatter = JSONFormatter()
+        
+        console_handler.setFormatter(console_formatter)
+        handlers = [console_handler]
+        
+        # File handler for errors
+        if settings.ENVIRONMENT != "development" and settings.LOG_FILE:
+            file_handler = logging.FileHandler(settings.LOG_FILE, delay=True)
+            file_handler.setLevel(logging.ERROR)
+            file_handler.setFormatter(JSONFormatter())
+            handlers.append(file_handler)
+        
+        # Filters run on the calling thread, before the record is queued
+        _sampling_filter = SamplingFilter(settings.LOG_SAMPLE_RATE, settings.LOG_MAX_RECORDS_PER_SECOND)
+        _queue_handler = BoundedQueueHandler(queue.Queue(maxsize=settings.LOG_QUEUE_SIZE))
+        _queue_handler.setLevel(log_level)
+        _queue_handler.addFilter(_sampling_filter)
+        _queue_handler.addFilter(RequestContextFilter())
+        
+        _listener = LogQueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+        
+        # No output includes processName, so skip looking it up for every record
+        logging.logMultiprocessing = False
+        
+        # Configure root logger
+        root_logger = logging.getLogger()
+        root_logger.setLevel(log_level)
+        root_logger.addHandler(_queue_handler)
+        
+        # Configure third-party loggers
+        logging.getLogger("uvicorn").setLevel(logging.WARNING)
+        logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
+        logging.getLogger("anthropic").setLevel(logging.WARNING)
+        logging.getLogger("httpx").setLevel(logging.WARNING)
     
     # Log startup message
     logger = logging.getLogger(__name__)
     logger.info(f"🔧 Logging configured - Level: {settings.LOG_LEVEL}, Environment: {settings.ENVIRONMENT}")
 
+def shutdown_logging():
+    """Write out queued records and stop the logging thread"""
+    global _listener
+    
+    with _setup_lock:
+        listener, _listener = _listener, None
+        if listener is None:
+            return
+        
+        logging.getLogger().removeHandler(_queue_handler)
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+def get_logging_stats() -> Dict[str, Any]:
+    """Counters for the logging pipeline"""
+    if _queue_handler is None:
+        return {"enabled": False}
+    
+    return {
+        "enabled": _listener is not None,
+        "queued": _queue_handler.queued,
+        "dropped": _queue_handler.dropped,
+        "sampled_out": _sampling_filter.sampled_out,
+        "rate_limited": _sampling_filter.rate_limited,
+        "queue_depth": _queue_handler.queue.qsize(),
+        "queue_size": _queue_handler.queue.maxsize,
+    }
+
+def get_request_id() -> Optional[str]:
+    """Correlation ID of the request being handled, if any"""
+    return _request_id.get()
+
+class RequestIdMiddleware:
+    """ASGI middleware giving each HTTP request and WebSocket a correlation ID
+    
+    An incoming X-Request-ID header is kept when it looks safe, so IDs can follow a request across
+    services; otherwise a new one is generated. The ID is echoed on HTTP responses.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-request-id":
+                candidate = value.decode("latin-1")
+                if _REQUEST_ID_RE.match(candidate):
+                    request_id = candidate
+                break
+        request_id = request_id or uuid.uuid4().hex
+        
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", ())) + [(b"x-request-id", request_id.encode())]
+            await send(message)
+        
+        token = _request_id.set(request_id)
+        try:
+            await self.app(scope, receive, send_with_request_id if scope["type"] == "http" else send)
+        finally:
+            _request_id.reset(token)
+
 def get_logger(name: str) -> logging.Logger:
     """Get a logger instance"""
-    return logging.getLogger(name)
\ No newline at end of file
+    return logging.getLogger(name)
@@ -0,0 +1,83 @@
+import importlib.util
+import logging
+import math
+import os
+from pathlib import Path
+from typing import List
+
+from app.core.config import settings
+from app.services.shared_memory import remove_shared_stores
+
+logger = logging.getLogger(__name__)
+
+def available_cpus() -> int:
+    """CPUs this process may run on, honouring CPU affinity and a cgroup v2 quota (containers)"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    try:
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()
+        if quota != "max":
+            cpus = min(cpus, max(math.ceil(int(quota) / int(period)), 1))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+def worker_count() -> int:
+    """Worker processes to start: WORKERS, or one per available CPU"""
+    return settings.WORKERS if settings.WORKERS > 0 else available_cpus()
+
+def unshared_state() -> List[str]:
+    """State that lives in one worker's memory, so a follow-up request on another worker would miss it"""
+    problems = []
+    if importlib.util.find_spec("redis") is None:
+        problems.append("the redis package is not installed")
+    if settings.CONVERSATIONS_ENABLED and not settings.CONVERSATION_REDIS_ENABLED:
+        problems.append("chat conversations (set CONVERSATION_REDIS_ENABLED, or CONVERSATIONS_ENABLED=false)")
+    if not (settings.CACHE_ENABLED and settings.CACHE_REDIS_ENABLED):
+        problems.append("pending suggestions and batch jobs (set CACHE_ENABLED and CACHE_REDIS_ENABLED)")
+    return problems
+
+def run(app: str = "main:app"):
+    """Serve the app: a single reloading process in development, WORKERS processes otherwise
+
+    Workers share a listening socket and, through SHARED_MEMORY_NAME, a host-wide result cache,
+    rate limits and metrics. Several workers are only started when conversations, pending
+    suggestions and batch jobs are kept in Redis. SIGHUP replaces the workers one at a time, each
+    new worker serving before the old one is stopped; SIGTTIN and SIGTTOU add and remove a worker.
+    """
+    import uvicorn
+
+    if settings.ENVIRONMENT == "development":
+        uvicorn.run(app, host=settings.HOST, port=settings.PORT, reload=True, log_level="info")
+        return
+
+    workers = worker_count()
+    problems = unshared_state() if workers > 1 and not settings.ALLOW_UNSHARED_WORKER_STATE else []
+    if problems:
+        raise SystemExit(
+            f"Refusing to start {workers} workers: requests that land on another worker would not find "
+            f"{'; '.join(problems)}. Use WORKERS=1, or set ALLOW_UNSHARED_WORKER_STATE=true."
+        )
+    
+    created_name = None
+    if workers > 1 and not settings.SHARED_MEMORY_NAME:
+        created_name = f"aiwatch-{os.getpid()}"
+        # Workers are spawned, not forked, and read their settings from the environment
+        os.environ["SHARED_MEMORY_NAME"] = created_name
+
+    logger.info(f"Starting {workers} worker(s) on {settings.HOST}:{settings.PORT}")
+    try:
+        uvicorn.run(
+            app,
+            host=settings.HOST,
+            port=settings.PORT,
+            workers=workers,
+            log_level="info",
+            timeout_graceful_shutdown=settings.GRACEFUL_SHUTDOWN_SECONDS,
+        )
+    finally:
+        if created_name:
+            remove_shared_stores(created_name, settings.SHARED_MEMORY_DIR)
@@ -0,0 +1,277 @@
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from app.core.config import settings
+from app.services.shared_memory import SharedMemoryStore, open_shared_store
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # Redis tier is optional
+    redis_asyncio = None
+
+try:
+    import orjson
+except ImportError:  # Falls back to the standard library encoder
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Query parameters that never change page content
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid", "ref", "ref_src"}
+
+def normalize_url(url: str) -> str:
+    """Normalize a URL so equivalent addresses share cache entries"""
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return url.strip()
+
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    port = parts.port
+    if port and not ((scheme == "http" and port == 80) or (scheme == "https" and port == 443)):
+        host = f"{host}:{port}"
+
+    path = parts.path or "/"
+    if len(path) > 1 and path.endswith("/"):
+        path = path.rstrip("/")
+
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS
+    )
+
+    # Fragments are client-side only and dropped
+    return urlunsplit((scheme, host, path, urlencode(query), ""))
+
+def make_cache_key(kind: str, url: str, content: str, intent: Optional[str] = None) -> str:
+    """Build a cache key from a normalized URL, a content hash and the user intent"""
+    content_hash = hashlib.sha256(content.encode("utf-8", "ignore")).hexdigest()
+    raw = "\0".join([normalize_url(url), content_hash, (intent or "").strip().lower()])
+    return f"aiwatch:{kind}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+class LRUCache:
+    """In-process LRU cache with per-entry TTL"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """Get a value, refreshing its recency, or None if missing or expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        """Store a value, evicting the least recently used entries when full"""
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: str):
+        """Remove a value if present"""
+        self._entries.pop(key, None)
+
+    def clear(self):
+        """Remove all values"""
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class RedisCache:
+    """Shared Redis cache tier storing JSON-encoded values"""
+
+    def __init__(self, client: Any, ttl_seconds: float):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+
+    async def get(self, key: str) -> Optional[Any]:
+        """Get a value or None if missing"""
+        raw = await self.client.get(key)
+        if raw is None:
+            return None
+        return json.loads(raw)
+
+    async def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        """Store a value with a TTL"""
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        await self.client.set(key, json.dumps(value), ex=max(int(ttl), 1))
+
+    async def close(self):
+        """Close the Redis connection pool"""
+        close = getattr(self.client, "aclose", None) or self.client.close
+        await close()
+
+class SharedMemoryCache:
+    """Host-wide cache tier in shared memory, read by every worker without a network round trip"""
+
+    def __init__(self, store: SharedMemoryStore, ttl_seconds: float):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+
+    async def get(self, key: str) -> Optional[Any]:
+        """Get a value or None if missing"""
+        raw = self.store.get(key)
+        if raw is None:
+            return None
+        return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+    async def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        """Store a value with a TTL; values too large for a slot stay in the other tiers only"""
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        raw = orjson.dumps(value) if orjson is not None else json.dumps(value, separators=(",", ":")).encode("utf-8")
+        self.store.set(key, raw, ttl)
+
+    async def close(self):
+        """Unmap the shared memory"""
+        self.store.close()
+
+class ResultCache:
+    """Tiered result cache: an in-process LRU, then optional host-wide shared memory, then optional Redis"""
+
+    def __init__(
+        self,
+        local: LRUCache,
+        shared: Optional[RedisCache] = None,
+        enabled: bool = True,
+        host: Optional[SharedMemoryCache] = None
+    ):
+        self.local = local
+        # Shared by the workers on this host
+        self.host = host
+        # Shared by every host
+        self.shared = shared
+        self.enabled = enabled
+        self.stats: Dict[str, int] = {
+            "local_hits": 0,
+            "host_hits": 0,
+            "shared_hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "shared_errors": 0,
+        }
+
+    async def get(self, key: str) -> Optional[Any]:
+        """Look a key up in the local tier, then the shared tier"""
+        if not self.enabled:
+            return None
+
+        value = self.local.get(key)
+        if value is not None:
+            self.stats["local_hits"] += 1
+            return value
+
+        if self.host is not None:
+            value = await self.host.get(key)
+            if value is not None:
+                self.stats["host_hits"] += 1
+                self.local.set(key, value)
+                return value
+
+        if self.shared is not None:
+            try:
+                value = await self.shared.get(key)
+            except Exception as e:
+                # The shared tier is best effort; a Redis outage only costs cache hits
+                self.stats["shared_errors"] += 1
+                logger.warning(f"Shared cache read failed: {str(e)}")
+                value = None
+
+            if value is not None:
+                self.stats["shared_hits"] += 1
+                self.local.set(key, value)
+                if self.host is not None:
+                    await self.host.set(key, value)
+                return value
+
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        """Store a value in every tier"""
+        if not self.enabled:
+            return
+
+        self.stats["sets"] += 1
+        self.local.set(key, value, ttl_seconds)
+        if self.host is not None:
+            await self.host.set(key, value, ttl_seconds)
+
+        if self.shared is not None:
+            try:
+                await self.shared.set(key, value, ttl_seconds)
+            except Exception as e:
+                self.stats["shared_errors"] += 1
+                logger.warning(f"Shared cache write failed: {str(e)}")
+
+    def is_shared(self) -> bool:
+        """Whether values stored here can be read by other worker processes"""
+        return self.enabled and (self.host is not None or self.shared is not None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters and the hit ratio"""
+        hits = self.stats["local_hits"] + self.stats["host_hits"] + self.stats["shared_hits"]
+        lookups = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "local_entries": len(self.local),
+            "local_evictions": self.local.evictions,
+            "host_enabled": self.host is not None,
+            "host": self.host.store.get_stats() if self.host is not None else None,
+            "shared_enabled": self.shared is not None,
+        }
+
+    async def close(self):
+        """Release the shared tier connections"""
+        if self.host is not None:
+            await self.host.close()
+        if self.shared is not None:
+            await self.shared.close()
+
+def create_result_cache() -> ResultCache:
+    """Create the result cache configured by settings"""
+    local = LRUCache(max_entries=settings.CACHE_MAX_ENTRIES, ttl_seconds=settings.CACHE_TTL_SECONDS)
+
+    shared = None
+    if settings.CACHE_REDIS_ENABLED:
+        if redis_asyncio is None:
+            logger.warning("CACHE_REDIS_ENABLED is set but the redis package is not installed")
+        else:
+            client = redis_asyncio.from_url(
+                settings.REDIS_URL,
+                socket_timeout=settings.CACHE_REDIS_TIMEOUT,
+                socket_connect_timeout=settings.CACHE_REDIS_TIMEOUT,
+            )
+            shared = RedisCache(client, ttl_seconds=settings.CACHE_TTL_SECONDS)
+
+    host = None
+    store = open_shared_store("results", settings.SHARED_CACHE_SLOTS, settings.SHARED_CACHE_SLOT_BYTES)
+    if store is not None:
+        host = SharedMemoryCache(store, ttl_seconds=settings.CACHE_TTL_SECONDS)
+
+    return ResultCache(local, shared, enabled=settings.CACHE_ENABLED, host=host)
+
+# Process-wide result cache
+result_cache = create_result_cache()
@@ -1,54 +1,198 @@
 import asyncio
 import logging
-from typing import Dict, List, Optional, Any
+import time
+from contextlib import AsyncExitStack
+from typing import AsyncIterator, Callable, Dict, List, Optional, Any, Tuple
 from datetime import datetime
 import anthropic
-from anthropic import Anthropic
+import httpx
+from anthropic import AsyncAnthropic
 from app.core.config import settings
+from app.services.cache import LRUCache, ResultCache, make_cache_key, result_cache
+from app.services.context_packer import ContextPacker, PackedContext, context_packer
+from app.services.metrics import record_tokens, track_upstream, upstream_time_to_first_token
+from app.services.model_router import ModelRoute, ModelRouter, model_router
+from app.services.page_analysis import (
+    ANALYSIS_FIELDS,
+    ANALYSIS_TOOL,
+    ANALYSIS_TOOL_NAME,
+    JSONFieldParser,
+    parse_analysis,
+    validate_field,
+)
+from app.services.rate_limiter import RateLimitExceeded, RateLimiter, rate_limiter
+from app.services.resilience import (
+    CircuitBreaker,
+    ClaudeServiceError,
+    ServiceUnavailableError,
+    UpstreamError,
+    UpstreamTimeoutError,
+    call_with_resilience,
+    claude_breaker,
+    generation_scope,
+    is_upstream_failure,
+    remaining_time,
+    retry_after_seconds,
+)
+from app.services.similarity_cache import SimilarityIndex, similarity_index, similarity_namespace
+from app.services.single_flight import SingleFlight
+from app.services.token_budget import TokenBudgets, TokenReservation, current_month, token_budgets
+from app.services.upstream_scheduler import UpstreamScheduler, current_priority, upstream_scheduler
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_SYSTEM_PROMPT = """You are AIWatch, an AI assistant that helps users navigate and understand web content. 
+            You have access to the current page context and can provide contextual guidance.
+            
+            Guidelines:
+            - Be helpful and concise
+            - Focus on the current page context when relevant
+            - Provide actionable suggestions
+            - Be proactive in offering assistance based on the page content
+            """
+
+# Process-wide HTTP connection pool shared by every Claude client
+_http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Get the shared, pooled HTTP client used for Claude API calls"""
+    global _http_client
+    
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            http2=settings.CLAUDE_HTTP2,
+            limits=httpx.Limits(
+                max_connections=settings.CLAUDE_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.CLAUDE_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.CLAUDE_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                connect=settings.CLAUDE_CONNECT_TIMEOUT,
+                read=settings.CLAUDE_READ_TIMEOUT,
+                write=settings.CLAUDE_WRITE_TIMEOUT,
+                pool=settings.CLAUDE_POOL_TIMEOUT,
+            ),
+        )
+    
+    return _http_client
+
+async def close_http_client():
+    """Close the shared HTTP client and release pooled connections"""
+    global _http_client
+    
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+    _http_client = None
+
 class ClaudeService:
     """Service for interacting with Claude API"""
     
-    def __init__(self):
-        self.client: Optional[Anthropic] = None
+    def __init__(
+        self,
+        cache: Optional[ResultCache] = None,
+        packer: Optional[ContextPacker] = None,
+        limiter: Optional[RateLimiter] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        router: Optional[ModelRouter] = None,
+        similarity: Optional[SimilarityIndex] = None,
+        budgets: Optional[TokenBudgets] = None,
+        scheduler: Optional[UpstreamScheduler] = None
+    ):
+        self.client: Optional[AsyncAnthropic] = None
+        self.cache = cache or result_cache
+        self.packer = packer or context_packer
+        self.limiter = limiter or rate_limiter
+        self.breaker = breaker or claude_breaker
+        self.router = router or model_router
+        self.similarity = similarity or similarity_index
+        self.budgets = budgets or token_budgets
+        self.scheduler = scheduler or upstream_scheduler
+        self.single_flight = SingleFlight()
+        self._batch_jobs = LRUCache(max_entries=1000, ttl_seconds=settings.BATCH_JOB_TTL_SECONDS)
         self._initialized = False
         self._available = False
+        self._probe_task: Optional[asyncio.Task] = None
     
     async def initialize(self):
-        """Initialize the Claude client"""
+        """Initialize the Claude client without making a billable API call"""
         try:
-            if not settings.ANTHROPIC_API_KEY:
-                logger.error("ANTHROPIC_API_KEY not provided")
+            if not self._validate_config():
                 self._available = False
                 return
             
-            self.client = Anthropic(api_key=settings.ANTHROPIC_API_KEY)
-            
-            # Test the connection
-            await self._test_connection()
+            self.client = AsyncAnthropic(
+                api_key=settings.ANTHROPIC_API_KEY,
+                base_url=settings.ANTHROPIC_BASE_URL,
+                http_client=get_http_client(),
+                # Retries happen in the resilience layer, within the request deadline
+                max_retries=0,
+            )
             self._initialized = True
             self._available = True
             logger.info("✅ Claude service initialized successfully")
             
+            # Probe connectivity in the background so startup never waits on the network
+            if settings.CLAUDE_STARTUP_PROBE:
+                self._probe_task = asyncio.create_task(self._test_connection())
+            
         except Exception as e:
             logger.error(f"❌ Failed to initialize Claude service: {str(e)}")
             self._available = False
     
+    def _validate_config(self) -> bool:
+        """Validate Claude configuration locally"""
+        if not settings.ANTHROPIC_API_KEY:
+            logger.error("ANTHROPIC_API_KEY not provided")
+            return False
+        
+        if not settings.CLAUDE_MODEL:
+            logger.error("CLAUDE_MODEL not provided")
+            return False
+        
+        if settings.CLAUDE_MAX_TOKENS <= 0:
+            logger.error(f"Invalid CLAUDE_MAX_TOKENS: {settings.CLAUDE_MAX_TOKENS}")
+            return False
+        
+        if not settings.ANTHROPIC_API_KEY.startswith("sk-ant-"):
+            logger.warning("ANTHROPIC_API_KEY does not look like an Anthropic API key")
+        
+        return True
+    
     async def _test_connection(self):
-        """Test the Claude API connection"""
+        """Test the Claude API connection using the free model lookup endpoint"""
         try:
-            # Make a simple test call
-            response = self.client.messages.create(
-                model=settings.CLAUDE_MODEL,
-                max_tokens=10,
-                messages=[{"role": "user", "content": "Hello"}]
-            )
+            await self.client.models.retrieve(settings.CLAUDE_MODEL)
             logger.info("Claude API connection test successful")
-        except Exception as e:
+        except (anthropic.AuthenticationError, anthropic.PermissionDeniedError, anthropic.NotFoundError) as e:
+            # Bad key or unknown model will never recover on its own
             logger.error(f"Claude API connection test failed: {str(e)}")
-            raise
+            self._available = False
+            return
+        except Exception as e:
+            # Transient network problems should not take the service out of rotation
+            logger.warning(f"Claude API connection test inconclusive: {str(e)}")
+            return
+        
+        # Other tiers are optional; an unknown model there just routes to the standard tier
+        for tier, model in self.router.tiers.items():
+            if model == settings.CLAUDE_MODEL:
+                continue
+            try:
+                await self.client.models.retrieve(model)
+            except anthropic.NotFoundError:
+                self.router.disable_tier(tier)
+            except Exception as e:
+                logger.warning(f"Model lookup for tier '{tier}' inconclusive: {str(e)}")
+    
+    async def close(self):
+        """Release the client and the shared connection pool"""
+        if self._probe_task and not self._probe_task.done():
+            self._probe_task.cancel()
+        self._probe_task = None
+        self.client = None
+        self._initialized = False
+        self._available = False
+        await close_http_client()
     
     def is_available(self) -> bool:
         """Check if Claude service is available"""
@@ -59,98 +203,429 @@ class ClaudeService:
         message: str,
         context: Optional[Dict[str, Any]] = None,
         conversation_history: Optional[List[Dict[str, str]]] = None,
-        system_prompt: Optional[str] = None
+        system_prompt: Optional[str] = None,
+        slo: Optional[str] = None
     ) -> Dict[str, Any]:
         """Generate a response using Claude"""
         
         if not self.is_available():
-            raise Exception("Claude service is not available")
+            raise ServiceUnavailableError("Claude service is not available")
+        
+        packed = self.packer.pack(message, context, conversation_history, system_prompt or DEFAULT_SYSTEM_PROMPT)
+        system = self._build_system(system_prompt, packed)
+        messages = self._build_messages(message, packed)
+        route = self.router.route("chat", slo)
         
         try:
-            # Build the conversation messages
-            messages = []
-            
-            # Add conversation history if provided
-            if conversation_history:
-                for msg in conversation_history[-10:]:  # Limit to last 10 messages
-                    messages.append({
-                        "role": msg.get("role", "user"),
-                        "content": msg.get("content", "")
-                    })
-            
-            # Add current message with context
-            current_content = message
-            if context:
-                context_str = self._format_context(context)
-                current_content = f"{context_str}\n\nUser message: {message}"
-            
-            messages.append({
-                "role": "user",
-                "content": current_content
-            })
-            
-            # Prepare system prompt
-            default_system_prompt = """You are AIWatch, an AI assistant that helps users navigate and understand web content. 
-            You have access to the current page context and can provide contextual guidance.
-            
-            Guidelines:
-            - Be helpful and concise
-            - Focus on the current page context when relevant
-            - Provide actionable suggestions
-            - Be proactive in offering assistance based on the page content
-            """
-            
-            final_system_prompt = system_prompt or default_system_prompt
-            
-            # Make the API call
-            response = self.client.messages.create(
-                model=settings.CLAUDE_MODEL,
-                max_tokens=settings.CLAUDE_MAX_TOKENS,
-                temperature=settings.CLAUDE_TEMPERATURE,
-                system=final_system_prompt,
-                messages=messages
-            )
-            
-            # Extract response content
-            response_content = ""
-            if response.content and len(response.content) > 0:
-                response_content = response.content[0].text if hasattr(response.content[0], 'text') else str(response.content[0])
-            
-            return {
-                "content": response_content,
-                "model": settings.CLAUDE_MODEL,
-                "timestamp": datetime.utcnow().isoformat(),
-                "usage": {
-                    "input_tokens": response.usage.input_tokens if response.usage else 0,
-                    "output_tokens": response.usage.output_tokens if response.usage else 0,
-                },
-                "context_used": bool(context)
-            }
-            
-        except anthropic.APIError as e:
+            response, route = await self._create_routed(route, system=system, messages=messages)
+        except ClaudeServiceError as e:
             logger.error(f"Claude API error: {str(e)}")
-            raise Exception(f"Claude API error: {str(e)}")
-        except Exception as e:
-            logger.error(f"Claude service error: {str(e)}")
-            raise Exception(f"Failed to generate response: {str(e)}")
+            raise
+        
+        return {
+            "content": self._response_text(response),
+            "model": route.model,
+            "timestamp": datetime.utcnow().isoformat(),
+            "usage": self._format_usage(response.usage),
+            "context_used": bool(context)
+        }
+    
+    async def stream_response(
+        self,
+        message: str,
+        context: Optional[Dict[str, Any]] = None,
+        conversation_history: Optional[List[Dict[str, str]]] = None,
+        system_prompt: Optional[str] = None,
+        slo: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Stream a response from Claude as text deltas followed by a final metadata event"""
+        
+        if not self.is_available():
+            raise ServiceUnavailableError("Claude service is not available")
+        
+        packed = self.packer.pack(message, context, conversation_history, system_prompt or DEFAULT_SYSTEM_PROMPT)
+        system = self._build_system(system_prompt, packed)
+        messages = self._build_messages(message, packed)
+        route = self.router.route("chat", slo)
+        started = time.perf_counter()
+        first_token_at: Optional[float] = None
+        
+        stack, stream = await self._open_stream(
+            route.task,
+            model=route.model,
+            max_tokens=route.max_tokens,
+            temperature=route.temperature,
+            system=system,
+            messages=messages
+        )
+        
+        async with stack:
+            try:
+                with track_upstream(route.task, route.model):
+                    async for text in stream.text_stream:
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                            upstream_time_to_first_token.labels(route.task, route.model).observe(first_token_at - started)
+                        yield {"type": "delta", "text": text}
+                    
+                    final_message = await stream.get_final_message()
+                
+            except anthropic.APIError as e:
+                raise self._stream_error(e) from e
+        
+        self.router.record_usage(route, final_message.usage.output_tokens, final_message.stop_reason)
+        record_tokens(route.task, route.model, final_message.usage)
+        finished = time.perf_counter()
+        timing = {
+            "time_to_first_token_ms": round((first_token_at - started) * 1000, 1) if first_token_at else None,
+            "duration_ms": round((finished - started) * 1000, 1),
+        }
+        logger.info(
+            f"Claude stream completed - TTFT: {timing['time_to_first_token_ms']}ms, total: {timing['duration_ms']}ms",
+            extra=timing
+        )
+        
+        yield {
+            "type": "done",
+            "model": route.model,
+            "timestamp": datetime.utcnow().isoformat(),
+            "usage": self._format_usage(final_message.usage),
+            "context_used": bool(context),
+            "timing": timing,
+        }
+    
+    def _build_system(
+        self,
+        system_prompt: Optional[str],
+        packed: PackedContext
+    ) -> List[Dict[str, Any]]:
+        """Build the system blocks: instructions plus the stable page context, marked cacheable"""
+        blocks = [{"type": "text", "text": system_prompt or DEFAULT_SYSTEM_PROMPT}]
+        
+        if packed.page:
+            blocks.append({"type": "text", "text": f"Current page context:\n{packed.page}"})
+        
+        if settings.CLAUDE_PROMPT_CACHING:
+            blocks[-1]["cache_control"] = {"type": "ephemeral"}
+        
+        return blocks
+    
+    def _build_messages(self, message: str, packed: PackedContext) -> List[Dict[str, Any]]:
+        """Build the conversation messages sent to Claude, oldest first so the prefix stays cacheable"""
+        messages: List[Dict[str, Any]] = [dict(msg) for msg in packed.history]
+        
+        if settings.CLAUDE_PROMPT_CACHING and messages:
+            last = messages[-1]
+            last["content"] = [
+                {"type": "text", "text": last["content"], "cache_control": {"type": "ephemeral"}}
+            ]
+        
+        # Add current message with the per-turn context that changes between requests
+        current_content = message
+        if packed.activity:
+            current_content = f"{packed.activity}\n\nUser message: {message}"
+        
+        messages.append({
+            "role": "user",
+            "content": current_content
+        })
+        
+        return messages
+    
+    async def _create_message(self, task: str, **params: Any) -> Any:
+        """Call messages.create with a token reservation, an upstream slot, admission control, the request deadline, retries and the circuit breaker"""
+        reservation = self._reserve(task, params)
+        
+        sent = False
+        
+        async def admit():
+            await self.limiter.admit_upstream(reservation.estimated_tokens)
+        
+        async def attempt():
+            nonlocal sent
+            sent = True
+            with track_upstream(task, params["model"]):
+                response = await self.client.messages.create(**params)
+            record_tokens(task, params["model"], response.usage)
+            return response
+        
+        try:
+            # The slot is held across retries, so a struggling upstream is not sent more calls at once
+            async with self.scheduler.slot(current_priority(task), timeout=remaining_time()):
+                with generation_scope(reservation.max_tokens):
+                    response = await call_with_resilience(attempt, self.breaker, on_error=self._observe_error, admit=admit)
+        except UpstreamTimeoutError:
+            # Given up on while Claude may have been generating, so charged like a cancellation
+            if sent:
+                self.budgets.settle(reservation)
+            else:
+                self.budgets.release(reservation)
+            raise
+        except (ClaudeServiceError, RateLimitExceeded):
+            # Refused or failed upstream, so nothing was billed
+            self.budgets.release(reservation)
+            raise
+        except BaseException:
+            # Cancelled: once sent, Claude may already be reading the prompt; cancelled while queued, nothing was
+            if sent:
+                self.budgets.settle(reservation)
+            else:
+                self.budgets.release(reservation)
+            raise
+        
+        self.budgets.settle(reservation, response.usage)
+        return response
+    
+    async def _open_stream(self, task: str, **params: Any) -> Tuple[AsyncExitStack, Any]:
+        """Open messages.stream with a token reservation, an upstream slot, admission control and resilience; the caller enters the returned stack"""
+        reservation = self._reserve(task, params)
+        
+        sent = False
+        
+        async def admit():
+            await self.limiter.admit_upstream(reservation.estimated_tokens)
+        
+        async def open_stream():
+            nonlocal sent
+            sent = True
+            # Only opening the stream is retried; once tokens flow a retry would repeat them
+            stack = AsyncExitStack()
+            stream = await stack.enter_async_context(self.client.messages.stream(**params))
+            # Charged when the stream closes, from the usage it reported, also when it was cut short
+            stack.callback(self._settle_stream, reservation, stream)
+            return stack, stream
+        
+        try:
+            await self.scheduler.acquire(current_priority(task), timeout=remaining_time())
+        except BaseException:
+            self.budgets.release(reservation)
+            raise
+        
+        try:
+            stack, stream = await call_with_resilience(open_stream, self.breaker, on_error=self._observe_error, admit=admit)
+        except ClaudeServiceError as e:
+            logger.error(f"Claude API streaming error: {str(e)}")
+            self.scheduler.release()
+            if isinstance(e, UpstreamTimeoutError) and sent:
+                self.budgets.settle(reservation)
+            else:
+                self.budgets.release(reservation)
+            raise
+        except BaseException:
+            self.scheduler.release()
+            self.budgets.release(reservation)
+            raise
+        
+        # The slot is held until the stream closes
+        stack.callback(self.scheduler.release)
+        return stack, stream
+    
+    def _reserve(self, task: str, params: Dict[str, Any]) -> TokenReservation:
+        """Estimate a call before it is sent, refusing it or lowering max_tokens to fit the caller's budget"""
+        reservation = self.budgets.reserve(task, params)
+        params["max_tokens"] = reservation.max_tokens
+        return reservation
+    
+    def _settle_stream(self, reservation: TokenReservation, stream: Any):
+        """Charge a closed stream by the usage in its last message snapshot"""
+        try:
+            usage = stream.current_message_snapshot.usage
+        except AssertionError:
+            # Closed before Claude sent anything
+            usage = None
+        self.budgets.settle(reservation, usage)
+    
+    def _stream_error(self, error: anthropic.APIError) -> UpstreamError:
+        """Account for an error raised after a stream started; it cannot be retried"""
+        logger.error(f"Claude API streaming error: {str(error)}")
+        self._observe_error(error)
+        if is_upstream_failure(error):
+            self.breaker.record_failure()
+        return UpstreamError(f"Claude API error: {str(error)}")
+    
+    async def _create_routed(
+        self,
+        route: ModelRoute,
+        validate: Optional[Callable[[Any], bool]] = None,
+        **params: Any
+    ) -> Tuple[Any, ModelRoute]:
+        """Call Claude on a route, escalating once to a stronger tier when the response fails validation"""
+        response = await self._create_message(
+            route.task,
+            model=route.model, max_tokens=route.max_tokens, temperature=route.temperature, **params
+        )
+        self.router.record_usage(route, response.usage.output_tokens, response.stop_reason)
+        if validate is None or validate(response):
+            return response, route
+        
+        escalated = self.router.escalate(route)
+        if escalated is None:
+            return response, route
+        
+        logger.info(f"Escalating {route.task} from {route.model} to {escalated.model} after a response failed validation")
+        response = await self._create_message(
+            escalated.task,
+            model=escalated.model, max_tokens=escalated.max_tokens, temperature=escalated.temperature, **params
+        )
+        self.router.record_usage(escalated, response.usage.output_tokens, response.stop_reason)
+        return response, escalated
+    
+    def _observe_error(self, error: Exception):
+        """Back off globally when Claude itself reports a rate limit"""
+        if isinstance(error, anthropic.RateLimitError):
+            self.limiter.pause_upstream(retry_after_seconds(error) or 1.0)
+    
+    def _format_usage(self, usage: Any) -> Dict[str, int]:
+        """Convert an Anthropic usage object into a plain dict"""
+        return {
+            "input_tokens": usage.input_tokens if usage else 0,
+            "output_tokens": usage.output_tokens if usage else 0,
+            "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", None) or 0,
+            "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", None) or 0,
+        }
     
     async def analyze_context(
         self,
         url: str,
         page_content: str,
-        user_intent: Optional[str] = None
+        user_intent: Optional[str] = None,
+        slo: Optional[str] = None
     ) -> Dict[str, Any]:
         """Analyze page context and provide insights"""
         
         if not self.is_available():
-            raise Exception("Claude service is not available")
+            raise ServiceUnavailableError("Claude service is not available")
+        
+        cache_key = make_cache_key("page_analysis", url, page_content, user_intent)
+        cached = await self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        # Pages differing only by ads, timestamps or session IDs reuse a near-duplicate's analysis
+        namespace = similarity_namespace("analysis", url, user_intent)
+        fingerprint = self.similarity.fingerprint(page_content)
+        similar = await self._find_similar(namespace, fingerprint)
+        if similar is not None:
+            return {**similar, "url": url, "similar_to": similar["url"]}
+        
+        # Identical analyses already in flight share one upstream call
+        analysis = await self.single_flight.do(
+            cache_key,
+            lambda: self._analyze_uncached(cache_key, url, page_content, user_intent, slo)
+        )
+        self.similarity.add(namespace, fingerprint, cache_key)
+        return analysis
+    
+    async def stream_analysis(
+        self,
+        url: str,
+        page_content: str,
+        user_intent: Optional[str] = None,
+        slo: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Stream a context analysis: each top-level field as soon as it is complete, then the validated whole"""
+        
+        if not self.is_available():
+            raise ServiceUnavailableError("Claude service is not available")
+        
+        cache_key = make_cache_key("page_analysis", url, page_content, user_intent)
+        namespace = similarity_namespace("analysis", url, user_intent)
+        fingerprint = None
+        analysis = await self.cache.get(cache_key)
+        if analysis is None:
+            fingerprint = self.similarity.fingerprint(page_content)
+            similar = await self._find_similar(namespace, fingerprint)
+            if similar is not None:
+                analysis = {**similar, "url": url, "similar_to": similar["url"]}
+        
+        if analysis is not None:
+            for name, value in analysis["analysis"].items():
+                yield {"type": "field", "name": name, "value": value}
+            yield {"type": "done", **analysis}
+            return
+        
+        route = self.router.route("analysis", slo)
+        parser = JSONFieldParser()
+        started = time.perf_counter()
+        first_token_at: Optional[float] = None
+        stack, stream = await self._open_stream(route.task, **self._analysis_params(url, page_content, user_intent, route))
+        
+        async with stack:
+            try:
+                with track_upstream(route.task, route.model):
+                    async for event in stream:
+                        if event.type != "content_block_delta" or event.delta.type != "input_json_delta":
+                            continue
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                            upstream_time_to_first_token.labels(route.task, route.model).observe(first_token_at - started)
+                        for name, value in parser.feed(event.delta.partial_json):
+                            if name in ANALYSIS_FIELDS:
+                                yield {"type": "field", "name": name, "value": validate_field(name, value)}
+                    
+                    final_message = await stream.get_final_message()
+                
+            except anthropic.APIError as e:
+                raise self._stream_error(e) from e
+            except ValueError as e:
+                raise UpstreamError(f"Claude streamed an invalid analysis: {str(e)}") from e
+        
+        self.router.record_usage(route, final_message.usage.output_tokens, final_message.stop_reason)
+        record_tokens(route.task, route.model, final_message.usage)
+        analysis = self._analysis_result(url, final_message)
+        
+        await self.cache.set(cache_key, analysis)
+        self.similarity.add(namespace, fingerprint, cache_key)
+        yield {"type": "done", **analysis}
+    
+    async def _analyze_uncached(
+        self,
+        cache_key: str,
+        url: str,
+        page_content: str,
+        user_intent: Optional[str],
+        slo: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Call Claude for a context analysis and cache the result"""
         
         try:
-            # Build context analysis prompt
-            analysis_prompt = f"""Analyze this web page and provide insights:
+            response, route = await self._create_routed(
+                self.router.route("analysis", slo),
+                validate=lambda message: parse_analysis(message) is not None,
+                **self._analysis_params(url, page_content, user_intent)
+            )
+        except ClaudeServiceError as e:
+            logger.error(f"Context analysis error: {str(e)}")
+            raise
+        
+        analysis = self._analysis_result(url, response)
+        
+        await self.cache.set(cache_key, analysis)
+        return analysis
+    
+    def _analysis_params(
+        self,
+        url: str,
+        page_content: str,
+        user_intent: Optional[str],
+        route: Optional[ModelRoute] = None
+    ) -> Dict[str, Any]:
+        """Build the messages.create parameters for a context analysis; without a route, _create_routed adds the model"""
+        params = {
+            "messages": self._analysis_messages(url, page_content, user_intent),
+            "tools": [ANALYSIS_TOOL],
+            "tool_choice": {"type": "tool", "name": ANALYSIS_TOOL_NAME},
+        }
+        if route is not None:
+            params.update(model=route.model, max_tokens=route.max_tokens, temperature=route.temperature)
+        return params
+    
+    def _analysis_messages(self, url: str, page_content: str, user_intent: Optional[str]) -> List[Dict[str, Any]]:
+        """Build the messages for a context analysis"""
+        analysis_prompt = f"""Analyze this web page and provide insights:
 
 URL: {url}
-Page Content: {page_content[:2000]}...  # Truncate for token limits
+Page Content: {self.packer.pack_text(page_content, settings.ANALYSIS_CONTENT_TOKENS)}
 
 Please provide:
 1. Page type and purpose
@@ -160,29 +635,179 @@ Please provide:
 
 {"User indicated intent: " + user_intent if user_intent else ""}
 
-Respond in JSON format with keys: page_type, purpose, key_actions, suggestions, insights"""
+Record your analysis with the {ANALYSIS_TOOL_NAME} tool."""
 
-            response = self.client.messages.create(
-                model=settings.CLAUDE_MODEL,
-                max_tokens=1000,
-                temperature=0.3,
-                messages=[{"role": "user", "content": analysis_prompt}]
-            )
+        return [{"role": "user", "content": analysis_prompt}]
+    
+    def _analysis_result(self, url: str, response: Any) -> Dict[str, Any]:
+        """Convert an analysis response message into the analysis dict, rejecting output that breaks the schema"""
+        analysis = parse_analysis(response)
+        if analysis is None:
+            raise UpstreamError(f"Claude returned an analysis that does not match the schema (stop reason: {response.stop_reason})")
+        
+        return {
+            "analysis": analysis.model_dump(),
+            "url": url,
+            "timestamp": datetime.utcnow().isoformat(),
+            "model": response.model
+        }
+    
+    def _response_text(self, response: Any) -> str:
+        """Text of the first content block"""
+        if response.content and len(response.content) > 0:
+            return response.content[0].text if hasattr(response.content[0], 'text') else str(response.content[0])
+        return ""
+    
+    async def submit_analysis_batch(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Submit context analyses to the discounted Message Batches API"""
+        
+        if not self.is_available():
+            raise ServiceUnavailableError("Claude service is not available")
+        
+        # Nobody waits on a batch, so it routes with the batch SLO
+        route = self.router.route("analysis", "batch")
+        requests = []
+        entries = []
+        for index, item in enumerate(items):
+            url, page_content, user_intent = item["url"], item["page_content"], item.get("user_intent")
+            requests.append({
+                "custom_id": f"item-{index}",
+                "params": self._analysis_params(url, page_content, user_intent, route),
+            })
+            entries.append({"url": url, "cache_key": make_cache_key("page_analysis", url, page_content, user_intent)})
+        
+        reservations = []
+        try:
+            # Every item is checked and held against the caller's budget like a single call
+            for request in requests:
+                reservations.append(self._reserve(route.task, request["params"]))
             
-            response_content = ""
-            if response.content and len(response.content) > 0:
-                response_content = response.content[0].text if hasattr(response.content[0], 'text') else str(response.content[0])
+            # Submitting twice would bill twice, so creation is never retried
+            batch = await call_with_resilience(
+                lambda: self.client.messages.batches.create(requests=requests),
+                self.breaker,
+                max_retries=0
+            )
+        except ClaudeServiceError as e:
+            logger.error(f"Batch submission error: {str(e)}")
+            for reservation in reservations:
+                self.budgets.release(reservation)
+            raise
+        except BaseException:
+            for reservation in reservations:
+                self.budgets.release(reservation)
+            raise
+        
+        # Charged from the estimates now, and corrected by the reported usage once the batch has ended
+        for entry, reservation in zip(entries, reservations):
+            self.budgets.charge(reservation, reservation.estimated_tokens, reservation.max_tokens)
+            entry["charged"] = [reservation.estimated_tokens, reservation.max_tokens]
+        
+        # Results only carry custom_ids, so remember which page each one belongs to
+        job = {"entries": entries, "user_id": reservations[0].user_id if reservations else None, "month": current_month()}
+        self._batch_jobs.set(batch.id, job)
+        if self.cache.is_shared():
+            # Results may be fetched from any worker
+            await self.cache.set(f"aiwatch:batch_job:{batch.id}", job, settings.BATCH_JOB_TTL_SECONDS)
+        logger.info(f"Submitted analysis batch {batch.id} with {len(requests)} items")
+        
+        return self._batch_status(batch)
+    
+    async def get_analysis_batch(self, job_id: str) -> Dict[str, Any]:
+        """Get the status of an analysis batch and, once it has ended, its results"""
+        
+        if not self.is_available():
+            raise ServiceUnavailableError("Claude service is not available")
+        
+        try:
+            batch = await call_with_resilience(lambda: self.client.messages.batches.retrieve(job_id), self.breaker)
+            status = self._batch_status(batch)
+            if batch.processing_status != "ended":
+                return status
             
-            return {
-                "analysis": response_content,
-                "url": url,
-                "timestamp": datetime.utcnow().isoformat(),
-                "model": settings.CLAUDE_MODEL
-            }
+            job = self._batch_jobs.get(job_id)
+            if job is None and self.cache.is_shared():
+                job = await self.cache.get(f"aiwatch:batch_job:{job_id}")
+            entries = job["entries"] if job else []
+            results = []
+            # Input and output tokens each item used; errored and expired items are not billed
+            used: Dict[int, Tuple[int, int]] = {}
+            async for entry in await self.client.messages.batches.results(job_id):
+                index = int(entry.custom_id.rsplit("-", 1)[-1])
+                known = entries[index] if index < len(entries) else None
+                url = known["url"] if known else None
+                
+                if entry.result.type == "succeeded":
+                    usage = self._format_usage(entry.result.message.usage)
+                    used[index] = (
+                        usage["input_tokens"] + usage["cache_creation_input_tokens"] + usage["cache_read_input_tokens"],
+                        usage["output_tokens"],
+                    )
+                    try:
+                        analysis = self._analysis_result(url, entry.result.message)
+                    except UpstreamError as e:
+                        results.append({"index": index, "url": url, "status": "error", "error": str(e)})
+                        continue
+                    if known:
+                        await self.cache.set(known["cache_key"], analysis)
+                    results.append({"index": index, "url": url, "status": "ok", "analysis": analysis})
+                else:
+                    error = getattr(entry.result, "error", None)
+                    results.append({
+                        "index": index,
+                        "url": url,
+                        "status": "error",
+                        "error": str(error) if error else entry.result.type,
+                    })
             
-        except Exception as e:
-            logger.error(f"Context analysis error: {str(e)}")
-            raise Exception(f"Failed to analyze context: {str(e)}")
+        except ClaudeServiceError as e:
+            logger.error(f"Batch retrieval error: {str(e)}")
+            raise
+        except anthropic.APIError as e:
+            logger.error(f"Batch retrieval error: {str(e)}")
+            raise UpstreamError(f"Failed to get analysis batch: {str(e)}") from e
+        
+        if job and job.get("user_id"):
+            await self._reconcile_batch(job_id, job, used)
+        
+        status["results"] = sorted(results, key=lambda result: result["index"])
+        return status
+    
+    async def _reconcile_batch(self, job_id: str, job: Dict[str, Any], used: Dict[int, Tuple[int, int]]):
+        """Replace an ended batch's estimated charge by the usage its items reported, the first time its results are read"""
+        key = f"aiwatch:batch_reconciled:{job_id}"
+        if job.get("reconciled") or (self.cache.is_shared() and await self.cache.get(key)):
+            return
+        
+        # Marked before the await below, so polls racing this one do not correct the charge again
+        job["reconciled"] = True
+        if self.cache.is_shared():
+            await self.cache.set(key, True, settings.BATCH_JOB_TTL_SECONDS)
+        
+        input_delta = output_delta = 0
+        for index, entry in enumerate(job["entries"]):
+            charged_input, charged_output = entry.get("charged") or (0, 0)
+            actual_input, actual_output = used.get(index, (0, 0))
+            input_delta += actual_input - charged_input
+            output_delta += actual_output - charged_output
+        await self.budgets.adjust(job["user_id"], job["month"], input_delta, output_delta)
+    
+    def _batch_status(self, batch: Any) -> Dict[str, Any]:
+        """Summarize a Message Batch"""
+        counts = batch.request_counts
+        return {
+            "job_id": batch.id,
+            "status": batch.processing_status,
+            "request_counts": {
+                "processing": counts.processing,
+                "succeeded": counts.succeeded,
+                "errored": counts.errored,
+                "canceled": counts.canceled,
+                "expired": counts.expired,
+            },
+            "created_at": batch.created_at.isoformat() if batch.created_at else None,
+            "ended_at": batch.ended_at.isoformat() if batch.ended_at else None,
+        }
     
     async def generate_proactive_suggestions(
         self,
@@ -193,64 +818,92 @@ Respond in JSON format with keys: page_type, purpose, key_actions, suggestions,
         if not self.is_available():
             return ["Claude service is currently unavailable"]
         
+        cache_key = self._suggestions_cache_key(context)
+        cached = await self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        namespace = similarity_namespace("suggestions", str(context.get("url") or ""), context.get("userIntent"))
+        fingerprint = self.similarity.fingerprint(str(context.get("content") or ""))
+        similar = await self._find_similar(namespace, fingerprint)
+        if similar is not None:
+            return similar
+        
         try:
-            context_str = self._format_context(context)
-            
-            prompt = f"""Based on this page context, suggest 3-5 proactive ways I can help the user:
-
-{context_str}
-
-Provide specific, actionable suggestions as a simple list. Focus on what would be most helpful for someone viewing this page."""
-
-            response = self.client.messages.create(
-                model=settings.CLAUDE_MODEL,
-                max_tokens=500,
-                temperature=0.5,
-                messages=[{"role": "user", "content": prompt}]
+            suggestions = await self.single_flight.do(
+                cache_key,
+                lambda: self._suggestions_uncached(cache_key, context)
             )
-            
-            response_content = ""
-            if response.content and len(response.content) > 0:
-                response_content = response.content[0].text if hasattr(response.content[0], 'text') else str(response.content[0])
-            
-            # Extract suggestions from response
-            suggestions = []
-            lines = response_content.split('\n')
-            for line in lines:
-                line = line.strip()
-                if line and (line.startswith('-') or line.startswith('•') or line.startswith('*')):
-                    suggestion = line[1:].strip()
-                    if suggestion:
-                        suggestions.append(suggestion)
-            
-            return suggestions[:5]  # Limit to 5 suggestions
-            
+            if suggestions:
+                self.similarity.add(namespace, fingerprint, cache_key)
+            return suggestions
         except Exception as e:
             logger.error(f"Proactive suggestions error: {str(e)}")
             return ["I'm here to help! Ask me anything about this page."]
     
-    def _format_context(self, context: Dict[str, Any]) -> str:
-        """Format context information for Claude"""
-        formatted = []
+    async def _suggestions_uncached(self, cache_key: str, context: Dict[str, Any]) -> List[str]:
+        """Call Claude for proactive suggestions and cache the result"""
         
-        if context.get('url'):
-            formatted.append(f"Current page: {context['url']}")
+        context_str = self._format_context(context)
         
-        if context.get('title'):
-            formatted.append(f"Page title: {context['title']}")
-        
-        if context.get('pageType'):
-            formatted.append(f"Page type: {context['pageType']}")
-        
-        if context.get('content'):
-            # Truncate content to avoid token limits
-            content = str(context['content'])[:1000]
-            formatted.append(f"Page content: {content}...")
+        prompt = f"""Based on this page context, suggest 3-5 proactive ways I can help the user:
+
+{context_str}
+
+Provide specific, actionable suggestions as a simple list. Focus on what would be most helpful for someone viewing this page."""
+
+        # Cheap tier first; a reply with no usable list is retried once on the stronger tier
+        response, _ = await self._create_routed(
+            self.router.route("suggestions"),
+            validate=lambda message: bool(self._parse_suggestions(message)),
+            messages=[{"role": "user", "content": prompt}]
+        )
+        suggestions = self._parse_suggestions(response)
         
-        if context.get('userActivity'):
-            formatted.append(f"User activity: {context['userActivity']}")
+        if suggestions:
+            await self.cache.set(cache_key, suggestions)
+        return suggestions
+    
+    def _parse_suggestions(self, response: Any) -> List[str]:
+        """Extract the bulleted suggestions from a response"""
+        suggestions = []
+        lines = self._response_text(response).split('\n')
+        for line in lines:
+            line = line.strip()
+            if line and (line.startswith('-') or line.startswith('•') or line.startswith('*')):
+                suggestion = line[1:].strip()
+                if suggestion:
+                    suggestions.append(suggestion)
         
-        if context.get('timestamp'):
-            formatted.append(f"Context timestamp: {context['timestamp']}")
+        return suggestions[:5]  # Limit to 5 suggestions
+    
+    async def _find_similar(self, namespace: str, fingerprint: Optional[int]) -> Optional[Any]:
+        """Get the cached result of a near-duplicate page"""
+        key = self.similarity.find(namespace, fingerprint)
+        if key is None:
+            return None
         
-        return "\n".join(formatted)
\ No newline at end of file
+        value = await self.cache.get(key)
+        if value is None:
+            # The result it pointed at has expired or been evicted
+            self.similarity.discard(key)
+        return value
+    
+    def _suggestions_cache_key(self, context: Dict[str, Any]) -> str:
+        """Build the suggestions cache key from the stable parts of a context"""
+        # User activity and timestamps change constantly and are left out of the key
+        content = "\0".join(
+            str(context.get(field) or "") for field in ("title", "pageType", "content", "metadata")
+        )
+        return make_cache_key("suggestions", str(context.get("url") or ""), content, context.get("userIntent"))
+    
+    def _format_context(self, context: Dict[str, Any]) -> str:
+        """Format context information for Claude"""
+        return self.packer.format_context(context, settings.SUGGESTIONS_CONTENT_TOKENS)
+
+# Process-wide service instance, provided to routes through dependency injection
+claude_service = ClaudeService()
+
+def get_claude_service() -> ClaudeService:
+    """FastAPI dependency returning the shared Claude service"""
+    return claude_service
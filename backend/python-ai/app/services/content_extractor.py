@@ -0,0 +1,265 @@
+import asyncio
+import hashlib
+import re
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+
+# Elements whose whole subtree is boilerplate or not human-readable text
+SKIPPED_TAGS = {
+    "script", "style", "noscript", "template", "svg", "canvas", "iframe", "object",
+    "nav", "header", "footer", "aside", "button", "select", "textarea",
+}
+
+# Main content; a header inside one holds its title and byline rather than site chrome
+CONTENT_TAGS = {"article", "main"}
+
+# Elements that end a block of text
+BLOCK_TAGS = {
+    "p", "div", "section", "article", "main", "li", "ul", "ol", "dl", "dt", "dd", "table", "tr",
+    "td", "th", "pre", "blockquote", "figure", "figcaption", "h1", "h2", "h3", "h4", "h5", "h6",
+    "br", "hr", "form", "label", "body", "header",
+}
+
+HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+FIELD_TAGS = {"input", "select", "textarea", "button"}
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_HTML_HINT_RE = re.compile(r"<(?:!doctype|html|head|body|div|p|span|a|script|meta|form|section|article)\b", re.I)
+
+# Limits that keep memory bounded no matter how large the page is
+MAX_HEADINGS = 100
+MAX_LINKS = 200
+MAX_FORMS = 20
+MAX_FIELDS_PER_FORM = 50
+MAX_SEEN_BLOCKS = 20000
+MIN_BLOCK_CHARS = 3
+
+@dataclass
+class ExtractedContent:
+    """Main-content text and structured elements extracted from an HTML page"""
+    text: str = ""
+    title: Optional[str] = None
+    headings: List[Dict[str, str]] = field(default_factory=list)
+    forms: List[Dict[str, Any]] = field(default_factory=list)
+    links: List[Dict[str, str]] = field(default_factory=list)
+    truncated: bool = False
+    chars_in: int = 0
+    blocks: int = 0
+    duplicate_blocks: int = 0
+
+class ContentExtractor(HTMLParser):
+    """Incremental HTML to main-content extractor; feed it chunks and call result()"""
+
+    def __init__(self, max_text_chars: int):
+        super().__init__(convert_charrefs=True)
+        self.max_text_chars = max_text_chars
+        self.content = ExtractedContent()
+        self._parts: List[str] = []
+        self._text_chars = 0
+        self._block: List[str] = []
+        self._block_chars = 0
+        self._skip_depth = 0
+        self._content_depth = 0
+        # Whether each open header was skipped, so its end tag undoes the right thing
+        self._headers: List[bool] = []
+        self._seen: set = set()
+        self._in_title = False
+        self._title: List[str] = []
+        self._heading: Optional[List[str]] = None
+        self._heading_tag = ""
+        self._link: Optional[Dict[str, Any]] = None
+        self._form: Optional[Dict[str, Any]] = None
+
+    def feed(self, data: str):
+        self.content.chars_in += len(data)
+        super().feed(data)
+
+    def handle_starttag(self, tag: str, attrs: List[tuple]):
+        if tag in FIELD_TAGS and self._form is not None:
+            self._add_field(tag, dict(attrs))
+
+        if tag == "header":
+            skipped = bool(self._skip_depth) or not self._content_depth
+            self._headers.append(skipped)
+            if skipped:
+                self._skip_depth += 1
+                return
+        elif tag in SKIPPED_TAGS:
+            if tag not in VOID_TAGS:
+                self._skip_depth += 1
+            return
+
+        if self._skip_depth:
+            return
+
+        if tag in CONTENT_TAGS:
+            self._content_depth += 1
+        if tag in BLOCK_TAGS:
+            self._flush_block()
+
+        if tag == "title":
+            self._in_title = True
+        elif tag in HEADING_TAGS:
+            self._heading, self._heading_tag = [], tag
+        elif tag == "a":
+            href = dict(attrs).get("href")
+            if href and not href.startswith(("#", "javascript:")):
+                self._link = {"href": href, "text": []}
+        elif tag == "form":
+            attributes = dict(attrs)
+            self._form = {
+                "action": attributes.get("action") or "",
+                "method": (attributes.get("method") or "get").lower(),
+                "fields": [],
+            }
+
+    def handle_startendtag(self, tag: str, attrs: List[tuple]):
+        # Self-closing tags never open a subtree
+        if tag in FIELD_TAGS and self._form is not None:
+            self._add_field(tag, dict(attrs))
+        if not self._skip_depth and tag in BLOCK_TAGS:
+            self._flush_block()
+
+    def handle_endtag(self, tag: str):
+        if tag == "header":
+            # A header that was kept ends like any other element
+            skipped = self._headers.pop() if self._headers else True
+        else:
+            skipped = tag in SKIPPED_TAGS
+        if skipped:
+            if self._skip_depth:
+                self._skip_depth -= 1
+            return
+
+        if self._skip_depth:
+            return
+
+        if tag in CONTENT_TAGS and self._content_depth:
+            self._content_depth -= 1
+
+        if tag == "title":
+            self._in_title = False
+            if self.content.title is None:
+                self.content.title = _normalize("".join(self._title)) or None
+        elif tag == self._heading_tag and self._heading is not None:
+            text = _normalize("".join(self._heading))
+            if text and len(self.content.headings) < MAX_HEADINGS:
+                self.content.headings.append({"level": tag, "text": text})
+            self._heading, self._heading_tag = None, ""
+        elif tag == "a" and self._link is not None:
+            text = _normalize("".join(self._link["text"]))
+            if len(self.content.links) < MAX_LINKS:
+                self.content.links.append({"href": self._link["href"], "text": text})
+            self._link = None
+        elif tag == "form" and self._form is not None:
+            if len(self.content.forms) < MAX_FORMS:
+                self.content.forms.append(self._form)
+            self._form = None
+
+        if tag in BLOCK_TAGS:
+            self._flush_block()
+
+    def handle_data(self, data: str):
+        if self._in_title:
+            self._title.append(data)
+            return
+
+        if self._skip_depth:
+            return
+
+        if self._heading is not None:
+            self._heading.append(data)
+        if self._link is not None:
+            self._link["text"].append(data)
+
+        self._block.append(data)
+        self._block_chars += len(data)
+
+        # A page without block elements must not grow the buffer without bound
+        if self._block_chars > self.max_text_chars:
+            self._flush_block()
+
+    def result(self) -> ExtractedContent:
+        """Finish parsing and return the extracted content"""
+        self.close()
+        self._flush_block()
+
+        if self._form is not None and len(self.content.forms) < MAX_FORMS:
+            self.content.forms.append(self._form)
+            self._form = None
+
+        self.content.text = "\n\n".join(self._parts)
+        return self.content
+
+    def _add_field(self, tag: str, attributes: Dict[str, Optional[str]]):
+        """Record a form field"""
+        fields = self._form["fields"]
+        if len(fields) >= MAX_FIELDS_PER_FORM:
+            return
+
+        field_type = attributes.get("type") or ("text" if tag == "input" else tag)
+        if field_type == "hidden":
+            return
+
+        fields.append({
+            "tag": tag,
+            "type": field_type,
+            "name": attributes.get("name") or attributes.get("id") or "",
+            "required": "required" in attributes,
+        })
+
+    def _flush_block(self):
+        """Close the current text block, dropping empty and repeated blocks"""
+        if not self._block:
+            return
+
+        text = _normalize("".join(self._block))
+        self._block = []
+        self._block_chars = 0
+        if len(text) < MIN_BLOCK_CHARS:
+            return
+
+        self.content.blocks += 1
+        digest = hashlib.blake2b(text.lower().encode("utf-8", "ignore"), digest_size=8).digest()
+        if digest in self._seen:
+            self.content.duplicate_blocks += 1
+            return
+        if len(self._seen) < MAX_SEEN_BLOCKS:
+            self._seen.add(digest)
+
+        if self._text_chars >= self.max_text_chars:
+            self.content.truncated = True
+            return
+
+        remaining = self.max_text_chars - self._text_chars
+        if len(text) > remaining:
+            text = text[:remaining]
+            self.content.truncated = True
+
+        self._parts.append(text)
+        self._text_chars += len(text) + 2
+
+def _normalize(text: str) -> str:
+    """Collapse whitespace"""
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+def looks_like_html(content: str) -> bool:
+    """Check whether submitted page content is markup rather than plain text"""
+    return bool(_HTML_HINT_RE.search(content[:4096]))
+
+def extract_content(html: str, max_text_chars: Optional[int] = None, chunk_size: int = 65536) -> ExtractedContent:
+    """Extract main-content text, headings, forms and links from an HTML document"""
+    extractor = ContentExtractor(max_text_chars or settings.EXTRACTION_MAX_TEXT_CHARS)
+    for start in range(0, len(html), chunk_size):
+        extractor.feed(html[start:start + chunk_size])
+    return extractor.result()
+
+async def extract_content_async(html: str) -> ExtractedContent:
+    """Extract content, moving large pages off the event loop"""
+    if len(html) < settings.EXTRACTION_THREAD_THRESHOLD:
+        return extract_content(html)
+    return await asyncio.to_thread(extract_content, html)
@@ -0,0 +1,317 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Scroll depth past which content counts as read
+READ_SCROLL_DEPTH = 0.8
+
+class DiffError(ValueError):
+    """A diff could not be applied to the stored page state"""
+
+def _list(value: Any, name: str) -> List[Any]:
+    """A list field of a client message, which may be left out"""
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        raise DiffError(f"{name} must be a list")
+    return value
+
+def _dict(value: Any, name: str) -> Dict[str, Any]:
+    """An object field of a client message, which may be left out"""
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        raise DiffError(f"{name} must be an object")
+    return value
+
+class PageState:
+    """Server-side copy of one connection's page, kept up to date from snapshots and diffs"""
+
+    def __init__(self, max_content_chars: int):
+        self.max_content_chars = max_content_chars
+        self.url = ""
+        self.title: Optional[str] = None
+        # The first max_content_chars of the client's content; splices and lengths refer to the full content
+        self.content = ""
+        self.length = 0
+        self.scroll_depth = 0.0
+        self.dom_elements: Dict[str, Dict[str, str]] = {}
+        self.version = 0
+        # Change accumulated since insights were last computed
+        self._changed_chars = 0
+        self._url_changed = False
+        self._forms_changed = False
+        self._insight_scroll_depth = 0.0
+        self._insight_content_length = 0
+
+    def apply_snapshot(self, message: Dict[str, Any]):
+        """Replace the whole page state"""
+        url = str(message.get("url") or "")
+        if not url:
+            raise DiffError("Snapshot requires a url")
+        elements = [_dict(element, "DOM element") for element in _list(message.get("domElements"), "domElements")]
+
+        self._url_changed = self._url_changed or url != self.url
+        self.url = url
+        self.title = message.get("title")
+        full_content = str(message.get("content") or "")
+        content = full_content[:self.max_content_chars]
+        self._changed_chars += abs(len(content) - len(self.content)) or len(content)
+        self.content = content
+        self.length = len(full_content)
+        self.dom_elements = {}
+        self._apply_elements({"added": elements})
+        self._set_scroll(message.get("scrollDepth"))
+        self.version += 1
+
+    def apply_diff(self, message: Dict[str, Any]):
+        """Apply content splices, a scroll update and DOM element changes"""
+        if not self.url:
+            raise DiffError("Diff received before snapshot")
+
+        content, length, changed = self.content, self.length, 0
+        for op in _list(message.get("content"), "content"):
+            op = _dict(op, "Splice")
+            start, end, text = int(op.get("start", 0)), int(op.get("end", 0)), str(op.get("text") or "")
+            if not 0 <= start <= end <= length:
+                raise DiffError(f"Splice {start}:{end} is outside content of length {length}")
+            length += len(text) - (end - start)
+            changed += max(end - start, len(text))
+            # Past the stored prefix the splice only moves the length; a splice reaching past it ends the known prefix
+            if start <= len(content):
+                content = content[:start] + text + (content[end:] if end <= len(content) else "")
+
+        expected = message.get("length")
+        if expected is not None and int(expected) != length:
+            raise DiffError(f"Content length {length} does not match client length {expected}")
+
+        elements = _dict(message.get("domElements"), "domElements")
+        self.content = content[:self.max_content_chars]
+        self.length = length
+        self._changed_chars += changed
+        self._apply_elements(elements)
+        self._set_scroll(message.get("scrollDepth"))
+        if message.get("title") is not None:
+            self.title = message["title"]
+        self.version += 1
+
+    def is_significant(self, min_change_ratio: float) -> bool:
+        """Check whether the page changed enough since the last insights to recompute them"""
+        if self._url_changed or self._forms_changed:
+            return True
+
+        if self.scroll_depth > READ_SCROLL_DEPTH >= self._insight_scroll_depth:
+            return True
+
+        baseline = max(self._insight_content_length, len(self.content), 1)
+        return self._changed_chars / baseline >= min_change_ratio
+
+    def mark_computed(self):
+        """Reset change tracking after insights were sent"""
+        self._changed_chars = 0
+        self._url_changed = False
+        self._forms_changed = False
+        self._insight_scroll_depth = self.scroll_depth
+        self._insight_content_length = len(self.content)
+
+    def user_activity(self) -> Dict[str, Any]:
+        """Activity in the shape the insights endpoint expects"""
+        return {"scrollDepth": self.scroll_depth}
+
+    def elements(self) -> List[Dict[str, str]]:
+        """Current DOM elements"""
+        return list(self.dom_elements.values())
+
+    def _set_scroll(self, value: Any):
+        if value is not None:
+            self.scroll_depth = min(max(float(value), 0.0), 1.0)
+
+    def _apply_elements(self, changes: Dict[str, Any]):
+        removed_ids = _list(changes.get("removed"), "domElements.removed")
+        added = [_dict(element, "DOM element") for element in _list(changes.get("added"), "domElements.added")]
+
+        for element_id in removed_ids:
+            removed = self.dom_elements.pop(str(element_id), None)
+            if removed and removed.get("tag") == "form":
+                self._forms_changed = True
+
+        for element in added[:settings.MONITOR_MAX_DOM_ELEMENTS]:
+            element = {str(key): str(value) for key, value in element.items()}
+            element_id = element.get("id") or f"el-{len(self.dom_elements)}"
+            if element.get("tag") == "form" and element_id not in self.dom_elements:
+                self._forms_changed = True
+            self.dom_elements[element_id] = element
+
+class MonitorSession:
+    """Debounces page events on one connection and recomputes insights when changes are significant"""
+
+    def __init__(
+        self,
+        compute_insights: Callable[[PageState], Awaitable[Dict[str, Any]]],
+        send: Callable[[Dict[str, Any]], Awaitable[None]],
+        debounce_seconds: float,
+        max_wait_seconds: float,
+        min_change_ratio: float,
+    ):
+        self.state = PageState(settings.MONITOR_MAX_CONTENT_CHARS)
+        self.compute_insights = compute_insights
+        self.send = send
+        self.debounce_seconds = debounce_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.min_change_ratio = min_change_ratio
+        self.events = 0
+        self.recomputes = 0
+        self.superseded = 0
+        self._first_event_at = 0.0
+        self._last_event_at = 0.0
+        # Only exists while events are pending, so idle connections hold no task
+        self._flush_task: Optional[asyncio.Task] = None
+        # URL whose insights are being computed, while a recompute is running
+        self._computing_url: Optional[str] = None
+
+    async def handle(self, message: Dict[str, Any]):
+        """Apply one client message"""
+        kind = message.get("type")
+
+        if kind == "ping":
+            await self.send({"type": "pong"})
+            return
+
+        try:
+            if kind == "snapshot":
+                self.state.apply_snapshot(message)
+            elif kind == "diff":
+                self.state.apply_diff(message)
+            else:
+                await self.send({"type": "error", "detail": f"Unknown message type: {kind}"})
+                return
+        except (DiffError, TypeError, ValueError) as e:
+            # The client's copy has drifted; ask for a fresh snapshot
+            await self.send({"type": "resync", "detail": str(e)})
+            return
+
+        self.events += 1
+        now = time.monotonic()
+        if self._computing_url is not None and self.state.url != self._computing_url:
+            # The tab navigated away; insights for the old page would arrive stale, so stop their Claude calls
+            self._flush_task.cancel()
+            self._flush_task = None
+            self._computing_url = None
+            self.superseded += 1
+        if self._flush_task is None:
+            self._first_event_at = now
+            self._flush_task = asyncio.create_task(self._flush_when_quiet())
+        self._last_event_at = now
+
+    async def close(self):
+        """Cancel pending work when the connection ends"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+    async def _flush_when_quiet(self):
+        """Wait until events stop (or the max wait passes), then recompute if needed"""
+        try:
+            while True:
+                await self._wait_until_quiet()
+                if not self.state.is_significant(self.min_change_ratio):
+                    return
+
+                version = self.state.version
+                self.state.mark_computed()
+                self.recomputes += 1
+                self._computing_url = self.state.url
+                try:
+                    insights = await self.compute_insights(self.state)
+                finally:
+                    if self._flush_task is asyncio.current_task():
+                        self._computing_url = None
+                await self.send({"type": "insights", "version": version, **insights})
+
+                # Events that arrived during the recompute start a new window
+                if self.state.version == version:
+                    return
+                self._first_event_at = time.monotonic()
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Context monitor recompute failed: {type(e).__name__}: {str(e)}")
+            try:
+                await self.send({"type": "error", "detail": f"Failed to generate insights: {str(e)}"})
+            except Exception:
+                # The connection is already gone
+                pass
+        finally:
+            # A superseded task is replaced before it finishes unwinding
+            if self._flush_task is asyncio.current_task():
+                self._flush_task = None
+
+    async def _wait_until_quiet(self):
+        """Sleep until no event arrived for the debounce period, capped by the max wait"""
+        while True:
+            now = time.monotonic()
+            deadline = min(
+                self._last_event_at + self.debounce_seconds,
+                self._first_event_at + self.max_wait_seconds,
+            )
+            if now >= deadline:
+                return
+            await asyncio.sleep(deadline - now)
+
+class MonitorRegistry:
+    """Tracks open monitoring connections for admission and reporting"""
+
+    def __init__(self, max_connections: int, max_per_client: int = 0):
+        self.max_connections = max_connections
+        # 0 leaves clients bounded only by max_connections
+        self.max_per_client = max_per_client
+        self.sessions: "set[MonitorSession]" = set()
+        self.total_connections = 0
+        self.rejected_per_client = 0
+        self._clients: Dict[MonitorSession, str] = {}
+        self._per_client: Dict[str, int] = {}
+
+    def try_add(self, session: MonitorSession, client_id: Optional[str] = None) -> Optional[str]:
+        """Register a session, or return why it was refused: the global or the per-client limit"""
+        if len(self.sessions) >= self.max_connections:
+            return "Too many monitoring connections"
+        if client_id is not None:
+            if self.max_per_client > 0 and self._per_client.get(client_id, 0) >= self.max_per_client:
+                self.rejected_per_client += 1
+                return "Too many monitoring connections from this client"
+            self._clients[session] = client_id
+            self._per_client[client_id] = self._per_client.get(client_id, 0) + 1
+        self.sessions.add(session)
+        self.total_connections += 1
+        return None
+
+    def remove(self, session: MonitorSession):
+        self.sessions.discard(session)
+        client_id = self._clients.pop(session, None)
+        if client_id is not None:
+            remaining = self._per_client[client_id] - 1
+            if remaining:
+                self._per_client[client_id] = remaining
+            else:
+                del self._per_client[client_id]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "active_connections": len(self.sessions),
+            "active_clients": len(self._per_client),
+            "pending_recomputes": sum(1 for session in self.sessions if session._flush_task is not None),
+            "superseded_recomputes": sum(session.superseded for session in self.sessions),
+            "total_connections": self.total_connections,
+            "rejected_per_client": self.rejected_per_client,
+            "max_connections": self.max_connections,
+            "max_connections_per_client": self.max_per_client,
+        }
+
+# Process-wide registry of monitoring connections
+monitor_registry = MonitorRegistry(settings.MONITOR_MAX_CONNECTIONS, settings.MONITOR_MAX_CONNECTIONS_PER_CLIENT)
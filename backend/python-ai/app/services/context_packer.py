@@ -0,0 +1,232 @@
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+
+# Approximates BPE tokenization: short letter runs, digit groups and single symbols
+_TOKEN_RE = re.compile(r"[A-Za-z]{1,4}|\d{1,3}|[^\sA-Za-z\d]")
+
+# Paragraph and sentence boundaries used when trimming content
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+CONTENT_LABEL = "Page content: "
+
+# History is trimmed from the front in steps of this many messages so the prompt prefix stays cacheable
+HISTORY_STEP = 10
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in a text without calling the API"""
+    if not text:
+        return 0
+    # subn counts matches without creating a match object per token, about twice as fast
+    return _TOKEN_RE.subn("", text)[1]
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut a text after roughly max_tokens tokens"""
+    if max_tokens <= 0:
+        return ""
+
+    for count, match in enumerate(_TOKEN_RE.finditer(text), start=1):
+        if count == max_tokens:
+            return text[:match.end()]
+
+    return text
+
+@dataclass
+class PackedContext:
+    """Context sections fitted to a token budget"""
+    page: str = ""
+    activity: str = ""
+    history: List[Dict[str, str]] = field(default_factory=list)
+    tokens: Dict[str, int] = field(default_factory=dict)
+
+class ContextPacker:
+    """Allocates a per-request token budget across system prompt, page content, activity and history
+
+    The system prompt and the user message are always sent in full. Page content and activity get
+    fixed shares of the total budget and history gets whatever is left, newest messages first.
+    """
+
+    def __init__(
+        self,
+        total_budget: int,
+        page_share: float,
+        activity_share: float
+    ):
+        self.total_budget = total_budget
+        self.page_share = page_share
+        self.activity_share = activity_share
+
+    def pack(
+        self,
+        message: str,
+        context: Optional[Dict[str, Any]] = None,
+        conversation_history: Optional[List[Dict[str, str]]] = None,
+        system_prompt: str = ""
+    ) -> PackedContext:
+        """Fit page context, activity and history into the budget left after the prompt and message"""
+        context = context or {}
+        history = conversation_history or []
+
+        page_header = self._format_page_header(context)
+        page_content = str(context.get("content") or "")
+        activity = self._format_activity(context)
+
+        # Page and activity budgets depend only on the total so the page block stays byte-identical
+        # across turns; whatever they leave unused goes to history
+        page_budget = int(self.total_budget * self.page_share)
+        activity_budget = int(self.total_budget * self.activity_share)
+
+        page = page_header
+        if page_content:
+            content_budget = page_budget - estimate_tokens(page_header) - estimate_tokens(CONTENT_LABEL + "...")
+            content = self.pack_text(page_content, max(content_budget, 0))
+            if content:
+                suffix = "" if len(content) == len(page_content) else "..."
+                page = "\n".join(filter(None, [page_header, f"{CONTENT_LABEL}{content}{suffix}"]))
+
+        if estimate_tokens(activity) > activity_budget:
+            activity = truncate_to_tokens(activity, activity_budget)
+
+        fixed = estimate_tokens(system_prompt) + estimate_tokens(message)
+        history_budget = self.total_budget - fixed - estimate_tokens(page) - estimate_tokens(activity)
+        packed_history = self.pack_history(history, history_budget)
+
+        return PackedContext(
+            page=page,
+            activity=activity,
+            history=packed_history,
+            tokens={
+                "system": estimate_tokens(system_prompt),
+                "message": estimate_tokens(message),
+                "page": estimate_tokens(page),
+                "activity": estimate_tokens(activity),
+                "history": sum(estimate_tokens(msg["content"]) for msg in packed_history),
+            },
+        )
+
+    def pack_text(self, text: str, max_tokens: int) -> str:
+        """Keep whole leading paragraphs, then sentences, that fit within max_tokens"""
+        if max_tokens <= 0 or not text:
+            return ""
+
+        if estimate_tokens(text) <= max_tokens:
+            return text
+
+        kept: List[str] = []
+        seen = set()
+        used = 0
+
+        for paragraph in _PARAGRAPH_RE.split(text):
+            paragraph = paragraph.strip()
+            if not paragraph or paragraph in seen:
+                continue
+            seen.add(paragraph)
+
+            tokens = estimate_tokens(paragraph)
+            if used + tokens <= max_tokens:
+                kept.append(paragraph)
+                used += tokens
+                continue
+
+            # Fill what is left with whole sentences from the first paragraph that does not fit
+            sentences = []
+            for sentence in _SENTENCE_RE.split(paragraph):
+                tokens = estimate_tokens(sentence)
+                if used + tokens > max_tokens:
+                    break
+                sentences.append(sentence)
+                used += tokens
+
+            if sentences:
+                kept.append(" ".join(sentences))
+            elif not kept:
+                kept.append(truncate_to_tokens(paragraph, max_tokens))
+            break
+
+        return "\n\n".join(kept)
+
+    def pack_history(self, history: List[Dict[str, str]], max_tokens: int) -> List[Dict[str, str]]:
+        """Keep the newest messages that fit, trimming the front in fixed steps"""
+        if not history or max_tokens <= 0:
+            return []
+
+        # Cap single messages by the total budget, not the per-turn history budget, so they are cut identically every turn
+        message_cap = max(self.total_budget // 4, 1)
+        messages = []
+        for msg in history:
+            content = msg.get("content", "")
+            if estimate_tokens(content) > message_cap:
+                content = truncate_to_tokens(content, message_cap)
+            messages.append({"role": msg.get("role", "user"), "content": content})
+
+        used = 0
+        start = len(messages)
+        while start > 0:
+            tokens = estimate_tokens(messages[start - 1]["content"])
+            if used + tokens > max_tokens:
+                break
+            used += tokens
+            start -= 1
+
+        # Round the cut up to a step boundary so the same prefix is reused across turns,
+        # unless that would throw away more than half of what fits
+        if start:
+            aligned = -(-start // HISTORY_STEP) * HISTORY_STEP
+            start = aligned if len(messages) - aligned >= (len(messages) - start) // 2 else start
+        packed = messages[start:]
+
+        # The conversation must open with a user turn
+        while packed and packed[0]["role"] != "user":
+            packed = packed[1:]
+
+        return packed
+
+    def format_context(self, context: Dict[str, Any], content_tokens: int) -> str:
+        """Format a whole context with its page content fitted to content_tokens"""
+        formatted = [self._format_page_header(context)]
+
+        page_content = str(context.get("content") or "")
+        if page_content:
+            content = self.pack_text(page_content, content_tokens)
+            suffix = "" if len(content) == len(page_content) else "..."
+            formatted.append(f"{CONTENT_LABEL}{content}{suffix}")
+
+        formatted.append(self._format_activity(context))
+        return "\n".join(filter(None, formatted))
+
+    def _format_page_header(self, context: Dict[str, Any]) -> str:
+        """Format the short, stable page fields"""
+        formatted = []
+
+        if context.get("url"):
+            formatted.append(f"Current page: {context['url']}")
+
+        if context.get("title"):
+            formatted.append(f"Page title: {context['title']}")
+
+        if context.get("pageType"):
+            formatted.append(f"Page type: {context['pageType']}")
+
+        return "\n".join(formatted)
+
+    def _format_activity(self, context: Dict[str, Any]) -> str:
+        """Format the per-turn fields that change between requests"""
+        formatted = []
+
+        if context.get("userActivity"):
+            formatted.append(f"User activity: {context['userActivity']}")
+
+        if context.get("timestamp"):
+            formatted.append(f"Context timestamp: {context['timestamp']}")
+
+        return "\n".join(formatted)
+
+# Process-wide packer configured by settings
+context_packer = ContextPacker(
+    total_budget=settings.CONTEXT_TOKEN_BUDGET,
+    page_share=settings.CONTEXT_PAGE_SHARE,
+    activity_share=settings.CONTEXT_ACTIVITY_SHARE,
+)
@@ -0,0 +1,220 @@
+import json
+import logging
+import re
+import uuid
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.services.cache import LRUCache
+from app.services.context_packer import estimate_tokens, truncate_to_tokens
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # Redis store is optional
+    redis_asyncio = None
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "aiwatch:conversation"
+
+CONVERSATION_ID_PATTERN = r"^[A-Za-z0-9_-]{8,64}$"
+_CONVERSATION_ID_RE = re.compile(CONVERSATION_ID_PATTERN)
+
+Message = Dict[str, str]
+
+def new_conversation_id() -> str:
+    return uuid.uuid4().hex
+
+def compact_messages(messages: List[Dict[str, Any]], max_message_tokens: int) -> List[Message]:
+    """Keep only role and content, cut long messages the way the context packer would"""
+    compacted = []
+    for msg in messages:
+        content = str(msg.get("content") or "")
+        if estimate_tokens(content) > max_message_tokens:
+            content = truncate_to_tokens(content, max_message_tokens)
+        compacted.append({"role": "assistant" if msg.get("role") == "assistant" else "user", "content": content})
+    return compacted
+
+class MemoryConversationStore:
+    """Conversations held in this process, least recently used dropped first"""
+
+    def __init__(self, max_conversations: int, ttl_seconds: float, max_messages: int):
+        self.max_messages = max_messages
+        self._conversations = LRUCache(max_entries=max_conversations, ttl_seconds=ttl_seconds)
+
+    async def load(self, conversation_id: str) -> Optional[List[Message]]:
+        messages = self._conversations.get(conversation_id)
+        return list(messages) if messages is not None else None
+
+    async def append(self, conversation_id: str, messages: List[Message]):
+        stored = (self._conversations.get(conversation_id) or []) + messages
+        self._conversations.set(conversation_id, stored[-self.max_messages:])
+
+    async def delete(self, conversation_id: str):
+        self._conversations.delete(conversation_id)
+
+    def __len__(self) -> int:
+        return len(self._conversations)
+
+class RedisConversationStore:
+    """Conversations shared by every worker, one Redis list per conversation
+
+    Appending a turn pushes only the new messages and trims the list in one transaction, so the
+    cost of a turn does not grow with the length of the conversation.
+    """
+
+    def __init__(self, client: Any, ttl_seconds: float, max_messages: int):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.max_messages = max_messages
+
+    async def load(self, conversation_id: str) -> Optional[List[Message]]:
+        raw = await self.client.lrange(self._key(conversation_id), 0, -1)
+        if not raw:
+            return None
+        return [json.loads(item) for item in raw]
+
+    async def append(self, conversation_id: str, messages: List[Message]):
+        if not messages:
+            return
+        key = self._key(conversation_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.rpush(key, *[json.dumps(msg, separators=(",", ":")) for msg in messages])
+            pipe.ltrim(key, -self.max_messages, -1)
+            pipe.expire(key, max(int(self.ttl_seconds), 1))
+            await pipe.execute()
+
+    async def delete(self, conversation_id: str):
+        await self.client.delete(self._key(conversation_id))
+
+    async def close(self):
+        close = getattr(self.client, "aclose", None) or self.client.close
+        await close()
+
+    def _key(self, conversation_id: str) -> str:
+        return f"{KEY_PREFIX}:{conversation_id}"
+
+class ConversationStore:
+    """Server-side conversation history, so clients only send the newest message
+
+    History is stored compacted: role and content only, long messages already cut to what the
+    context packer would keep, and at most max_messages per conversation.
+    """
+
+    def __init__(
+        self,
+        local: MemoryConversationStore,
+        shared: Optional[RedisConversationStore] = None,
+        max_message_tokens: int = 1500,
+        enabled: bool = True
+    ):
+        self.local = local
+        # Used when the shared store is unreachable, so conversations degrade to per-worker
+        self.shared = shared
+        self.max_message_tokens = max_message_tokens
+        self.enabled = enabled
+        self.stats: Dict[str, int] = {
+            "created": 0,
+            "loaded": 0,
+            "not_found": 0,
+            "appended_messages": 0,
+            "shared_errors": 0,
+        }
+
+    @staticmethod
+    def valid_id(conversation_id: str) -> bool:
+        return bool(_CONVERSATION_ID_RE.match(conversation_id))
+
+    async def load(self, conversation_id: str) -> Optional[List[Message]]:
+        """Stored history of a conversation, oldest first, or None if it is unknown or expired"""
+        messages = None
+        if self.shared is not None:
+            try:
+                messages = await self.shared.load(conversation_id)
+            except Exception as e:
+                self.stats["shared_errors"] += 1
+                logger.warning(f"Shared conversation store read failed: {str(e)}")
+                messages = await self.local.load(conversation_id)
+        else:
+            messages = await self.local.load(conversation_id)
+
+        self.stats["loaded" if messages is not None else "not_found"] += 1
+        return messages
+
+    async def append(self, conversation_id: str, messages: List[Dict[str, Any]], created: bool = False):
+        """Add new messages to a conversation, creating it if needed"""
+        compacted = compact_messages(messages, self.max_message_tokens)
+        if created:
+            self.stats["created"] += 1
+        self.stats["appended_messages"] += len(compacted)
+
+        if self.shared is not None:
+            try:
+                await self.shared.append(conversation_id, compacted)
+                return
+            except Exception as e:
+                self.stats["shared_errors"] += 1
+                logger.warning(f"Shared conversation store write failed: {str(e)}")
+        await self.local.append(conversation_id, compacted)
+
+    async def delete(self, conversation_id: str):
+        """Forget a conversation"""
+        await self.local.delete(conversation_id)
+        if self.shared is not None:
+            try:
+                await self.shared.delete(conversation_id)
+            except Exception as e:
+                self.stats["shared_errors"] += 1
+                logger.warning(f"Shared conversation store delete failed: {str(e)}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "local_conversations": len(self.local),
+            "shared_enabled": self.shared is not None,
+        }
+
+    async def close(self):
+        """Release the shared store connections"""
+        if self.shared is not None:
+            await self.shared.close()
+
+def create_conversation_store() -> ConversationStore:
+    """Create the conversation store configured by settings"""
+    local = MemoryConversationStore(
+        max_conversations=settings.CONVERSATION_MAX_CONVERSATIONS,
+        ttl_seconds=settings.CONVERSATION_TTL_SECONDS,
+        max_messages=settings.CONVERSATION_MAX_MESSAGES,
+    )
+
+    shared = None
+    if settings.CONVERSATION_REDIS_ENABLED:
+        if redis_asyncio is None:
+            logger.warning("CONVERSATION_REDIS_ENABLED is set but the redis package is not installed")
+        else:
+            client = redis_asyncio.from_url(
+                settings.REDIS_URL,
+                socket_timeout=settings.CONVERSATION_REDIS_TIMEOUT,
+                socket_connect_timeout=settings.CONVERSATION_REDIS_TIMEOUT,
+            )
+            shared = RedisConversationStore(
+                client,
+                ttl_seconds=settings.CONVERSATION_TTL_SECONDS,
+                max_messages=settings.CONVERSATION_MAX_MESSAGES,
+            )
+
+    # Same per-message cap as ContextPacker.pack_history, so stored messages need no further cutting
+    return ConversationStore(
+        local,
+        shared,
+        max_message_tokens=max(settings.CONTEXT_TOKEN_BUDGET // 4, 1),
+        enabled=settings.CONVERSATIONS_ENABLED,
+    )
+
+# Process-wide conversation store
+conversation_store = create_conversation_store()
+
+def get_conversation_store() -> ConversationStore:
+    """Dependency to get the conversation store"""
+    return conversation_store
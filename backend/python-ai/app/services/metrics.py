@@ -0,0 +1,595 @@
+import abc
+import asyncio
+import glob
+import json
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+from app.services.shared_memory import default_directory
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; spans a cache hit through a long generation
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+# Actual over estimated input tokens; 1.0 is a perfect estimate
+ESTIMATE_RATIO_BUCKETS = (0.5, 0.75, 0.9, 0.95, 1.0, 1.05, 1.1, 1.25, 1.5, 2.0, 3.0)
+
+# (metric name, type, help, [(labels, value), ...]) produced at scrape time
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+# (metric name, type, help, sample lines) ready to be rendered
+RenderedFamily = Tuple[str, str, str, List[str]]
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _label_text(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+def _add_labels(line: str, label_text: str) -> str:
+    """Put extra labels (without braces) in front of a sample line's own"""
+    end = min(index for index in (line.find("{"), line.find(" ")) if index >= 0)
+    if line[end] == "{":
+        return f"{line[:end]}{{{label_text},{line[end + 1:]}"
+    return f"{line[:end]}{{{label_text}}}{line[end:]}"
+
+def format_families(families: Iterable[RenderedFamily]) -> str:
+    """Families in the Prometheus text exposition format"""
+    lines: List[str] = []
+    for name, kind, help, samples in families:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+class _Metric(abc.ABC):
+    """A metric family; each distinct set of label values is a child holding the numbers"""
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._default = None if self.labelnames else self.labels()
+
+    def labels(self, *values: str) -> Any:
+        """The child for these label values, created on first use"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[values] = self._new_child(_label_text(self.labelnames, values))
+        return child
+
+    def samples(self) -> List[str]:
+        lines = []
+        for child in self._children.values():
+            lines.extend(child.render(self.name))
+        return lines
+
+    @abc.abstractmethod
+    def _new_child(self, label_text: str) -> Any:
+        """A child holding the numbers for one set of label values"""
+
+class _Value:
+    __slots__ = ("label_text", "value")
+
+    def __init__(self, label_text: str):
+        self.label_text = label_text
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+    def render(self, name: str) -> List[str]:
+        return [f"{name}{self.label_text} {_number(self.value)}"]
+
+class Counter(_Metric):
+    """Monotonic count, e.g. tokens used"""
+    type = "counter"
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+    def _new_child(self, label_text: str) -> _Value:
+        return _Value(label_text)
+
+class Gauge(_Metric):
+    """Value that goes up and down, e.g. requests in flight"""
+    type = "gauge"
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._default.dec(amount)
+
+    def set(self, value: float):
+        self._default.set(value)
+
+    def _new_child(self, label_text: str) -> _Value:
+        return _Value(label_text)
+
+class _HistogramValue:
+    __slots__ = ("label_text", "bounds", "counts", "sum")
+
+    def __init__(self, label_text: str, bounds: Tuple[float, ...]):
+        self.label_text = label_text
+        self.bounds = bounds
+        # Per-bucket (not cumulative) counts; the last slot is +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def render(self, name: str) -> List[str]:
+        # The le label goes inside the child's label set
+        prefix = self.label_text[:-1] + "," if self.label_text else "{"
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{prefix}le="{_number(bound)}"}} {cumulative}')
+        lines.append(f"{name}_sum{self.label_text} {_number(self.sum)}")
+        lines.append(f"{name}_count{self.label_text} {cumulative}")
+        return lines
+
+class Histogram(_Metric):
+    """Distribution over fixed buckets, e.g. request latency"""
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def _new_child(self, label_text: str) -> _HistogramValue:
+        return _HistogramValue(label_text, self.buckets)
+
+class MetricsRegistry:
+    """In-process metrics in the Prometheus text format
+
+    Updates are plain attribute arithmetic with no locks, since they all happen on the event loop.
+    Values owned by other services (cache stats and the like) are read by collectors at scrape time
+    instead of being counted twice.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def register_collector(self, collector: Callable[[], Iterable[Family]]):
+        """Add a function returning metric families computed at scrape time"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format"""
+        return format_families(self.collect())
+
+    def collect(self, labels: Optional[Dict[str, str]] = None) -> List[RenderedFamily]:
+        """Every metric family with its sample lines, adding constant labels to each sample if given"""
+        families: List[RenderedFamily] = []
+        for metric in self._metrics.values():
+            families.append((metric.name, metric.type, metric.help, metric.samples()))
+
+        for collector in self._collectors:
+            try:
+                collected = list(collector())
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {str(e)}")
+                continue
+            for name, kind, help, samples in collected:
+                families.append((name, kind, help, [
+                    f"{name}{_label_text(tuple(sample_labels), tuple(sample_labels.values()))} {_number(value)}"
+                    for sample_labels, value in samples
+                ]))
+
+        if labels:
+            label_text = _label_text(tuple(labels), tuple(labels.values()))[1:-1]
+            families = [
+                (name, kind, help, [_add_labels(line, label_text) for line in samples])
+                for name, kind, help, samples in families
+            ]
+        return families
+
+    def _register(self, metric: _Metric) -> Any:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+# Process-wide registry and the service's metrics
+metrics = MetricsRegistry()
+
+http_request_duration = metrics.histogram(
+    "aiwatch_http_request_duration_seconds",
+    "HTTP request latency by route template, until the response body is sent",
+    ("method", "route", "status"),
+)
+http_requests_in_flight = metrics.gauge(
+    "aiwatch_http_requests_in_flight",
+    "HTTP requests currently being served",
+)
+upstream_request_duration = metrics.histogram(
+    "aiwatch_upstream_request_duration_seconds",
+    "Claude messages.create latency per attempt, and full duration of streams",
+    ("task", "model", "outcome"),
+)
+upstream_time_to_first_token = metrics.histogram(
+    "aiwatch_upstream_time_to_first_token_seconds",
+    "Time from opening a Claude stream to its first token",
+    ("task", "model"),
+)
+upstream_requests_in_flight = metrics.gauge(
+    "aiwatch_upstream_requests_in_flight",
+    "Claude calls currently running",
+    ("task",),
+)
+upstream_tokens = metrics.counter(
+    "aiwatch_upstream_tokens_total",
+    "Tokens reported by Claude, by kind (input, output, cache_read, cache_creation)",
+    ("task", "model", "kind"),
+)
+event_loop_lag = metrics.histogram(
+    "aiwatch_event_loop_lag_seconds",
+    "How late the event loop ran a timer, sampled periodically",
+    buckets=LOOP_LAG_BUCKETS,
+)
+event_loop_lag_current = metrics.gauge(
+    "aiwatch_event_loop_lag_current_seconds",
+    "Event loop lag at the latest sample",
+)
+persistence_flush_duration = metrics.histogram(
+    "aiwatch_persistence_flush_duration_seconds",
+    "Time to write one batch of buffered rows to Postgres",
+    buckets=LATENCY_BUCKETS,
+)
+token_estimate_ratio = metrics.histogram(
+    "aiwatch_token_estimate_ratio",
+    "Input tokens reported by Claude over the local estimate made before the call",
+    ("model",),
+    buckets=ESTIMATE_RATIO_BUCKETS,
+)
+upstream_queue_wait = metrics.histogram(
+    "aiwatch_upstream_queue_wait_seconds",
+    "Time a Claude call waited for an upstream slot, by priority class",
+    ("priority",),
+)
+
+@contextmanager
+def track_upstream(task: str, model: str) -> Iterator[None]:
+    """Time one upstream call and count it as in flight while it runs"""
+    in_flight = upstream_requests_in_flight.labels(task)
+    in_flight.inc()
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    except (asyncio.CancelledError, GeneratorExit):
+        # The client went away or the deadline passed; not an upstream failure
+        outcome = "cancelled"
+        raise
+    finally:
+        in_flight.dec()
+        upstream_request_duration.labels(task, model, outcome).observe(time.perf_counter() - started)
+
+def record_tokens(task: str, model: str, usage: Any):
+    """Add a response's token usage to the counters"""
+    if usage is None:
+        return
+    for kind, attribute in (
+        ("input", "input_tokens"),
+        ("output", "output_tokens"),
+        ("cache_read", "cache_read_input_tokens"),
+        ("cache_creation", "cache_creation_input_tokens"),
+    ):
+        tokens = getattr(usage, attribute, None)
+        if tokens:
+            upstream_tokens.labels(task, model, kind).inc(tokens)
+
+class MetricsMiddleware:
+    """ASGI middleware timing HTTP requests per route template
+
+    The route is read after the app has run, since routing sets it on the scope; unmatched paths
+    share one label so that scanners cannot create unbounded series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_requests_in_flight.dec()
+            http_request_duration.labels(
+                scope["method"], route_template(scope), str(status)
+            ).observe(time.perf_counter() - started)
+
+def route_template(scope: Dict[str, Any]) -> str:
+    """Path template of the route that served a request, e.g. /chat/suggestions/{suggestions_id}"""
+    route = scope.get("route")
+    path_format = getattr(route, "path_format", None)
+    if path_format is None:
+        return "unmatched"
+
+    # Depending on the FastAPI version, routes from included routers may hold their path without the
+    # router prefix; recover the prefix from the part of the request path in front of the route's own
+    try:
+        concrete = path_format.format(**scope.get("path_params", {}))
+    except (KeyError, IndexError, ValueError):
+        return route.path
+    path = scope["path"]
+    prefix = path[: len(path) - len(concrete)] if concrete and path.endswith(concrete) else ""
+    return prefix + route.path
+
+class LoopLagMonitor:
+    """Samples event loop lag: how much later than requested a short sleep wakes up"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(time.perf_counter() - started - self.interval, 0.0)
+            event_loop_lag.observe(lag)
+            event_loop_lag_current.set(lag)
+
+class WorkerMetrics:
+    """Lets any worker answer a scrape for all of them
+
+    A scrape lands on one worker at random, so with several workers each one writes its metrics,
+    labelled with its pid, to a file next to the shared memory stores every interval and whenever
+    it is scraped. The scraped worker merges the snapshots that are still fresh, so series of a
+    worker that has exited disappear after a few intervals. Inactive with a single worker.
+    """
+
+    def __init__(self, registry: MetricsRegistry, interval: float):
+        self.registry = registry
+        self.interval = interval
+        self.worker = str(os.getpid())
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def active(self) -> bool:
+        # The multi-worker entry point names the shared stores; a single process leaves it unset
+        return bool(settings.SHARED_MEMORY_NAME) and self.interval > 0
+
+    def start(self):
+        if self._task is None and self.active:
+            self.worker = str(os.getpid())
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            try:
+                os.unlink(self._path(self.worker))
+            except OSError:
+                pass
+
+    def render(self) -> str:
+        """Metrics of every live worker, or just this process's when it runs alone"""
+        if not self.active:
+            return self.registry.render()
+
+        own = self.publish()
+        merged: Dict[str, RenderedFamily] = {family[0]: family for family in own}
+        fresh_after = time.time() - 3 * self.interval
+        for path in glob.glob(self._path("*")):
+            if path == self._path(self.worker):
+                continue
+            try:
+                if os.path.getmtime(path) < fresh_after:
+                    continue
+                with open(path, "r", encoding="utf-8") as snapshot:
+                    families = json.load(snapshot)
+            except (OSError, ValueError):
+                continue
+            for name, kind, help, samples in families:
+                if name in merged:
+                    merged[name][3].extend(samples)
+                else:
+                    merged[name] = (name, kind, help, list(samples))
+        return format_families(merged.values())
+
+    def publish(self) -> List[RenderedFamily]:
+        """Write this worker's snapshot, replacing the previous one atomically"""
+        families = self.registry.collect({"worker": self.worker})
+        path = self._path(self.worker)
+        try:
+            with open(f"{path}.tmp", "w", encoding="utf-8") as snapshot:
+                json.dump(families, snapshot)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            logger.warning(f"Failed to publish worker metrics: {str(e)}")
+        return families
+
+    def _path(self, worker: str) -> str:
+        directory = settings.SHARED_MEMORY_DIR or default_directory()
+        return os.path.join(directory, f"{settings.SHARED_MEMORY_NAME}-metrics-{worker}.json")
+
+    async def _run(self):
+        while True:
+            self.publish()
+            await asyncio.sleep(self.interval)
+
+def cache_families() -> List[Family]:
+    """Result cache and near-duplicate index counters, read from their own stats"""
+    from app.services.cache import result_cache
+    from app.services.similarity_cache import similarity_index
+
+    cache = result_cache.stats
+    similar = similarity_index.stats
+    return [
+        ("aiwatch_cache_hits_total", "counter", "Cache lookups answered, by cache and tier", [
+            ({"cache": "result", "tier": "local"}, cache["local_hits"]),
+            ({"cache": "result", "tier": "host"}, cache["host_hits"]),
+            ({"cache": "result", "tier": "shared"}, cache["shared_hits"]),
+            ({"cache": "similarity", "tier": "local"}, similar["hits"]),
+        ]),
+        ("aiwatch_cache_lookups_total", "counter", "Cache lookups, by cache", [
+            ({"cache": "result"}, cache["local_hits"] + cache["host_hits"] + cache["shared_hits"] + cache["misses"]),
+            ({"cache": "similarity"}, similar["lookups"]),
+        ]),
+        ("aiwatch_cache_hit_ratio", "gauge", "Hits over lookups since start, by cache", [
+            ({"cache": "result"}, result_cache.get_stats()["hit_ratio"]),
+            ({"cache": "similarity"}, similarity_index.get_stats()["hit_ratio"]),
+        ]),
+        ("aiwatch_cache_entries", "gauge", "Entries held in process, by cache", [
+            ({"cache": "result"}, len(result_cache.local)),
+            ({"cache": "similarity"}, len(similarity_index)),
+        ]),
+    ]
+
+def persistence_families() -> List[Family]:
+    """Write-behind persistence counters, read from the writer's stats"""
+    from app.services.persistence import persistence_writer
+
+    stats = persistence_writer.stats
+    return [
+        ("aiwatch_persistence_rows_total", "counter", "Rows handed to the persistence writer, by outcome", [
+            ({"outcome": "written"}, stats["written"]),
+            ({"outcome": "dropped"}, stats["dropped"]),
+            ({"outcome": "rejected"}, stats["rejected"]),
+        ]),
+        ("aiwatch_persistence_flush_errors_total", "counter", "Flushes that failed and were retried", [
+            ({}, stats["flush_errors"]),
+        ]),
+        ("aiwatch_persistence_pending_rows", "gauge", "Rows buffered and not yet written", [
+            ({}, persistence_writer.pending),
+        ]),
+    ]
+
+def token_budget_families() -> List[Family]:
+    """Token accounting counters, read from the budget tracker's stats"""
+    from app.services.token_budget import token_budgets
+
+    stats = token_budgets.stats
+    return [
+        ("aiwatch_token_budget_rejections_total", "counter", "Calls refused before reaching Claude, by reason", [
+            ({"reason": "too_large"}, stats["too_large"]),
+            ({"reason": "budget"}, stats["budget_exceeded"]),
+        ]),
+        ("aiwatch_token_budget_output_trimmed_total", "counter", "Calls whose max_tokens was lowered to fit a budget", [
+            ({}, stats["output_trimmed"]),
+        ]),
+        ("aiwatch_token_budget_charged_tokens_total", "counter", "Tokens charged to user budgets, by subscription tier", [
+            ({"tier": tier}, tokens) for tier, tokens in token_budgets.charged_by_tier.items()
+        ]),
+        ("aiwatch_token_estimate_calibration", "gauge", "Factor applied to raw token estimates, learned per model", [
+            ({"model": model}, factor) for model, factor in token_budgets.calibration.items()
+        ]),
+        ("aiwatch_token_budget_unflushed_tokens", "gauge", "Charged tokens not yet written to users.usage_stats", [
+            ({}, token_budgets.unflushed_tokens()),
+        ]),
+    ]
+
+def scheduler_families() -> List[Family]:
+    """Upstream slot usage and queue depth, read from the scheduler"""
+    from app.services.upstream_scheduler import upstream_scheduler
+
+    stats = upstream_scheduler.stats
+    return [
+        ("aiwatch_upstream_queue_depth", "gauge", "Claude calls waiting for an upstream slot, by priority class", [
+            ({"priority": priority}, depth) for priority, depth in upstream_scheduler.queue_depths().items()
+        ]),
+        ("aiwatch_upstream_slots_in_use", "gauge", "Upstream slots held by running Claude calls", [
+            ({}, upstream_scheduler.in_use),
+        ]),
+        ("aiwatch_upstream_slots", "gauge", "Upstream slots per worker (0 is unlimited)", [
+            ({}, upstream_scheduler.max_slots),
+        ]),
+        ("aiwatch_upstream_shed_total", "counter", "Claude calls refused because the slot queue was full, by priority class", [
+            ({"priority": priority}, counts["shed"]) for priority, counts in stats.items()
+        ]),
+        ("aiwatch_upstream_cancelled_total", "counter", "Requests whose work was cancelled, by reason", [
+            ({"reason": reason}, count) for reason, count in upstream_scheduler.cancelled.items()
+        ]),
+    ]
+
+metrics.register_collector(cache_families)
+metrics.register_collector(persistence_families)
+metrics.register_collector(token_budget_families)
+metrics.register_collector(scheduler_families)
+
+loop_lag_monitor = LoopLagMonitor(settings.METRICS_LOOP_LAG_INTERVAL)
+worker_metrics = WorkerMetrics(metrics, settings.METRICS_WORKER_SNAPSHOT_SECONDS)
+
+def get_metrics() -> MetricsRegistry:
+    """Dependency to get the metrics registry"""
+    return metrics
+
+def get_worker_metrics() -> WorkerMetrics:
+    """Dependency to get the view of every worker's metrics"""
+    return worker_metrics
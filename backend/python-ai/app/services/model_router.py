@@ -0,0 +1,204 @@
+import logging
+import math
+from collections import deque
+from dataclasses import dataclass, replace
+from typing import Any, Deque, Dict, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Latency SLOs a caller can ask for
+SLOS = ("interactive", "standard", "batch")
+DEFAULT_SLO = "standard"
+
+# Adaptive budgets need this many samples before they move off the ceiling
+MIN_BUDGET_SAMPLES = 20
+BUDGET_HEADROOM = 1.5
+
+@dataclass(frozen=True)
+class TaskPolicy:
+    """How one kind of task is served"""
+    tier: str
+    max_tokens: int
+    temperature: float
+    min_tokens: int = 0
+    escalation_tier: Optional[str] = None
+    # Shrink max_tokens towards what responses actually use; never for open-ended chat
+    adaptive: bool = False
+
+@dataclass(frozen=True)
+class ModelRoute:
+    """The model and parameters chosen for one call"""
+    task: str
+    slo: str
+    tier: str
+    model: str
+    max_tokens: int
+    temperature: float
+    escalation_tier: Optional[str] = None
+
+def default_tiers() -> Dict[str, str]:
+    return {
+        "fast": settings.CLAUDE_FAST_MODEL,
+        "standard": settings.CLAUDE_MODEL,
+    }
+
+def default_policies() -> Dict[str, TaskPolicy]:
+    return {
+        "chat": TaskPolicy(
+            tier="standard",
+            max_tokens=settings.CLAUDE_MAX_TOKENS,
+            temperature=settings.CLAUDE_TEMPERATURE,
+        ),
+        "analysis": TaskPolicy(
+            tier="fast",
+            max_tokens=settings.ANALYSIS_MAX_TOKENS,
+            temperature=0.3,
+            min_tokens=300,
+            escalation_tier="standard",
+            adaptive=True,
+        ),
+        "suggestions": TaskPolicy(
+            tier="fast",
+            max_tokens=settings.SUGGESTIONS_MAX_TOKENS,
+            temperature=0.5,
+            min_tokens=150,
+            escalation_tier="standard",
+            adaptive=True,
+        ),
+    }
+
+def default_slo_overrides() -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """Per-SLO changes to task policies"""
+    return {
+        # Tight latency: a fast model with a short answer beats a slow complete one
+        "interactive": {
+            "chat": {"tier": "fast", "max_tokens": min(settings.CLAUDE_MAX_TOKENS, 1024)},
+        },
+        # Nobody is waiting, so spend the time on the stronger model
+        "batch": {
+            "analysis": {"tier": "standard", "escalation_tier": None},
+        },
+    }
+
+class ModelRouter:
+    """Picks model tier, max_tokens and temperature per task and latency SLO"""
+
+    def __init__(
+        self,
+        tiers: Dict[str, str],
+        policies: Dict[str, TaskPolicy],
+        slo_overrides: Optional[Dict[str, Dict[str, Dict[str, Any]]]] = None,
+        adaptive: bool = True,
+        window: int = 200,
+    ):
+        self.tiers = dict(tiers)
+        self.policies = policies
+        self.slo_overrides = slo_overrides or {}
+        self.adaptive = adaptive
+        self.disabled_tiers: set = set()
+        self._outputs: Dict[str, Deque[int]] = {task: deque(maxlen=window) for task in policies}
+        self.stats: Dict[str, int] = {"routed": 0, "escalations": 0, "truncations": 0}
+
+    def route(self, task: str, slo: Optional[str] = None) -> ModelRoute:
+        """Choose the model and parameters for a task"""
+        slo = slo if slo in SLOS else DEFAULT_SLO
+        policy = self.policy(task, slo)
+        tier = self._available_tier(policy.tier)
+        self.stats["routed"] += 1
+
+        return ModelRoute(
+            task=task,
+            slo=slo,
+            tier=tier,
+            model=self.tiers[tier],
+            max_tokens=self.budget(task, policy),
+            temperature=policy.temperature,
+            escalation_tier=policy.escalation_tier,
+        )
+
+    def escalate(self, route: ModelRoute) -> Optional[ModelRoute]:
+        """Route to retry on after a response failed validation, or None if there is nowhere to go"""
+        if not route.escalation_tier:
+            return None
+
+        tier = self._available_tier(route.escalation_tier)
+        if self.tiers[tier] == route.model:
+            return None
+
+        self.stats["escalations"] += 1
+        policy = self.policy(route.task, route.slo)
+        return replace(route, tier=tier, model=self.tiers[tier], max_tokens=policy.max_tokens, escalation_tier=None)
+
+    def policy(self, task: str, slo: str) -> TaskPolicy:
+        """Task policy with the SLO's overrides applied"""
+        policy = self.policies[task]
+        override = self.slo_overrides.get(slo, {}).get(task)
+        return replace(policy, **override) if override else policy
+
+    def budget(self, task: str, policy: TaskPolicy) -> int:
+        """max_tokens for a task: the policy ceiling, or recent usage plus headroom when adaptive"""
+        outputs = self._outputs.get(task)
+        if not (self.adaptive and policy.adaptive) or not outputs or len(outputs) < MIN_BUDGET_SAMPLES:
+            return policy.max_tokens
+
+        ordered = sorted(outputs)
+        p95 = ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)]
+        return max(policy.min_tokens, min(policy.max_tokens, math.ceil(p95 * BUDGET_HEADROOM)))
+
+    def record_usage(self, route: ModelRoute, output_tokens: int, stop_reason: Optional[str]):
+        """Feed a finished call back into the adaptive budget"""
+        outputs = self._outputs.get(route.task)
+        if outputs is None:
+            return
+
+        if stop_reason == "max_tokens":
+            # A cut-off answer says the budget was too small, so count it as needing the full ceiling
+            self.stats["truncations"] += 1
+            output_tokens = self.policies[route.task].max_tokens
+        outputs.append(output_tokens)
+
+    def disable_tier(self, tier: str):
+        """Stop routing to a tier whose model is unavailable"""
+        if tier != "standard":
+            self.disabled_tiers.add(tier)
+            logger.warning(f"Model tier '{tier}' ({self.tiers.get(tier)}) disabled, routing to standard")
+
+    def get_table(self) -> Dict[str, Any]:
+        """The current routing table for every task and SLO"""
+        routes: Dict[str, Dict[str, Any]] = {}
+        for task in self.policies:
+            routes[task] = {}
+            for slo in SLOS:
+                policy = self.policy(task, slo)
+                tier = self._available_tier(policy.tier)
+                routes[task][slo] = {
+                    "tier": tier,
+                    "model": self.tiers[tier],
+                    "max_tokens": self.budget(task, policy),
+                    "max_tokens_ceiling": policy.max_tokens,
+                    "temperature": policy.temperature,
+                    "escalation_tier": policy.escalation_tier,
+                    "adaptive": self.adaptive and policy.adaptive,
+                }
+
+        return {
+            "tiers": {
+                tier: {"model": model, "available": tier not in self.disabled_tiers}
+                for tier, model in self.tiers.items()
+            },
+            "routes": routes,
+            "stats": dict(self.stats),
+        }
+
+    def _available_tier(self, tier: str) -> str:
+        return "standard" if tier in self.disabled_tiers or tier not in self.tiers else tier
+
+# Process-wide router
+model_router = ModelRouter(
+    default_tiers(),
+    default_policies(),
+    default_slo_overrides(),
+    adaptive=settings.ADAPTIVE_OUTPUT_BUDGETS,
+)
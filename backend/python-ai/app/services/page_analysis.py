@@ -0,0 +1,110 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+
+ANALYSIS_TOOL_NAME = "record_page_analysis"
+
+# Field order is the order the model writes them in, so short fields stream first
+class PageAnalysis(BaseModel):
+    """Structured analysis of a web page"""
+    page_type: str = Field(description="Kind of page, e.g. e-commerce, documentation, content, developer-tools, social-media, form-page or general")
+    purpose: str = Field(description="One sentence on what the page is for")
+    key_actions: List[str] = Field(default_factory=list, description="Main actions or information available on the page")
+    suggestions: List[str] = Field(default_factory=list, description="Ways the assistant could help someone viewing this page")
+    insights: List[str] = Field(default_factory=list, description="Likely user intents and other observations")
+
+# Forcing this tool makes the model answer with arguments that follow the PageAnalysis schema
+ANALYSIS_TOOL: Dict[str, Any] = {
+    "name": ANALYSIS_TOOL_NAME,
+    "description": "Record the structured analysis of the web page.",
+    "input_schema": PageAnalysis.model_json_schema(),
+}
+
+ANALYSIS_FIELDS = tuple(PageAnalysis.model_fields)
+
+_FIELD_ADAPTERS = {name: TypeAdapter(field.annotation) for name, field in PageAnalysis.model_fields.items()}
+
+def parse_analysis(message: Any) -> Optional[PageAnalysis]:
+    """Validate the analysis tool call in a response message, or None if it is missing or invalid"""
+    for block in message.content or []:
+        if getattr(block, "type", None) == "tool_use" and block.name == ANALYSIS_TOOL_NAME:
+            try:
+                return PageAnalysis.model_validate(block.input)
+            except ValidationError:
+                return None
+    return None
+
+def validate_field(name: str, value: Any) -> Any:
+    """Validate one top-level field on its own; raises ValueError when it does not fit the schema"""
+    adapter = _FIELD_ADAPTERS.get(name)
+    if adapter is None:
+        raise ValueError(f"Unknown analysis field: {name}")
+    try:
+        return adapter.validate_python(value)
+    except ValidationError as e:
+        raise ValueError(f"Invalid analysis field {name}: {str(e)}") from e
+
+class JSONFieldParser:
+    """Incremental parser yielding each top-level field of a streamed JSON object once it is complete
+
+    Chunks are scanned once, tracking only nesting depth and string state; a field's text is handed
+    to json.loads as soon as the comma or closing brace after it arrives.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._expect_key = True
+        self._key_start = 0
+        self._key: Optional[str] = None
+        self._value_start = 0
+        self.done = False
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Add streamed text and return the fields it completed"""
+        self._buffer += chunk
+        completed: List[Tuple[str, Any]] = []
+        buffer = self._buffer
+
+        for index in range(self._pos, len(buffer)):
+            char = buffer[index]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._expect_key:
+                        self._key = json.loads(buffer[self._key_start:index + 1])
+                continue
+
+            if char == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect_key:
+                    self._key_start = index
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    if not self._expect_key:
+                        completed.append(self._complete(buffer, index))
+                    self.done = True
+            elif self._depth == 1:
+                if char == ":" and self._expect_key:
+                    self._expect_key = False
+                    self._value_start = index + 1
+                elif char == "," and not self._expect_key:
+                    completed.append(self._complete(buffer, index))
+
+        self._pos = len(buffer)
+        return completed
+
+    def _complete(self, buffer: str, end: int) -> Tuple[str, Any]:
+        self._expect_key = True
+        return self._key, json.loads(buffer[self._value_start:end])
@@ -0,0 +1,214 @@
+import math
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+from app.core.config import settings
+
+GENERAL = "general"
+LABELS = ("e-commerce", "social-media", "developer-tools", "documentation", "content", "form-page", GENERAL)
+
+# Score a page needs before it beats "general"
+GENERAL_PRIOR = 1.5
+
+# Softmax temperature, fitted on the fit split of benchmarks/corpus with
+# `python -m benchmarks.page_classifier --fit`; kept a little above the log-loss optimum (0.5)
+# because the corpus is small
+TEMPERATURE = 0.6
+
+# Each text feature counts at most this many times, so long pages cannot drown out the URL
+TEXT_MATCH_CAP = 3
+TITLE_WEIGHT = 2.0
+
+# (label, pattern, weight); URL patterns run on "host path", text patterns on lowercased title and content
+URL_FEATURES: List[Tuple[str, str, float]] = [
+    ("e-commerce", r"amazon|ebay|etsy|shopify|aliexpress|walmart", 4.0),
+    ("e-commerce", r"shop|store|cart|checkout|products?|item|buy|dp", 2.0),
+    ("social-media", r"facebook|twitter|x\.com|instagram|linkedin|reddit|tiktok|mastodon|threads\.net", 4.0),
+    ("developer-tools", r"github|gitlab|bitbucket|stackoverflow|stackexchange|npmjs|pypi", 4.0),
+    ("developer-tools", r"issues|pulls?|commits?|merge_requests|blob|tree", 1.5),
+    ("documentation", r"docs\.[a-z0-9.-]+|developer\.[a-z0-9.-]+|readthedocs\.io", 3.0),
+    ("documentation", r"docs?|documentation|reference|guides?|manual|api|sdk|tutorials?", 2.0),
+    ("content", r"news|blog|articles?|posts?|stories|magazine", 2.0),
+    ("content", r"\d{4}/\d{1,2}(?:/\d{1,2})?", 2.0),
+    ("form-page", r"sign-?up|register|log-?in|sign-?in|contact|apply|forms?|onboarding", 2.5),
+]
+
+TEXT_FEATURES: List[Tuple[str, str, float]] = [
+    ("e-commerce", r"add to (?:cart|bag|basket)|buy now|in stock|out of stock|free shipping|free returns", 1.2),
+    ("e-commerce", r"[$€£]\s?\d{1,5}(?:[.,]\d{2})?|customer reviews|size guide|quantity|sku", 0.8),
+    ("social-media", r"retweets?|reposts?|followers|following|trending|what's happening|who to follow|news feed", 0.9),
+    ("social-media", r"likes|replies|shared a post|mentions|timeline", 0.5),
+    ("developer-tools", r"pull request|merge request|repository|stack trace|opened this issue|assignees|commits?", 0.9),
+    ("developer-tools", r"branch|fork|labels|milestone|traceback|npm install|pip install", 0.5),
+    ("documentation", r"api reference|request body|query parameters|response body|example request|endpoints?", 1.0),
+    ("documentation", r"parameters|returns|getting started|installation|deprecated|get /\S*|post /\S*|put /\S*|patch /\S*|delete /\S*", 0.6),
+    ("content", r"min(?:ute)? read|published|share this article|related articles|reporter|editor's note", 1.0),
+    ("content", r"comments|subscribe|newsletter|written by|posted on|updated", 0.5),
+    ("form-page", r"confirm password|create (?:an )?account|sign up|register|forgot password|required fields?", 1.2),
+    ("form-page", r"password|email address|log in|sign in|submit|i agree|terms of service", 0.6),
+]
+
+def _alternatives(pattern: str) -> List[str]:
+    """Split a pattern at its top-level |"""
+    parts: List[str] = []
+    depth, start, index, in_class = 0, 0, 0, False
+    while index < len(pattern):
+        char = pattern[index]
+        if char == "\\":
+            index += 2
+            continue
+        if in_class:
+            in_class = char != "]"
+        elif char == "[":
+            in_class = True
+        elif char in "()":
+            depth += 1 if char == "(" else -1
+        elif char == "|" and depth == 0:
+            parts.append(pattern[start:index])
+            start = index + 1
+        index += 1
+    parts.append(pattern[start:])
+    return parts
+
+def _may_start_with_letter(alternative: str) -> bool:
+    """Whether an alternative can match starting with a letter; True when that is not obvious"""
+    if alternative.startswith("\\d"):
+        return False
+    if alternative.startswith("[") and "]" in alternative:
+        return any(char.isalpha() or char == "\\" for char in alternative[1:alternative.index("]")])
+    return True
+
+def _compile(features: Sequence[Tuple[str, str, float]]) -> Tuple["re.Pattern[str]", List[int]]:
+    """Combine every feature into one alternation so a text is scanned once
+
+    Returns the pattern and the feature of each group number. Every alternative ends in an empty
+    group marking its feature (feature patterns use only non-capturing groups). Alternatives that
+    start with a letter are grouped by it, so at each word only those that can start there are
+    tried; an alternative is never moved past another that could match at the same place.
+    A match starts with the separator before its word, which lets the regex engine skip straight
+    to separators instead of testing a lookbehind at every character, so scanned text needs a
+    leading space.
+    """
+    branches: List[str] = []
+    groups = [-1]
+    # Alternatives starting with a letter, by that letter, since the last one that could collide with them
+    run: Dict[str, List[Tuple[int, str]]] = {}
+
+    def close_run():
+        for head, members in run.items():
+            groups.extend(index for index, _ in members)
+            branches.append(head + "(?:" + "|".join(f"{rest}()" for _, rest in members) + ")")
+        run.clear()
+
+    for index, (_, pattern, _) in enumerate(features):
+        for alternative in _alternatives(pattern):
+            head = alternative[:1]
+            if "a" <= head <= "z" and alternative[1:2] not in ("?", "*", "+", "{"):
+                run.setdefault(head, []).append((index, alternative[1:]))
+                continue
+            if _may_start_with_letter(alternative):
+                close_run()
+            groups.append(index)
+            branches.append(f"{alternative}()")
+    close_run()
+
+    return re.compile(r"[^a-z0-9](?:" + "|".join(branches) + r")(?![a-z0-9])"), groups
+
+_URL_RE, _URL_GROUPS = _compile(URL_FEATURES)
+_TEXT_RE, _TEXT_GROUPS = _compile(TEXT_FEATURES)
+
+@dataclass
+class PageClassification:
+    """Page type with a calibrated confidence"""
+    label: str
+    confidence: float
+    scores: Dict[str, float] = field(default_factory=dict)
+
+class PageClassifier:
+    """Single-pass weighted pattern classifier over URL, title, content and form structure"""
+
+    def __init__(self, temperature: float = TEMPERATURE, max_content_chars: Optional[int] = None):
+        self.temperature = temperature
+        self.max_content_chars = max_content_chars or settings.CLASSIFIER_MAX_CONTENT_CHARS
+
+    def classify(
+        self,
+        url: str,
+        title: Optional[str] = None,
+        content: str = "",
+        forms: Optional[List[Dict[str, Any]]] = None,
+        has_forms: bool = False
+    ) -> PageClassification:
+        """Classify a page"""
+        scores = dict.fromkeys(LABELS, 0.0)
+        scores[GENERAL] = GENERAL_PRIOR
+
+        self._score_url(url, scores)
+        if title:
+            self._score_text(title.lower(), scores, TITLE_WEIGHT)
+        if content:
+            # Page-type signals sit near the top, so only a bounded prefix is scanned
+            self._score_text(content[:self.max_content_chars].lower(), scores, 1.0)
+        self._score_forms(forms, has_forms, scores)
+
+        return self._calibrate(scores)
+
+    def _score_url(self, url: str, scores: Dict[str, float]):
+        try:
+            parts = urlsplit(url.strip().lower())
+            target = f" {parts.hostname or ''} {parts.path}"
+        except ValueError:
+            target = " " + url.lower()
+
+        # A URL signal counts once however often it repeats
+        seen = set()
+        for match in _URL_RE.finditer(target):
+            index = _URL_GROUPS[match.lastindex]
+            if index not in seen:
+                seen.add(index)
+                label, _, weight = URL_FEATURES[index]
+                scores[label] += weight
+
+    def _score_text(self, text: str, scores: Dict[str, float], multiplier: float):
+        counts: Dict[int, int] = {}
+        for match in _TEXT_RE.finditer(" " + text):
+            index = _TEXT_GROUPS[match.lastindex]
+            count = counts.get(index, 0)
+            if count < TEXT_MATCH_CAP:
+                counts[index] = count + 1
+                label, _, weight = TEXT_FEATURES[index]
+                scores[label] += weight * multiplier
+
+    def _score_forms(self, forms: Optional[List[Dict[str, Any]]], has_forms: bool, scores: Dict[str, float]):
+        # Search boxes are everywhere, so only forms with real input fields are strong evidence
+        for form in forms or []:
+            field_types = {form_field.get("type") for form_field in form.get("fields", [])}
+            if "password" in field_types:
+                scores["form-page"] += 3.0
+            elif len(form.get("fields", [])) >= 3:
+                scores["form-page"] += 1.5
+            else:
+                scores["form-page"] += 0.3
+        if has_forms and not forms:
+            scores["form-page"] += 1.0
+
+    def _calibrate(self, scores: Dict[str, float]) -> PageClassification:
+        """Turn raw scores into a softmax distribution and pick the most likely label"""
+        # Highest score, "general" winning ties
+        label, top = GENERAL, scores[GENERAL]
+        for name, score in scores.items():
+            if score > top:
+                label, top = name, score
+        # The winner's own weight is exp(0) = 1
+        total = sum(math.exp((score - top) / self.temperature) for score in scores.values())
+
+        return PageClassification(
+            label=label,
+            confidence=round(1 / total, 4),
+            scores={name: round(score, 2) for name, score in scores.items()},
+        )
+
+# Process-wide classifier
+page_classifier = PageClassifier()
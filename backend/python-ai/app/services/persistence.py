@@ -0,0 +1,424 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from app.core.config import settings
+from app.services.metrics import persistence_flush_duration
+
+try:
+    import asyncpg
+except ImportError:  # Persistence is optional
+    asyncpg = None
+
+logger = logging.getLogger(__name__)
+
+# Conversation ids chosen by clients need not be UUIDs; they map to a stable one
+CONVERSATION_NAMESPACE = uuid.UUID("6f1c1b52-8d0e-4a5e-9c7e-2f4b8a3d9e10")
+
+# One statement per table per flush: columns go in as arrays and unnest() turns them into rows
+INSERT_CONVERSATIONS = """
+    INSERT INTO conversations (id, user_id, title, initial_context, started_at, message_count)
+    SELECT * FROM unnest($1::uuid[], $2::uuid[], $3::text[], $4::jsonb[], $5::timestamptz[], $6::int[])
+    ON CONFLICT (id) DO UPDATE
+    SET message_count = conversations.message_count + EXCLUDED.message_count, updated_at = NOW()
+"""
+
+INSERT_MESSAGES = """
+    INSERT INTO messages (conversation_id, user_id, role, content, context_snapshot, ai_model, processing_time, created_at)
+    SELECT * FROM unnest(
+        $1::uuid[], $2::uuid[], $3::text[], $4::text[], $5::jsonb[], $6::text[], $7::float8[], $8::timestamptz[]
+    )
+"""
+
+INSERT_CONTEXTS = """
+    INSERT INTO contexts (
+        user_id, url, domain, title, meta_description, content_summary, page_type, key_elements,
+        user_intent, ai_insights, guidance_opportunities, created_at
+    )
+    SELECT * FROM unnest(
+        $1::uuid[], $2::text[], $3::text[], $4::text[], $5::text[], $6::text[], $7::text[], $8::jsonb[],
+        $9::text[], $10::jsonb[], $11::jsonb[], $12::timestamptz[]
+    )
+"""
+
+TITLE_CHARS = 100
+
+CONNECT_TIMEOUT_SECONDS = 5.0
+
+def conversation_uuid(conversation_id: str) -> uuid.UUID:
+    try:
+        return uuid.UUID(conversation_id)
+    except ValueError:
+        return uuid.uuid5(CONVERSATION_NAMESPACE, conversation_id)
+
+def user_uuid(user_id: Optional[str]) -> Optional[uuid.UUID]:
+    """The users.id rows are owned by; row level security matches it against auth.uid()"""
+    if not user_id:
+        return None
+    try:
+        return uuid.UUID(user_id)
+    except ValueError:
+        return None
+
+def _text(value: Any) -> Any:
+    """Postgres text and jsonb cannot hold NUL characters, so they are removed from strings"""
+    if isinstance(value, str):
+        return value.replace("\x00", "") if "\x00" in value else value
+    if isinstance(value, dict):
+        return {_text(key): _text(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_text(item) for item in value]
+    return value
+
+def _json(value: Any) -> Optional[str]:
+    return None if value is None else json.dumps(_text(value), default=str)
+
+def _snapshot(context: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Page state worth keeping with a message; the page content itself is left out"""
+    if not context:
+        return None
+    return {key: context[key] for key in ("url", "title", "userIntent") if context.get(key)}
+
+class PersistenceWriter:
+    """Write-behind persistence of chat turns and analyzed contexts
+
+    Requests only append rows to an in-memory buffer. A single background task writes them in
+    transactions of up to batch_size rows per flush, one multi-row INSERT per table, when a batch
+    fills up or flush_interval passes. The buffer is bounded: once max_pending rows are waiting, new
+    rows are dropped and counted rather than slowing requests down. Failed flushes are retried with
+    backoff, and close() keeps flushing until the buffer is empty or its timeout runs out.
+    """
+
+    def __init__(
+        self,
+        dsn: Optional[str],
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        max_pending: int = 50000,
+        pool_size: int = 2,
+        retry_max_seconds: float = 30.0,
+        shutdown_timeout: float = 10.0,
+        server_settings: Optional[Dict[str, str]] = None,
+        enabled: bool = True
+    ):
+        self.dsn = dsn
+        self.batch_size = max(batch_size, 1)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pool_size = max(pool_size, 1)
+        self.retry_max_seconds = retry_max_seconds
+        self.shutdown_timeout = shutdown_timeout
+        self.server_settings = server_settings
+        self.enabled = enabled and bool(dsn) and asyncpg is not None
+
+        self._messages: Deque[Tuple] = deque()
+        self._contexts: Deque[Tuple] = deque()
+        self._in_flight = 0
+        self._pool: Any = None
+        self._pool_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._last_drop_log = 0.0
+        self.stats: Dict[str, Any] = {
+            "enqueued": 0,
+            "written": 0,
+            "dropped": 0,
+            "rejected": 0,
+            "flushes": 0,
+            "flush_errors": 0,
+            "last_flush_at": None,
+            "last_error": None,
+        }
+
+    @property
+    def pending(self) -> int:
+        return len(self._messages) + len(self._contexts) + self._in_flight
+
+    def record_turn(
+        self,
+        conversation_id: Optional[str],
+        message: str,
+        reply: str,
+        model: str,
+        processing_time: float,
+        context: Optional[Dict[str, Any]] = None,
+        started_at: Optional[datetime] = None,
+        user_id: Optional[str] = None
+    ):
+        """Queue a user message and the reply to it, owned by user_id when the caller is identified"""
+        if not self.enabled:
+            return
+        now = datetime.now(timezone.utc)
+        # The page content is dropped before buffering; serializing the rest is left to the writer
+        self._enqueue(self._messages, [
+            (conversation_id, user_id, "user", message, _snapshot(context), None, None, started_at or now),
+            (conversation_id, user_id, "assistant", reply, None, model, processing_time, now),
+        ])
+
+    def record_context(
+        self,
+        url: str,
+        analysis: Dict[str, Any],
+        title: Optional[str] = None,
+        user_intent: Optional[str] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        model: Optional[str] = None,
+        user_id: Optional[str] = None
+    ):
+        """Queue an analyzed page, owned by user_id when the caller is identified"""
+        if not self.enabled:
+            return
+        self._enqueue(self._contexts, [
+            (user_id, url, analysis, title, user_intent, metadata, model, datetime.now(timezone.utc)),
+        ])
+
+    def _enqueue(self, buffer: Deque[Tuple], rows: List[Tuple]):
+        if self._stopping or self.pending + len(rows) > self.max_pending:
+            self.stats["dropped"] += len(rows)
+            now = time.monotonic()
+            if now - self._last_drop_log >= 10:
+                self._last_drop_log = now
+                logger.warning(f"Persistence buffer full, dropping rows ({self.stats['dropped']} dropped so far)")
+            return
+
+        buffer.extend(rows)
+        self.stats["enqueued"] += len(rows)
+        if self._wake is not None and self.pending >= self.batch_size:
+            self._wake.set()
+
+    async def start(self):
+        """Start the background writer; the database is connected on the first flush"""
+        if not self.enabled or self._task is not None:
+            return
+        self._stopping = False
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Persistence writer started (batch size {self.batch_size}, interval {self.flush_interval}s)")
+
+    async def _run(self):
+        backoff = 0.0
+        while True:
+            if not self._stopping and self.pending < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+
+            if not self.pending:
+                if self._stopping:
+                    return
+                continue
+
+            try:
+                await self.flush_once()
+                backoff = 0.0
+            except Exception as e:
+                self.stats["flush_errors"] += 1
+                self.stats["last_error"] = str(e)
+                backoff = min(max(backoff * 2, 0.5), self.retry_max_seconds)
+                logger.warning(f"Persistence flush failed, retrying in {backoff}s: {str(e)}")
+                await asyncio.sleep(backoff)
+
+    async def flush_once(self) -> int:
+        """Write up to batch_size buffered rows in one transaction, returning the number written"""
+        messages = [self._messages.popleft() for _ in range(min(len(self._messages), self.batch_size))]
+        contexts = [self._contexts.popleft() for _ in range(min(len(self._contexts), self.batch_size - len(messages)))]
+        rows = len(messages) + len(contexts)
+        if not rows:
+            return 0
+
+        self._in_flight = rows
+        started = time.perf_counter()
+        errors: List[str] = []
+        try:
+            message_rows = [_message_row(*row) for row in messages]
+            context_rows = [_context_row(*row) for row in contexts]
+            pool = await self.get_pool()
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    written = await self._insert(conn, message_rows, context_rows, errors)
+        except BaseException:
+            # Back to the front of the buffer, including when shutdown cancels the flush midway
+            self._messages.extendleft(reversed(messages))
+            self._contexts.extendleft(reversed(contexts))
+            raise
+        finally:
+            self._in_flight = 0
+
+        if written < rows:
+            # Retrying cannot fix rows the database refuses, so they are dropped
+            self.stats["rejected"] += rows - written
+            self.stats["last_error"] = errors[-1]
+            logger.error(f"Persistence rejected {rows - written} of {rows} rows: {errors[-1]}")
+
+        persistence_flush_duration.observe(time.perf_counter() - started)
+        self.stats["written"] += written
+        self.stats["flushes"] += 1
+        self.stats["last_flush_at"] = datetime.utcnow().isoformat()
+        return written
+
+    async def _insert(self, conn: Any, message_rows: List[Tuple], context_rows: List[Tuple], errors: List[str]) -> int:
+        """Insert rows under a savepoint, splitting the batch when the database refuses it
+
+        Halves are retried until the refused rows are on their own, so one bad row costs only
+        itself. Returns the number of rows written; the refusals are appended to errors.
+        """
+        try:
+            async with conn.transaction():
+                if message_rows:
+                    conversations = _conversation_rows(message_rows)
+                    if conversations:
+                        await conn.execute(INSERT_CONVERSATIONS, *_columns(conversations))
+                    await conn.execute(INSERT_MESSAGES, *_columns(message_rows))
+                if context_rows:
+                    await conn.execute(INSERT_CONTEXTS, *_columns(context_rows))
+            return len(message_rows) + len(context_rows)
+        except (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError) as e:
+            if len(message_rows) + len(context_rows) == 1:
+                errors.append(str(e))
+                return 0
+
+        if message_rows and context_rows:
+            halves = [(message_rows, []), ([], context_rows)]
+        elif message_rows:
+            middle = len(message_rows) // 2
+            halves = [(message_rows[:middle], []), (message_rows[middle:], [])]
+        else:
+            middle = len(context_rows) // 2
+            halves = [([], context_rows[:middle]), ([], context_rows[middle:])]
+
+        written = 0
+        for messages, contexts in halves:
+            written += await self._insert(conn, messages, contexts, errors)
+        return written
+
+    async def get_pool(self) -> Any:
+        """The connection pool, created on first use; token usage flushes share it"""
+        async with self._pool_lock:
+            if self._pool is None:
+                self._pool = await asyncpg.create_pool(
+                    self.dsn,
+                    min_size=1,
+                    max_size=self.pool_size,
+                    timeout=CONNECT_TIMEOUT_SECONDS,
+                    server_settings=self.server_settings,
+                )
+        return self._pool
+
+    async def ping(self, timeout: float = 1.0) -> bool:
+        """Whether the database answers, for the health report"""
+        if not self.enabled:
+            return False
+        try:
+            pool = await asyncio.wait_for(self.get_pool(), timeout=timeout)
+            return await pool.fetchval("SELECT 1", timeout=timeout) == 1
+        except Exception as e:
+            logger.warning(f"Database ping failed: {str(e)}")
+            return False
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "enabled": self.enabled, "pending": self.pending}
+
+    async def close(self):
+        """Flush what is buffered, waiting at most shutdown_timeout, then close the pool"""
+        if self._task is not None:
+            self._stopping = True
+            self._wake.set()
+            try:
+                await asyncio.wait_for(self._task, timeout=self.shutdown_timeout)
+            except asyncio.TimeoutError:
+                logger.error(f"Persistence shutdown timed out, {self.pending} rows not written")
+            self._task = None
+
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+def _message_row(
+    conversation_id: Optional[str],
+    user_id: Optional[str],
+    role: str,
+    content: str,
+    snapshot: Optional[Dict[str, Any]],
+    model: Optional[str],
+    processing_time: Optional[float],
+    created_at: datetime
+) -> Tuple:
+    conversation = conversation_uuid(conversation_id) if conversation_id else None
+    return (conversation, user_uuid(user_id), role, _text(content), _json(snapshot), model, processing_time, created_at)
+
+def _context_row(
+    user_id: Optional[str],
+    url: str,
+    analysis: Dict[str, Any],
+    title: Optional[str],
+    user_intent: Optional[str],
+    metadata: Optional[Dict[str, Any]],
+    model: Optional[str],
+    created_at: datetime
+) -> Tuple:
+    metadata = metadata or {}
+    url = _text(url)
+    return (
+        user_uuid(user_id),
+        url,
+        urlparse(url).netloc or url,
+        _text(title or metadata.get("title")),
+        _text(metadata.get("description")),
+        _text(analysis.get("purpose")),
+        _text(analysis.get("page_type")),
+        _json(analysis.get("key_actions", [])),
+        _text(user_intent),
+        _json({"insights": analysis.get("insights", []), "model": model}),
+        _json(analysis.get("suggestions", [])),
+        created_at,
+    )
+
+def _conversation_rows(messages: List[Tuple]) -> List[Tuple]:
+    """One row per conversation in the batch, so the upsert touches each conversation only once"""
+    conversations: Dict[uuid.UUID, List[Any]] = {}
+    for conversation, user, role, content, snapshot, _model, _time, created_at in messages:
+        if conversation is None:
+            continue
+        row = conversations.get(conversation)
+        if row is None:
+            title = content[:TITLE_CHARS] if role == "user" else None
+            conversations[conversation] = [conversation, user, title, snapshot, created_at, 1]
+        else:
+            row[5] += 1
+    return [tuple(row) for row in conversations.values()]
+
+def _columns(rows: List[Tuple]) -> List[List[Any]]:
+    """Rows turned into one list per column, the shape unnest() takes"""
+    return [list(column) for column in zip(*rows)]
+
+def create_persistence_writer() -> PersistenceWriter:
+    """Create the persistence writer configured by settings"""
+    if settings.DATABASE_URL and settings.PERSISTENCE_ENABLED and asyncpg is None:
+        logger.warning("DATABASE_URL is set but the asyncpg package is not installed")
+
+    return PersistenceWriter(
+        settings.DATABASE_URL,
+        batch_size=settings.PERSISTENCE_BATCH_SIZE,
+        flush_interval=settings.PERSISTENCE_FLUSH_INTERVAL_SECONDS,
+        max_pending=settings.PERSISTENCE_MAX_PENDING,
+        pool_size=settings.PERSISTENCE_POOL_SIZE,
+        retry_max_seconds=settings.PERSISTENCE_RETRY_MAX_SECONDS,
+        shutdown_timeout=settings.PERSISTENCE_SHUTDOWN_TIMEOUT_SECONDS,
+        enabled=settings.PERSISTENCE_ENABLED,
+    )
+
+# Process-wide persistence writer
+persistence_writer = create_persistence_writer()
+
+def get_persistence_writer() -> PersistenceWriter:
+    """Dependency to get the persistence writer"""
+    return persistence_writer
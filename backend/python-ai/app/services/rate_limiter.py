@@ -0,0 +1,321 @@
+import asyncio
+import logging
+import math
+import struct
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi.requests import HTTPConnection
+
+from app.core.config import settings
+from app.services.shared_memory import SLOT_HEADER_BYTES, SharedMemoryStore, open_shared_store
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # Shared limits are optional
+    redis_asyncio = None
+
+logger = logging.getLogger(__name__)
+
+# (key, capacity, refill per second, cost)
+BucketRequest = Tuple[str, float, float, float]
+
+KEY_PREFIX = "aiwatch:ratelimit"
+
+# Token bucket state in shared memory: tokens, last update (wall clock, which all workers share)
+_BUCKET = struct.Struct("<dd")
+
+class RateLimitExceeded(Exception):
+    """A request was rejected by a rate limit; retry_after is in seconds"""
+
+    def __init__(self, message: str, retry_after: float, scope: str):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.scope = scope
+
+    def retry_after_header(self) -> str:
+        """Retry-After value in whole seconds"""
+        return str(max(int(math.ceil(self.retry_after)), 1))
+
+class LocalBucketStore:
+    """In-process token buckets, bounded to the most recently used keys"""
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, requests: List[BucketRequest]) -> float:
+        """Take from every bucket or from none; returns 0 on success, else seconds until possible"""
+        now = time.monotonic()
+        levels = []
+        wait = 0.0
+        for key, capacity, rate, cost in requests:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            levels.append(tokens)
+            if tokens < cost:
+                wait = max(wait, (cost - tokens) / rate)
+
+        if wait > 0:
+            return wait
+
+        for (key, _, _, cost), tokens in zip(requests, levels):
+            self._buckets[key] = (tokens - cost, now)
+            self._buckets.move_to_end(key)
+
+        # An evicted bucket comes back full, which only matters for clients idle long enough to refill anyway
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+        return 0.0
+
+    async def close(self):
+        pass
+
+class SharedMemoryBucketStore:
+    """Token buckets shared by the workers on this host, kept in a memory-mapped table"""
+
+    def __init__(self, store: SharedMemoryStore):
+        self.store = store
+
+    async def take(self, requests: List[BucketRequest]) -> float:
+        """Take from every bucket or from none; returns 0 on success, else seconds until possible"""
+        keys = [key for key, _, _, _ in requests]
+        with self.store.transaction(keys) as buckets:
+            now = time.time()
+            levels = []
+            wait = 0.0
+            for key, capacity, rate, cost in requests:
+                raw = buckets.get(key)
+                tokens, updated = _BUCKET.unpack(raw) if raw is not None else (capacity, now)
+                tokens = min(capacity, tokens + max(now - updated, 0.0) * rate)
+                levels.append(tokens)
+                if tokens < cost:
+                    wait = max(wait, (cost - tokens) / rate)
+
+            if wait > 0:
+                return wait
+
+            for (key, capacity, rate, cost), tokens in zip(requests, levels):
+                # Kept until the bucket would be full again, when a missing bucket means the same thing
+                buckets.set(key, _BUCKET.pack(tokens - cost, now), capacity / rate + 1)
+            return 0.0
+
+    async def close(self):
+        self.store.close()
+
+# Atomically refill and take from several buckets; uses the Redis clock so workers agree on time
+_TAKE_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local levels = {}
+local wait = 0
+for i = 1, #KEYS do
+  local capacity = tonumber(ARGV[i * 3 - 2])
+  local rate = tonumber(ARGV[i * 3 - 1])
+  local cost = tonumber(ARGV[i * 3])
+  local state = redis.call('HMGET', KEYS[i], 't', 'u')
+  local tokens = tonumber(state[1]) or capacity
+  local updated = tonumber(state[2]) or now
+  tokens = math.min(capacity, tokens + math.max(now - updated, 0) * rate)
+  levels[i] = tokens
+  if tokens < cost then
+    wait = math.max(wait, (cost - tokens) / rate)
+  end
+end
+if wait > 0 then
+  return tostring(wait)
+end
+for i = 1, #KEYS do
+  local capacity = tonumber(ARGV[i * 3 - 2])
+  local rate = tonumber(ARGV[i * 3 - 1])
+  local cost = tonumber(ARGV[i * 3])
+  redis.call('HSET', KEYS[i], 't', tostring(levels[i] - cost), 'u', tostring(now))
+  redis.call('PEXPIRE', KEYS[i], math.ceil(capacity / rate * 1000) + 1000)
+end
+return '0'
+"""
+
+class RedisBucketStore:
+    """Token buckets shared by every worker through a Redis Lua script"""
+
+    def __init__(self, client: Any):
+        self.client = client
+        self._script = client.register_script(_TAKE_SCRIPT)
+
+    async def take(self, requests: List[BucketRequest]) -> float:
+        """Take from every bucket or from none; returns 0 on success, else seconds until possible"""
+        keys = [key for key, _, _, _ in requests]
+        args = [value for _, capacity, rate, cost in requests for value in (capacity, rate, cost)]
+        result = await self._script(keys=keys, args=args)
+        return float(result)
+
+    async def close(self):
+        close = getattr(self.client, "aclose", None) or self.client.close
+        await close()
+
+class RateLimiter:
+    """Per-client request limits plus global admission control for upstream Claude calls"""
+
+    def __init__(self, store: Any, fallback: Optional[LocalBucketStore] = None, enabled: bool = True):
+        self.store = store
+        # Used when the shared store is unreachable, so limits degrade to per-worker instead of off
+        self.fallback = fallback
+        self.enabled = enabled
+        self._waiting = 0
+        self._queue_lock = asyncio.Lock()
+        self._paused_until = 0.0
+        self.stats: Dict[str, int] = {
+            "client_allowed": 0,
+            "client_rejected": 0,
+            "upstream_admitted": 0,
+            "upstream_queued": 0,
+            "upstream_shed": 0,
+            "upstream_pauses": 0,
+            "store_errors": 0,
+        }
+
+    async def check_client(self, client_id: str):
+        """Take one request from a client's bucket or raise RateLimitExceeded"""
+        if not self.enabled or settings.REQUESTS_PER_MINUTE <= 0:
+            return
+
+        rate = settings.REQUESTS_PER_MINUTE / 60
+        wait = await self._take([(f"{KEY_PREFIX}:client:{client_id}", settings.RATE_LIMIT_BURST, rate, 1)])
+        if wait:
+            self.stats["client_rejected"] += 1
+            raise RateLimitExceeded("Too many requests, please slow down", retry_after=wait, scope="client")
+        self.stats["client_allowed"] += 1
+
+    async def admit_upstream(self, estimated_tokens: int):
+        """Wait for global request and token budget before an upstream call, or shed the request"""
+        buckets = self._upstream_buckets(estimated_tokens)
+        if not self.enabled or not buckets:
+            return
+
+        # Fast path only when nobody is queued, so waiting requests keep their place
+        if self._waiting == 0:
+            wait = await self._take_upstream(buckets)
+            if not wait:
+                self.stats["upstream_admitted"] += 1
+                return
+            if wait > settings.UPSTREAM_MAX_WAIT_SECONDS:
+                self._shed(wait)
+
+        if self._waiting >= settings.UPSTREAM_MAX_QUEUE:
+            self._shed(settings.UPSTREAM_MAX_WAIT_SECONDS)
+
+        self.stats["upstream_queued"] += 1
+        self._waiting += 1
+        deadline = time.monotonic() + settings.UPSTREAM_MAX_WAIT_SECONDS
+        try:
+            try:
+                await asyncio.wait_for(self._queue_lock.acquire(), timeout=settings.UPSTREAM_MAX_WAIT_SECONDS)
+            except asyncio.TimeoutError:
+                self._shed(settings.UPSTREAM_MAX_WAIT_SECONDS)
+
+            try:
+                while True:
+                    wait = await self._take_upstream(buckets)
+                    if not wait:
+                        self.stats["upstream_admitted"] += 1
+                        return
+                    if wait > deadline - time.monotonic():
+                        self._shed(wait)
+                    await asyncio.sleep(wait)
+            finally:
+                self._queue_lock.release()
+        finally:
+            self._waiting -= 1
+
+    def pause_upstream(self, seconds: float):
+        """Stop admitting upstream calls for a while, e.g. after Claude answered 429"""
+        until = time.monotonic() + seconds
+        if until > self._paused_until:
+            self._paused_until = until
+            self.stats["upstream_pauses"] += 1
+            logger.warning(f"Upstream rate limited, pausing admission for {seconds:.1f}s")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "upstream_waiting": self._waiting,
+            "shared_store": not isinstance(self.store, LocalBucketStore),
+        }
+
+    async def close(self):
+        await self.store.close()
+
+    def _upstream_buckets(self, estimated_tokens: int) -> List[BucketRequest]:
+        buckets = []
+        if settings.UPSTREAM_REQUESTS_PER_MINUTE > 0:
+            rpm = settings.UPSTREAM_REQUESTS_PER_MINUTE
+            buckets.append((f"{KEY_PREFIX}:upstream:requests", rpm, rpm / 60, 1))
+        if settings.UPSTREAM_TOKENS_PER_MINUTE > 0:
+            tpm = settings.UPSTREAM_TOKENS_PER_MINUTE
+            # A single oversized request must still be admissible once the bucket is full
+            buckets.append((f"{KEY_PREFIX}:upstream:tokens", tpm, tpm / 60, min(max(estimated_tokens, 1), tpm)))
+        return buckets
+
+    async def _take_upstream(self, buckets: List[BucketRequest]) -> float:
+        paused = self._paused_until - time.monotonic()
+        if paused > 0:
+            return paused
+        return await self._take(buckets)
+
+    async def _take(self, requests: List[BucketRequest]) -> float:
+        try:
+            return await self.store.take(requests)
+        except Exception as e:
+            if self.fallback is None:
+                raise
+            self.stats["store_errors"] += 1
+            logger.warning(f"Shared rate limit store failed, using local limits: {str(e)}")
+            return await self.fallback.take(requests)
+
+    def _shed(self, retry_after: float):
+        self.stats["upstream_shed"] += 1
+        raise RateLimitExceeded("The AI service is at capacity, please retry shortly", retry_after=retry_after, scope="upstream")
+
+def create_rate_limiter() -> RateLimiter:
+    """Create the rate limiter configured by settings"""
+    local = LocalBucketStore(max_keys=settings.RATE_LIMIT_MAX_CLIENTS)
+
+    if settings.RATE_LIMIT_REDIS_ENABLED:
+        if redis_asyncio is None:
+            logger.warning("RATE_LIMIT_REDIS_ENABLED is set but the redis package is not installed")
+        else:
+            client = redis_asyncio.from_url(
+                settings.REDIS_URL,
+                socket_timeout=settings.RATE_LIMIT_REDIS_TIMEOUT,
+                socket_connect_timeout=settings.RATE_LIMIT_REDIS_TIMEOUT,
+            )
+            return RateLimiter(RedisBucketStore(client), fallback=local, enabled=settings.RATE_LIMIT_ENABLED)
+
+    # Without Redis, workers on one host still share limits through shared memory
+    store = open_shared_store("ratelimit", settings.RATE_LIMIT_MAX_CLIENTS, SLOT_HEADER_BYTES + _BUCKET.size)
+    if store is not None:
+        return RateLimiter(SharedMemoryBucketStore(store), fallback=local, enabled=settings.RATE_LIMIT_ENABLED)
+
+    return RateLimiter(local, enabled=settings.RATE_LIMIT_ENABLED)
+
+# Process-wide rate limiter
+rate_limiter = create_rate_limiter()
+
+def get_client_id(connection: HTTPConnection) -> str:
+    """Identify the caller for per-client limits"""
+    if settings.RATE_LIMIT_CLIENT_HEADER:
+        client_id = connection.headers.get(settings.RATE_LIMIT_CLIENT_HEADER)
+        if client_id:
+            return client_id
+    return connection.client.host if connection.client else "anonymous"
+
+async def enforce_rate_limit(connection: HTTPConnection):
+    """FastAPI dependency applying the per-client request limit to HTTP routes"""
+    # Monitoring sockets are long-lived: they are capped per client by the monitor registry and each
+    # insights recompute is charged to the client's bucket
+    if connection.scope["type"] != "http":
+        return
+    await rate_limiter.check_client(get_client_id(connection))
@@ -0,0 +1,288 @@
+import asyncio
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional, TypeVar
+
+import anthropic
+from fastapi.requests import HTTPConnection
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Upstream statuses where the request was not processed and can be sent again
+RETRYABLE_STATUS_CODES = {429, 502, 503, 504, 529}
+
+# Absolute time.monotonic() by which the current request must finish
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+# Whether long generations may push the deadline back; not when the client chose it
+_extendable: ContextVar[bool] = ContextVar("deadline_extendable", default=True)
+
+class ClaudeServiceError(Exception):
+    """Base class for Claude service failures, carrying the HTTP status to report"""
+    status_code = 500
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class ServiceUnavailableError(ClaudeServiceError):
+    """Claude is not configured or not reachable right now"""
+    status_code = 503
+
+class CircuitOpenError(ServiceUnavailableError):
+    """The circuit breaker is open and calls fail fast"""
+
+class UpstreamTimeoutError(ClaudeServiceError):
+    """The request deadline passed before Claude answered"""
+    status_code = 504
+
+class UpstreamError(ClaudeServiceError):
+    """Claude returned an error that retrying will not fix"""
+    status_code = 502
+
+@contextmanager
+def deadline_scope(seconds: float, replace: bool = False) -> Iterator[float]:
+    """Run a block with a deadline; nested scopes can only shorten it unless replace is set"""
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None and not replace:
+        deadline = min(deadline, current)
+
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+@contextmanager
+def generation_scope(max_tokens: int) -> Iterator[Optional[float]]:
+    """Push the deadline back for a non-streaming call that may generate up to max_tokens
+
+    The whole reply arrives at once, so the deadline must cover generating it at
+    CLAUDE_MIN_OUTPUT_TOKENS_PER_SECOND, up to CLAUDE_READ_TIMEOUT. A deadline the client asked
+    for is kept as it is.
+    """
+    current = _deadline.get()
+    if current is None or not _extendable.get() or settings.CLAUDE_MIN_OUTPUT_TOKENS_PER_SECOND <= 0:
+        yield current
+        return
+
+    seconds = min(max_tokens / settings.CLAUDE_MIN_OUTPUT_TOKENS_PER_SECOND, settings.CLAUDE_READ_TIMEOUT)
+    token = _deadline.set(max(current, time.monotonic() + seconds))
+    try:
+        yield _deadline.get()
+    finally:
+        _deadline.reset(token)
+
+def remaining_time() -> Optional[float]:
+    """Seconds left before the current deadline, or None without one"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+async def apply_request_deadline(connection: HTTPConnection):
+    """FastAPI dependency giving each HTTP request a deadline budget
+
+    Clients may ask for a shorter budget with an X-Request-Timeout header (seconds).
+    """
+    if connection.scope["type"] != "http":
+        return
+
+    seconds = settings.REQUEST_TIMEOUT_SECONDS
+    requested = connection.headers.get("x-request-timeout")
+    if requested:
+        try:
+            seconds = min(seconds, max(float(requested), 0.1))
+            _extendable.set(False)
+        except ValueError:
+            pass
+
+    # Dependencies run in the request's context, so the deadline stays set for the endpoint
+    _deadline.set(time.monotonic() + seconds)
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open probe"""
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self.stats: Dict[str, int] = {"opened": 0, "rejected": 0, "failures": 0, "successes": 0}
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go through"""
+        if self.state == "closed":
+            return
+
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_seconds:
+                self.stats["rejected"] += 1
+                raise CircuitOpenError("Claude is temporarily unavailable", retry_after=self.retry_in())
+            self.state = "half_open"
+
+        # Half-open lets one probe through to test the upstream
+        if self._probe_in_flight:
+            self.stats["rejected"] += 1
+            raise CircuitOpenError("Claude is temporarily unavailable", retry_after=1.0)
+        self._probe_in_flight = True
+
+    def record_success(self):
+        self.stats["successes"] += 1
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+        if self.state != "closed":
+            logger.info("Claude circuit breaker closed")
+        self.state = "closed"
+
+    def record_failure(self):
+        self.stats["failures"] += 1
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self.stats["opened"] += 1
+                logger.warning(f"Claude circuit breaker opened after {self.consecutive_failures} failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """Free the half-open slot when a call ended without telling us anything about the upstream"""
+        self._probe_in_flight = False
+
+    def retry_in(self) -> float:
+        """Seconds until an open breaker lets a probe through"""
+        if self.state != "open":
+            return 0.0
+        return max(self.reset_seconds - (time.monotonic() - self.opened_at), 0.0)
+
+    def is_open(self) -> bool:
+        return self.state == "open" and self.retry_in() > 0
+
+    def get_state(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "retry_in_seconds": round(self.retry_in(), 1),
+            **self.stats,
+        }
+
+def is_retryable(error: BaseException) -> bool:
+    """Check whether an upstream error is safe to retry"""
+    if isinstance(error, anthropic.APIConnectionError):
+        # Includes timeouts; the request never produced a response
+        return True
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """Check whether an error says the upstream is unhealthy (as opposed to a bad request)"""
+    if isinstance(error, (anthropic.APIConnectionError, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code >= 500
+    return False
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Read the retry-after header from an upstream error"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        value = response.headers.get("retry-after")
+        return float(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt: int, error: BaseException) -> float:
+    """Full-jitter exponential backoff, never shorter than the upstream's retry-after"""
+    cap = min(settings.CLAUDE_RETRY_MAX_DELAY, settings.CLAUDE_RETRY_BASE_DELAY * 2 ** attempt)
+    delay = random.uniform(0, cap)
+    retry_after = retry_after_seconds(error)
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, settings.CLAUDE_RETRY_MAX_DELAY))
+    return delay
+
+async def call_with_resilience(
+    func: Callable[[], Awaitable[T]],
+    breaker: CircuitBreaker,
+    max_retries: Optional[int] = None,
+    on_error: Optional[Callable[[BaseException], None]] = None,
+    admit: Optional[Callable[[], Awaitable[None]]] = None,
+) -> T:
+    """Call the upstream within the request deadline, retrying safe errors behind a circuit breaker
+
+    admit runs before every attempt, e.g. to wait for the global upstream budget. Running out of
+    time there says nothing about Claude, so only a deadline passing during func itself counts as
+    a breaker failure.
+    """
+    retries = settings.CLAUDE_MAX_RETRIES if max_retries is None else max_retries
+    attempt = 0
+
+    while True:
+        remaining = remaining_time()
+        if remaining is not None and remaining <= 0:
+            raise UpstreamTimeoutError("Request deadline exceeded before Claude answered")
+
+        if admit is not None:
+            try:
+                await asyncio.wait_for(admit(), timeout=remaining)
+            except asyncio.TimeoutError as e:
+                raise UpstreamTimeoutError("Request deadline exceeded while waiting for upstream capacity") from e
+            remaining = remaining_time()
+            if remaining is not None and remaining <= 0:
+                raise UpstreamTimeoutError("Request deadline exceeded before Claude answered")
+
+        breaker.before_call()
+        try:
+            result = await asyncio.wait_for(func(), timeout=remaining)
+        except asyncio.TimeoutError as e:
+            breaker.record_failure()
+            raise UpstreamTimeoutError("Request deadline exceeded before Claude answered") from e
+        except anthropic.APIError as e:
+            if on_error:
+                on_error(e)
+            if is_upstream_failure(e):
+                breaker.record_failure()
+            else:
+                breaker.release()
+
+            delay = backoff_delay(attempt, e)
+            remaining = remaining_time()
+            if not is_retryable(e) or attempt >= retries or (remaining is not None and delay >= remaining):
+                raise _translate(e) from e
+
+            attempt += 1
+            logger.warning(f"Retrying Claude call in {delay:.2f}s (attempt {attempt}/{retries}): {str(e)}")
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            # Cancellation or a local error says nothing about upstream health
+            breaker.release()
+            raise
+
+        breaker.record_success()
+        return result
+
+def _translate(error: anthropic.APIError) -> ClaudeServiceError:
+    """Map an SDK error to a service error"""
+    if isinstance(error, anthropic.APITimeoutError):
+        return UpstreamTimeoutError(f"Claude API timed out: {str(error)}")
+    if isinstance(error, anthropic.APIConnectionError):
+        return ServiceUnavailableError(f"Claude API unreachable: {str(error)}", retry_after=1.0)
+    if isinstance(error, anthropic.APIStatusError) and error.status_code in RETRYABLE_STATUS_CODES:
+        return ServiceUnavailableError(f"Claude API overloaded: {str(error)}", retry_after=retry_after_seconds(error))
+    return UpstreamError(f"Claude API error: {str(error)}")
+
+# Process-wide breaker guarding Claude calls
+claude_breaker = CircuitBreaker(settings.CIRCUIT_FAILURE_THRESHOLD, settings.CIRCUIT_RESET_SECONDS)
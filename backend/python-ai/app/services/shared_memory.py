@@ -0,0 +1,236 @@
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"AIWSHM01"
+# magic, slot count, slot size, ways per set
+_FILE_HEADER = struct.Struct("<8sIII")
+FILE_HEADER_BYTES = 64
+
+# seq, payload length, payload crc32, reserved, expires at (wall clock), key digest
+_SLOT_HEADER = struct.Struct("<IIIId16s")
+SLOT_HEADER_BYTES = _SLOT_HEADER.size
+_SEQ = struct.Struct("<I")
+WAYS = 4
+
+# Reads that keep overlapping a write give up and count as a miss
+READ_ATTEMPTS = 3
+
+def default_directory() -> str:
+    """tmpfs when available, so the store never touches a disk"""
+    return "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+class SharedMemoryStore:
+    """Fixed-size hash table in a memory-mapped file, shared by every worker process on the host
+
+    The table is set-associative: a key hashes to a set of WAYS slots, and a full set replaces the
+    entry closest to expiry. Readers take no locks. Each slot carries a sequence number that writers
+    make odd while they write, plus a CRC of the payload, so a reader that races a writer sees a
+    mismatch and retries instead of returning torn data. Writers lock their set with a POSIX record
+    lock on its byte range, which also serializes writers in different processes.
+    """
+
+    def __init__(self, path: str, slots: int, slot_bytes: int):
+        self.path = path
+        self.slot_bytes = max(slot_bytes, _SLOT_HEADER.size + 16)
+        self.sets = max(slots // WAYS, 1)
+        self.slots = self.sets * WAYS
+        self.max_value_bytes = self.slot_bytes - _SLOT_HEADER.size
+        self.size = FILE_HEADER_BYTES + self.slots * self.slot_bytes
+        self.stats: Dict[str, int] = {
+            "hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "evictions": 0,
+            "oversize": 0,
+            "torn_reads": 0,
+        }
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            self._initialize()
+            self._map = mmap.mmap(self._fd, self.size)
+        except BaseException:
+            os.close(self._fd)
+            raise
+
+    def _initialize(self):
+        """Size and stamp a new file, or check that an existing one has the same layout"""
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, FILE_HEADER_BYTES, 0)
+        try:
+            header = os.pread(self._fd, _FILE_HEADER.size, 0)
+            expected = _FILE_HEADER.pack(MAGIC, self.slots, self.slot_bytes, WAYS)
+            if len(header) < _FILE_HEADER.size or not header.startswith(MAGIC):
+                # New files are sparse; tmpfs only allocates pages as slots are written
+                os.ftruncate(self._fd, self.size)
+                os.pwrite(self._fd, expected, 0)
+            elif header != expected:
+                raise ValueError(f"Shared memory file {self.path} has a different layout; remove it or change SHARED_MEMORY_NAME")
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, FILE_HEADER_BYTES, 0)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """The value stored for a key, or None if missing or expired"""
+        digest = _digest(key)
+        value = self._read(digest, self._set_offset(digest))
+        self.stats["hits" if value is not None else "misses"] += 1
+        return value
+
+    def set(self, key: str, value: bytes, ttl_seconds: float) -> bool:
+        """Store a value; returns False when it is too large for a slot"""
+        if len(value) > self.max_value_bytes:
+            self.stats["oversize"] += 1
+            return False
+        digest = _digest(key)
+        offset = self._set_offset(digest)
+        with self._locked([offset]):
+            self._write(digest, offset, value, time.time() + ttl_seconds)
+        self.stats["sets"] += 1
+        return True
+
+    def delete(self, key: str):
+        """Remove a key if present"""
+        digest = _digest(key)
+        offset = self._set_offset(digest)
+        with self._locked([offset]):
+            slot = self._find(digest, offset)
+            if slot is not None:
+                self._write_slot(slot, b"\0" * 16, b"", 0.0)
+
+    @contextmanager
+    def transaction(self, keys: List[str]) -> Iterator["SharedMemoryTransaction"]:
+        """Lock the sets of several keys for a read-modify-write across processes"""
+        digests = {key: _digest(key) for key in keys}
+        offsets = {key: self._set_offset(digest) for key, digest in digests.items()}
+        with self._locked(list(offsets.values())):
+            yield SharedMemoryTransaction(self, digests, offsets)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {**self.stats, "slots": self.slots, "slot_bytes": self.slot_bytes}
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+    def _set_offset(self, digest: bytes) -> int:
+        index = int.from_bytes(digest[:8], "little") % self.sets
+        return FILE_HEADER_BYTES + index * WAYS * self.slot_bytes
+
+    @contextmanager
+    def _locked(self, offsets: List[int]) -> Iterator[None]:
+        # Always in offset order, so two processes locking the same sets cannot deadlock
+        locked = sorted(set(offsets))
+        length = WAYS * self.slot_bytes
+        for offset in locked:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, length, offset)
+        try:
+            yield
+        finally:
+            for offset in reversed(locked):
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, offset)
+
+    def _read(self, digest: bytes, set_offset: int) -> Optional[bytes]:
+        for way in range(WAYS):
+            slot = set_offset + way * self.slot_bytes
+            for _ in range(READ_ATTEMPTS):
+                seq, length, crc, _, expires_at, slot_digest = _SLOT_HEADER.unpack_from(self._map, slot)
+                if seq & 1:
+                    continue
+                if slot_digest != digest:
+                    break
+                start = slot + _SLOT_HEADER.size
+                value = self._map[start:start + min(length, self.max_value_bytes)]
+                if _SEQ.unpack_from(self._map, slot)[0] != seq or zlib.crc32(value) != crc:
+                    continue
+                return value if expires_at > time.time() else None
+            else:
+                self.stats["torn_reads"] += 1
+        return None
+
+    def _find(self, digest: bytes, set_offset: int) -> Optional[int]:
+        for way in range(WAYS):
+            slot = set_offset + way * self.slot_bytes
+            if _SLOT_HEADER.unpack_from(self._map, slot)[5] == digest:
+                return slot
+        return None
+
+    def _write(self, digest: bytes, set_offset: int, value: bytes, expires_at: float):
+        """Write under the set lock: the key's own slot, else a free or expired one, else the oldest"""
+        slot = self._find(digest, set_offset)
+        if slot is None:
+            now = time.time()
+            candidates: List[Tuple[float, int]] = []
+            for way in range(WAYS):
+                offset = set_offset + way * self.slot_bytes
+                candidates.append((_SLOT_HEADER.unpack_from(self._map, offset)[4], offset))
+            slot_expires, slot = min(candidates)
+            if slot_expires > now:
+                self.stats["evictions"] += 1
+        self._write_slot(slot, digest, value, expires_at)
+
+    def _write_slot(self, slot: int, digest: bytes, value: bytes, expires_at: float):
+        seq = _SEQ.unpack_from(self._map, slot)[0]
+        # Odd while the slot is being written, so readers skip it
+        _SEQ.pack_into(self._map, slot, (seq + 1) & 0xFFFFFFFF | 1)
+        start = slot + _SLOT_HEADER.size
+        self._map[start:start + len(value)] = value
+        _SLOT_HEADER.pack_into(
+            self._map, slot, (seq + 2) & 0xFFFFFFFE, len(value), zlib.crc32(value), 0, expires_at, digest
+        )
+
+class SharedMemoryTransaction:
+    """Reads and writes of keys whose sets are locked by SharedMemoryStore.transaction"""
+
+    def __init__(self, store: SharedMemoryStore, digests: Dict[str, bytes], offsets: Dict[str, int]):
+        self.store = store
+        self.digests = digests
+        self.offsets = offsets
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.store._read(self.digests[key], self.offsets[key])
+
+    def set(self, key: str, value: bytes, ttl_seconds: float):
+        self.store._write(self.digests[key], self.offsets[key], value, time.time() + ttl_seconds)
+
+def _digest(key: str) -> bytes:
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+
+def open_shared_store(kind: str, slots: int, slot_bytes: int) -> Optional[SharedMemoryStore]:
+    """Open the host-wide store for one kind of data, or None when shared memory is not configured
+
+    Workers find each other's stores by SHARED_MEMORY_NAME, which the multi-worker entry point in
+    main.py sets before starting them.
+    """
+    if not settings.SHARED_MEMORY_ENABLED or not settings.SHARED_MEMORY_NAME:
+        return None
+
+    directory = settings.SHARED_MEMORY_DIR or default_directory()
+    path = os.path.join(directory, f"{settings.SHARED_MEMORY_NAME}-{kind}")
+    try:
+        return SharedMemoryStore(path, slots, slot_bytes)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Shared memory store {path} unavailable, using per-worker state: {str(e)}")
+        return None
+
+def remove_shared_stores(name: str, directory: Optional[str] = None):
+    """Delete the files of every store under a name, once no worker uses them any more"""
+    directory = directory or default_directory()
+    prefix = f"{name}-"
+    for entry in os.listdir(directory):
+        if entry.startswith(prefix):
+            try:
+                os.unlink(os.path.join(directory, entry))
+            except OSError:
+                pass
@@ -0,0 +1,226 @@
+import re
+import zlib
+from collections import OrderedDict
+from itertools import combinations
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from app.core.config import settings
+from app.services.cache import normalize_url
+
+FINGERPRINT_BITS = 64
+SHINGLE_WORDS = 3
+BANDS = 3
+_MASK = (1 << FINGERPRINT_BITS) - 1
+
+_WORD_RE = re.compile(r"[^\W_]+")
+_DIGITS_RE = re.compile(r"\d+")
+
+def simhash(text: str, min_tokens: int = 0) -> Optional[int]:
+    """64-bit SimHash over word 3-gram shingles, or None for texts too short to fingerprint reliably
+
+    Digit runs are folded to one token so timestamps, counters and session IDs do not move the hash.
+    """
+    words = _WORD_RE.findall(_DIGITS_RE.sub("0", text.lower()))
+    if len(words) < max(min_tokens, SHINGLE_WORDS):
+        return None
+
+    # crc32 is stable across processes (unlike hash()); the mixing below removes its linearity
+    word_hashes: Dict[str, int] = {}
+    hashes = []
+    for word in words:
+        value = word_hashes.get(word)
+        if value is None:
+            encoded = word.encode()
+            value = word_hashes[word] = (zlib.crc32(encoded) << 32) | zlib.crc32(encoded, 0x9E3779B9)
+        hashes.append(value)
+
+    # Per-bit vote counts kept bit-sliced: counters[level] holds bit `level` of all 64 column counts,
+    # so adding a shingle is a few carry steps instead of 64 separate increments
+    counters: List[int] = []
+    for i in range(len(hashes) - SHINGLE_WORDS + 1):
+        value = (hashes[i] * 0x9E3779B97F4A7C15 ^ hashes[i + 1] * 0xC2B2AE3D27D4EB4F ^ hashes[i + 2]) & _MASK
+        value ^= value >> 31
+        value = (value * 0xBF58476D1CE4E5B9) & _MASK
+        value ^= value >> 29
+
+        level = 0
+        while value:
+            if level == len(counters):
+                counters.append(0)
+            carry = counters[level] & value
+            counters[level] ^= value
+            value = carry
+            level += 1
+
+    # Each output bit is the majority vote of that bit across shingles
+    half = (len(hashes) - SHINGLE_WORDS + 1) / 2
+    fingerprint = 0
+    for bit in range(FINGERPRINT_BITS):
+        count = 0
+        for level, counter in enumerate(counters):
+            count |= ((counter >> bit) & 1) << level
+        if count > half:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+def similarity_namespace(kind: str, url: str, intent: Optional[str] = None) -> str:
+    """Entries are only compared within one kind, domain and user intent"""
+    host = urlsplit(normalize_url(url)).netloc.removeprefix("www.")
+    return "\0".join([kind, host, (intent or "").strip().lower()])
+
+class SimilarityIndex:
+    """In-memory near-duplicate index over SimHash fingerprints
+
+    Fingerprints are split into 3 bands of 21-22 bits. Two fingerprints within max_distance bits
+    differ in at most max_distance // 3 bits of some band (pigeonhole), so a lookup probes each
+    band's value with up to that many bits flipped and only compares the entries found there,
+    instead of scanning the namespace.
+    """
+
+    def __init__(self, max_distance: int, max_entries: int, min_tokens: int = 0, enabled: bool = True):
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.min_tokens = min_tokens
+        self.enabled = enabled
+        self._bands = self._band_layout(BANDS)
+        self._probes = [self._probe_masks(mask.bit_length(), max_distance // BANDS) for _, mask in self._bands]
+        # Namespace -> id, and entries per id; a namespace is forgotten with its last entry, so both
+        # stay bounded by max_entries
+        self._namespaces: Dict[str, int] = {}
+        self._namespace_entries: Dict[int, Tuple[str, int]] = {}
+        self._next_namespace_id = 0
+        # key -> (namespace id, fingerprint), oldest first for eviction
+        self._entries: "OrderedDict[str, Tuple[int, int]]" = OrderedDict()
+        # Bucket ids pack (namespace id, band, band value) into one int, and buckets are tuples
+        # (almost all hold one key), to keep per-entry memory low
+        self._buckets: Dict[int, Tuple[str, ...]] = {}
+        self.stats: Dict[str, int] = {"lookups": 0, "hits": 0, "adds": 0, "evictions": 0, "candidates": 0}
+
+    def fingerprint(self, text: str) -> Optional[int]:
+        """Fingerprint page text, or None when it is too short to match safely"""
+        if not self.enabled:
+            return None
+        return simhash(text, self.min_tokens)
+
+    def find(self, namespace: str, fingerprint: Optional[int]) -> Optional[str]:
+        """Key of the nearest stored entry within max_distance, if any"""
+        namespace_id = self._namespaces.get(namespace)
+        if fingerprint is None or namespace_id is None:
+            return None
+
+        self.stats["lookups"] += 1
+        best_key, best_distance = None, self.max_distance + 1
+        seen = set()
+        for band, (shift, mask) in enumerate(self._bands):
+            value = (fingerprint >> shift) & mask
+            for probe in self._probes[band]:
+                for key in self._buckets.get(self._bucket_id(namespace_id, band, value ^ probe), ()):
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    distance = hamming(fingerprint, self._entries[key][1])
+                    if distance < best_distance:
+                        best_key, best_distance = key, distance
+
+        self.stats["candidates"] += len(seen)
+        if best_key is not None:
+            self.stats["hits"] += 1
+            self._entries.move_to_end(best_key)
+        return best_key
+
+    def add(self, namespace: str, fingerprint: Optional[int], key: str):
+        """Index an entry, evicting the least recently used ones when full"""
+        if fingerprint is None:
+            return
+
+        self.discard(key)
+        namespace_id = self._namespaces.get(namespace)
+        if namespace_id is None:
+            namespace_id = self._namespaces[namespace] = self._next_namespace_id
+            self._next_namespace_id += 1
+            self._namespace_entries[namespace_id] = (namespace, 0)
+        name, count = self._namespace_entries[namespace_id]
+        self._namespace_entries[namespace_id] = (name, count + 1)
+        self._entries[key] = (namespace_id, fingerprint)
+        for bucket in self._bucket_keys(namespace_id, fingerprint):
+            self._buckets[bucket] = self._buckets.get(bucket, ()) + (key,)
+        self.stats["adds"] += 1
+
+        while len(self._entries) > self.max_entries:
+            self.discard(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+    def discard(self, key: str):
+        """Remove an entry, e.g. once its cached value has expired"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+
+        for bucket in self._bucket_keys(*entry):
+            keys = tuple(other for other in self._buckets[bucket] if other != key)
+            if keys:
+                self._buckets[bucket] = keys
+            else:
+                del self._buckets[bucket]
+
+        namespace_id = entry[0]
+        name, count = self._namespace_entries[namespace_id]
+        if count > 1:
+            self._namespace_entries[namespace_id] = (name, count - 1)
+        else:
+            del self._namespace_entries[namespace_id]
+            del self._namespaces[name]
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["lookups"]
+        return {
+            **self.stats,
+            "hit_ratio": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "namespaces": len(self._namespaces),
+            "max_distance": self.max_distance,
+            "enabled": self.enabled,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _bucket_keys(self, namespace_id: int, fingerprint: int) -> List[int]:
+        return [
+            self._bucket_id(namespace_id, band, (fingerprint >> shift) & mask)
+            for band, (shift, mask) in enumerate(self._bands)
+        ]
+
+    @staticmethod
+    def _bucket_id(namespace_id: int, band: int, value: int) -> int:
+        return (namespace_id << 26) | (band << 24) | value
+
+    @staticmethod
+    def _band_layout(count: int) -> List[Tuple[int, int]]:
+        """(shift, mask) for each band; the last band takes any leftover bits"""
+        width = FINGERPRINT_BITS // count
+        layout = []
+        for band in range(count):
+            bits = width if band < count - 1 else FINGERPRINT_BITS - width * (count - 1)
+            layout.append((band * width, (1 << bits) - 1))
+        return layout
+
+    @staticmethod
+    def _probe_masks(width: int, radius: int) -> List[int]:
+        """Every XOR mask over a band of `width` bits with at most `radius` bits set"""
+        masks = [0]
+        for flips in range(1, radius + 1):
+            masks.extend(sum(1 << bit for bit in bits) for bits in combinations(range(width), flips))
+        return masks
+
+# Process-wide near-duplicate index, pointing at entries in the result cache
+similarity_index = SimilarityIndex(
+    max_distance=settings.SIMILARITY_MAX_DISTANCE,
+    max_entries=settings.SIMILARITY_MAX_ENTRIES,
+    min_tokens=settings.SIMILARITY_MIN_TOKENS,
+    enabled=settings.SIMILARITY_CACHE_ENABLED,
+)
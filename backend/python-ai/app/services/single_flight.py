@@ -0,0 +1,61 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+class _Call:
+    """One in-flight upstream call and the number of callers waiting on it"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key onto a single shared task
+
+    The shared task keeps running while at least one caller is waiting for it. When the last
+    waiter is cancelled (for example because its client disconnected) the task is cancelled too.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self.stats: Dict[str, int] = {
+            "calls": 0,
+            "coalesced": 0,
+            "cancelled": 0,
+        }
+
+    async def do(self, key: str, func: Callable[[], Awaitable[T]]) -> T:
+        """Run func for key, or join the call already in flight for the same key"""
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.create_task(func()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _, key=key, call=call: self._forget(key, call))
+            self.stats["calls"] += 1
+        else:
+            self.stats["coalesced"] += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Nobody is left to receive the result
+                self._forget(key, call)
+                call.task.cancel()
+                self.stats["cancelled"] += 1
+
+    def in_flight(self) -> int:
+        """Number of distinct upstream calls currently running"""
+        return len(self._calls)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get call counters; coalesced calls are the upstream requests saved"""
+        return {**self.stats, "saved_calls": self.stats["coalesced"], "in_flight": self.in_flight()}
+
+    def _forget(self, key: str, call: _Call):
+        """Drop a finished or abandoned call so later requests start fresh"""
+        if self._calls.get(key) is call:
+            del self._calls[key]
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.services.cache import ResultCache, result_cache
+
+logger = logging.getLogger(__name__)
+
+class SuggestionStore:
+    """Holds suggestion tasks that missed their response deadline so clients can fetch them later
+
+    With a result cache shared by several workers, pending IDs and finished suggestions are also
+    published there, so the follow-up request can land on any worker.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, cache: Optional[ResultCache] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.cache = cache
+        self._entries: "OrderedDict[str, Tuple[float, asyncio.Task]]" = OrderedDict()
+        self._publishing: Set["asyncio.Task[None]"] = set()
+
+    async def resolve(
+        self,
+        task: "asyncio.Task[List[str]]",
+        started: float,
+        deadline: Optional[float] = None
+    ) -> Tuple[Optional[List[str]], Optional[str]]:
+        """Wait for suggestions until the deadline, otherwise park the task and return its ID"""
+        deadline = settings.SUGGESTIONS_DEADLINE_SECONDS if deadline is None else deadline
+        remaining = deadline - (time.perf_counter() - started)
+
+        try:
+            done, _ = await asyncio.wait({task}, timeout=max(remaining, 0))
+        except asyncio.CancelledError:
+            # The response was abandoned, so nobody will read the suggestions
+            task.cancel()
+            raise
+        if task in done:
+            return self._result(task), None
+
+        return None, self.add(task)
+
+    def add(self, task: "asyncio.Task[List[str]]") -> str:
+        """Track a pending suggestion task and return its ID"""
+        self._evict()
+
+        suggestions_id = uuid.uuid4().hex
+        self._entries[suggestions_id] = (time.monotonic(), task)
+
+        while len(self._entries) > self.max_entries:
+            _, (_, oldest) = self._entries.popitem(last=False)
+            oldest.cancel()
+
+        if self.cache is not None and self.cache.is_shared():
+            publishing = asyncio.create_task(self._publish(suggestions_id, task))
+            self._publishing.add(publishing)
+            publishing.add_done_callback(self._publishing.discard)
+
+        return suggestions_id
+
+    async def get(self, suggestions_id: str) -> Optional[Dict[str, Any]]:
+        """Get the status and, when finished, the suggestions for an ID"""
+        self._evict()
+
+        entry = self._entries.get(suggestions_id)
+        if entry is None:
+            return await self._get_shared(suggestions_id)
+
+        _, task = entry
+        if not task.done():
+            return {"status": "pending", "suggestions": None}
+
+        suggestions = self._result(task)
+        if suggestions is None:
+            return {"status": "failed", "suggestions": None}
+
+        return {"status": "ready", "suggestions": suggestions}
+
+    async def _publish(self, suggestions_id: str, task: "asyncio.Task[List[str]]"):
+        """Share an entry's pending status, then its outcome, with the other workers"""
+        await self.cache.set(f"aiwatch:suggestions_pending:{suggestions_id}", True, self.ttl_seconds)
+        await asyncio.wait({task})
+
+        suggestions = self._result(task)
+        result = {"status": "ready" if suggestions is not None else "failed", "suggestions": suggestions}
+        await self.cache.set(f"aiwatch:suggestions_result:{suggestions_id}", result, self.ttl_seconds)
+
+    async def _get_shared(self, suggestions_id: str) -> Optional[Dict[str, Any]]:
+        """Look an ID another worker handed out up in the shared cache"""
+        if self.cache is None or not self.cache.is_shared():
+            return None
+
+        # The outcome is written once under its own key, so a cached pending status never hides it
+        result = await self.cache.get(f"aiwatch:suggestions_result:{suggestions_id}")
+        if result is not None:
+            return result
+        if await self.cache.get(f"aiwatch:suggestions_pending:{suggestions_id}"):
+            return {"status": "pending", "suggestions": None}
+        return None
+
+    def _result(self, task: "asyncio.Task[List[str]]") -> Optional[List[str]]:
+        """Read a finished task's suggestions, treating errors as no result"""
+        if task.cancelled():
+            return None
+
+        try:
+            return task.result()
+        except Exception as e:
+            logger.warning(f"Failed to generate suggestions: {str(e)}")
+            return None
+
+    def _evict(self):
+        """Drop entries older than the TTL"""
+        cutoff = time.monotonic() - self.ttl_seconds
+        while self._entries:
+            suggestions_id, (created, task) = next(iter(self._entries.items()))
+            if created >= cutoff:
+                break
+            del self._entries[suggestions_id]
+            task.cancel()
+
+# Process-wide store for suggestions delivered after their response
+suggestion_store = SuggestionStore(
+    max_entries=settings.SUGGESTIONS_MAX_PENDING,
+    ttl_seconds=settings.SUGGESTIONS_RESULT_TTL_SECONDS,
+    cache=result_cache,
+)
+
+def get_suggestion_store() -> SuggestionStore:
+    """FastAPI dependency returning the shared suggestion store"""
+    return suggestion_store
@@ -0,0 +1,559 @@
+import asyncio
+import json
+import logging
+import math
+import time
+import uuid
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi.requests import HTTPConnection
+
+from app.core.config import settings
+from app.services.cache import LRUCache
+from app.services.context_packer import estimate_tokens
+from app.services.metrics import token_estimate_ratio
+from app.services.persistence import PersistenceWriter, persistence_writer
+from app.services.resilience import ClaudeServiceError
+
+logger = logging.getLogger(__name__)
+
+TIERS = ("free", "pro", "enterprise")
+
+# Framing the API adds around each message and each tool definition
+MESSAGE_OVERHEAD_TOKENS = 4
+TOOL_OVERHEAD_TOKENS = 20
+
+# Actual over estimated input tokens, smoothed per model; bounded so one odd response cannot swing it
+CALIBRATION_WEIGHT = 0.05
+CALIBRATION_MIN = 0.5
+CALIBRATION_MAX = 3.0
+
+# Long texts repeat across turns and retries (system prompt, page block, history), so their estimates are kept
+MEMO_MIN_CHARS = 1024
+MEMO_MAX_ENTRIES = 4096
+
+# Loading a user's tier and usage may hold up a request this long; failed loads are retried after RETRY_LOAD_SECONDS
+LOAD_TIMEOUT_SECONDS = 0.5
+RETRY_LOAD_SECONDS = 30.0
+
+SELECT_USER = "SELECT subscription_tier, usage_stats FROM users WHERE id = $1"
+
+def _this_month(key: str) -> str:
+    """A stored monthly counter, or 0 once the month it was counted in is over"""
+    return (
+        f"CASE WHEN u.usage_stats->>'usage_month' = d.month "
+        f"THEN COALESCE((u.usage_stats->>'{key}')::bigint, 0) ELSE 0 END"
+    )
+
+# Adds each user's unwritten usage to the stored counters and reads back the totals, which include other workers
+UPDATE_USAGE = f"""
+    UPDATE users AS u
+    SET usage_stats = COALESCE(u.usage_stats, '{{}}'::jsonb) || jsonb_build_object(
+            'usage_month', d.month,
+            'input_tokens_this_month', {_this_month('input_tokens_this_month')} + d.input_tokens,
+            'output_tokens_this_month', {_this_month('output_tokens_this_month')} + d.output_tokens,
+            'tokens_this_month', {_this_month('tokens_this_month')} + d.input_tokens + d.output_tokens,
+            'messages_this_month', {_this_month('messages_this_month')} + d.messages,
+            'last_active', d.last_active
+        ),
+        updated_at = NOW()
+    FROM unnest($1::uuid[], $2::text[], $3::bigint[], $4::bigint[], $5::bigint[], $6::timestamptz[])
+        AS d(id, month, input_tokens, output_tokens, messages, last_active)
+    WHERE u.id = d.id
+    RETURNING u.id, u.subscription_tier, (u.usage_stats->>'tokens_this_month')::bigint
+"""
+
+class RequestTooLargeError(ClaudeServiceError):
+    """The estimated input is larger than any single Claude call may be"""
+    status_code = 413
+
+class TokenBudgetExceeded(ClaudeServiceError):
+    """The caller's token budget for this month is used up"""
+    status_code = 429
+
+@dataclass(frozen=True)
+class UsageAccount:
+    """The user whose budget a request's upstream calls are charged to"""
+    user_id: str
+    tier: Optional[str] = None
+
+@dataclass
+class UserUsage:
+    """One user's monthly token usage as seen by this worker"""
+    month: str
+    tier: str
+    # Stored in the users table: usage is written back and totals read from there
+    persistent: bool
+    # Monthly total last read from the database, every worker included
+    base: int = 0
+    # Charged here and not yet written
+    input_tokens: int = 0
+    output_tokens: int = 0
+    messages: int = 0
+    # Written by a flush that has not finished
+    flushing: int = 0
+    # Held by calls in flight
+    reserved: int = 0
+    last_active: Optional[datetime] = None
+    refresh_at: float = 0.0
+
+    @property
+    def used(self) -> int:
+        return self.base + self.flushing + self.input_tokens + self.output_tokens
+
+    @property
+    def unflushed(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+@dataclass
+class TokenReservation:
+    """Tokens held for one upstream call until its real usage is known"""
+    task: str
+    model: str
+    # Raw estimate of the input, and the same after calibration
+    raw_tokens: int
+    estimated_tokens: int
+    # Output allowed for the call, lowered when the budget cannot cover the requested max_tokens
+    max_tokens: int
+    user_id: Optional[str] = None
+    reserved: int = 0
+    settled: bool = field(default=False, repr=False)
+
+# Set per request by apply_usage_account
+_account: ContextVar[Optional[UsageAccount]] = ContextVar("usage_account", default=None)
+
+def current_account() -> Optional[UsageAccount]:
+    """The account of the current request, or None when the caller is not identified"""
+    return _account.get()
+
+def current_user_id() -> Optional[str]:
+    """The users.id the current request was made for, as passed by the trusted gateway"""
+    account = _account.get()
+    return account.user_id if account is not None else None
+
+def current_month() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m")
+
+def seconds_until_next_month() -> float:
+    now = datetime.now(timezone.utc)
+    year, month = (now.year + 1, 1) if now.month == 12 else (now.year, now.month + 1)
+    return (datetime(year, month, 1, tzinfo=timezone.utc) - now).total_seconds()
+
+class TokenBudgets:
+    """Token estimates before every upstream call, and monthly token budgets per user by subscription tier
+
+    Every call is estimated locally before it is sent: one above max_request_tokens is refused, and a
+    budgeted user's call must fit what is left of their month, with max_tokens lowered when only the
+    reply would not fit. The estimate is held while the call runs, then replaced by the usage Claude
+    reports, and the ratio of the two calibrates later estimates per model.
+
+    Usage is counted in memory. A background task adds it to users.usage_stats every flush_interval
+    in one statement and reads back each user's total, so budgets converge across workers without a
+    database round trip per call.
+    """
+
+    def __init__(
+        self,
+        budgets: Dict[str, int],
+        default_tier: str = "free",
+        max_request_tokens: int = 20000,
+        min_output_tokens: int = 256,
+        writer: Optional[PersistenceWriter] = None,
+        flush_interval: float = 10.0,
+        refresh_seconds: float = 300.0,
+        max_accounts: int = 100000,
+        enabled: bool = True
+    ):
+        self.budgets = budgets
+        self.default_tier = default_tier if default_tier in TIERS else "free"
+        self.max_request_tokens = max_request_tokens
+        self.min_output_tokens = min_output_tokens
+        self.writer = writer
+        self.flush_interval = flush_interval
+        self.refresh_seconds = refresh_seconds
+        self.max_accounts = max_accounts
+        self.enabled = enabled
+
+        self.calibration: Dict[str, float] = {}
+        self.charged_by_tier: Dict[str, int] = {tier: 0 for tier in TIERS}
+        self._usage: Dict[str, UserUsage] = {}
+        self._memo = LRUCache(max_entries=MEMO_MAX_ENTRIES, ttl_seconds=3600)
+        self._task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, Any] = {
+            "reserved": 0,
+            "too_large": 0,
+            "budget_exceeded": 0,
+            "output_trimmed": 0,
+            "reconciled": 0,
+            "adjusted_tokens": 0,
+            "estimated_input_tokens": 0,
+            "actual_input_tokens": 0,
+            "flushes": 0,
+            "flush_errors": 0,
+            "last_error": None,
+        }
+
+    @property
+    def persistent(self) -> bool:
+        return self.writer is not None and self.writer.enabled
+
+    def estimate(self, params: Dict[str, Any]) -> int:
+        """Raw estimate of the input tokens of a messages.create call"""
+        system = params.get("system")
+        if isinstance(system, str):
+            tokens = self._estimate_text(system)
+        else:
+            tokens = sum(self._estimate_text(block.get("text", "")) for block in system or [])
+
+        for msg in params.get("messages", []):
+            content = msg["content"]
+            if isinstance(content, str):
+                tokens += self._estimate_text(content)
+            else:
+                tokens += sum(self._estimate_text(block.get("text", "")) for block in content)
+            tokens += MESSAGE_OVERHEAD_TOKENS
+
+        for tool in params.get("tools") or []:
+            tokens += self._estimate_text(json.dumps(tool)) + TOOL_OVERHEAD_TOKENS
+
+        return tokens
+
+    def _estimate_text(self, text: str) -> int:
+        if len(text) < MEMO_MIN_CHARS:
+            return estimate_tokens(text)
+        key = f"{hash(text)}:{len(text)}"
+        tokens = self._memo.get(key)
+        if tokens is None:
+            tokens = estimate_tokens(text)
+            self._memo.set(key, tokens)
+        return tokens
+
+    def calibrated(self, model: str, raw_tokens: int) -> int:
+        """A raw estimate corrected by what this model has reported so far"""
+        return int(math.ceil(raw_tokens * self.calibration.get(model, 1.0)))
+
+    def reserve(self, task: str, params: Dict[str, Any]) -> TokenReservation:
+        """Estimate a call and hold its tokens against the caller's budget, or refuse it"""
+        model = params["model"]
+        max_tokens = params["max_tokens"]
+        raw = self.estimate(params)
+        estimated = self.calibrated(model, raw)
+
+        if self.max_request_tokens > 0 and estimated > self.max_request_tokens:
+            self.stats["too_large"] += 1
+            raise RequestTooLargeError(
+                f"Request is too large: about {estimated} input tokens, the limit is {self.max_request_tokens}"
+            )
+
+        reservation = TokenReservation(task, model, raw, estimated, max_tokens)
+        account = current_account()
+        self.stats["reserved"] += 1
+        if account is None or not self.enabled:
+            return reservation
+
+        usage = self._usage.get(account.user_id)
+        if usage is None:
+            return reservation
+        self._roll_month(usage)
+
+        budget = self.budgets.get(usage.tier, 0)
+        if budget > 0:
+            remaining = budget - usage.used - usage.reserved
+            if remaining < estimated + min(self.min_output_tokens, max_tokens):
+                self.stats["budget_exceeded"] += 1
+                raise TokenBudgetExceeded(
+                    f"Monthly token budget of the {usage.tier} plan is used up",
+                    retry_after=seconds_until_next_month()
+                )
+            if remaining - estimated < max_tokens:
+                self.stats["output_trimmed"] += 1
+                reservation.max_tokens = remaining - estimated
+
+        reservation.user_id = account.user_id
+        reservation.reserved = estimated + reservation.max_tokens
+        usage.reserved += reservation.reserved
+        return reservation
+
+    def settle(self, reservation: TokenReservation, usage: Any = None):
+        """Charge a finished call by the usage Claude reported, or by its input estimate when there is none"""
+        if usage is None:
+            self.charge(reservation, reservation.estimated_tokens, 0)
+            return
+
+        actual_input = (
+            (usage.input_tokens or 0)
+            + (getattr(usage, "cache_creation_input_tokens", None) or 0)
+            + (getattr(usage, "cache_read_input_tokens", None) or 0)
+        )
+        self._reconcile(reservation, actual_input)
+        self.charge(reservation, actual_input, usage.output_tokens or 0)
+
+    def charge(self, reservation: TokenReservation, input_tokens: int, output_tokens: int):
+        """Replace a reservation with the tokens actually used"""
+        if reservation.settled:
+            return
+        reservation.settled = True
+        usage = self._usage.get(reservation.user_id) if reservation.user_id else None
+        if usage is None:
+            return
+
+        usage.reserved = max(usage.reserved - reservation.reserved, 0)
+        self._roll_month(usage)
+        if not input_tokens and not output_tokens:
+            return
+        usage.input_tokens += input_tokens
+        usage.output_tokens += output_tokens
+        if reservation.task == "chat":
+            usage.messages += 1
+        usage.last_active = datetime.now(timezone.utc)
+        self.charged_by_tier[usage.tier] = self.charged_by_tier.get(usage.tier, 0) + input_tokens + output_tokens
+
+    async def adjust(self, user_id: str, month: str, input_tokens: int, output_tokens: int):
+        """Correct tokens charged to a user earlier in the month, e.g. a batch charged from its estimates
+
+        Negative amounts give tokens back. Corrections for a month that is over are dropped along
+        with that month's usage.
+        """
+        if not input_tokens and not output_tokens:
+            return
+        await self.account(user_id)
+        usage = self._usage.get(user_id)
+        if usage is None:
+            return
+        self._roll_month(usage)
+        if usage.month != month:
+            return
+
+        usage.input_tokens += input_tokens
+        usage.output_tokens += output_tokens
+        self.stats["adjusted_tokens"] += input_tokens + output_tokens
+        if input_tokens + output_tokens > 0:
+            # The per-tier counter only grows; refunds show in adjusted_tokens
+            self.charged_by_tier[usage.tier] = self.charged_by_tier.get(usage.tier, 0) + input_tokens + output_tokens
+
+    def release(self, reservation: TokenReservation):
+        """Drop a reservation without charging, for calls that failed before Claude did any work"""
+        self.charge(reservation, 0, 0)
+
+    def _reconcile(self, reservation: TokenReservation, actual_input: int):
+        if not reservation.raw_tokens or not actual_input:
+            return
+        self.stats["reconciled"] += 1
+        self.stats["estimated_input_tokens"] += reservation.estimated_tokens
+        self.stats["actual_input_tokens"] += actual_input
+        token_estimate_ratio.labels(reservation.model).observe(actual_input / max(reservation.estimated_tokens, 1))
+
+        ratio = min(max(actual_input / reservation.raw_tokens, CALIBRATION_MIN), CALIBRATION_MAX)
+        current = self.calibration.get(reservation.model)
+        self.calibration[reservation.model] = ratio if current is None else current + CALIBRATION_WEIGHT * (ratio - current)
+
+    def _roll_month(self, usage: UserUsage):
+        month = current_month()
+        if usage.month != month:
+            # Unwritten usage of the previous month is dropped with it
+            usage.month = month
+            usage.base = usage.input_tokens = usage.output_tokens = usage.messages = 0
+
+    async def account(self, user_id: str, tier: Optional[str] = None) -> UsageAccount:
+        """The account of a user, loading their tier and monthly total when unknown or stale"""
+        tier = tier if tier in TIERS else None
+        usage = self._usage.get(user_id)
+        if usage is None or usage.refresh_at <= time.monotonic():
+            usage = await self._load(user_id, usage)
+        if tier and usage.tier != tier:
+            usage.tier = tier
+        return UsageAccount(user_id, usage.tier)
+
+    async def _load(self, user_id: str, usage: Optional[UserUsage]) -> UserUsage:
+        try:
+            user_uuid = uuid.UUID(user_id)
+        except ValueError:
+            user_uuid = None
+
+        persistent = user_uuid is not None and self.persistent
+        loaded: Optional[Tuple[str, int]] = None
+        failed = False
+        if persistent:
+            try:
+                loaded = await asyncio.wait_for(self._select_user(user_uuid), timeout=LOAD_TIMEOUT_SECONDS)
+            except Exception as e:
+                failed = True
+                logger.warning(f"Loading token usage of user {user_id} failed: {str(e)}")
+
+        # Another request may have created the entry while this one waited on the database
+        current = self._usage.get(user_id) or usage
+        if current is None:
+            if len(self._usage) >= self.max_accounts:
+                self._prune(force=True)
+            current = UserUsage(month=current_month(), tier=self.default_tier, persistent=persistent)
+            self._usage[user_id] = current
+
+        if loaded is not None:
+            current.tier, current.base = loaded
+        elif persistent and not failed:
+            # Not in the users table: counted here only
+            current.persistent = False
+        current.refresh_at = time.monotonic() + (RETRY_LOAD_SECONDS if failed else self.refresh_seconds)
+        self._usage[user_id] = current
+        return current
+
+    async def _select_user(self, user_id: uuid.UUID) -> Optional[Tuple[str, int]]:
+        pool = await self.writer.get_pool()
+        row = await pool.fetchrow(SELECT_USER, user_id)
+        if row is None:
+            return None
+
+        stats = row["usage_stats"] or {}
+        if isinstance(stats, str):
+            stats = json.loads(stats)
+        base = int(stats.get("tokens_this_month") or 0) if stats.get("usage_month") == current_month() else 0
+        tier = row["subscription_tier"] if row["subscription_tier"] in TIERS else self.default_tier
+        return tier, base
+
+    async def start(self):
+        """Start writing usage back periodically"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush_once()
+            except Exception as e:
+                self.stats["flush_errors"] += 1
+                self.stats["last_error"] = str(e)
+                logger.warning(f"Token usage flush failed, retrying in {self.flush_interval}s: {str(e)}")
+            self._prune()
+
+    async def flush_once(self) -> int:
+        """Write every user's unwritten usage in one statement, returning the number of users written"""
+        if not self.persistent:
+            return 0
+
+        batch: List[Tuple[str, UserUsage, int, int, int]] = []
+        for user_id, usage in self._usage.items():
+            if usage.persistent and (usage.unflushed or usage.messages):
+                batch.append((user_id, usage, usage.input_tokens, usage.output_tokens, usage.messages))
+        if not batch:
+            return 0
+
+        rows = []
+        for user_id, usage, input_tokens, output_tokens, messages in batch:
+            rows.append((uuid.UUID(user_id), usage.month, input_tokens, output_tokens, messages, usage.last_active))
+            usage.flushing = input_tokens + output_tokens
+            usage.input_tokens = usage.output_tokens = usage.messages = 0
+
+        try:
+            pool = await self.writer.get_pool()
+            returned = await pool.fetch(UPDATE_USAGE, *[list(column) for column in zip(*rows)])
+        except BaseException:
+            for _, usage, input_tokens, output_tokens, messages in batch:
+                usage.flushing = 0
+                usage.input_tokens += input_tokens
+                usage.output_tokens += output_tokens
+                usage.messages += messages
+            raise
+
+        totals = {str(row[0]): (row[1], row[2]) for row in returned}
+        for user_id, usage, _, _, _ in batch:
+            written = usage.flushing
+            usage.flushing = 0
+            if user_id not in totals:
+                # Deleted since it was loaded; keep counting here
+                usage.persistent = False
+                usage.base += written
+                continue
+            tier, total = totals[user_id]
+            usage.base = total or 0
+            if tier in TIERS:
+                usage.tier = tier
+
+        self.stats["flushes"] += 1
+        return len(batch)
+
+    def _prune(self, force: bool = False):
+        """Forget users with nothing unwritten or in flight whose loaded state is stale, or all such users when forced"""
+        now = time.monotonic()
+        idle = [
+            user_id for user_id, usage in self._usage.items()
+            if not (usage.unflushed or usage.messages or usage.reserved or usage.flushing)
+            and (force or usage.refresh_at <= now)
+        ]
+        for user_id in idle:
+            del self._usage[user_id]
+
+    def unflushed_tokens(self) -> int:
+        return sum(usage.unflushed + usage.flushing for usage in self._usage.values())
+
+    def get_stats(self) -> Dict[str, Any]:
+        estimated = self.stats["estimated_input_tokens"]
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "persistent": self.persistent,
+            "accounts": len(self._usage),
+            "unflushed_tokens": self.unflushed_tokens(),
+            "estimate_ratio": round(self.stats["actual_input_tokens"] / estimated, 3) if estimated else None,
+            "calibration": {model: round(factor, 3) for model, factor in self.calibration.items()},
+            "charged_by_tier": dict(self.charged_by_tier),
+        }
+
+    async def close(self):
+        """Stop the periodic task and write what is left"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        try:
+            await self.flush_once()
+        except Exception as e:
+            logger.error(f"Final token usage flush failed, {self.unflushed_tokens()} tokens not written: {str(e)}")
+
+def create_token_budgets() -> TokenBudgets:
+    """Create the token budget tracker configured by settings"""
+    return TokenBudgets(
+        {
+            "free": settings.TOKEN_BUDGET_FREE,
+            "pro": settings.TOKEN_BUDGET_PRO,
+            "enterprise": settings.TOKEN_BUDGET_ENTERPRISE,
+        },
+        default_tier=settings.TOKEN_BUDGET_DEFAULT_TIER,
+        max_request_tokens=settings.REQUEST_MAX_INPUT_TOKENS,
+        min_output_tokens=settings.TOKEN_BUDGET_MIN_OUTPUT_TOKENS,
+        writer=persistence_writer,
+        flush_interval=settings.USAGE_FLUSH_INTERVAL_SECONDS,
+        refresh_seconds=settings.USAGE_REFRESH_SECONDS,
+        max_accounts=settings.USAGE_MAX_ACCOUNTS,
+        enabled=settings.TOKEN_BUDGETS_ENABLED,
+    )
+
+# Process-wide budget tracker
+token_budgets = create_token_budgets()
+
+def get_token_budgets() -> TokenBudgets:
+    """Dependency to get the token budget tracker"""
+    return token_budgets
+
+async def apply_usage_account(connection: HTTPConnection):
+    """FastAPI dependency identifying the user whose token budget a request draws on
+
+    The user comes from USAGE_USER_HEADER, set by a trusted gateway; without it calls are still
+    estimated and size-checked, but no budget applies.
+    """
+    if not settings.USAGE_USER_HEADER:
+        return
+    user_id = connection.headers.get(settings.USAGE_USER_HEADER)
+    if not user_id:
+        return
+
+    tier = connection.headers.get(settings.USAGE_TIER_HEADER) if settings.USAGE_TIER_HEADER else None
+    # Dependencies run in the request's context, so the account stays set for the endpoint
+    _account.set(await token_budgets.account(user_id, tier))
@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Deque, Dict, Iterator, List, Optional, TypeVar
+
+from fastapi.requests import HTTPConnection, Request
+
+from app.core.config import settings
+from app.services.metrics import upstream_queue_wait
+from app.services.rate_limiter import RateLimitExceeded, get_client_id
+from app.services.resilience import ClaudeServiceError, UpstreamTimeoutError
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Scheduling classes, served strictly in this order
+PRIORITIES = ("interactive", "background", "prefetch")
+
+# The class of each Claude task unless the caller set one
+TASK_PRIORITIES = {
+    "chat": "interactive",
+    "analysis": "background",
+    "suggestions": "background",
+}
+
+# Priority class set for the current request or block, overriding the task's default
+_priority: ContextVar[Optional[str]] = ContextVar("upstream_priority", default=None)
+
+class ClientDisconnected(ClaudeServiceError):
+    """The client went away before its work finished; nobody receives the response"""
+    status_code = 499
+
+class WorkSuperseded(ClaudeServiceError):
+    """A newer request from the same tab replaced this one"""
+    status_code = 409
+
+@contextmanager
+def priority_scope(priority: str) -> Iterator[str]:
+    """Run a block's Claude calls in a priority class"""
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority: {priority}")
+
+    token = _priority.set(priority)
+    try:
+        yield priority
+    finally:
+        _priority.reset(token)
+
+def current_priority(task: str) -> str:
+    """Priority class for a Claude call of this task"""
+    return _priority.get() or TASK_PRIORITIES.get(task, "background")
+
+async def apply_request_priority(connection: HTTPConnection):
+    """FastAPI dependency running requests the browser marks as prefetches in the lowest class
+
+    Browsers send Sec-Purpose (older ones Purpose) on speculative requests; clients can only lower
+    their priority this way, never raise it.
+    """
+    if connection.scope["type"] != "http":
+        return
+
+    purpose = connection.headers.get("sec-purpose") or connection.headers.get("purpose") or ""
+    if "prefetch" in purpose.lower():
+        # Dependencies run in the request's context, so the class stays set for the endpoint
+        _priority.set("prefetch")
+
+class _Run:
+    """A request's work, and why it was cancelled if it was"""
+    __slots__ = ("task", "reason")
+
+    def __init__(self, task: "asyncio.Future[Any]"):
+        self.task = task
+        self.reason: Optional[str] = None
+
+class UpstreamScheduler:
+    """Bounds concurrent Claude calls and hands free slots out by priority class
+
+    A call takes a slot right away while one is free and nobody is queued. Otherwise it waits in
+    its class's FIFO queue, and each slot released goes to the oldest waiter of the highest class.
+    Slots are per worker process.
+    """
+
+    def __init__(self, max_slots: int, max_queue: int):
+        self.max_slots = max_slots
+        self.max_queue = max_queue
+        self.in_use = 0
+        self._queues: List[Deque["asyncio.Future[None]"]] = [deque() for _ in PRIORITIES]
+        self._tabs: Dict[str, _Run] = {}
+        self.stats: Dict[str, Dict[str, int]] = {
+            priority: {"admitted": 0, "queued": 0, "shed": 0, "timed_out": 0} for priority in PRIORITIES
+        }
+        self.cancelled: Dict[str, int] = {"disconnected": 0, "superseded": 0}
+
+    @asynccontextmanager
+    async def slot(self, priority: str, timeout: Optional[float] = None) -> AsyncIterator[None]:
+        """Hold an upstream slot for a block"""
+        await self.acquire(priority, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, priority: str, timeout: Optional[float] = None):
+        """Take a slot, waiting behind every queued call of the same or a higher class
+
+        Raises UpstreamTimeoutError when no slot frees up within timeout, and RateLimitExceeded
+        when the queue is full of calls that outrank this one.
+        """
+        rank = PRIORITIES.index(priority)
+        stats = self.stats[priority]
+
+        if self.max_slots <= 0 or (self.in_use < self.max_slots and not self.queued()):
+            self.in_use += 1
+            stats["admitted"] += 1
+            upstream_queue_wait.labels(priority).observe(0.0)
+            return
+
+        if timeout is not None and timeout <= 0:
+            stats["timed_out"] += 1
+            raise UpstreamTimeoutError("Request deadline exceeded while waiting for Claude")
+
+        if self.queued() >= self.max_queue:
+            self._make_room(rank)
+
+        waiter: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        self._queues[rank].append(waiter)
+        stats["queued"] += 1
+        started = time.perf_counter()
+
+        try:
+            await asyncio.wait((waiter,), timeout=timeout)
+        except BaseException:
+            self._abandon(rank, waiter)
+            raise
+
+        if not waiter.done():
+            self._abandon(rank, waiter)
+            stats["timed_out"] += 1
+            raise UpstreamTimeoutError("Request deadline exceeded while waiting for Claude")
+
+        # Raises if the call was displaced from the queue
+        waiter.result()
+        stats["admitted"] += 1
+        upstream_queue_wait.labels(priority).observe(time.perf_counter() - started)
+
+    def release(self):
+        """Return a slot, handing it straight to the next waiter if there is one"""
+        for queue in self._queues:
+            while queue:
+                waiter = queue.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    return
+        self.in_use -= 1
+
+    def queued(self) -> int:
+        """Calls waiting for a slot"""
+        return sum(len(queue) for queue in self._queues)
+
+    def queue_depths(self) -> Dict[str, int]:
+        return {priority: len(queue) for priority, queue in zip(PRIORITIES, self._queues)}
+
+    async def run(self, connection: Request, work: Awaitable[T]) -> T:
+        """Run a request's work, cancelling it if the client disconnects or its tab sends a newer request
+
+        Cancelling the work also cancels its Claude calls, whether they are queued or already running.
+        """
+        run = _Run(asyncio.ensure_future(work))
+        key = self._tab_key(connection)
+        if key is not None:
+            previous = self._tabs.get(key)
+            if previous is not None:
+                self._cancel(previous, "superseded")
+            self._tabs[key] = run
+
+        watcher = asyncio.create_task(self._watch_disconnect(connection, run))
+        try:
+            return await run.task
+        except asyncio.CancelledError:
+            if run.reason is None or not run.task.cancelled():
+                raise
+            if run.reason == "superseded":
+                raise WorkSuperseded("Superseded by a newer request from the same tab")
+            raise ClientDisconnected("Client disconnected before the response was ready")
+        finally:
+            watcher.cancel()
+            if key is not None and self._tabs.get(key) is run:
+                del self._tabs[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "max_slots": self.max_slots,
+            "in_use": self.in_use,
+            "queued": self.queue_depths(),
+            "priorities": self.stats,
+            "cancelled": self.cancelled,
+        }
+
+    def _make_room(self, rank: int):
+        """Displace the newest waiter of the lowest class below rank, or shed the newcomer"""
+        for lower in range(len(PRIORITIES) - 1, rank, -1):
+            queue = self._queues[lower]
+            if queue:
+                waiter = queue.pop()
+                self.stats[PRIORITIES[lower]]["shed"] += 1
+                waiter.set_exception(self._shed_error())
+                return
+
+        self.stats[PRIORITIES[rank]]["shed"] += 1
+        raise self._shed_error()
+
+    def _shed_error(self) -> RateLimitExceeded:
+        return RateLimitExceeded("The AI service is at capacity, please retry shortly", retry_after=1.0, scope="upstream")
+
+    def _abandon(self, rank: int, waiter: "asyncio.Future[None]"):
+        """Take a waiter that gave up out of its queue"""
+        if not waiter.done():
+            self._queues[rank].remove(waiter)
+            waiter.cancel()
+        elif not waiter.cancelled() and waiter.exception() is None:
+            # The slot was handed over just as the caller gave up, so pass it on
+            self.release()
+
+    def _cancel(self, run: _Run, reason: str):
+        if run.task.done() or run.reason is not None:
+            return
+        run.reason = reason
+        self.cancelled[reason] += 1
+        run.task.cancel()
+
+    async def _watch_disconnect(self, connection: Request, run: _Run):
+        """Wait for the client to go away; the request body has been read, so disconnect is the only message left"""
+        while True:
+            message = await connection.receive()
+            if message["type"] == "http.disconnect":
+                logger.debug(f"Client disconnected, cancelling {connection.url.path}")
+                self._cancel(run, "disconnected")
+                return
+
+    def _tab_key(self, connection: HTTPConnection) -> Optional[str]:
+        """Key shared by requests from one tab to one endpoint"""
+        if not settings.TAB_ID_HEADER:
+            return None
+        tab_id = connection.headers.get(settings.TAB_ID_HEADER)
+        if not tab_id:
+            return None
+        return f"{get_client_id(connection)}:{tab_id[:128]}:{connection.url.path}"
+
+# Process-wide scheduler for Claude calls
+upstream_scheduler = UpstreamScheduler(settings.UPSTREAM_MAX_CONCURRENCY, settings.UPSTREAM_SCHEDULER_MAX_QUEUE)
+
+def get_upstream_scheduler() -> UpstreamScheduler:
+    """FastAPI dependency returning the shared upstream scheduler"""
+    return upstream_scheduler
@@ -0,0 +1,121 @@
+"""Compare tokens sent per request before and after token-budget context packing.
+
+Usage (from backend/python-ai):
+    python -m benchmarks.context_packing [--corpus benchmarks/corpus] [--turns 4 12 30]
+
+For every saved page in the corpus, a chat request is built at several conversation lengths.
+"Before" reproduces the old fixed truncation (1000 characters of page content and the last
+10 history messages). "After" uses ContextPacker with the configured budget. Both are measured
+with the same local token estimator.
+"""
+
+import argparse
+import html
+import json
+import re
+from pathlib import Path
+from typing import Any, Dict, List
+
+from app.core.config import settings
+from app.services.claude_service import DEFAULT_SYSTEM_PROMPT
+from app.services.context_packer import ContextPacker, estimate_tokens
+
+CORPUS_DIR = Path(__file__).parent / "corpus"
+
+_TAG_RE = re.compile(r"<(script|style)\b.*?</\1>|<[^>]+>", re.S | re.I)
+_BLANK_RE = re.compile(r"[ \t]+")
+
+def load_corpus(corpus_dir: Path) -> List[Dict[str, Any]]:
+    """Load saved pages as the plain text a browser would report"""
+    index_path = corpus_dir / "index.json"
+    index = json.loads(index_path.read_text()) if index_path.exists() else {}
+
+    pages = []
+    for path in sorted(corpus_dir.glob("*.htm*")) + sorted(corpus_dir.glob("*.txt")):
+        raw = path.read_text(encoding="utf-8", errors="ignore")
+        text = raw if path.suffix == ".txt" else html.unescape(_TAG_RE.sub("\n", raw))
+        text = "\n".join(line for line in (_BLANK_RE.sub(" ", l).strip() for l in text.splitlines()) if line)
+        pages.append({
+            "name": path.name,
+            "url": index.get(path.name, {}).get("url", f"https://example.com/{path.stem}"),
+            "content": text,
+        })
+    return pages
+
+def make_history(turns: int) -> List[Dict[str, str]]:
+    """Build a synthetic conversation where assistant answers are much longer than questions"""
+    history = []
+    for turn in range(turns):
+        history.append({"role": "user", "content": f"Question {turn}: can you explain the part about section {turn}?"})
+        history.append({"role": "assistant", "content": f"Answer {turn}. " + "Here is a detailed explanation with examples. " * (20 + 15 * (turn % 4))})
+    return history
+
+def tokens_before(message: str, context: Dict[str, Any], history: List[Dict[str, str]]) -> Dict[str, int]:
+    """Token counts with the old fixed character truncation"""
+    page = "\n".join([
+        f"Current page: {context['url']}",
+        f"Page content: {context['content'][:1000]}...",
+    ])
+    kept = history[-10:]
+    return {
+        "system": estimate_tokens(DEFAULT_SYSTEM_PROMPT),
+        "message": estimate_tokens(message),
+        "page": estimate_tokens(page),
+        "history": sum(estimate_tokens(msg["content"]) for msg in kept),
+        "page_coverage": min(1000, len(context["content"])) / max(len(context["content"]), 1),
+    }
+
+def tokens_after(packer: ContextPacker, message: str, context: Dict[str, Any], history: List[Dict[str, str]]) -> Dict[str, int]:
+    """Token counts with the context packer"""
+    packed = packer.pack(message, context, history, DEFAULT_SYSTEM_PROMPT)
+    content_chars = len(packed.page) - len(f"Current page: {context['url']}\nPage content: ")
+    return {
+        **{key: value for key, value in packed.tokens.items() if key != "activity"},
+        "page_coverage": min(max(content_chars, 0), len(context["content"])) / max(len(context["content"]), 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", type=Path, default=CORPUS_DIR)
+    parser.add_argument("--turns", type=int, nargs="+", default=[0, 4, 12, 30])
+    parser.add_argument("--budget", type=int, default=settings.CONTEXT_TOKEN_BUDGET)
+    parser.add_argument("--output", type=Path, help="Write results as JSON")
+    args = parser.parse_args()
+
+    packer = ContextPacker(args.budget, settings.CONTEXT_PAGE_SHARE, settings.CONTEXT_ACTIVITY_SHARE)
+    message = "What are the most important things on this page?"
+    rows = []
+
+    for page in load_corpus(args.corpus):
+        context = {"url": page["url"], "content": page["content"]}
+        for turns in args.turns:
+            history = make_history(turns)
+            before = tokens_before(message, context, history)
+            after = tokens_after(packer, message, context, history)
+            rows.append({
+                "page": page["name"],
+                "turns": turns,
+                "before_total": sum(v for k, v in before.items() if k != "page_coverage"),
+                "after_total": sum(v for k, v in after.items() if k != "page_coverage"),
+                "before_page_coverage": round(before["page_coverage"], 3),
+                "after_page_coverage": round(after["page_coverage"], 3),
+            })
+
+    print(f"{'page':<26} {'turns':>5} {'before':>8} {'after':>8} {'cov before':>10} {'cov after':>10}")
+    for row in rows:
+        print(
+            f"{row['page']:<26} {row['turns']:>5} {row['before_total']:>8} {row['after_total']:>8} "
+            f"{row['before_page_coverage']:>10.1%} {row['after_page_coverage']:>10.1%}"
+        )
+
+    before_sum = sum(row["before_total"] for row in rows)
+    after_sum = sum(row["after_total"] for row in rows)
+    over_budget = sum(1 for row in rows if row["before_total"] > args.budget)
+    print(f"\nTotal tokens before: {before_sum}, after: {after_sum} (budget {args.budget}/request)")
+    print(f"Requests over budget before: {over_budget}/{len(rows)}, after: {sum(1 for r in rows if r['after_total'] > args.budget)}/{len(rows)}")
+
+    if args.output:
+        args.output.write_text(json.dumps({"budget": args.budget, "rows": rows}, indent=2))
+
+if __name__ == "__main__":
+    main()
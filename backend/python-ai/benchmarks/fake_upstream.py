@@ -0,0 +1,263 @@
+"""Local stand-in for the Anthropic Messages API, for load tests that must not spend real credits.
+
+Usage (from backend/python-ai):
+    python -m benchmarks.fake_upstream [--port 9911] [--latency 0.4] [--jitter 0.1]
+        [--tokens-per-second 80] [--output-tokens 120] [--error-rate 0.01] [--error-status 529]
+
+Point the service at it with ANTHROPIC_BASE_URL=http://127.0.0.1:9911 and any API key.
+
+Supported: model lookup (the startup probe), messages.create with and without streaming (text,
+or a tool_use block when tools are given, streamed as input_json_delta), and Message Batches,
+which end immediately. A response waits `latency` plus exponential `jitter` before its first
+byte, then produces output_tokens at tokens_per_second. A share of requests (`error_rate`) fails
+with `error_status`. The behaviour can be changed while running:
+
+    POST /control  {"latency": 1.0, "error_rate": 0.2}
+    GET  /control  current settings and request counters
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import asdict, dataclass, fields
+from typing import Any, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+SUGGESTION_LINES = [
+    "- Summarize the main points of this page",
+    "- Compare the options described here",
+    "- Explain the technical terms in simpler language",
+    "- Draft a short reply or note about this page",
+    "- Find the section that answers a specific question",
+]
+
+FILLER = (
+    "This page covers the topic in some depth, with examples and links to related material. "
+    "The key points are listed near the top and the details follow in later sections. "
+)
+
+ERROR_TYPES = {
+    429: "rate_limit_error",
+    500: "api_error",
+    503: "overloaded_error",
+    529: "overloaded_error",
+}
+
+@dataclass
+class FakeUpstreamConfig:
+    # Seconds before the first byte, plus an exponentially distributed extra with mean `jitter`
+    latency: float = 0.4
+    jitter: float = 0.1
+    # Generation speed and length of every response
+    tokens_per_second: float = 80.0
+    output_tokens: int = 120
+    input_tokens: int = 800
+    # Share of requests answered with error_status instead
+    error_rate: float = 0.0
+    error_status: int = 529
+
+    def update(self, values: Dict[str, Any]):
+        for field in fields(self):
+            if field.name in values:
+                setattr(self, field.name, type(getattr(self, field.name))(values[field.name]))
+
+def create_app(config: FakeUpstreamConfig) -> FastAPI:
+    app = FastAPI(title="Fake Anthropic upstream")
+    counters: Dict[str, int] = {"messages": 0, "streams": 0, "errors": 0, "batches": 0, "in_flight": 0, "max_in_flight": 0}
+    batches: Dict[str, List[Dict[str, Any]]] = {}
+
+    def first_byte_delay() -> float:
+        return config.latency + (random.expovariate(1 / config.jitter) if config.jitter > 0 else 0.0)
+
+    def generation_seconds(tokens: int) -> float:
+        return tokens / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+
+    def error_response() -> JSONResponse:
+        counters["errors"] += 1
+        status = config.error_status
+        headers = {"retry-after": "1"} if status == 429 else None
+        return JSONResponse(
+            {"type": "error", "error": {"type": ERROR_TYPES.get(status, "api_error"), "message": "Injected by the fake upstream"}},
+            status_code=status,
+            headers=headers,
+        )
+
+    def response_content(body: Dict[str, Any]) -> List[Dict[str, Any]]:
+        tools = body.get("tools")
+        if tools:
+            return [{
+                "type": "tool_use",
+                "id": f"toolu_{uuid.uuid4().hex[:24]}",
+                "name": tools[0]["name"],
+                "input": {
+                    "page_type": "documentation",
+                    "purpose": "Explains how to use the product and its API",
+                    "key_actions": ["Read the guide", "Copy the code samples", "Open the API reference"],
+                    "suggestions": [line[2:] for line in SUGGESTION_LINES[:3]],
+                    "insights": ["The reader is probably integrating the API", "The page is long and well structured"],
+                },
+            }]
+
+        # Roughly output_tokens worth of text (about 4 characters per token), led by a bulleted
+        # list so suggestion parsing works
+        text = "\n".join(SUGGESTION_LINES) + "\n\n"
+        while len(text) < config.output_tokens * 4:
+            text += FILLER
+        return [{"type": "text", "text": text[: max(config.output_tokens * 4, 1)]}]
+
+    def message(body: Dict[str, Any], content: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {
+            "id": f"msg_{uuid.uuid4().hex[:24]}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "claude-fake"),
+            "content": content,
+            "stop_reason": "tool_use" if content[0]["type"] == "tool_use" else "end_turn",
+            "stop_sequence": None,
+            "usage": {
+                "input_tokens": config.input_tokens,
+                "output_tokens": config.output_tokens,
+                "cache_creation_input_tokens": 0,
+                "cache_read_input_tokens": 0,
+            },
+        }
+
+    def sse(event: str, data: Dict[str, Any]) -> str:
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    async def stream_events(full: Dict[str, Any]):
+        block = full["content"][0]
+        start = dict(full, content=[], stop_reason=None, usage=dict(full["usage"], output_tokens=1))
+        yield sse("message_start", {"type": "message_start", "message": start})
+
+        if block["type"] == "tool_use":
+            yield sse("content_block_start", {"type": "content_block_start", "index": 0, "content_block": dict(block, input={})})
+            payload, delta_type, key = json.dumps(block["input"]), "input_json_delta", "partial_json"
+        else:
+            yield sse("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+            payload, delta_type, key = block["text"], "text_delta", "text"
+
+        # About 4 characters per token, sent in chunks of a few tokens at the configured speed
+        chunk_chars = 16
+        chunks = [payload[i:i + chunk_chars] for i in range(0, len(payload), chunk_chars)] or [""]
+        interval = generation_seconds(config.output_tokens) / len(chunks)
+        started = time.perf_counter()
+        for number, chunk in enumerate(chunks):
+            delay = started + number * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield sse("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": {"type": delta_type, key: chunk}})
+
+        yield sse("content_block_stop", {"type": "content_block_stop", "index": 0})
+        yield sse("message_delta", {
+            "type": "message_delta",
+            "delta": {"stop_reason": full["stop_reason"], "stop_sequence": None},
+            "usage": {"output_tokens": full["usage"]["output_tokens"]},
+        })
+        yield sse("message_stop", {"type": "message_stop"})
+
+    async def tracked_stream(full: Dict[str, Any]):
+        try:
+            async for event in stream_events(full):
+                yield event
+        finally:
+            counters["in_flight"] -= 1
+
+    @app.get("/v1/models/{model_id}")
+    async def get_model(model_id: str):
+        return {"id": model_id, "type": "model", "display_name": model_id, "created_at": "2024-10-22T00:00:00Z"}
+
+    @app.post("/v1/messages")
+    async def create_message(request: Request):
+        body = await request.json()
+        counters["messages"] += 1
+        counters["in_flight"] += 1
+        counters["max_in_flight"] = max(counters["max_in_flight"], counters["in_flight"])
+        try:
+            await asyncio.sleep(first_byte_delay())
+            if random.random() < config.error_rate:
+                return error_response()
+
+            full = message(body, response_content(body))
+            if body.get("stream"):
+                counters["streams"] += 1
+                # The stream decrements in_flight itself when it ends
+                counters["in_flight"] += 1
+                return StreamingResponse(tracked_stream(full), media_type="text/event-stream")
+
+            await asyncio.sleep(generation_seconds(config.output_tokens))
+            return JSONResponse(full)
+        finally:
+            counters["in_flight"] -= 1
+
+    def batch_status(request: Request, batch_id: str) -> Dict[str, Any]:
+        return {
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": "ended",
+            "request_counts": {"processing": 0, "succeeded": len(batches[batch_id]), "errored": 0, "canceled": 0, "expired": 0},
+            "created_at": "2024-10-22T00:00:00Z",
+            "ended_at": "2024-10-22T00:01:00Z",
+            "expires_at": "2024-10-23T00:00:00Z",
+            "archived_at": None,
+            "cancel_initiated_at": None,
+            "results_url": f"{str(request.base_url).rstrip('/')}/v1/messages/batches/{batch_id}/results",
+        }
+
+    @app.post("/v1/messages/batches")
+    async def create_batch(request: Request):
+        body = await request.json()
+        batch_id = f"msgbatch_{uuid.uuid4().hex[:24]}"
+        batches[batch_id] = body["requests"]
+        counters["batches"] += 1
+        return batch_status(request, batch_id)
+
+    @app.get("/v1/messages/batches/{batch_id}")
+    async def get_batch(batch_id: str, request: Request):
+        if batch_id not in batches:
+            return JSONResponse({"type": "error", "error": {"type": "not_found_error", "message": "Batch not found"}}, status_code=404)
+        return batch_status(request, batch_id)
+
+    @app.get("/v1/messages/batches/{batch_id}/results")
+    async def batch_results(batch_id: str):
+        lines = [
+            json.dumps({
+                "custom_id": entry["custom_id"],
+                "result": {"type": "succeeded", "message": message(entry["params"], response_content(entry["params"]))},
+            })
+            for entry in batches.get(batch_id, [])
+        ]
+        return PlainTextResponse("\n".join(lines), media_type="application/binary")
+
+    @app.get("/control")
+    async def get_control():
+        return {"config": asdict(config), "counters": counters}
+
+    @app.post("/control")
+    async def set_control(request: Request):
+        config.update(await request.json())
+        return {"config": asdict(config), "counters": counters}
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9911)
+    defaults = FakeUpstreamConfig()
+    for field in fields(FakeUpstreamConfig):
+        parser.add_argument(f"--{field.name.replace('_', '-')}", type=type(getattr(defaults, field.name)), default=getattr(defaults, field.name))
+    args = parser.parse_args()
+
+    import uvicorn
+
+    config = FakeUpstreamConfig(**{field.name: getattr(args, field.name) for field in fields(FakeUpstreamConfig)})
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+"""Load-test the service's HTTP endpoints against a local fake upstream.
+
+Usage (from backend/python-ai):
+    python -m benchmarks.load_test [--concurrency 10 50 200] [--duration 30] [--workers 1]
+        [--mix message=4,suggestions=2,analyze=3,insights=1] [--unique-ratio 0.3]
+        [--latency 0.4 --tokens-per-second 80 --error-rate 0.0] [--output results.json]
+
+By default the fake upstream (benchmarks.fake_upstream) and the service (uvicorn main:app) are
+started as subprocesses on free ports. The service runs with rate limiting and upstream
+admission control off, so the numbers measure the service itself. Pass --target to test a
+service that is already running, and --upstream to use a fake upstream that is already running.
+
+At each concurrency level, that many clients send requests back to back for --duration seconds
+after a --warmup period. Endpoints are picked by the --mix weights. Page content comes from
+benchmarks/corpus. A --unique-ratio share of requests uses a fresh host, so it misses both the
+result cache and the near-duplicate cache.
+
+The report gives per endpoint throughput, latency percentiles and errors by status, plus the CPU
+use of each service worker, the fake upstream and this client (from /proc). With --output, the
+results are written as JSON together with the git revision and configuration, so runs can be
+compared release over release.
+"""
+
+import argparse
+import asyncio
+import html
+import json
+import os
+import random
+import re
+import signal
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+CORPUS_DIR = Path(__file__).parent / "corpus"
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+
+ENDPOINTS = {
+    "message": ("POST", "/chat/message"),
+    "suggestions": ("POST", "/chat/suggestions"),
+    "analyze": ("POST", "/context/analyze"),
+    "insights": ("POST", "/context/insights"),
+}
+
+QUESTIONS = [
+    "What is this page about?",
+    "Summarize the key points for me.",
+    "What should I do next here?",
+    "Explain the main terms on this page.",
+]
+
+_TAG_RE = re.compile(r"<(script|style)\b.*?</\1>|<[^>]+>", re.S | re.I)
+_SPACE_RE = re.compile(r"\s+")
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+def load_pages(corpus_dir: Path) -> List[Dict[str, str]]:
+    """Saved pages as the url, title and plain text the browser extension would send"""
+    pages = []
+    for path in sorted(corpus_dir.glob("*.htm*")):
+        raw = path.read_text(encoding="utf-8", errors="ignore")
+        title = re.search(r"<title>(.*?)</title>", raw, re.S | re.I)
+        text = _SPACE_RE.sub(" ", html.unescape(_TAG_RE.sub(" ", raw))).strip()
+        pages.append({
+            "path": path.stem.replace("_", "-"),
+            "title": html.unescape(title.group(1).strip()) if title else path.stem,
+            "content": text[:20000],
+        })
+    if not pages:
+        raise SystemExit(f"No pages found in {corpus_dir}")
+    return pages
+
+def build_request(endpoint: str, pages: List[Dict[str, str]], unique_ratio: float, rng: random.Random) -> Dict[str, Any]:
+    """JSON body for one request to an endpoint"""
+    page = rng.choice(pages)
+    host = f"site-{uuid.uuid4().hex[:12]}.example.com" if rng.random() < unique_ratio else "www.example.com"
+    url = f"https://{host}/{page['path']}"
+    context = {"url": url, "title": page["title"], "content": page["content"]}
+
+    if endpoint == "message":
+        return {"message": rng.choice(QUESTIONS), "context": context}
+    if endpoint == "suggestions":
+        return {"context": context}
+    if endpoint == "analyze":
+        return {"url": url, "page_content": page["content"]}
+    return {"url": url, "title": page["title"], "content": page["content"]}
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint '{name}', expected one of {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def cpu_seconds(pid: int) -> Optional[float]:
+    """User plus system CPU time of a process, from /proc"""
+    try:
+        stat = Path(f"/proc/{pid}/stat").read_text()
+    except OSError:
+        return None
+    # The command name may contain spaces, so split after its closing parenthesis
+    values = stat.rsplit(")", 1)[1].split()
+    return (int(values[11]) + int(values[12])) / CLOCK_TICKS
+
+def child_pids(pid: int) -> List[int]:
+    """Direct children of a process, e.g. uvicorn workers"""
+    children = []
+    for task in Path(f"/proc/{pid}/task").glob("*"):
+        try:
+            children.extend(int(child) for child in (task / "children").read_text().split())
+        except OSError:
+            continue
+    return children
+
+def service_pids(pid: int) -> List[int]:
+    """The processes that serve requests: the workers, or the server itself with a single process"""
+    workers = []
+    for child in child_pids(pid):
+        try:
+            command = Path(f"/proc/{child}/cmdline").read_bytes()
+        except OSError:
+            continue
+        # With --workers, multiprocessing also starts a resource tracker next to the workers
+        if b"resource_tracker" not in command:
+            workers.append(child)
+    return workers or [pid]
+
+def wait_for(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0, trust_env=False).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"Timed out waiting for {url}")
+
+def start_upstream(args: argparse.Namespace) -> Tuple[subprocess.Popen, str]:
+    port = free_port()
+    command = [
+        sys.executable, "-m", "benchmarks.fake_upstream", "--port", str(port),
+        "--latency", str(args.latency), "--jitter", str(args.jitter),
+        "--tokens-per-second", str(args.tokens_per_second), "--output-tokens", str(args.output_tokens),
+        "--error-rate", str(args.error_rate), "--error-status", str(args.error_status),
+    ]
+    process = subprocess.Popen(command, cwd=SERVICE_DIR)
+    url = f"http://127.0.0.1:{port}"
+    wait_for(f"{url}/control")
+    return process, url
+
+def start_service(args: argparse.Namespace, upstream: str) -> Tuple[subprocess.Popen, str]:
+    port = free_port()
+    env = dict(
+        os.environ,
+        ANTHROPIC_API_KEY="sk-ant-load-test",
+        ANTHROPIC_BASE_URL=upstream,
+        ENVIRONMENT="production",
+        LOG_LEVEL="WARNING",
+        LOG_FILE="",
+        RATE_LIMIT_ENABLED="false",
+        UPSTREAM_REQUESTS_PER_MINUTE="0",
+        UPSTREAM_TOKENS_PER_MINUTE="0",
+        NO_PROXY="127.0.0.1,localhost",
+        no_proxy="127.0.0.1,localhost",
+    )
+    command = [
+        sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(args.workers), "--log-level", "warning", "--no-access-log",
+    ]
+    process = subprocess.Popen(command, cwd=SERVICE_DIR, env=env)
+    url = f"http://127.0.0.1:{port}"
+    wait_for(f"{url}/health/")
+    return process, url
+
+def stop(process: Optional[subprocess.Popen]):
+    if process is None or process.poll() is not None:
+        return
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+class Results:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {name: [] for name in ENDPOINTS}
+        self.statuses: Dict[str, Dict[str, int]] = {name: {} for name in ENDPOINTS}
+
+    def record(self, endpoint: str, status: str, seconds: float):
+        self.statuses[endpoint][status] = self.statuses[endpoint].get(status, 0) + 1
+        if status == "200":
+            self.latencies[endpoint].append(seconds)
+
+async def client_loop(
+    client: httpx.AsyncClient,
+    args: argparse.Namespace,
+    mix: Dict[str, float],
+    pages: List[Dict[str, str]],
+    record_from: float,
+    stop_at: float,
+    results: Results,
+    rng: random.Random,
+):
+    names, weights = list(mix), list(mix.values())
+    while time.perf_counter() < stop_at:
+        endpoint = rng.choices(names, weights)[0]
+        method, path = ENDPOINTS[endpoint]
+        body = build_request(endpoint, pages, args.unique_ratio, rng)
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, path, json=body)
+            await response.aread()
+            status = str(response.status_code)
+        except httpx.TimeoutException:
+            status = "timeout"
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        if started >= record_from:
+            results.record(endpoint, status, time.perf_counter() - started)
+
+async def run_level(
+    target: str,
+    concurrency: int,
+    args: argparse.Namespace,
+    mix: Dict[str, float],
+    pages: List[Dict[str, str]],
+    pids: Dict[str, List[int]],
+) -> Dict[str, Any]:
+    results = Results()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=target, limits=limits, timeout=args.timeout, trust_env=False) as client:
+        started = time.perf_counter()
+        record_from = started + args.warmup
+        stop_at = record_from + args.duration
+        rngs = [random.Random(args.seed * 100003 + concurrency * 1009 + index) for index in range(concurrency)]
+
+        # CPU is sampled at the end of the warmup and at the end of the measured window
+        cpu_task = asyncio.create_task(sample_cpu(pids, record_from, stop_at))
+        await asyncio.gather(*[
+            client_loop(client, args, mix, pages, record_from, stop_at, results, rng) for rng in rngs
+        ])
+        cpu = await cpu_task
+
+    endpoints = {}
+    total_ok = 0
+    for name in mix:
+        latencies = results.latencies[name]
+        total_ok += len(latencies)
+        endpoints[name] = {
+            "requests": sum(results.statuses[name].values()),
+            "ok": len(latencies),
+            "statuses": results.statuses[name],
+            "throughput_rps": round(len(latencies) / args.duration, 2),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+            "max_ms": round(max(latencies, default=0.0) * 1000, 1),
+        }
+
+    all_latencies = [value for name in mix for value in results.latencies[name]]
+    requests = sum(entry["requests"] for entry in endpoints.values())
+    return {
+        "concurrency": concurrency,
+        "duration_s": args.duration,
+        "requests": requests,
+        "ok": total_ok,
+        "error_rate": round(1 - total_ok / requests, 4) if requests else 0.0,
+        "throughput_rps": round(total_ok / args.duration, 2),
+        "p50_ms": round(percentile(all_latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(all_latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(all_latencies, 99) * 1000, 1),
+        "endpoints": endpoints,
+        "cpu": cpu,
+    }
+
+async def sample_cpu(pids: Dict[str, List[int]], start_at: float, stop_at: float) -> Dict[str, Any]:
+    """CPU use (1.0 = one core) of each watched process over the measured window"""
+    await asyncio.sleep(max(start_at - time.perf_counter(), 0))
+    before = {(role, pid): cpu_seconds(pid) for role, role_pids in pids.items() for pid in role_pids}
+    client_before = time.process_time()
+    window_started = time.perf_counter()
+
+    await asyncio.sleep(max(stop_at - time.perf_counter(), 0))
+    elapsed = time.perf_counter() - window_started
+    usage: Dict[str, Any] = {role: {} for role in pids}
+    for (role, pid), start in before.items():
+        end = cpu_seconds(pid)
+        if start is not None and end is not None:
+            usage[role][str(pid)] = round((end - start) / elapsed, 3)
+    usage["client"] = round((time.process_time() - client_before) / elapsed, 3)
+    return usage
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SERVICE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_level(level: Dict[str, Any]):
+    print(
+        f"\nconcurrency {level['concurrency']}: {level['throughput_rps']} req/s, "
+        f"p50 {level['p50_ms']} ms, p95 {level['p95_ms']} ms, p99 {level['p99_ms']} ms, errors {level['error_rate']:.2%}"
+    )
+    print(f"  {'endpoint':<12} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}  statuses")
+    for name, entry in level["endpoints"].items():
+        print(
+            f"  {name:<12} {entry['throughput_rps']:>8} {entry['p50_ms']:>8} {entry['p95_ms']:>8} "
+            f"{entry['p99_ms']:>8} {entry['max_ms']:>8}  {entry['statuses']}"
+        )
+    cpu = level["cpu"]
+    workers = ", ".join(f"{pid}: {share:.0%}" for pid, share in cpu.get("service", {}).items())
+    upstream = ", ".join(f"{share:.0%}" for share in cpu.get("upstream", {}).values())
+    print(f"  CPU  service workers [{workers}]  upstream [{upstream}]  client {cpu['client']:.0%}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", help="URL of a running service; one is started otherwise")
+    parser.add_argument("--target-pid", type=int, help="PID of the running --target server, for CPU figures")
+    parser.add_argument("--upstream", help="URL of a running fake upstream; one is started otherwise")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the started service")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--duration", type=float, default=30.0, help="Measured seconds per concurrency level")
+    parser.add_argument("--warmup", type=float, default=5.0)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--mix", default="message=4,suggestions=2,analyze=3,insights=1")
+    parser.add_argument("--unique-ratio", type=float, default=0.3, help="Share of requests that cannot hit a cache")
+    parser.add_argument("--corpus", type=Path, default=CORPUS_DIR)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", type=Path, help="Write results as JSON")
+    upstream_group = parser.add_argument_group("fake upstream (when started here)")
+    upstream_group.add_argument("--latency", type=float, default=0.4)
+    upstream_group.add_argument("--jitter", type=float, default=0.1)
+    upstream_group.add_argument("--tokens-per-second", type=float, default=80.0)
+    upstream_group.add_argument("--output-tokens", type=int, default=120)
+    upstream_group.add_argument("--error-rate", type=float, default=0.0)
+    upstream_group.add_argument("--error-status", type=int, default=529)
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    pages = load_pages(args.corpus)
+    upstream_process = service_process = None
+    try:
+        upstream = args.upstream
+        if upstream is None:
+            upstream_process, upstream = start_upstream(args)
+
+        target = args.target
+        if target is None:
+            service_process, target = start_service(args, upstream)
+
+        pids: Dict[str, List[int]] = {"service": [], "upstream": []}
+        if service_process is not None:
+            pids["service"] = service_pids(service_process.pid)
+        elif args.target_pid:
+            pids["service"] = service_pids(args.target_pid)
+        if upstream_process is not None:
+            pids["upstream"] = [upstream_process.pid]
+
+        print(f"Target {target}, upstream {upstream}, mix {mix}, unique ratio {args.unique_ratio}")
+        levels = []
+        for concurrency in args.concurrency:
+            level = asyncio.run(run_level(target, concurrency, args, mix, pages, pids))
+            print_level(level)
+            levels.append(level)
+    finally:
+        stop(service_process)
+        stop(upstream_process)
+
+    if args.output:
+        report = {
+            "timestamp": datetime.utcnow().isoformat(),
+            "git_revision": git_revision(),
+            "python": sys.version.split()[0],
+            "config": {
+                key: (str(value) if isinstance(value, Path) else value)
+                for key, value in vars(args).items()
+            },
+            "levels": levels,
+        }
+        args.output.write_text(json.dumps(report, indent=2))
+        print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""Measure logging cost on the request path before and after the queued logging pipeline.
+
+Usage (from backend/python-ai):
+    python -m benchmarks.logging_overhead [--requests 20000] [--records 6] [--slow-disk-ms 0 2]
+
+Each simulated request sets a request ID and logs a few INFO records with extra fields, as the
+routes and services do; every 50th request also logs a WARNING and every 200th an ERROR with a
+traceback. "Before" reproduces the old setup: JSON formatted with json.dumps and a full
+__dict__ scan, written synchronously to the console stream and, for errors, to a FileHandler.
+"After" queues records for a background thread (and optionally samples INFO). Output goes to
+files in a temporary directory. --slow-disk-ms adds a delay to every write to stand in for a
+stalled disk; the time only lands on the request in "before".
+
+Reported per pipeline: calling-thread µs per request (mean, p50, p99), time for the logging
+thread to drain, and records written, sampled out and dropped.
+"""
+
+import argparse
+import json
+import logging
+import queue
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List
+
+from app.core import logging_config
+from app.core.logging_config import (
+    BoundedQueueHandler,
+    JSONFormatter,
+    LogQueueListener,
+    RequestContextFilter,
+    SamplingFilter,
+)
+
+class LegacyJSONFormatter(logging.Formatter):
+    """The JSON formatter as it was before the queued pipeline"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        log_entry: Dict[str, Any] = {
+            'timestamp': datetime.utcnow().isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'function': record.funcName,
+            'line': record.lineno,
+        }
+        if record.exc_info:
+            log_entry['exception'] = self.formatException(record.exc_info)
+        for key, value in record.__dict__.items():
+            if key not in ['name', 'msg', 'args', 'levelname', 'levelno', 'pathname',
+                          'filename', 'module', 'lineno', 'funcName', 'created',
+                          'msecs', 'relativeCreated', 'thread', 'threadName',
+                          'processName', 'process', 'getMessage', 'exc_info',
+                          'exc_text', 'stack_info']:
+                log_entry[key] = value
+        return json.dumps(log_entry, default=str)
+
+class SlowFileHandler(logging.FileHandler):
+    """File handler whose writes take at least `delay` seconds"""
+
+    def __init__(self, path: Path, delay: float):
+        super().__init__(path)
+        self.delay = delay
+
+    def emit(self, record: logging.LogRecord):
+        if self.delay:
+            time.sleep(self.delay)
+        super().emit(record)
+
+def output_handlers(directory: Path, name: str, formatter_class, delay: float) -> List[logging.Handler]:
+    """A console stand-in for every record and an error file, like setup_logging outside development"""
+    console = SlowFileHandler(directory / f"{name}.out", delay)
+    console.setLevel(logging.INFO)
+    console.setFormatter(formatter_class())
+    errors = SlowFileHandler(directory / f"{name}.err", delay)
+    errors.setLevel(logging.ERROR)
+    errors.setFormatter(formatter_class())
+    return [console, errors]
+
+def simulate(logger: logging.Logger, requests: int, records: int) -> List[float]:
+    """Seconds spent in logging calls for each request"""
+    timings = []
+    for number in range(requests):
+        token = logging_config._request_id.set(f"req-{number:08d}")
+        started = time.perf_counter()
+        for index in range(records):
+            logger.info(
+                f"Handled step {index} for https://example.com/page/{number}",
+                extra={"cache": "miss", "tokens": 120 + index, "model": "claude-3-5-haiku"},
+            )
+        if number % 50 == 0:
+            logger.warning(f"Slow upstream call: {number % 7 + 1.5:.2f}s")
+        if number % 200 == 0:
+            try:
+                raise ValueError(f"Upstream returned malformed JSON for request {number}")
+            except ValueError:
+                logger.error("Analysis failed", exc_info=True)
+        timings.append(time.perf_counter() - started)
+        logging_config._request_id.reset(token)
+    return timings
+
+def count_lines(directory: Path, name: str) -> int:
+    return sum(sum(1 for _ in (directory / f"{name}{suffix}").open()) for suffix in (".out", ".err"))
+
+def run_before(directory: Path, args: argparse.Namespace) -> Dict[str, Any]:
+    logger = logging.getLogger("benchmark.before")
+    handlers = output_handlers(directory, "before", LegacyJSONFormatter, args.slow_disk_ms / 1000)
+    for handler in handlers:
+        logger.addHandler(handler)
+
+    timings = simulate(logger, args.requests, args.records)
+    for handler in handlers:
+        logger.removeHandler(handler)
+        handler.close()
+    return summarize("before (sync)", timings, 0.0, count_lines(directory, "before"), 0, 0)
+
+def run_after(directory: Path, args: argparse.Namespace, sample_rate: float, name: str) -> Dict[str, Any]:
+    logger = logging.getLogger(f"benchmark.{name}")
+    handlers = output_handlers(directory, name, JSONFormatter, args.slow_disk_ms / 1000)
+    sampling = SamplingFilter(sample_rate, args.max_per_second)
+    queue_handler = BoundedQueueHandler(queue.Queue(maxsize=args.queue_size))
+    queue_handler.addFilter(sampling)
+    queue_handler.addFilter(RequestContextFilter())
+    listener = LogQueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    logger.addHandler(queue_handler)
+
+    timings = simulate(logger, args.requests, args.records)
+    started = time.perf_counter()
+    listener.stop()
+    drain = time.perf_counter() - started
+    logger.removeHandler(queue_handler)
+    for handler in handlers:
+        handler.close()
+    return summarize(
+        name, timings, drain, count_lines(directory, name),
+        sampling.sampled_out + sampling.rate_limited, queue_handler.dropped,
+    )
+
+def summarize(name: str, timings: List[float], drain: float, written: int, sampled_out: int, dropped: int) -> Dict[str, Any]:
+    ordered = sorted(timings)
+    return {
+        "pipeline": name,
+        "mean_us": round(sum(ordered) / len(ordered) * 1_000_000, 1),
+        "p50_us": round(ordered[len(ordered) // 2] * 1_000_000, 1),
+        "p99_us": round(ordered[min(int(len(ordered) * 0.99), len(ordered) - 1)] * 1_000_000, 1),
+        "drain_ms": round(drain * 1000, 1),
+        "written": written,
+        "sampled_out": sampled_out,
+        "dropped": dropped,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--records", type=int, default=6, help="INFO records per request")
+    parser.add_argument("--slow-disk-ms", type=float, nargs="+", default=[0.0], help="Added delay per write")
+    parser.add_argument("--sample-rate", type=float, default=0.1, help="INFO share kept in the sampled run")
+    parser.add_argument("--max-per-second", type=int, default=0, help="INFO cap per second (0 for none)")
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument("--output", type=Path, help="Write results as JSON")
+    args = parser.parse_args()
+
+    logging.getLogger("benchmark").propagate = False
+    logging.getLogger("benchmark").setLevel(logging.INFO)
+    results = []
+    for slow_disk_ms in args.slow_disk_ms:
+        args.slow_disk_ms = slow_disk_ms
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory)
+            rows = [
+                run_before(path, args),
+                run_after(path, args, 1.0, "after (queued)"),
+                run_after(path, args, args.sample_rate, f"after (queued, {args.sample_rate:.0%} INFO)"),
+            ]
+
+        print(f"\n{args.requests} requests x {args.records} INFO records, slow disk {slow_disk_ms} ms per write")
+        print(f"{'pipeline':<32} {'mean us':>9} {'p50 us':>8} {'p99 us':>9} {'drain ms':>9} {'written':>8} {'sampled':>8} {'dropped':>8}")
+        for row in rows:
+            print(
+                f"{row['pipeline']:<32} {row['mean_us']:>9} {row['p50_us']:>8} {row['p99_us']:>9} "
+                f"{row['drain_ms']:>9} {row['written']:>8} {row['sampled_out']:>8} {row['dropped']:>8}"
+            )
+        results.append({"slow_disk_ms": slow_disk_ms, "results": rows})
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Measure what the metrics instrumentation costs per request and per scrape.
+
+Usage (from backend/python-ai):
+    python -m benchmarks.metrics_overhead [--requests 20000] [--rounds 5] [--series 50 500]
+
+Three parts:
+- the cost of single updates (counter, histogram, upstream call tracking)
+- a FastAPI app with a prefixed router, driven in process through ASGI with and without
+  MetricsMiddleware, so the difference is the middleware's cost per request
+- rendering /metrics with a growing number of label combinations
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from fastapi import APIRouter, FastAPI
+
+from app.services.metrics import MetricsMiddleware, MetricsRegistry, track_upstream
+
+def per_call_ns(func, count: int) -> float:
+    started = time.perf_counter()
+    for _ in range(count):
+        func()
+    return (time.perf_counter() - started) / count * 1e9
+
+def update_costs(count: int) -> Dict[str, float]:
+    registry = MetricsRegistry()
+    counter = registry.counter("bench_tokens_total", "Tokens", ("task", "model", "kind"))
+    histogram = registry.histogram("bench_latency_seconds", "Latency", ("method", "route", "status"))
+
+    def tracked():
+        with track_upstream("benchmark", "model"):
+            pass
+
+    return {
+        "counter_inc_ns": round(per_call_ns(lambda: counter.labels("chat", "model", "input").inc(120), count)),
+        "histogram_observe_ns": round(per_call_ns(lambda: histogram.labels("POST", "/chat/message", "200").observe(0.42), count)),
+        "track_upstream_ns": round(per_call_ns(tracked, count)),
+    }
+
+def build_app(instrumented: bool) -> FastAPI:
+    router = APIRouter()
+
+    @router.post("/message")
+    async def message():
+        return {"content": "ok"}
+
+    @router.get("/suggestions/{suggestions_id}")
+    async def suggestions(suggestions_id: str):
+        return {"id": suggestions_id}
+
+    app = FastAPI()
+    app.include_router(router, prefix="/chat")
+    if instrumented:
+        app.add_middleware(MetricsMiddleware)
+    return app
+
+async def drive(app: FastAPI, requests: int) -> float:
+    """Seconds per request through the ASGI app, without a network or server in between"""
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    scopes = [
+        {"type": "http", "method": "POST", "path": "/chat/message"},
+        {"type": "http", "method": "GET", "path": "/chat/suggestions/abc123"},
+    ]
+    for scope in scopes:
+        scope.update({
+            "asgi": {"version": "3.0"}, "http_version": "1.1", "scheme": "http", "root_path": "",
+            "query_string": b"", "headers": [], "client": ("127.0.0.1", 1), "server": ("test", 80),
+        })
+
+    # Warm up routing and the middleware stack
+    for scope in scopes:
+        await app(dict(scope), receive, send)
+
+    started = time.perf_counter()
+    for number in range(requests):
+        await app(dict(scopes[number % 2]), receive, send)
+    return (time.perf_counter() - started) / requests
+
+def render_costs(series_counts: List[int]) -> List[Dict[str, Any]]:
+    rows = []
+    for series in series_counts:
+        registry = MetricsRegistry()
+        histogram = registry.histogram("bench_latency_seconds", "Latency", ("method", "route", "status"))
+        for number in range(series):
+            histogram.labels("GET", f"/route/{number}", "200").observe(0.1)
+        started = time.perf_counter()
+        text = registry.render()
+        rows.append({
+            "series": series,
+            "render_ms": round((time.perf_counter() - started) * 1000, 2),
+            "bytes": len(text),
+        })
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--updates", type=int, default=200000)
+    parser.add_argument("--series", type=int, nargs="+", default=[50, 500])
+    parser.add_argument("--output", type=Path, help="Write results as JSON")
+    args = parser.parse_args()
+
+    updates = update_costs(args.updates)
+    print("Single updates")
+    for key, value in updates.items():
+        print(f"  {key:<24} {value}")
+
+    # Alternate the two apps over several rounds and keep each one's best, to cancel out noise
+    apps = {False: build_app(False), True: build_app(True)}
+    best = {False: float("inf"), True: float("inf")}
+    for _ in range(args.rounds):
+        for instrumented_app, app in apps.items():
+            best[instrumented_app] = min(best[instrumented_app], asyncio.run(drive(app, args.requests)))
+    plain, instrumented = best[False], best[True]
+    middleware = {
+        "plain_us": round(plain * 1e6, 1),
+        "instrumented_us": round(instrumented * 1e6, 1),
+        "overhead_us": round((instrumented - plain) * 1e6, 1),
+        "overhead_share": round((instrumented - plain) / plain, 4),
+    }
+    print(f"\nPer request through ASGI ({args.requests} requests)")
+    for key, value in middleware.items():
+        print(f"  {key:<24} {value}")
+
+    scrape = render_costs(args.series)
+    print(f"\n{'series':>8} {'render ms':>10} {'bytes':>9}")
+    for row in scrape:
+        print(f"{row['series']:>8} {row['render_ms']:>10} {row['bytes']:>9}")
+
+    if args.output:
+        args.output.write_text(json.dumps({"updates": updates, "middleware": middleware, "scrape": scrape}, indent=2))
+
+if __name__ == "__main__":
+    main()
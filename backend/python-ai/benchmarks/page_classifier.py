@@ -0,0 +1,209 @@
+"""Measure page classification accuracy, calibration and per-page cost.
+
+Usage (from backend/python-ai):
+    python -m benchmarks.page_classifier [--corpus benchmarks/corpus] [--repeat 200] [--large-chars 1000000] [--fit]
+
+Labeled pages come from corpus/index.json (saved HTML pages, run through the extractor first)
+and corpus/page_labels.jsonl (url, title, extracted text and label). "Before" is the old
+keyword scan that lowercased the whole page; "after" is PageClassifier. Cost is also measured
+on one very large page, where the old scan grows with page size.
+
+Pages are split by a hash of their name: about a third are held out and accuracy and
+calibration are reported on those only. --fit reports log loss and calibration error for a
+range of softmax temperatures on the remaining fit split, so the temperature is never chosen
+on the pages it is judged on.
+"""
+
+import argparse
+import json
+import math
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from app.core.config import settings
+from app.services.content_extractor import extract_content
+from app.services.page_classifier import PageClassifier, TEMPERATURE
+
+CORPUS_DIR = Path(__file__).parent / "corpus"
+
+# One page in this many is held out of fitting
+HELD_OUT_EVERY = 3
+
+def legacy_page_type(url: str, content: str, has_forms: bool = False) -> str:
+    """The keyword scan PageClassifier replaced"""
+    url_lower = url.lower()
+    content_lower = content.lower()
+    if any(keyword in url_lower for keyword in ['shop', 'store', 'cart', 'checkout', 'product']):
+        return "e-commerce"
+    if any(keyword in url_lower for keyword in ['facebook', 'twitter', 'instagram', 'linkedin']):
+        return "social-media"
+    if any(keyword in url_lower for keyword in ['github', 'gitlab', 'stackoverflow', 'dev']):
+        return "developer-tools"
+    if any(keyword in url_lower for keyword in ['docs', 'documentation', 'api', 'guide']):
+        return "documentation"
+    if any(keyword in url_lower for keyword in ['news', 'blog', 'article']):
+        return "content"
+    if has_forms or 'input' in content_lower:
+        return "form-page"
+    return "general"
+
+def load_labeled(corpus_dir: Path) -> List[Dict[str, Any]]:
+    """Load every labeled page"""
+    pages = []
+
+    index_path = corpus_dir / "index.json"
+    index = json.loads(index_path.read_text()) if index_path.exists() else {}
+    for name, meta in sorted(index.items()):
+        if "label" not in meta:
+            continue
+        extracted = extract_content((corpus_dir / name).read_text(encoding="utf-8", errors="ignore"))
+        pages.append({
+            "name": name,
+            "url": meta["url"],
+            "title": extracted.title,
+            "content": extracted.text,
+            "forms": extracted.forms,
+            "label": meta["label"],
+        })
+
+    labels_path = corpus_dir / "page_labels.jsonl"
+    if labels_path.exists():
+        for line in labels_path.read_text().splitlines():
+            if line.strip():
+                row = json.loads(line)
+                pages.append({"name": row["url"], "forms": [], **row})
+
+    return pages
+
+def split(pages: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Fit and held-out pages; stable across runs and corpus additions"""
+    fit, held_out = [], []
+    for page in pages:
+        (held_out if zlib.crc32(page["name"].encode()) % HELD_OUT_EVERY == 0 else fit).append(page)
+    return fit, held_out
+
+def time_per_page(func, pages: List[Dict[str, Any]], repeat: int) -> float:
+    """Best average microseconds per page over several runs"""
+    best = float("inf")
+    for _ in range(max(repeat // 20, 1)):
+        started = time.perf_counter()
+        for _ in range(20):
+            for page in pages:
+                func(page)
+        best = min(best, (time.perf_counter() - started) / (20 * len(pages)))
+    return best * 1_000_000
+
+def evaluate(classifier: PageClassifier, pages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Confidence and correctness for every page"""
+    rows = []
+    for page in pages:
+        result = classify(classifier, page)
+        rows.append({"confidence": result.confidence, "correct": result.label == page["label"]})
+    return rows
+
+def log_loss(classifier: PageClassifier, pages: List[Dict[str, Any]]) -> float:
+    """Mean negative log probability of the true label"""
+    total = 0.0
+    for page in pages:
+        result = classify(classifier, page)
+        top = max(result.scores.values())
+        weights = {label: math.exp((score - top) / classifier.temperature) for label, score in result.scores.items()}
+        total -= math.log(max(weights[page["label"]] / sum(weights.values()), 1e-9))
+    return total / len(pages)
+
+def classify(classifier: PageClassifier, page: Dict[str, Any]):
+    """Classify a labeled page"""
+    return classifier.classify(page["url"], page.get("title"), page["content"], forms=page.get("forms"))
+
+def calibration(rows: List[Dict[str, Any]], bins: int = 5) -> float:
+    """Expected calibration error: confidence versus accuracy, weighted by bin size"""
+    error = 0.0
+    for index in range(bins):
+        low, high = index / bins, (index + 1) / bins
+        members = [row for row in rows if low < row["confidence"] <= high or (index == 0 and row["confidence"] == 0)]
+        if members:
+            accuracy = sum(row["correct"] for row in members) / len(members)
+            confidence = sum(row["confidence"] for row in members) / len(members)
+            error += abs(accuracy - confidence) * len(members) / len(rows)
+    return error
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", type=Path, default=CORPUS_DIR)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--large-chars", type=int, default=1_000_000)
+    parser.add_argument("--fit", action="store_true", help="Compare softmax temperatures")
+    parser.add_argument("--output", type=Path, help="Write results as JSON")
+    args = parser.parse_args()
+
+    pages = load_labeled(args.corpus)
+    fit_pages, held_out = split(pages)
+    classifier = PageClassifier()
+
+    if args.fit:
+        print(f"Fitting on {len(fit_pages)} of {len(pages)} pages")
+        print(f"{'temperature':>11} {'log loss':>9} {'ECE':>6}")
+        for step in range(14):
+            temperature = round(0.2 + 0.1 * step, 1)
+            candidate = PageClassifier(temperature)
+            marker = "  (current)" if temperature == TEMPERATURE else ""
+            print(f"{temperature:>11} {log_loss(candidate, fit_pages):>9.3f} {calibration(evaluate(candidate, fit_pages)):>6.3f}{marker}")
+        return
+
+    rows = []
+    for page in held_out:
+        result = classify(classifier, page)
+        legacy = legacy_page_type(page["url"], page["content"], bool(page.get("forms")))
+        rows.append({
+            "page": page["name"],
+            "label": page["label"],
+            "predicted": result.label,
+            "confidence": result.confidence,
+            "correct": result.label == page["label"],
+            "legacy": legacy,
+            "legacy_correct": legacy == page["label"],
+        })
+
+    print(f"{'page':<70} {'label':<16} {'after':<16} {'conf':>5}  before")
+    for row in rows:
+        marker = "" if row["correct"] else "  <- wrong"
+        print(f"{row['page'][:70]:<70} {row['label']:<16} {row['predicted']:<16} {row['confidence']:>5.2f}  {row['legacy']}{marker}")
+
+    threshold = settings.CLASSIFIER_SKIP_LLM_CONFIDENCE
+    # Insights only skip the LLM for a specific page type, never for "general"
+    confident = [row for row in rows if row["confidence"] >= threshold and row["predicted"] != "general"]
+    after_us = time_per_page(lambda page: classify(classifier, page), pages, args.repeat)
+    before_us = time_per_page(lambda page: legacy_page_type(page["url"], page["content"], bool(page.get("forms"))), pages, args.repeat)
+
+    largest = max(pages, key=lambda page: len(page["content"]))
+    large = {**largest, "content": (largest["content"] + "\n\n") * (args.large_chars // max(len(largest["content"]), 1) + 1)}
+    large_after_us = time_per_page(lambda page: classify(classifier, page), [large], 20)
+    large_before_us = time_per_page(lambda page: legacy_page_type(page["url"], page["content"]), [large], 20)
+
+    summary = {
+        "pages": len(pages),
+        "held_out_pages": len(rows),
+        "accuracy_before": round(sum(row["legacy_correct"] for row in rows) / len(rows), 3),
+        "accuracy_after": round(sum(row["correct"] for row in rows) / len(rows), 3),
+        "expected_calibration_error": round(calibration(rows), 3),
+        "skip_llm_threshold": threshold,
+        "skip_llm_share": round(len(confident) / len(rows), 3),
+        "skip_llm_accuracy": round(sum(row["correct"] for row in confident) / len(confident), 3) if confident else None,
+        "us_per_page_before": round(before_us, 1),
+        "us_per_page_after": round(after_us, 1),
+        "large_page_chars": len(large["content"]),
+        "us_large_page_before": round(large_before_us, 1),
+        "us_large_page_after": round(large_after_us, 1),
+    }
+
+    print()
+    for key, value in summary.items():
+        print(f"{key:<28} {value}")
+
+    if args.output:
+        args.output.write_text(json.dumps({"summary": summary, "rows": rows}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""Measure write-behind persistence against a local Postgres, and check that every row arrives.
+
+Usage (from backend/python-ai):
+    python -m benchmarks.persistence_throughput --dsn postgresql://postgres@localhost/postgres
+        [--turns 20000] [--batch-sizes 50 500 2000] [--baseline-turns 2000] [--keep]
+
+The tables are created in a scratch schema (aiwatch_bench by default) with the columns of
+contexts, conversations and messages from database/schema.sql, minus the foreign keys into the
+Supabase auth tables, and dropped afterwards unless --keep is given.
+
+Reported:
+- the cost of record_turn on the request path
+- rows per second and flush durations for each batch size, with the row counts checked in the
+  database
+- the same turns inserted one row per statement, the way a synchronous write per request would
+- a shutdown check: rows buffered right before close() must all be written
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List
+
+import asyncpg
+
+from app.services.persistence import PersistenceWriter
+
+SCHEMA_DDL = """
+CREATE SCHEMA IF NOT EXISTS {schema};
+SET search_path TO {schema};
+
+CREATE TABLE contexts (
+    id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
+    user_id UUID,
+    session_id UUID,
+    url TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    title TEXT,
+    meta_description TEXT,
+    content_summary TEXT,
+    page_type TEXT,
+    key_elements JSONB,
+    user_intent TEXT,
+    time_spent INTEGER DEFAULT 0,
+    scroll_depth FLOAT DEFAULT 0.0,
+    interactions JSONB DEFAULT '[]',
+    ai_insights JSONB DEFAULT '{{}}',
+    guidance_opportunities JSONB DEFAULT '[]',
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE TABLE conversations (
+    id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
+    user_id UUID,
+    context_id UUID REFERENCES contexts(id) ON DELETE CASCADE,
+    title TEXT,
+    summary TEXT,
+    started_at TIMESTAMPTZ DEFAULT NOW(),
+    ended_at TIMESTAMPTZ,
+    message_count INTEGER DEFAULT 0,
+    initial_context JSONB,
+    topics JSONB DEFAULT '[]',
+    sentiment TEXT,
+    satisfaction_score FLOAT,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE TABLE messages (
+    id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
+    conversation_id UUID REFERENCES conversations(id) ON DELETE CASCADE,
+    user_id UUID,
+    content TEXT NOT NULL,
+    role TEXT NOT NULL CHECK (role IN ('user', 'assistant', 'system')),
+    message_type TEXT DEFAULT 'text' CHECK (message_type IN ('text', 'suggestion', 'guidance', 'warning')),
+    context_snapshot JSONB,
+    ai_model TEXT,
+    processing_time FLOAT,
+    confidence_score FLOAT,
+    user_feedback TEXT,
+    user_rating INTEGER,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX idx_contexts_created_at ON contexts(created_at);
+CREATE INDEX idx_messages_conversation_id ON messages(conversation_id);
+CREATE INDEX idx_messages_created_at ON messages(created_at);
+"""
+
+REPLY = "Here is a summary of the page. " * 20
+CONTEXT = {"url": "https://docs.example.com/guide", "title": "Guide", "content": "page text " * 200}
+ANALYSIS = {
+    "page_type": "documentation",
+    "purpose": "Explains how to use the product",
+    "key_actions": ["Read the guide", "Open the API reference"],
+    "suggestions": ["Summarize this section"],
+    "insights": ["The reader is integrating the API"],
+}
+
+async def reset_schema(dsn: str, schema: str):
+    conn = await asyncpg.connect(dsn)
+    try:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        await conn.execute(SCHEMA_DDL.format(schema=schema))
+    finally:
+        await conn.close()
+
+async def count_rows(dsn: str, schema: str) -> Dict[str, int]:
+    conn = await asyncpg.connect(dsn, server_settings={"search_path": schema})
+    try:
+        return {
+            "messages": await conn.fetchval("SELECT count(*) FROM messages"),
+            "contexts": await conn.fetchval("SELECT count(*) FROM contexts"),
+            "conversations": await conn.fetchval("SELECT count(*) FROM conversations"),
+            "conversation_messages": await conn.fetchval("SELECT coalesce(sum(message_count), 0) FROM conversations"),
+        }
+    finally:
+        await conn.close()
+
+def make_writer(dsn: str, schema: str, batch_size: int, **options: Any) -> PersistenceWriter:
+    return PersistenceWriter(
+        dsn,
+        batch_size=batch_size,
+        flush_interval=options.get("flush_interval", 0.05),
+        max_pending=options.get("max_pending", 10_000_000),
+        server_settings={"search_path": schema},
+    )
+
+def enqueue(writer: PersistenceWriter, turns: int, conversations: int) -> float:
+    """Queue turns spread over conversations (plus one context per 10 turns), returning ns per turn"""
+    ids = [uuid.uuid4().hex for _ in range(conversations)]
+    started = time.perf_counter()
+    for number in range(turns):
+        writer.record_turn(ids[number % conversations], f"Question {number}", REPLY, "claude-bench", 0.8, CONTEXT)
+        if number % 10 == 0:
+            writer.record_context(CONTEXT["url"], ANALYSIS, title="Guide", model="claude-bench")
+    return (time.perf_counter() - started) / turns * 1e9
+
+async def write_behind(dsn: str, schema: str, turns: int, conversations: int, batch_size: int) -> Dict[str, Any]:
+    await reset_schema(dsn, schema)
+    writer = make_writer(dsn, schema, batch_size)
+    # Connect up front so the measurement covers writing, not the first connection
+    await writer.ping()
+
+    durations: List[float] = []
+    flush_once = writer.flush_once
+
+    async def timed_flush() -> int:
+        started = time.perf_counter()
+        rows = await flush_once()
+        durations.append(time.perf_counter() - started)
+        return rows
+
+    writer.flush_once = timed_flush
+    enqueue_ns = enqueue(writer, turns, conversations)
+    rows = writer.pending
+
+    started = time.perf_counter()
+    await writer.start()
+    while writer.pending:
+        await asyncio.sleep(0.005)
+    elapsed = time.perf_counter() - started
+    await writer.close()
+
+    counts = await count_rows(dsn, schema)
+    expected_contexts = (turns + 9) // 10
+    return {
+        "batch_size": batch_size,
+        "rows": rows,
+        "enqueue_ns_per_turn": round(enqueue_ns),
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(rows / elapsed),
+        "flushes": writer.stats["flushes"],
+        "flush_p50_ms": round(statistics.median(durations) * 1000, 2) if durations else None,
+        "flush_max_ms": round(max(durations) * 1000, 2) if durations else None,
+        "complete": (
+            counts["messages"] == turns * 2
+            and counts["contexts"] == expected_contexts
+            and counts["conversations"] == min(conversations, turns)
+            and counts["conversation_messages"] == turns * 2
+        ),
+    }
+
+async def row_at_a_time(dsn: str, schema: str, turns: int, conversations: int) -> Dict[str, Any]:
+    """Each turn written in its own transaction, one INSERT per row, as a request handler would"""
+    await reset_schema(dsn, schema)
+    conn = await asyncpg.connect(dsn, server_settings={"search_path": schema})
+    ids = [uuid.uuid4() for _ in range(conversations)]
+    snapshot = json.dumps({"url": CONTEXT["url"], "title": CONTEXT["title"]})
+    latencies = []
+    started = time.perf_counter()
+    try:
+        for number in range(turns):
+            turn_started = time.perf_counter()
+            conversation = ids[number % conversations]
+            async with conn.transaction():
+                await conn.execute(
+                    "INSERT INTO conversations (id, title, message_count) VALUES ($1, $2, 2) "
+                    "ON CONFLICT (id) DO UPDATE SET message_count = conversations.message_count + 2",
+                    conversation, f"Question {number}",
+                )
+                await conn.execute(
+                    "INSERT INTO messages (conversation_id, role, content, context_snapshot) VALUES ($1, 'user', $2, $3)",
+                    conversation, f"Question {number}", snapshot,
+                )
+                await conn.execute(
+                    "INSERT INTO messages (conversation_id, role, content, ai_model, processing_time) "
+                    "VALUES ($1, 'assistant', $2, 'claude-bench', 0.8)",
+                    conversation, REPLY,
+                )
+            latencies.append(time.perf_counter() - turn_started)
+    finally:
+        await conn.close()
+    elapsed = time.perf_counter() - started
+    return {
+        "rows": turns * 2,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(turns * 2 / elapsed),
+        "added_latency_p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "added_latency_max_ms": round(max(latencies) * 1000, 3),
+    }
+
+async def shutdown_check(dsn: str, schema: str, turns: int) -> Dict[str, Any]:
+    """Rows buffered right before close() are written before it returns"""
+    await reset_schema(dsn, schema)
+    writer = make_writer(dsn, schema, batch_size=500, flush_interval=60.0)
+    await writer.start()
+    enqueue(writer, turns, conversations=max(turns // 20, 1))
+    buffered = writer.pending
+    started = time.perf_counter()
+    await writer.close()
+    counts = await count_rows(dsn, schema)
+    written = counts["messages"] + counts["contexts"]
+    return {
+        "buffered": buffered,
+        "written": written,
+        "close_seconds": round(time.perf_counter() - started, 3),
+        "complete": written == buffered,
+    }
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    results: Dict[str, Any] = {"write_behind": []}
+    for batch_size in args.batch_sizes:
+        row = await write_behind(args.dsn, args.schema, args.turns, args.conversations, batch_size)
+        results["write_behind"].append(row)
+    results["row_at_a_time"] = await row_at_a_time(args.dsn, args.schema, args.baseline_turns, args.conversations)
+    results["shutdown"] = await shutdown_check(args.dsn, args.schema, args.turns // 4)
+
+    if not args.keep:
+        conn = await asyncpg.connect(args.dsn)
+        try:
+            await conn.execute(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE")
+        finally:
+            await conn.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dsn", default=os.getenv("DATABASE_URL"), help="Postgres DSN (defaults to DATABASE_URL)")
+    parser.add_argument("--schema", default="aiwatch_bench")
+    parser.add_argument("--turns", type=int, default=20000)
+    parser.add_argument("--conversations", type=int, default=1000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[50, 500, 2000])
+    parser.add_argument("--baseline-turns", type=int, default=2000)
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch schema for inspection")
+    parser.add_argument("--output", type=Path, help="Write results as JSON")
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error("--dsn or DATABASE_URL is required")
+
+    results = asyncio.run(run(args))
+
+    print(f"{'batch':>6} {'rows':>8} {'enqueue ns':>11} {'rows/s':>9} {'flushes':>8} {'p50 ms':>8} {'max ms':>8} {'complete':>9}")
+    for row in results["write_behind"]:
+        print(
+            f"{row['batch_size']:>6} {row['rows']:>8} {row['enqueue_ns_per_turn']:>11} {row['rows_per_second']:>9} "
+            f"{row['flushes']:>8} {row['flush_p50_ms']:>8} {row['flush_max_ms']:>8} {str(row['complete']):>9}"
+        )
+
+    baseline = results["row_at_a_time"]
+    print(
+        f"\nRow at a time: {baseline['rows_per_second']} rows/s, "
+        f"{baseline['added_latency_p50_ms']} ms added per request (p50), {baseline['added_latency_max_ms']} ms max"
+    )
+    shutdown = results["shutdown"]
+    print(
+        f"Shutdown: {shutdown['written']}/{shutdown['buffered']} buffered rows written in "
+        f"{shutdown['close_seconds']}s, complete: {shutdown['complete']}"
+    )
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""Measure near-duplicate cache precision/recall, hit rate and index cost.
+
+Usage (from backend/python-ai):
+    python -m benchmarks.similarity_cache [--corpus benchmarks/corpus] [--requests 5000] [--scale 10000 100000 300000]
+
+Pages are the corpus HTML run through the extractor, plus synthetic pages recombined from corpus
+paragraphs so that pages on one domain share some text, the way templated sites do. Each page gets
+"noise" variants that a cache should treat as the same page: changed timestamps and counters,
+injected ad lines, session IDs and, half the time, a dropped paragraph. It also gets "edited"
+variants with a share of paragraphs replaced. Variants with 25% or more replaced, and unrelated
+pages, should not match. A 10% edit is a gray zone (a colour variant, an updated paragraph) and
+is reported separately instead of being counted either way.
+
+The report covers:
+- precision and recall at each Hamming distance
+- the hit rate on a Zipf-distributed request trace, exact-hash caching versus exact plus near-duplicate
+- fingerprint cost per page
+- index lookup time and memory at several sizes
+"""
+
+import argparse
+import json
+import random
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.services.cache import make_cache_key
+from app.services.content_extractor import extract_content
+from app.services.similarity_cache import SimilarityIndex, hamming, simhash, similarity_namespace
+
+CORPUS_DIR = Path(__file__).parent / "corpus"
+
+AD_LINES = [
+    "Sponsored: Save 20% on your first order with code WELCOME",
+    "Advertisement",
+    "You might also like: Top 10 gadgets this season",
+    "Sign up for our newsletter and never miss an update",
+]
+
+def load_paragraphs(corpus_dir: Path) -> List[List[str]]:
+    """Extracted text of every saved page, as paragraphs"""
+    pages = []
+    for path in sorted(corpus_dir.glob("*.htm*")):
+        text = extract_content(path.read_text(encoding="utf-8", errors="ignore")).text
+        paragraphs = [line for line in text.split("\n") if line.strip()]
+        if len(" ".join(paragraphs).split()) >= settings.SIMILARITY_MIN_TOKENS:
+            pages.append(paragraphs)
+    return pages
+
+def synthetic_pages(corpus: List[List[str]], count: int, rng: random.Random) -> List[List[str]]:
+    """Distinct pages built from a shared template plus their own paragraphs"""
+    pool = [paragraph for page in corpus for paragraph in page if len(paragraph.split()) >= 4]
+    template = rng.sample(pool, 4)
+    pages = []
+    for index in range(count):
+        body = rng.sample(pool, min(len(pool), rng.randint(25, 60)))
+        pages.append([f"Item {index}"] + template[:2] + body + template[2:])
+    return pages
+
+def noise_variant(page: List[str], rng: random.Random) -> str:
+    """The same page as another visitor would see it"""
+    lines = list(page)
+    if len(lines) > 10 and rng.random() < 0.5:
+        del lines[rng.randrange(len(lines))]
+    for _ in range(rng.randint(1, 3)):
+        lines.insert(rng.randrange(len(lines) + 1), rng.choice(AD_LINES))
+    lines.append(f"Last updated {rng.randint(1, 28)} minutes ago - {rng.randint(100, 9999)} views")
+    lines.append(f"session {rng.getrandbits(64):016x}")
+    return "\n".join(lines)
+
+def edited_variant(page: List[str], share: float, pool: List[str], rng: random.Random) -> str:
+    """The page with a share of its paragraphs replaced by other text"""
+    lines = list(page)
+    for index in rng.sample(range(len(lines)), max(1, int(len(lines) * share))):
+        lines[index] = rng.choice(pool)
+    return "\n".join(lines)
+
+def pair_distances(pages: List[List[str]], rng: random.Random) -> List[Tuple[int, Optional[bool], str]]:
+    """(distance, should_match, kind) for noise, edited and unrelated page pairs; None marks the gray zone"""
+    pool = [paragraph for page in pages for paragraph in page]
+    pairs = []
+    fingerprints = [simhash("\n".join(page)) for page in pages]
+    for index, page in enumerate(pages):
+        base = fingerprints[index]
+        for _ in range(3):
+            pairs.append((hamming(base, simhash(noise_variant(page, rng))), True, "noise"))
+        for share in (0.1, 0.25, 0.5):
+            should_match = None if share < 0.25 else False
+            pairs.append((hamming(base, simhash(edited_variant(page, share, pool, rng))), should_match, f"edited {int(share * 100)}%"))
+        other = fingerprints[rng.randrange(len(pages))]
+        if other != base:
+            pairs.append((hamming(base, other), False, "other page"))
+    return pairs
+
+def precision_recall(pairs: List[Tuple[int, Optional[bool], str]], max_distance: int) -> Dict[str, float]:
+    matched = [(distance <= max_distance, should_match) for distance, should_match, _ in pairs if should_match is not None]
+    gray = [distance <= max_distance for distance, should_match, _ in pairs if should_match is None]
+    true_positive = sum(1 for hit, should in matched if hit and should)
+    false_positive = sum(1 for hit, should in matched if hit and not should)
+    positives = sum(1 for _, should in matched if should)
+    return {
+        "precision": round(true_positive / (true_positive + false_positive), 4) if true_positive + false_positive else 1.0,
+        "recall": round(true_positive / positives, 4) if positives else 0.0,
+        "gray_zone_matched": round(sum(gray) / len(gray), 4) if gray else 0.0,
+    }
+
+def replay_trace(pages: List[List[str]], requests: int, rng: random.Random) -> Dict[str, Any]:
+    """Replay Zipf-distributed visits to noisy page variants through both cache strategies"""
+    weights = [1 / (rank + 1) for rank in range(len(pages))]
+    index = SimilarityIndex(settings.SIMILARITY_MAX_DISTANCE, settings.SIMILARITY_MAX_ENTRIES, settings.SIMILARITY_MIN_TOKENS)
+    exact: Dict[str, int] = {}
+    stored: Dict[str, int] = {}
+    counts = {"exact_hits": 0, "similar_hits": 0, "wrong_hits": 0, "misses": 0}
+    fingerprint_seconds = 0.0
+
+    for page_id in rng.choices(range(len(pages)), weights, k=requests):
+        url = f"https://shop.example.com/item/{page_id}?session={rng.getrandbits(32)}"
+        content = noise_variant(pages[page_id], rng) if rng.random() < 0.8 else "\n".join(pages[page_id])
+        key = make_cache_key("analysis", url, content)
+        if key in exact:
+            counts["exact_hits"] += 1
+            continue
+
+        namespace = similarity_namespace("analysis", url)
+        started = time.perf_counter()
+        fingerprint = index.fingerprint(content)
+        fingerprint_seconds += time.perf_counter() - started
+
+        similar = index.find(namespace, fingerprint)
+        if similar is not None:
+            counts["similar_hits"] += 1
+            counts["wrong_hits"] += stored[similar] != page_id
+            continue
+
+        counts["misses"] += 1
+        exact[key] = page_id
+        stored[key] = page_id
+        index.add(namespace, fingerprint, key)
+
+    fingerprinted = counts["similar_hits"] + counts["misses"]
+    return {
+        "requests": requests,
+        "pages": len(pages),
+        "hit_rate_exact_only": round(counts["exact_hits"] / requests, 4),
+        "hit_rate_with_similarity": round((counts["exact_hits"] + counts["similar_hits"]) / requests, 4),
+        "wrong_page_served": counts["wrong_hits"],
+        "upstream_calls_saved": counts["similar_hits"],
+        "fingerprint_us_per_page": round(fingerprint_seconds / max(fingerprinted, 1) * 1_000_000, 1),
+    }
+
+def index_scale(size: int, rng: random.Random, lookups: int = 2000) -> Dict[str, Any]:
+    """Lookup cost and memory with `size` entries in a single namespace, the worst case"""
+    fingerprints = [rng.getrandbits(64) for _ in range(size)]
+    # Keys are built first: in the service they are shared with the result cache, not owned by the index
+    keys = [f"aiwatch:analysis:{number:064x}" for number in range(size)]
+
+    tracemalloc.start()
+    index = SimilarityIndex(settings.SIMILARITY_MAX_DISTANCE, size, settings.SIMILARITY_MIN_TOKENS)
+    for key, fingerprint in zip(keys, fingerprints):
+        index.add("analysis\0example.com\0", fingerprint, key)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # Near queries are stored fingerprints with a few bits flipped
+    queries = []
+    for _ in range(lookups):
+        fingerprint = rng.choice(fingerprints)
+        for bit in rng.sample(range(64), rng.randint(0, settings.SIMILARITY_MAX_DISTANCE)):
+            fingerprint ^= 1 << bit
+        queries.append(fingerprint)
+    queries += [rng.getrandbits(64) for _ in range(lookups)]
+
+    started = time.perf_counter()
+    found = [index.find("analysis\0example.com\0", query) is not None for query in queries]
+    banded_us = (time.perf_counter() - started) / len(queries) * 1_000_000
+
+    # Linear scan over the same fingerprints for comparison, on a sample of queries
+    sample = queries[:50] + queries[-50:]
+    started = time.perf_counter()
+    for query in sample:
+        min(hamming(query, fingerprint) for fingerprint in fingerprints)
+    linear_us = (time.perf_counter() - started) / len(sample) * 1_000_000
+
+    return {
+        "entries": size,
+        "near_queries_found": round(sum(found[:lookups]) / lookups, 4),
+        "random_queries_found": round(sum(found[lookups:]) / lookups, 4),
+        "lookup_us": round(banded_us, 1),
+        "linear_scan_us": round(linear_us, 1),
+        "bytes_per_entry": round(memory / size),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", type=Path, default=CORPUS_DIR)
+    parser.add_argument("--synthetic", type=int, default=300, help="Synthetic pages added to the corpus pages")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--scale", type=int, nargs="+", default=[10000, 100000, 300000])
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", type=Path, help="Write results as JSON")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    corpus = load_paragraphs(args.corpus)
+    pages = corpus + synthetic_pages(corpus, args.synthetic, rng)
+
+    pairs = pair_distances(pages, rng)
+    print(f"Pair distances ({len(pages)} pages)")
+    for kind in sorted({kind for _, _, kind in pairs}):
+        distances = sorted(distance for distance, _, pair_kind in pairs if pair_kind == kind)
+        print(f"  {kind:<12} min {distances[0]:>2}  median {distances[len(distances) // 2]:>2}  max {distances[-1]:>2}")
+
+    curve = {distance: precision_recall(pairs, distance) for distance in range(13)}
+    print(f"\n{'distance':>8} {'precision':>9} {'recall':>7} {'10% edits matched':>18}")
+    for distance, scores in curve.items():
+        marker = "  (configured)" if distance == settings.SIMILARITY_MAX_DISTANCE else ""
+        print(f"{distance:>8} {scores['precision']:>9} {scores['recall']:>7} {scores['gray_zone_matched']:>18}{marker}")
+
+    trace = replay_trace(pages, args.requests, rng)
+    print()
+    for key, value in trace.items():
+        print(f"{key:<28} {value}")
+
+    scale = [index_scale(size, rng) for size in args.scale]
+    print(f"\n{'entries':>8} {'near found':>10} {'random found':>12} {'lookup us':>10} {'linear us':>10} {'bytes/entry':>12}")
+    for row in scale:
+        print(
+            f"{row['entries']:>8} {row['near_queries_found']:>10} {row['random_queries_found']:>12} "
+            f"{row['lookup_us']:>10} {row['linear_scan_us']:>10} {row['bytes_per_entry']:>12}"
+        )
+
+    if args.output:
+        args.output.write_text(json.dumps({"precision_recall": curve, "trace": trace, "scale": scale}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Measure what the local token estimate and budget reservation add to every Claude call.
+
+Usage (from backend/python-ai):
+    python -m benchmarks.token_accounting [--corpus benchmarks/corpus] [--turns 0 4 12 30] [--repeat 20]
+
+For every saved page in the corpus, the messages.create parameters of a chat turn are built at
+several conversation lengths, the same way ClaudeService builds them. Each is then estimated:
+- "old": the finditer count the upstream admission check used before
+- "cold": TokenBudgets.estimate with nothing memoized
+- "warm": the next turn on the same page, where the system prompt, page block and older history
+  are memoized, and only the new message is counted
+It also times a full reserve and settle for a user with a budget, and checks that the estimates
+agree with the packer's own count.
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List
+
+from app.core.config import settings
+from app.services.claude_service import DEFAULT_SYSTEM_PROMPT, ClaudeService
+from app.services.context_packer import _TOKEN_RE, ContextPacker
+from app.services.token_budget import TokenBudgets, UsageAccount, UserUsage, _account, current_month
+from benchmarks.context_packing import CORPUS_DIR, load_corpus, make_history
+
+MESSAGE = "What are the most important things on this page?"
+
+def old_estimate(params: Dict[str, Any]) -> int:
+    """The estimate made before upstream admission until now: a generator over finditer for every text"""
+    texts = [block["text"] for block in params.get("system") or []]
+    for msg in params["messages"]:
+        content = msg["content"]
+        texts.extend([content] if isinstance(content, str) else [block.get("text", "") for block in content])
+    return sum(sum(1 for _ in _TOKEN_RE.finditer(text)) for text in texts)
+
+def chat_params(service: ClaudeService, context: Dict[str, Any], history: List[Dict[str, str]]) -> Dict[str, Any]:
+    packed = service.packer.pack(MESSAGE, context, history, DEFAULT_SYSTEM_PROMPT)
+    return {
+        "model": settings.CLAUDE_MODEL,
+        "max_tokens": settings.CLAUDE_MAX_TOKENS,
+        "system": service._build_system(None, packed),
+        "messages": service._build_messages(MESSAGE, packed),
+    }
+
+def time_us(func: Callable[[], Any], repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", type=Path, default=CORPUS_DIR)
+    parser.add_argument("--turns", type=int, nargs="+", default=[0, 4, 12, 30])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", type=Path, help="Write results as JSON")
+    args = parser.parse_args()
+
+    packer = ContextPacker(settings.CONTEXT_TOKEN_BUDGET, settings.CONTEXT_PAGE_SHARE, settings.CONTEXT_ACTIVITY_SHARE)
+    service = ClaudeService(packer=packer)
+    usage = SimpleNamespace(input_tokens=1000, output_tokens=200, cache_creation_input_tokens=0, cache_read_input_tokens=0)
+    rows = []
+
+    for page in load_corpus(args.corpus):
+        context = {"url": page["url"], "content": page["content"]}
+        for turns in args.turns:
+            params = chat_params(service, context, make_history(turns))
+            # The next turn: same page, one more exchange of history
+            next_params = chat_params(service, context, make_history(turns + 1))
+
+            def cold():
+                budgets = TokenBudgets({"free": 0})
+                return budgets.estimate(params)
+
+            warm_budgets = TokenBudgets({"free": 0})
+            warm_budgets.estimate(params)
+
+            budgets = TokenBudgets({"free": 10 ** 12})
+            budgets._usage["bench-user"] = UserUsage(month=current_month(), tier="free", persistent=False)
+            token = _account.set(UsageAccount("bench-user", "free"))
+
+            def reserve_and_settle():
+                reservation = budgets.reserve("chat", dict(params))
+                budgets.settle(reservation, usage)
+
+            try:
+                rows.append({
+                    "page": page["name"],
+                    "turns": turns,
+                    "tokens": warm_budgets.estimate(params),
+                    "old_tokens": old_estimate(params),
+                    "old_us": round(time_us(lambda: old_estimate(params), args.repeat), 1),
+                    "cold_us": round(time_us(cold, args.repeat), 1),
+                    "warm_us": round(time_us(lambda: warm_budgets.estimate(next_params), args.repeat), 1),
+                    "reserve_settle_us": round(time_us(reserve_and_settle, args.repeat), 1),
+                })
+            finally:
+                _account.reset(token)
+
+    print(f"{'page':<26} {'turns':>5} {'tokens':>7} {'old us':>8} {'cold us':>8} {'warm us':>8} {'reserve+settle us':>18}")
+    for row in rows:
+        print(
+            f"{row['page']:<26} {row['turns']:>5} {row['tokens']:>7} {row['old_us']:>8} {row['cold_us']:>8} "
+            f"{row['warm_us']:>8} {row['reserve_settle_us']:>18}"
+        )
+
+    count = max(len(rows), 1)
+    print(
+        f"\nMean per call: old {sum(r['old_us'] for r in rows) / count:.0f}us, "
+        f"cold {sum(r['cold_us'] for r in rows) / count:.0f}us, "
+        f"warm {sum(r['warm_us'] for r in rows) / count:.0f}us, "
+        f"reserve+settle {sum(r['reserve_settle_us'] for r in rows) / count:.0f}us"
+    )
+    # The new estimate adds message and framing overhead on top of the same text count
+    print(f"Mean estimate vs old count: {sum(r['tokens'] / max(r['old_tokens'], 1) for r in rows) / count:.3f}")
+
+    if args.output:
+        args.output.write_text(json.dumps({"rows": rows}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Compare how interactive calls wait for upstream slots with FIFO and with priority scheduling.
+
+Usage (from backend/python-ai):
+    python -m benchmarks.upstream_scheduling [--slots 8] [--service-time 0.25] [--duration 10]
+        [--interactive-rate 6] [--background-rate 28] [--abandon-ratio 0.3] [--abandon-after 1.0]
+
+Calls arrive as Poisson streams of interactive (chat) and background (analysis, suggestions)
+work and hold an UpstreamScheduler slot for an exponential service time, standing in for Claude.
+A share of the background clients gives up after a while, like a tab closed mid-request.
+Each mode runs the same arrivals:
+- "fifo": every call in one class, abandoned calls run to the end (the behaviour before)
+- "priority": interactive calls are served first, abandoned calls still run to the end
+- "priority+cancel": abandoned calls are cancelled, whether queued or holding a slot
+Reported per class are the p50 and p99 wait for a slot, and the upstream seconds spent on
+calls whose client had already gone.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.services.upstream_scheduler import UpstreamScheduler
+
+MODES = ("fifo", "priority", "priority+cancel")
+
+# (arrival offset, priority, service time, seconds until the client gives up or None)
+Arrival = Tuple[float, str, float, Optional[float]]
+
+def make_arrivals(args: argparse.Namespace) -> List[Arrival]:
+    rng = random.Random(args.seed)
+    arrivals: List[Arrival] = []
+    for priority, rate in (("interactive", args.interactive_rate), ("background", args.background_rate)):
+        at = rng.expovariate(rate)
+        while at < args.duration:
+            abandon = None
+            if priority == "background" and rng.random() < args.abandon_ratio:
+                abandon = args.abandon_after
+            arrivals.append((at, priority, rng.expovariate(1 / args.service_time), abandon))
+            at += rng.expovariate(rate)
+    return sorted(arrivals)
+
+def percentile(values: List[float], share: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * share), len(ordered) - 1)]
+
+async def simulate(mode: str, arrivals: List[Arrival], slots: int) -> Dict[str, Any]:
+    scheduler = UpstreamScheduler(slots, max_queue=len(arrivals) + 1)
+    waits: Dict[str, List[float]] = {"interactive": [], "background": []}
+    upstream = {"useful": 0.0, "wasted": 0.0}
+    cancelled = 0
+
+    async def call(priority: str, service_time: float, abandon_after: Optional[float]):
+        nonlocal cancelled
+        arrived = time.perf_counter()
+        gone_at = arrived + abandon_after if abandon_after is not None else None
+
+        async def work():
+            await scheduler.acquire(priority if mode != "fifo" else "background")
+            started = time.perf_counter()
+            waits[priority].append(started - arrived)
+            try:
+                await asyncio.sleep(service_time)
+            finally:
+                scheduler.release()
+                finished = time.perf_counter()
+                # Upstream time after the client left produced a response nobody read
+                useful_until = min(finished, gone_at) if gone_at is not None else finished
+                upstream["useful"] += max(useful_until - started, 0.0)
+                upstream["wasted"] += max(finished - max(started, useful_until), 0.0)
+
+        task = asyncio.ensure_future(work())
+        if abandon_after is None or mode != "priority+cancel":
+            await task
+            return
+
+        done, _ = await asyncio.wait({task}, timeout=abandon_after)
+        if not done:
+            cancelled += 1
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    started = time.perf_counter()
+    calls = []
+    for at, priority, service_time, abandon_after in arrivals:
+        delay = started + at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        calls.append(asyncio.create_task(call(priority, service_time, abandon_after)))
+    await asyncio.gather(*calls)
+
+    return {
+        "mode": mode,
+        "interactive_p50_ms": round(percentile(waits["interactive"], 0.5) * 1000, 1),
+        "interactive_p99_ms": round(percentile(waits["interactive"], 0.99) * 1000, 1),
+        "background_p50_ms": round(percentile(waits["background"], 0.5) * 1000, 1),
+        "background_p99_ms": round(percentile(waits["background"], 0.99) * 1000, 1),
+        "upstream_seconds": round(upstream["useful"] + upstream["wasted"], 1),
+        "wasted_seconds": round(upstream["wasted"], 1),
+        "cancelled": cancelled,
+        "elapsed_seconds": round(time.perf_counter() - started, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--slots", type=int, default=8)
+    parser.add_argument("--service-time", type=float, default=0.25, help="Mean seconds a call holds a slot")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--interactive-rate", type=float, default=6.0, help="Interactive calls per second")
+    parser.add_argument("--background-rate", type=float, default=28.0, help="Background calls per second")
+    parser.add_argument("--abandon-ratio", type=float, default=0.3, help="Share of background clients that leave early")
+    parser.add_argument("--abandon-after", type=float, default=1.0)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", type=Path, help="Write results as JSON")
+    args = parser.parse_args()
+
+    arrivals = make_arrivals(args)
+    capacity = args.slots / args.service_time
+    offered = (args.interactive_rate + args.background_rate) / capacity
+    print(f"{len(arrivals)} calls over {args.duration}s, {args.slots} slots, offered load {offered:.0%} of capacity")
+
+    rows = [asyncio.run(simulate(mode, arrivals, args.slots)) for mode in args.modes]
+
+    print(f"\n{'mode':<16} {'int p50':>8} {'int p99':>8} {'bg p50':>8} {'bg p99':>8} {'upstream s':>11} {'wasted s':>9} {'cancelled':>9}")
+    for row in rows:
+        print(
+            f"{row['mode']:<16} {row['interactive_p50_ms']:>8} {row['interactive_p99_ms']:>8} {row['background_p50_ms']:>8} "
+            f"{row['background_p99_ms']:>8} {row['upstream_seconds']:>11} {row['wasted_seconds']:>9} {row['cancelled']:>9}"
+        )
+    print("\nWaits in ms until a slot was free; upstream seconds are slot time spent, wasted after the client left")
+
+    if args.output:
+        args.output.write_text(json.dumps({"config": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()}, "runs": rows}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Compare throughput and latency from 1 worker process to N, with and without shared memory.
+
+Usage (from backend/python-ai):
+    python -m benchmarks.worker_scaling [--workers 1 2 4 8] [--concurrency 64] [--duration 20]
+        [--unique-ratio 0.2] [--output worker-scaling.json]
+
+For each worker count the service is started the way production runs it (`python main.py` with
+ENVIRONMENT=production and WORKERS=n) against a local fake upstream, and driven by the load_test
+client at one concurrency level. The fake upstream answers quickly by default, so the service's
+own CPU work decides the result. With more than one worker, the run is repeated with
+SHARED_MEMORY_ENABLED=false, so the per-worker result caches are cold in every worker.
+
+Reported per run:
+- throughput, p50 and p99, and the speedup and efficiency relative to one worker
+- CPU per worker, which also shows how evenly the kernel spread connections across workers
+- upstream calls per request, read from the fake upstream's counters, which is where a result
+  cache shared across workers shows up
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from app.core.serving import available_cpus
+from benchmarks.load_test import (
+    CORPUS_DIR,
+    SERVICE_DIR,
+    free_port,
+    git_revision,
+    load_pages,
+    parse_mix,
+    run_level,
+    service_pids,
+    start_upstream,
+    stop,
+    wait_for,
+)
+
+def start_service(workers: int, upstream: str, shared_memory: bool) -> Tuple[subprocess.Popen, str]:
+    port = free_port()
+    env = dict(
+        os.environ,
+        ANTHROPIC_API_KEY="sk-ant-load-test",
+        ANTHROPIC_BASE_URL=upstream,
+        ENVIRONMENT="production",
+        HOST="127.0.0.1",
+        PORT=str(port),
+        WORKERS=str(workers),
+        # The benchmark never uses follow-up endpoints, so per-worker conversations are fine
+        ALLOW_UNSHARED_WORKER_STATE="true",
+        SHARED_MEMORY_ENABLED=str(shared_memory).lower(),
+        LOG_LEVEL="WARNING",
+        LOG_FILE="",
+        RATE_LIMIT_ENABLED="false",
+        UPSTREAM_REQUESTS_PER_MINUTE="0",
+        UPSTREAM_TOKENS_PER_MINUTE="0",
+        NO_PROXY="127.0.0.1,localhost",
+        no_proxy="127.0.0.1,localhost",
+    )
+    env.pop("SHARED_MEMORY_NAME", None)
+    process = subprocess.Popen([sys.executable, "main.py"], cwd=SERVICE_DIR, env=env)
+    url = f"http://127.0.0.1:{port}"
+    wait_for(f"{url}/health/", timeout=60.0)
+    return process, url
+
+def upstream_messages(upstream: str) -> int:
+    return httpx.get(f"{upstream}/control", timeout=5.0, trust_env=False).json()["counters"]["messages"]
+
+def wait_for_workers(pid: int, workers: int, timeout: float = 30.0) -> List[int]:
+    """Worker PIDs once every worker has started, so CPU figures cover all of them"""
+    deadline = time.monotonic() + timeout
+    pids = service_pids(pid)
+    while workers > 1 and len(pids) < workers and time.monotonic() < deadline:
+        time.sleep(0.2)
+        pids = service_pids(pid)
+    return pids
+
+def measure(
+    workers: int,
+    shared_memory: bool,
+    args: argparse.Namespace,
+    upstream: str,
+    upstream_pid: int,
+    mix: Dict[str, float],
+    pages: List[Dict[str, str]],
+) -> Dict[str, Any]:
+    service: Optional[subprocess.Popen] = None
+    try:
+        service, target = start_service(workers, upstream, shared_memory)
+        pids = {"service": wait_for_workers(service.pid, workers), "upstream": [upstream_pid]}
+        calls_before = upstream_messages(upstream)
+        level = asyncio.run(run_level(target, args.concurrency, args, mix, pages, pids))
+        calls = upstream_messages(upstream) - calls_before
+    finally:
+        stop(service)
+
+    worker_cpu = list(level["cpu"].get("service", {}).values())
+    return {
+        "workers": workers,
+        "shared_memory": shared_memory,
+        "throughput_rps": level["throughput_rps"],
+        "p50_ms": level["p50_ms"],
+        "p99_ms": level["p99_ms"],
+        "error_rate": level["error_rate"],
+        "worker_cpu": worker_cpu,
+        "service_cpu": round(sum(worker_cpu), 3),
+        "upstream_calls_per_request": round(calls / level["requests"], 3) if level["requests"] else None,
+        "level": level,
+    }
+
+def print_row(row: Dict[str, Any]):
+    spread = " ".join(f"{share:.0%}" for share in row["worker_cpu"])
+    print(
+        f"{row['workers']:>7} {str(row['shared_memory']):>6} {row['throughput_rps']:>9} {row.get('speedup', ''):>8} "
+        f"{row.get('efficiency', ''):>10} {row['p50_ms']:>8} {row['p99_ms']:>8} {row['upstream_calls_per_request']:>10}  [{spread}]"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    cpus = available_cpus()
+    default_workers = sorted({1, 2, max(cpus // 2, 1), cpus})
+    parser.add_argument("--workers", type=int, nargs="+", default=default_workers)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--warmup", type=float, default=5.0)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--mix", default="message=4,suggestions=2,analyze=3,insights=1")
+    parser.add_argument("--unique-ratio", type=float, default=0.2, help="Share of requests that cannot hit a cache")
+    parser.add_argument("--no-shared-comparison", action="store_true", help="Skip the runs without shared memory")
+    parser.add_argument("--corpus", type=Path, default=CORPUS_DIR)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", type=Path, help="Write results as JSON")
+    upstream_group = parser.add_argument_group("fake upstream")
+    upstream_group.add_argument("--latency", type=float, default=0.05)
+    upstream_group.add_argument("--jitter", type=float, default=0.01)
+    upstream_group.add_argument("--tokens-per-second", type=float, default=4000.0)
+    upstream_group.add_argument("--output-tokens", type=int, default=120)
+    upstream_group.add_argument("--error-rate", type=float, default=0.0)
+    upstream_group.add_argument("--error-status", type=int, default=529)
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    pages = load_pages(args.corpus)
+    print(f"{cpus} CPUs available, concurrency {args.concurrency}, mix {mix}, unique ratio {args.unique_ratio}")
+    if max(args.workers) > cpus:
+        print(f"Note: more workers than CPUs ({max(args.workers)} > {cpus}); those runs measure oversubscription")
+
+    rows = []
+    upstream_process, upstream = start_upstream(args)
+    try:
+        for workers in args.workers:
+            modes = [True] if workers == 1 or args.no_shared_comparison else [True, False]
+            for shared_memory in modes:
+                rows.append(measure(workers, shared_memory, args, upstream, upstream_process.pid, mix, pages))
+    finally:
+        stop(upstream_process)
+
+    baseline = next((row for row in rows if row["workers"] == 1), None)
+    print(f"\n{'workers':>7} {'shm':>6} {'req/s':>9} {'speedup':>8} {'efficiency':>10} {'p50 ms':>8} {'p99 ms':>8} {'calls/req':>10}  worker CPU")
+    for row in rows:
+        if baseline and baseline["throughput_rps"]:
+            row["speedup"] = round(row["throughput_rps"] / baseline["throughput_rps"], 2)
+            row["efficiency"] = round(row["speedup"] / row["workers"], 2)
+        print_row(row)
+
+    if args.output:
+        report = {
+            "timestamp": datetime.utcnow().isoformat(),
+            "git_revision": git_revision(),
+            "python": sys.version.split()[0],
+            "cpus": cpus,
+            "config": {key: (str(value) if isinstance(value, Path) else value) for key, value in vars(args).items()},
+            "runs": rows,
+        }
+        args.output.write_text(json.dumps(report, indent=2))
+        print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
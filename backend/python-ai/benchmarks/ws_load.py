@@ -0,0 +1,164 @@
+"""Load-test the context monitoring WebSocket with many mostly idle connections.
+
+Usage (from backend/python-ai, with the service running):
+    python -m benchmarks.ws_load [--url ws://localhost:8000/context/monitor/ws] [--connections 2000]
+        [--active 0.05] [--duration 30] [--event-interval 0.1] [--server-pid PID]
+
+Every connection sends one snapshot. A fraction of them then behaves like a user editing a page:
+small content splices and scroll updates every event interval, with the occasional large change.
+The rest stay idle and only answer pings. The report shows connect latency, how many events were
+coalesced into each insights push, and (with --server-pid) the server's resident memory.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import websockets
+
+PARAGRAPH = "This paragraph describes the product in some detail so the page has realistic text. "
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+def server_rss_mb(pid: Optional[int]) -> Optional[float]:
+    """Resident memory of the server process, read from /proc"""
+    if not pid:
+        return None
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+class Stats:
+    def __init__(self):
+        self.connect_ms: List[float] = []
+        self.failed = 0
+        self.events = 0
+        self.insights = 0
+        self.resyncs = 0
+        self.errors = 0
+
+async def run_connection(index: int, args: argparse.Namespace, active: bool, stop_at: float, stats: Stats):
+    """Open one monitoring connection and drive it until stop_at"""
+    started = time.perf_counter()
+    try:
+        ws = await websockets.connect(args.url, max_size=2 ** 20, open_timeout=30)
+    except Exception:
+        stats.failed += 1
+        return
+    stats.connect_ms.append((time.perf_counter() - started) * 1000)
+
+    content = PARAGRAPH * random.randint(10, 40)
+    scroll = 0.0
+
+    async def receive():
+        async for raw in ws:
+            message = json.loads(raw)
+            kind = message.get("type")
+            if kind == "insights":
+                stats.insights += 1
+            elif kind == "resync":
+                stats.resyncs += 1
+            elif kind == "error":
+                stats.errors += 1
+
+    receiver = asyncio.create_task(receive())
+    try:
+        await ws.send(json.dumps({
+            "type": "snapshot",
+            "url": f"https://example.com/products/{index}",
+            "title": f"Product {index}",
+            "content": content,
+            "scrollDepth": scroll,
+            "domElements": [{"id": "buy", "tag": "button", "text": "Buy now"}],
+        }))
+        stats.events += 1
+
+        while time.monotonic() < stop_at:
+            if not active:
+                await asyncio.sleep(min(5.0, max(stop_at - time.monotonic(), 0)))
+                continue
+
+            await asyncio.sleep(args.event_interval * random.uniform(0.5, 1.5))
+            position = random.randint(0, len(content))
+            text = PARAGRAPH * (20 if random.random() < 0.02 else 0) or "typed "
+            content = content[:position] + text + content[position:]
+            scroll = min(scroll + random.uniform(0, 0.02), 1.0)
+            await ws.send(json.dumps({
+                "type": "diff",
+                "content": [{"start": position, "end": position, "text": text}],
+                "scrollDepth": scroll,
+                "length": len(content),
+            }))
+            stats.events += 1
+    finally:
+        receiver.cancel()
+        await ws.close()
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    stats = Stats()
+    active_count = int(args.connections * args.active)
+    rss_before = server_rss_mb(args.server_pid)
+
+    stop_at = time.monotonic() + args.ramp + args.duration
+    tasks = []
+    for index in range(args.connections):
+        tasks.append(asyncio.create_task(run_connection(index, args, index < active_count, stop_at, stats)))
+        # Spread connects over the ramp period
+        await asyncio.sleep(args.ramp / max(args.connections, 1))
+
+    rss_connected = server_rss_mb(args.server_pid)
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    return {
+        "connections": args.connections,
+        "active_connections": active_count,
+        "failed_connections": stats.failed,
+        "connect_ms_p50": round(percentile(stats.connect_ms, 50), 2),
+        "connect_ms_p99": round(percentile(stats.connect_ms, 99), 2),
+        "events_sent": stats.events,
+        "insights_received": stats.insights,
+        "events_per_insight": round(stats.events / stats.insights, 1) if stats.insights else None,
+        "resyncs": stats.resyncs,
+        "errors": stats.errors,
+        "server_rss_mb_before": rss_before,
+        "server_rss_mb_connected": rss_connected,
+        "server_kb_per_connection": (
+            round((rss_connected - rss_before) * 1024 / args.connections, 1)
+            if rss_before is not None and rss_connected is not None else None
+        ),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="ws://localhost:8000/context/monitor/ws")
+    parser.add_argument("--connections", type=int, default=2000)
+    parser.add_argument("--active", type=float, default=0.05, help="Fraction of connections sending diffs")
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--ramp", type=float, default=5.0, help="Seconds over which connections are opened")
+    parser.add_argument("--event-interval", type=float, default=0.1)
+    parser.add_argument("--server-pid", type=int, help="Report resident memory of this server process")
+    parser.add_argument("--output", type=Path, help="Write results as JSON")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    for key, value in result.items():
+        print(f"{key:<28} {value}")
+
+    if args.output:
+        args.output.write_text(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,27 @@
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
 import logging
 from datetime import datetime
 
 from app.core.config import settings
-from app.core.logging_config import setup_logging
-from app.api.routes import chat, context, health
-from app.services.claude_service import ClaudeService
+from app.core.logging_config import RequestIdMiddleware, setup_logging, shutdown_logging
+from app.api.routes import chat, context, health, metrics
+from app.services.cache import result_cache
+from app.services.claude_service import claude_service
+from app.services.conversation_store import conversation_store
+from app.services.metrics import MetricsMiddleware, loop_lag_monitor, worker_metrics
+from app.services.persistence import persistence_writer
+from app.services.rate_limiter import RateLimitExceeded, enforce_rate_limit, rate_limiter
+from app.services.resilience import ClaudeServiceError, apply_request_deadline
+from app.services.token_budget import apply_usage_account, token_budgets
+from app.services.upstream_scheduler import apply_request_priority
 
 # Setup logging
 setup_logging()
 logger = logging.getLogger(__name__)
 
-# Initialize services
-claude_service = ClaudeService()
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan manager"""
@@ -26,11 +32,26 @@ async def lifespan(app: FastAPI):
     
     # Initialize services
     await claude_service.initialize()
+    await persistence_writer.start()
+    await token_budgets.start()
+    if settings.METRICS_ENABLED:
+        loop_lag_monitor.start()
+        worker_metrics.start()
     
     yield
     
     # Shutdown
     logger.info("👋 Shutting down AIWatch Python AI Service")
+    await loop_lag_monitor.stop()
+    await worker_metrics.stop()
+    # Buffered token usage, chat turns and contexts are flushed before anything else goes away
+    await token_budgets.close()
+    await persistence_writer.close()
+    await claude_service.close()
+    await result_cache.close()
+    await conversation_store.close()
+    await rate_limiter.close()
+    shutdown_logging()
 
 # Create FastAPI app
 app = FastAPI(
@@ -47,12 +68,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
 
+# Request latency metrics per route
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
+# Request correlation IDs for logs (outermost, so every log line of a request carries one)
+app.add_middleware(RequestIdMiddleware)
+
 # Include routers
 app.include_router(health.router, prefix="/health", tags=["health"])
-app.include_router(chat.router, prefix="/chat", tags=["chat"])
-app.include_router(context.router, prefix="/context", tags=["context"])
+app.include_router(metrics.router, prefix="/metrics", tags=["metrics"])
+api_dependencies = [
+    Depends(enforce_rate_limit),
+    Depends(apply_request_deadline),
+    Depends(apply_usage_account),
+    Depends(apply_request_priority),
+]
+app.include_router(chat.router, prefix="/chat", tags=["chat"], dependencies=api_dependencies)
+app.include_router(context.router, prefix="/context", tags=["context"], dependencies=api_dependencies)
 
 # Root endpoint
 @app.get("/")
@@ -65,6 +101,25 @@ async def root():
         "claude_available": claude_service.is_available(),
     }
 
+# Rate limit handler
+@app.exception_handler(RateLimitExceeded)
+async def rate_limit_exception_handler(request, exc: RateLimitExceeded):
+    return JSONResponse(
+        status_code=429,
+        content={"error": "Rate limit exceeded", "detail": str(exc), "scope": exc.scope},
+        headers={"Retry-After": exc.retry_after_header()},
+    )
+
+# Claude service error handler
+@app.exception_handler(ClaudeServiceError)
+async def claude_service_exception_handler(request, exc: ClaudeServiceError):
+    headers = {"Retry-After": str(max(int(exc.retry_after + 0.999), 1))} if exc.retry_after else None
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"error": type(exc).__name__, "detail": str(exc)},
+        headers=headers,
+    )
+
 # Global exception handler
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
@@ -72,12 +127,6 @@ async def global_exception_handler(request, exc):
     return {"error": "Internal server error", "detail": str(exc)}
 
 if __name__ == "__main__":
-    import uvicorn
+    from app.core.serving import run
     
-    uvicorn.run(
-        "main:app",
-        host="0.0.0.0",
-        port=8001,
-        reload=settings.ENVIRONMENT == "development",
-        log_level="info",
-    )
\ No newline at end of file
+    run("main:app")
\ No newline at end of file
@@ -0,0 +1,136 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import cache
+from app.services.cache import LRUCache, RedisCache, ResultCache, SharedMemoryCache, make_cache_key, normalize_url
+from app.services.shared_memory import SharedMemoryStore
+
+fakeredis = pytest.importorskip("fakeredis")
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+class FailingRedis:
+    async def get(self, key):
+        raise ConnectionError("Redis is down")
+
+    async def set(self, key, value, ex=None):
+        raise ConnectionError("Redis is down")
+
+def test_lru_entries_expire_after_their_ttl(clock):
+    lru = LRUCache(max_entries=10, ttl_seconds=60)
+    lru.set("default", 1)
+    lru.set("short", 2, ttl_seconds=5)
+
+    clock.now += 10
+    assert lru.get("short") is None
+    assert lru.get("default") == 1
+
+    clock.now += 60
+    assert lru.get("default") is None
+    assert len(lru) == 0
+
+def test_lru_evicts_the_least_recently_used_entry(clock):
+    lru = LRUCache(max_entries=2, ttl_seconds=60)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    # Reading a makes b the oldest
+    assert lru.get("a") == 1
+    lru.set("c", 3)
+
+    assert lru.get("b") is None
+    assert (lru.get("a"), lru.get("c")) == (1, 3)
+    assert lru.evictions == 1
+
+async def test_shared_hits_fill_the_local_tier():
+    shared = RedisCache(fakeredis.FakeAsyncRedis(), ttl_seconds=60)
+    await shared.set("key", {"answer": 42})
+    results = ResultCache(LRUCache(max_entries=10, ttl_seconds=60), shared)
+
+    assert await results.get("key") == {"answer": 42}
+    assert await results.get("key") == {"answer": 42}
+    assert await results.get("other") is None
+
+    assert results.stats["shared_hits"] == 1
+    assert results.stats["local_hits"] == 1
+    assert results.stats["misses"] == 1
+    assert results.get_stats()["hit_ratio"] == round(2 / 3, 4)
+
+async def test_host_tier_is_read_before_redis_and_filled_from_it(tmp_path):
+    host = SharedMemoryCache(SharedMemoryStore(str(tmp_path / "results"), 64, 1024), ttl_seconds=60)
+    shared = RedisCache(fakeredis.FakeAsyncRedis(), ttl_seconds=60)
+    await shared.set("key", "from redis")
+    results = ResultCache(LRUCache(max_entries=10, ttl_seconds=60), shared, host=host)
+
+    assert await results.get("key") == "from redis"
+    assert await host.get("key") == "from redis"
+
+    # A second worker on the host finds it in shared memory without asking Redis
+    other = ResultCache(LRUCache(max_entries=10, ttl_seconds=60), shared, host=host)
+    assert await other.get("key") == "from redis"
+    assert other.stats["host_hits"] == 1
+    assert other.stats["shared_hits"] == 0
+    await host.close()
+
+async def test_set_writes_every_tier():
+    shared = RedisCache(fakeredis.FakeAsyncRedis(), ttl_seconds=60)
+    results = ResultCache(LRUCache(max_entries=10, ttl_seconds=60), shared)
+
+    await results.set("key", [1, 2, 3], ttl_seconds=30)
+
+    assert results.local.get("key") == [1, 2, 3]
+    assert await shared.get("key") == [1, 2, 3]
+    assert 0 < await shared.client.ttl("key") <= 30
+    assert results.stats["sets"] == 1
+
+async def test_redis_outage_only_costs_hits():
+    results = ResultCache(LRUCache(max_entries=10, ttl_seconds=60), RedisCache(FailingRedis(), ttl_seconds=60))
+
+    await results.set("key", "value")
+    assert await results.get("key") == "value"
+    assert await results.get("missing") is None
+
+    assert results.stats["shared_errors"] == 2
+    assert results.stats["local_hits"] == 1
+    assert results.stats["misses"] == 1
+
+async def test_disabled_cache_stores_nothing():
+    results = ResultCache(LRUCache(max_entries=10, ttl_seconds=60), enabled=False)
+
+    await results.set("key", "value")
+
+    assert await results.get("key") is None
+    assert len(results.local) == 0
+    assert not results.is_shared()
+
+@pytest.mark.parametrize("url, expected", [
+    ("HTTPS://Example.COM/Docs/", "https://example.com/Docs"),
+    ("https://example.com:443/a", "https://example.com/a"),
+    ("http://example.com:8080/a", "http://example.com:8080/a"),
+    ("https://example.com", "https://example.com/"),
+    ("https://example.com/a?b=2&a=1#section", "https://example.com/a?a=1&b=2"),
+    ("https://example.com/a?utm_source=x&fbclid=y&id=3", "https://example.com/a?id=3"),
+    ("  https://example.com/a  ", "https://example.com/a"),
+])
+def test_normalize_url(url, expected):
+    assert normalize_url(url) == expected
+
+def test_cache_key_ignores_url_noise_but_not_content_or_intent():
+    key = make_cache_key("analysis", "https://example.com/a?utm_source=x", "page text", "Buy")
+
+    assert key.startswith("aiwatch:analysis:")
+    assert key == make_cache_key("analysis", "https://EXAMPLE.com/a/#top", "page text", " buy ")
+    assert key != make_cache_key("analysis", "https://example.com/a", "other text", "buy")
+    assert key != make_cache_key("analysis", "https://example.com/a", "page text", "learn")
+    assert key != make_cache_key("suggestions", "https://example.com/a", "page text", "buy")
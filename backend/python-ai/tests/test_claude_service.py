@@ -0,0 +1,96 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.cache import LRUCache, ResultCache
+from app.services.claude_service import ClaudeService
+from app.services.resilience import CircuitBreaker
+from app.services.token_budget import TokenBudgets, _account
+from app.services.upstream_scheduler import UpstreamScheduler
+
+PARAMS = {
+    "model": "claude-test",
+    "max_tokens": 500,
+    "messages": [{"role": "user", "content": "Summarize this page for me"}],
+}
+
+class FakeMessages:
+    """messages.create that counts calls and answers after a delay"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = 0
+
+    async def create(self, **params):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        usage = SimpleNamespace(input_tokens=40, output_tokens=10, cache_creation_input_tokens=0, cache_read_input_tokens=0)
+        return SimpleNamespace(usage=usage, content=[], stop_reason="end_turn", model=params["model"])
+
+@pytest.fixture
+def budgets():
+    return TokenBudgets({"free": 100000, "pro": 0, "enterprise": 0})
+
+@pytest.fixture
+async def account(budgets):
+    token = _account.set(await budgets.account("user-1"))
+    yield budgets._usage["user-1"]
+    _account.reset(token)
+
+def make_service(budgets: TokenBudgets, scheduler: UpstreamScheduler, messages: FakeMessages) -> ClaudeService:
+    service = ClaudeService(
+        cache=ResultCache(LRUCache(max_entries=10, ttl_seconds=60)),
+        breaker=CircuitBreaker(failure_threshold=5, reset_seconds=30),
+        budgets=budgets,
+        scheduler=scheduler,
+    )
+    service.client = SimpleNamespace(messages=messages)
+    return service
+
+async def test_call_cancelled_while_queued_is_not_charged(budgets, account):
+    scheduler = UpstreamScheduler(max_slots=1, max_queue=10)
+    messages = FakeMessages()
+    service = make_service(budgets, scheduler, messages)
+
+    # Another call holds the only slot, so this one waits in the queue
+    await scheduler.acquire("interactive")
+    call = asyncio.create_task(service._create_message("analysis", **PARAMS))
+    await asyncio.sleep(0.01)
+    assert scheduler.queued() == 1
+    assert account.reserved > 0
+
+    call.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await call
+
+    assert messages.calls == 0
+    assert account.reserved == 0
+    assert account.input_tokens == 0 and account.output_tokens == 0
+    scheduler.release()
+    assert scheduler.in_use == 0
+
+async def test_call_cancelled_after_it_was_sent_is_charged_the_estimate(budgets, account):
+    scheduler = UpstreamScheduler(max_slots=1, max_queue=10)
+    messages = FakeMessages(delay=1.0)
+    service = make_service(budgets, scheduler, messages)
+
+    call = asyncio.create_task(service._create_message("analysis", **PARAMS))
+    await asyncio.sleep(0.01)
+    assert messages.calls == 1
+
+    call.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await call
+
+    assert account.reserved == 0
+    assert account.input_tokens > 0
+    assert account.output_tokens == 0
+
+async def test_finished_call_is_charged_the_reported_usage(budgets, account):
+    service = make_service(budgets, UpstreamScheduler(max_slots=1, max_queue=10), FakeMessages())
+
+    await service._create_message("analysis", **PARAMS)
+
+    assert account.reserved == 0
+    assert (account.input_tokens, account.output_tokens) == (40, 10)
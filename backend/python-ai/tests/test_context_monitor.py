@@ -0,0 +1,72 @@
+import pytest
+
+from app.services.context_monitor import DiffError, MonitorSession, PageState
+
+URL = "https://example.com/article"
+
+def snapshot(content: str) -> dict:
+    return {"type": "snapshot", "url": URL, "title": "Article", "content": content}
+
+def test_diffs_apply_to_a_truncated_snapshot():
+    state = PageState(max_content_chars=10)
+    state.apply_snapshot(snapshot("abcdefghijklmnopqrst"))
+    assert state.content == "abcdefghij"
+    assert state.length == 20
+
+    # Past the stored prefix: only the length moves
+    state.apply_diff({"content": [{"start": 15, "end": 15, "text": "XYZ"}], "length": 23})
+    assert state.content == "abcdefghij"
+
+    # Inside the prefix: the tail that falls off is dropped again
+    state.apply_diff({"content": [{"start": 2, "end": 4, "text": "1234"}], "length": 25})
+    assert state.content == "ab1234efgh"
+    assert state.length == 25
+
+def test_splice_reaching_past_the_prefix_keeps_only_what_is_known():
+    state = PageState(max_content_chars=10)
+    state.apply_snapshot(snapshot("abcdefghijklmnopqrst"))
+
+    state.apply_diff({"content": [{"start": 5, "end": 18, "text": "--"}], "length": 9})
+    assert state.content == "abcde--"
+    assert state.length == 9
+
+def test_splice_outside_the_client_content_is_refused():
+    state = PageState(max_content_chars=10)
+    state.apply_snapshot(snapshot("abcdefghijklmnopqrst"))
+
+    with pytest.raises(DiffError):
+        state.apply_diff({"content": [{"start": 18, "end": 21, "text": ""}]})
+
+def test_failed_diff_leaves_the_state_unchanged():
+    state = PageState(max_content_chars=100)
+    state.apply_snapshot(snapshot("hello world"))
+    state.mark_computed()
+    version = state.version
+
+    message = {"content": [{"start": 0, "end": 5, "text": "HELLO"}, {"start": 6, "end": 11, "text": "there"}], "length": 99}
+    with pytest.raises(DiffError):
+        state.apply_diff(message)
+
+    assert state.content == "hello world"
+    assert state.length == 11
+    assert state.version == version
+    assert state._changed_chars == 0
+    assert not state.is_significant(0.01)
+
+async def test_session_accepts_diffs_after_a_truncated_snapshot():
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def compute_insights(state):
+        return {}
+
+    session = MonitorSession(compute_insights, send, debounce_seconds=60, max_wait_seconds=60, min_change_ratio=0.1)
+    session.state.max_content_chars = 10
+    await session.handle(snapshot("x" * 30))
+    await session.handle({"type": "diff", "content": [{"start": 30, "end": 30, "text": "more"}], "length": 34})
+    await session.close()
+
+    assert session.events == 2
+    assert not [message for message in sent if message["type"] == "resync"]
@@ -0,0 +1,109 @@
+import pytest
+
+from app.services.context_packer import estimate_tokens
+from app.services.conversation_store import ConversationStore, MemoryConversationStore, RedisConversationStore
+
+fakeredis = pytest.importorskip("fakeredis")
+
+def turn(number: int):
+    return [
+        {"role": "user", "content": f"Question {number}"},
+        {"role": "assistant", "content": f"Answer {number}"},
+    ]
+
+def memory_store(max_messages: int = 6) -> MemoryConversationStore:
+    return MemoryConversationStore(max_conversations=10, ttl_seconds=60, max_messages=max_messages)
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+@pytest.fixture
+def store(server) -> ConversationStore:
+    shared = RedisConversationStore(fakeredis.FakeAsyncRedis(server=server), ttl_seconds=60, max_messages=6)
+    return ConversationStore(memory_store(), shared, max_message_tokens=50)
+
+async def test_turns_are_shared_through_redis(server, store):
+    await store.append("conversation-1", turn(1), created=True)
+
+    # Another worker has its own memory store but the same Redis
+    other = ConversationStore(memory_store(), RedisConversationStore(fakeredis.FakeAsyncRedis(server=server), 60, 6))
+    assert await other.load("conversation-1") == turn(1)
+    assert len(store.local) == 0
+    assert store.stats["created"] == 1
+
+async def test_redis_history_is_trimmed_to_the_newest_messages(store):
+    for number in range(5):
+        await store.append("conversation-1", turn(number))
+
+    messages = await store.load("conversation-1")
+    assert messages == turn(2) + turn(3) + turn(4)
+    assert store.stats["appended_messages"] == 10
+
+async def test_redis_conversations_expire(store):
+    await store.append("conversation-1", turn(1))
+
+    ttl = await store.shared.client.ttl("aiwatch:conversation:conversation-1")
+    assert 0 < ttl <= 60
+
+async def test_redis_outage_falls_back_to_memory(server, store):
+    server.connected = False
+
+    await store.append("conversation-1", turn(1))
+    assert await store.load("conversation-1") == turn(1)
+    assert len(store.local) == 1
+    assert store.stats["shared_errors"] == 2
+
+    # Once Redis is back, conversations written meanwhile are only on this worker
+    server.connected = True
+    assert await store.load("conversation-1") is None
+    assert store.stats["not_found"] == 1
+
+async def test_memory_history_is_trimmed_to_the_newest_messages():
+    store = ConversationStore(memory_store(max_messages=4))
+
+    for number in range(3):
+        await store.append("conversation-1", turn(number))
+
+    assert await store.load("conversation-1") == turn(1) + turn(2)
+
+async def test_memory_store_drops_the_least_recently_used_conversation():
+    store = ConversationStore(MemoryConversationStore(max_conversations=2, ttl_seconds=60, max_messages=10))
+
+    for conversation_id in ("conversation-1", "conversation-2", "conversation-3"):
+        await store.append(conversation_id, turn(1))
+
+    assert await store.load("conversation-1") is None
+    assert await store.load("conversation-3") == turn(1)
+
+async def test_messages_are_compacted_before_storing(store):
+    long_reply = "word " * 2000
+    await store.append("conversation-1", [
+        {"role": "user", "content": "Question", "timestamp": "2024-01-01T00:00:00"},
+        {"role": "assistant", "content": long_reply},
+        {"role": "system", "content": None},
+    ])
+
+    user, assistant, other = await store.load("conversation-1")
+    assert user == {"role": "user", "content": "Question"}
+    assert estimate_tokens(assistant["content"]) <= 50 < estimate_tokens(long_reply)
+    assert other == {"role": "user", "content": ""}
+
+async def test_delete_forgets_the_conversation_in_both_tiers(server, store):
+    await store.append("conversation-1", turn(1))
+    await store.local.append("conversation-1", turn(1))
+
+    await store.delete("conversation-1")
+
+    assert await store.load("conversation-1") is None
+    assert len(store.local) == 0
+
+@pytest.mark.parametrize("conversation_id, valid", [
+    ("0123456789abcdef0123456789abcdef", True),
+    ("conv_2024-01", True),
+    ("short", False),
+    ("has space in it", False),
+    ("x" * 65, False),
+])
+def test_conversation_ids_are_validated(conversation_id, valid):
+    assert ConversationStore.valid_id(conversation_id) is valid
@@ -0,0 +1,73 @@
+import pytest
+
+from app.services.page_classifier import GENERAL, TEXT_FEATURES, URL_FEATURES, PageClassifier, _alternatives
+
+@pytest.fixture
+def classifier():
+    return PageClassifier(max_content_chars=10_000)
+
+# The old keyword scan matched "dev" and "api" anywhere in the URL
+@pytest.mark.parametrize("url, label", [
+    ("https://example-devices.com/", GENERAL),
+    ("https://devblog.example.com/", GENERAL),
+    ("https://www.example.com/devices/phones", GENERAL),
+    ("https://developers-guild.example.org/events", GENERAL),
+    ("https://developer.apple.com/documentation/swift", "documentation"),
+    ("https://github.com/python/cpython/pulls", "developer-tools"),
+])
+def test_dev_in_a_url(classifier, url, label):
+    assert classifier.classify(url).label == label
+
+@pytest.mark.parametrize("url, label", [
+    ("https://rapidsupplies.com/", GENERAL),
+    ("https://example.com/capital/", GENERAL),
+    ("https://www.therapist-finder.example.com/", GENERAL),
+    ("https://example.com/api/v2/users", "documentation"),
+    ("https://api.example.com/", "documentation"),
+    ("https://docs.example.com/api/reference", "documentation"),
+])
+def test_api_in_a_url(classifier, url, label):
+    assert classifier.classify(url).label == label
+
+def test_page_text_decides_when_the_url_says_nothing(classifier):
+    result = classifier.classify(
+        "https://example.com/item-4411",
+        title="Trail Runner 2",
+        content="$89.99 Add to cart. In stock, free shipping. Customer reviews (120). Size guide",
+    )
+
+    assert result.label == "e-commerce"
+    assert result.confidence > 0.9
+
+def test_repeated_text_is_capped(classifier):
+    once = classifier.classify("https://example.com/", content="followers " * 3)
+    many = classifier.classify("https://example.com/", content="followers " * 500)
+
+    assert many.scores == once.scores
+
+def test_words_only_match_whole(classifier):
+    result = classifier.classify("https://example.com/", content="unsubscribed misreporter prepublished forks")
+
+    assert result.scores["content"] == 0
+    assert result.scores["developer-tools"] == 0
+
+def test_password_form_marks_a_form_page(classifier):
+    forms = [{"fields": [{"type": "email"}, {"type": "password"}]}]
+
+    assert classifier.classify("https://example.com/", forms=forms).label == "form-page"
+
+def test_confidence_is_a_softmax_over_the_scores(classifier):
+    result = classifier.classify("https://example.com/")
+
+    assert result.label == GENERAL
+    assert 0 < result.confidence < 1
+    assert PageClassifier(temperature=0.2).classify("https://example.com/").confidence > result.confidence
+
+@pytest.mark.parametrize("pattern", [pattern for _, pattern, _ in URL_FEATURES + TEXT_FEATURES])
+def test_alternatives_split_only_at_the_top_level(pattern):
+    assert "|".join(_alternatives(pattern)) == pattern
+    for alternative in _alternatives(pattern):
+        assert alternative.count("(") == alternative.count(")")
+
+def test_alternatives_respect_classes_and_escapes():
+    assert _alternatives(r"a|(?:b|c)d|[|]|\|e") == ["a", "(?:b|c)d", "[|]", r"\|e"]
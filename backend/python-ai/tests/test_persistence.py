@@ -0,0 +1,123 @@
+import os
+import uuid
+
+import pytest
+
+asyncpg = pytest.importorskip("asyncpg")
+
+from app.services.persistence import PersistenceWriter, conversation_uuid
+from benchmarks.persistence_throughput import reset_schema
+
+# A scratch schema in a local Postgres; the tests are skipped when it cannot be reached
+DSN = os.environ.get("TEST_DATABASE_URL", "postgresql://postgres@/postgres?host=/tmp/pg/data")
+SCHEMA = "aiwatch_test"
+
+USER_ID = "7d2b6c1e-3f4a-4b5c-8d9e-0a1b2c3d4e5f"
+CONTEXT = {"url": "https://docs.example.com/guide", "title": "Guide", "userIntent": "learn", "content": "page text " * 100}
+ANALYSIS = {"page_type": "documentation", "purpose": "Explains the product", "key_actions": ["Read"], "suggestions": []}
+
+@pytest.fixture
+async def conn():
+    try:
+        await reset_schema(DSN, SCHEMA)
+        conn = await asyncpg.connect(DSN, server_settings={"search_path": SCHEMA})
+    except (OSError, asyncpg.PostgresError) as e:
+        pytest.skip(f"Postgres not available: {e}")
+    yield conn
+    await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    await conn.close()
+
+@pytest.fixture
+async def writer(conn):
+    writer = PersistenceWriter(DSN, batch_size=100, flush_interval=0.05, server_settings={"search_path": SCHEMA})
+    yield writer
+    await writer.close()
+
+async def test_flush_writes_turns_and_contexts_in_one_batch(conn, writer):
+    writer.record_turn("conv-a", "First question", "First answer", "claude-test", 0.5, CONTEXT, user_id=USER_ID)
+    writer.record_turn("conv-a", "Second question", "Second answer", "claude-test", 0.7)
+    writer.record_turn("conv-b", "Other question", "Other answer", "claude-test", 0.2)
+    writer.record_context("https://docs.example.com/guide", ANALYSIS, title="Guide", user_id=USER_ID)
+
+    assert await writer.flush_once() == 7
+    assert writer.pending == 0
+
+    conversations = {row["id"]: row for row in await conn.fetch("SELECT * FROM conversations")}
+    assert conversations[conversation_uuid("conv-a")]["message_count"] == 4
+    assert conversations[conversation_uuid("conv-a")]["title"] == "First question"
+    assert conversations[conversation_uuid("conv-b")]["message_count"] == 2
+
+    first = await conn.fetchrow("SELECT * FROM messages WHERE content = 'First question'")
+    assert first["user_id"] == uuid.UUID(USER_ID)
+    assert first["role"] == "user"
+    assert await conn.fetchval("SELECT count(*) FROM messages") == 6
+
+    context = await conn.fetchrow("SELECT * FROM contexts")
+    assert (context["domain"], context["page_type"], context["user_id"]) == ("docs.example.com", "documentation", uuid.UUID(USER_ID))
+
+async def test_only_the_context_snapshot_is_buffered_and_written(conn, writer):
+    writer.record_turn("conv-a", "Question", "Answer", "claude-test", 0.5, CONTEXT)
+
+    assert "content" not in writer._messages[0][4]
+    await writer.flush_once()
+    snapshot = await conn.fetchval("SELECT context_snapshot::text FROM messages WHERE role = 'user'")
+    assert "page text" not in snapshot
+    assert "docs.example.com" in snapshot
+
+async def test_refused_rows_are_dropped_without_losing_the_rest(conn, writer):
+    for number in range(5):
+        # content is NOT NULL, so the third reply is refused on its own
+        writer.record_turn(f"conv-{number}", f"Question {number}", None if number == 2 else "Answer", "claude-test", 0.1)
+    writer.record_context("https://example.com", ANALYSIS)
+
+    assert await writer.flush_once() == 10
+    assert writer.stats["rejected"] == 1
+    assert writer.pending == 0
+    assert await conn.fetchval("SELECT count(*) FROM messages") == 9
+    assert await conn.fetchval("SELECT count(*) FROM contexts") == 1
+    assert await conn.fetchval("SELECT count(*) FROM messages WHERE content = 'Question 2'") == 1
+
+async def test_nul_characters_are_stripped(conn, writer):
+    context = {"url": "https://example.com/a\x00b", "title": "Ti\x00tle"}
+    writer.record_turn("conv-a", "Hel\x00lo", "Wor\x00ld", "claude-test", 0.1, context)
+    writer.record_context("https://example.com/\x00", {"purpose": "Pur\x00pose"}, title="Pa\x00ge")
+
+    assert await writer.flush_once() == 3
+    assert writer.stats["rejected"] == 0
+    assert sorted(await conn.fetchval("SELECT array_agg(content) FROM messages")) == ["Hello", "World"]
+    snapshot = await conn.fetchval("SELECT context_snapshot->>'title' FROM messages WHERE role = 'user'")
+    assert snapshot == "Title"
+    context = await conn.fetchrow("SELECT url, title, content_summary FROM contexts")
+    assert tuple(context) == ("https://example.com/", "Page", "Purpose")
+
+async def test_close_flushes_what_is_buffered(conn, writer):
+    await writer.start()
+    for number in range(250):
+        writer.record_turn("conv-a", f"Question {number}", "Answer", "claude-test", 0.1)
+
+    await writer.close()
+
+    assert writer.pending == 0
+    assert writer.stats["written"] == 500
+    assert await conn.fetchval("SELECT count(*) FROM messages") == 500
+    assert await conn.fetchval("SELECT message_count FROM conversations") == 500
+
+def test_full_buffer_drops_new_rows():
+    writer = PersistenceWriter("postgresql://unused", max_pending=5)
+
+    for number in range(4):
+        writer.record_turn("conv-a", f"Question {number}", "Answer", "claude-test", 0.1)
+    writer.record_context("https://example.com", ANALYSIS)
+
+    assert writer.pending == 5
+    assert writer.stats["enqueued"] == 5
+    # A turn is two rows and is kept or dropped whole, so the last two turns went and the context still fit
+    assert writer.stats["dropped"] == 4
+
+def test_disabled_writer_buffers_nothing():
+    writer = PersistenceWriter("postgresql://unused", enabled=False)
+
+    writer.record_turn("conv-a", "Question", "Answer", "claude-test", 0.1)
+
+    assert writer.pending == 0
+    assert writer.stats["enqueued"] == 0
@@ -0,0 +1,141 @@
+import asyncio
+import time
+
+import pytest
+
+from app.core.config import settings
+from app.services.rate_limiter import (
+    _BUCKET,
+    LocalBucketStore,
+    RateLimiter,
+    RateLimitExceeded,
+    RedisBucketStore,
+    SharedMemoryBucketStore,
+)
+from app.services.shared_memory import SLOT_HEADER_BYTES, SharedMemoryStore
+
+fakeredis = pytest.importorskip("fakeredis")
+
+def shared_memory_store(path) -> SharedMemoryBucketStore:
+    return SharedMemoryBucketStore(SharedMemoryStore(str(path), 64, SLOT_HEADER_BYTES + _BUCKET.size))
+
+@pytest.fixture(params=["local", "shared_memory", "redis"])
+async def store(request, tmp_path):
+    if request.param == "local":
+        store = LocalBucketStore(max_keys=100)
+    elif request.param == "shared_memory":
+        store = shared_memory_store(tmp_path / "ratelimit")
+    else:
+        # fakeredis runs the Lua script when lupa is installed
+        pytest.importorskip("lupa")
+        store = RedisBucketStore(fakeredis.FakeAsyncRedis())
+    yield store
+    await store.close()
+
+class BrokenStore:
+    async def take(self, requests):
+        raise ConnectionError("Redis is down")
+
+    async def close(self):
+        pass
+
+async def test_bucket_allows_a_burst_then_reports_the_wait(store):
+    bucket = [("client:a", 3, 1.0, 1)]
+
+    assert [await store.take(bucket) for _ in range(3)] == [0.0, 0.0, 0.0]
+    wait = await store.take(bucket)
+    assert 0.9 < wait <= 1.0
+
+async def test_bucket_refills_over_time(store):
+    bucket = [("client:a", 2, 20.0, 1)]
+    await store.take(bucket)
+    await store.take(bucket)
+    assert await store.take(bucket) > 0
+
+    await asyncio.sleep(0.1)
+    assert await store.take(bucket) == 0.0
+
+async def test_buckets_are_taken_from_together_or_not_at_all(store):
+    requests = [("upstream:requests", 10, 1.0, 1), ("upstream:tokens", 100, 1.0, 60)]
+
+    assert await store.take(requests) == 0.0
+    # The token bucket is short, so the request bucket must not be charged either
+    assert await store.take(requests) > 0
+    for _ in range(9):
+        assert await store.take([("upstream:requests", 10, 1.0, 1)]) == 0.0
+    assert await store.take([("upstream:requests", 10, 1.0, 1)]) > 0
+
+async def test_keys_have_separate_buckets(store):
+    assert await store.take([("client:a", 1, 1.0, 1)]) == 0.0
+    assert await store.take([("client:a", 1, 1.0, 1)]) > 0
+    assert await store.take([("client:b", 1, 1.0, 1)]) == 0.0
+
+async def test_redis_buckets_expire_once_they_would_be_full():
+    pytest.importorskip("lupa")
+    client = fakeredis.FakeAsyncRedis()
+    store = RedisBucketStore(client)
+
+    await store.take([("client:a", 10, 2.0, 1)])
+
+    assert 5000 < await client.pttl("client:a") <= 6000
+
+async def test_shared_memory_buckets_are_shared_by_workers(tmp_path):
+    first = shared_memory_store(tmp_path / "ratelimit")
+    second = shared_memory_store(tmp_path / "ratelimit")
+    bucket = [("client:a", 2, 1.0, 1)]
+
+    assert await first.take(bucket) == 0.0
+    assert await second.take(bucket) == 0.0
+    assert await first.take(bucket) > 0
+    await first.close()
+    await second.close()
+
+async def test_local_store_keeps_only_recent_keys():
+    store = LocalBucketStore(max_keys=2)
+
+    for key in ("a", "b", "c"):
+        await store.take([(key, 1, 1.0, 1)])
+
+    assert list(store._buckets) == ["b", "c"]
+
+async def test_check_client_raises_with_retry_after(monkeypatch):
+    monkeypatch.setattr(settings, "REQUESTS_PER_MINUTE", 60)
+    monkeypatch.setattr(settings, "RATE_LIMIT_BURST", 2)
+    limiter = RateLimiter(LocalBucketStore(max_keys=100))
+
+    await limiter.check_client("client-1")
+    await limiter.check_client("client-1")
+    with pytest.raises(RateLimitExceeded) as exc_info:
+        await limiter.check_client("client-1")
+
+    assert exc_info.value.scope == "client"
+    assert exc_info.value.retry_after_header() == "1"
+    assert (limiter.stats["client_allowed"], limiter.stats["client_rejected"]) == (2, 1)
+
+async def test_unreachable_store_falls_back_to_local_limits(monkeypatch):
+    monkeypatch.setattr(settings, "REQUESTS_PER_MINUTE", 60)
+    monkeypatch.setattr(settings, "RATE_LIMIT_BURST", 1)
+    limiter = RateLimiter(BrokenStore(), fallback=LocalBucketStore(max_keys=100))
+
+    await limiter.check_client("client-1")
+    with pytest.raises(RateLimitExceeded):
+        await limiter.check_client("client-1")
+
+    assert limiter.stats["store_errors"] == 2
+
+async def test_upstream_requests_wait_for_budget_or_are_shed(monkeypatch):
+    monkeypatch.setattr(settings, "UPSTREAM_REQUESTS_PER_MINUTE", 600)
+    monkeypatch.setattr(settings, "UPSTREAM_TOKENS_PER_MINUTE", 0)
+    monkeypatch.setattr(settings, "UPSTREAM_MAX_WAIT_SECONDS", 0.5)
+    limiter = RateLimiter(LocalBucketStore(max_keys=100))
+    # Ten requests per second, starting from an empty bucket
+    limiter.store._buckets["aiwatch:ratelimit:upstream:requests"] = (0.0, time.monotonic())
+
+    await limiter.admit_upstream(100)
+    assert limiter.stats["upstream_queued"] == 1
+
+    limiter.pause_upstream(5)
+    with pytest.raises(RateLimitExceeded) as exc_info:
+        await limiter.admit_upstream(100)
+    assert exc_info.value.scope == "upstream"
+    assert limiter.stats["upstream_shed"] == 1
@@ -0,0 +1,227 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import anthropic
+import httpx
+import pytest
+
+from app.core.config import settings
+from app.services import resilience
+from app.services.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    ServiceUnavailableError,
+    UpstreamError,
+    UpstreamTimeoutError,
+    backoff_delay,
+    call_with_resilience,
+    deadline_scope,
+    generation_scope,
+    remaining_time,
+)
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resilience, "time", SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(settings, "CLAUDE_RETRY_BASE_DELAY", 0.01)
+    monkeypatch.setattr(settings, "CLAUDE_RETRY_MAX_DELAY", 0.05)
+    monkeypatch.setattr(settings, "CLAUDE_MAX_RETRIES", 2)
+
+def status_error(status: int, retry_after: str = None) -> anthropic.APIStatusError:
+    headers = {"retry-after": retry_after} if retry_after else {}
+    response = httpx.Response(status, headers=headers, request=httpx.Request("POST", "https://api.anthropic.com/v1/messages"))
+    return anthropic.APIStatusError(f"Error code: {status}", response=response, body=None)
+
+class Upstream:
+    """Fails with the given errors in turn, then answers"""
+
+    def __init__(self, *errors: BaseException):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def __call__(self) -> str:
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "reply"
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=30)
+
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.consecutive_failures == 0
+
+    for _ in range(3):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == "open"
+
+    clock.now += 10
+    with pytest.raises(CircuitOpenError) as exc_info:
+        breaker.before_call()
+    assert exc_info.value.retry_after == 20
+    assert breaker.is_open()
+
+def test_half_open_breaker_lets_one_probe_through(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+    breaker.before_call()
+    breaker.record_failure()
+
+    clock.now += 30
+    breaker.before_call()
+    assert breaker.state == "half_open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.before_call()
+
+def test_failed_probe_reopens_the_breaker(clock):
+    breaker = CircuitBreaker(failure_threshold=5, reset_seconds=30)
+    for _ in range(5):
+        breaker.record_failure()
+
+    clock.now += 30
+    breaker.before_call()
+    breaker.record_failure()
+
+    assert breaker.state == "open"
+    assert breaker.retry_in() == 30
+    assert breaker.stats["opened"] == 2
+
+def test_released_probe_frees_the_half_open_slot(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+    breaker.record_failure()
+    clock.now += 30
+
+    breaker.before_call()
+    breaker.release()
+
+    breaker.before_call()
+    assert breaker.state == "half_open"
+
+def test_backoff_is_jittered_up_to_a_growing_cap(monkeypatch):
+    monkeypatch.setattr(settings, "CLAUDE_RETRY_BASE_DELAY", 0.5)
+    monkeypatch.setattr(settings, "CLAUDE_RETRY_MAX_DELAY", 8.0)
+    bounds = []
+    monkeypatch.setattr(resilience.random, "uniform", lambda low, high: bounds.append((low, high)) or high / 2)
+
+    delays = [backoff_delay(attempt, status_error(503)) for attempt in range(6)]
+
+    assert bounds == [(0, 0.5), (0, 1.0), (0, 2.0), (0, 4.0), (0, 8.0), (0, 8.0)]
+    assert delays == [0.25, 0.5, 1.0, 2.0, 4.0, 4.0]
+
+def test_backoff_waits_at_least_the_capped_retry_after(monkeypatch):
+    monkeypatch.setattr(settings, "CLAUDE_RETRY_MAX_DELAY", 8.0)
+
+    assert backoff_delay(0, status_error(429, retry_after="3")) >= 3
+    assert backoff_delay(0, status_error(429, retry_after="60")) == 8.0
+
+async def test_retryable_errors_are_retried_until_success():
+    breaker = CircuitBreaker(failure_threshold=5, reset_seconds=30)
+    upstream = Upstream(status_error(529), status_error(503))
+    seen = []
+
+    assert await call_with_resilience(upstream, breaker, on_error=seen.append) == "reply"
+
+    assert upstream.calls == 3
+    assert [error.status_code for error in seen] == [529, 503]
+    assert breaker.state == "closed"
+    assert breaker.stats["failures"] == 2
+
+async def test_retries_stop_after_max_retries():
+    breaker = CircuitBreaker(failure_threshold=5, reset_seconds=30)
+    upstream = Upstream(*(status_error(503) for _ in range(5)))
+
+    with pytest.raises(ServiceUnavailableError):
+        await call_with_resilience(upstream, breaker, max_retries=1)
+
+    assert upstream.calls == 2
+
+async def test_client_errors_are_not_retried_or_counted_against_the_upstream():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+    upstream = Upstream(status_error(400))
+
+    with pytest.raises(UpstreamError):
+        await call_with_resilience(upstream, breaker)
+
+    assert upstream.calls == 1
+    assert breaker.state == "closed"
+
+async def test_rate_limits_are_retried_without_opening_the_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+    upstream = Upstream(status_error(429))
+
+    assert await call_with_resilience(upstream, breaker) == "reply"
+    assert breaker.state == "closed"
+
+async def test_open_breaker_fails_fast():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+    breaker.record_failure()
+    upstream = Upstream()
+
+    with pytest.raises(CircuitOpenError):
+        await call_with_resilience(upstream, breaker)
+    assert upstream.calls == 0
+
+async def test_deadline_bounds_the_call_and_counts_as_a_failure():
+    breaker = CircuitBreaker(failure_threshold=5, reset_seconds=30)
+
+    async def slow():
+        await asyncio.sleep(1)
+
+    with deadline_scope(0.05):
+        with pytest.raises(UpstreamTimeoutError):
+            await call_with_resilience(slow, breaker)
+    assert breaker.consecutive_failures == 1
+
+async def test_deadline_spent_waiting_for_admission_is_not_a_failure():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+
+    async def admit():
+        await asyncio.sleep(1)
+
+    with deadline_scope(0.05):
+        with pytest.raises(UpstreamTimeoutError):
+            await call_with_resilience(Upstream(), breaker, admit=admit)
+    assert breaker.state == "closed"
+    assert breaker.stats["failures"] == 0
+
+def test_nested_deadlines_only_shorten():
+    with deadline_scope(10) as outer:
+        with deadline_scope(60) as inner:
+            assert inner == outer
+        with deadline_scope(1):
+            assert remaining_time() <= 1
+    assert remaining_time() is None
+
+def test_generation_scope_extends_the_deadline_for_long_replies(monkeypatch):
+    monkeypatch.setattr(settings, "CLAUDE_MIN_OUTPUT_TOKENS_PER_SECOND", 50.0)
+
+    with deadline_scope(1):
+        with generation_scope(4000) as deadline:
+            assert deadline - time.monotonic() > 70
+        assert remaining_time() <= 1
+
+        token = resilience._extendable.set(False)
+        with generation_scope(4000):
+            assert remaining_time() <= 1
+        resilience._extendable.reset(token)
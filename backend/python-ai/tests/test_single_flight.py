@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from app.services.single_flight import SingleFlight
+
+class Upstream:
+    """A call that runs until released, recording whether it was cancelled"""
+
+    def __init__(self):
+        self.started = 0
+        self.cancelled = False
+        self.release = asyncio.Event()
+
+    async def __call__(self) -> str:
+        self.started += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return "result"
+
+async def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    upstream = Upstream()
+
+    waiters = [asyncio.create_task(flight.do("key", upstream)) for _ in range(3)]
+    await asyncio.sleep(0)
+    upstream.release.set()
+
+    assert await asyncio.gather(*waiters) == ["result"] * 3
+    assert upstream.started == 1
+    assert flight.stats["coalesced"] == 2
+    assert flight.in_flight() == 0
+
+async def test_cancelling_one_waiter_leaves_the_others_running():
+    flight = SingleFlight()
+    upstream = Upstream()
+
+    first = asyncio.create_task(flight.do("key", upstream))
+    second = asyncio.create_task(flight.do("key", upstream))
+    await asyncio.sleep(0)
+
+    first.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await first
+    await asyncio.sleep(0)
+    assert not upstream.cancelled
+    assert flight.in_flight() == 1
+
+    upstream.release.set()
+    assert await second == "result"
+    assert flight.stats["cancelled"] == 0
+
+async def test_shared_call_is_cancelled_when_the_last_waiter_leaves():
+    flight = SingleFlight()
+    upstream = Upstream()
+
+    waiters = [asyncio.create_task(flight.do("key", upstream)) for _ in range(2)]
+    await asyncio.sleep(0)
+
+    for waiter in waiters:
+        waiter.cancel()
+    await asyncio.gather(*waiters, return_exceptions=True)
+    await asyncio.sleep(0)
+
+    assert upstream.cancelled
+    assert flight.stats["cancelled"] == 1
+    assert flight.in_flight() == 0
+
+async def test_caller_after_cancellation_starts_a_fresh_call():
+    flight = SingleFlight()
+    abandoned, fresh = Upstream(), Upstream()
+
+    waiter = asyncio.create_task(flight.do("key", abandoned))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+
+    fresh.release.set()
+    assert await flight.do("key", fresh) == "result"
+    assert (abandoned.started, fresh.started) == (1, 1)
+
+async def test_errors_reach_every_waiter():
+    flight = SingleFlight()
+
+    async def failing():
+        await asyncio.sleep(0)
+        raise RuntimeError("upstream failed")
+
+    results = await asyncio.gather(*(flight.do("key", failing) for _ in range(2)), return_exceptions=True)
+
+    assert [type(result) for result in results] == [RuntimeError, RuntimeError]
+    assert flight.stats["calls"] == 1
+    assert flight.in_flight() == 0
@@ -0,0 +1,136 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.token_budget import (
+    RequestTooLargeError,
+    TokenBudgetExceeded,
+    TokenBudgets,
+    _account,
+    current_month,
+)
+
+def params(text: str = "Summarize this page for me", max_tokens: int = 500) -> dict:
+    return {"model": "claude-test", "max_tokens": max_tokens, "messages": [{"role": "user", "content": text}]}
+
+def reported(input_tokens: int, output_tokens: int, cache_read: int = 0):
+    return SimpleNamespace(
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        cache_creation_input_tokens=0,
+        cache_read_input_tokens=cache_read,
+    )
+
+@pytest.fixture
+def budgets():
+    return TokenBudgets({"free": 2000, "pro": 0, "enterprise": 0}, max_request_tokens=1000, min_output_tokens=100)
+
+@pytest.fixture
+async def usage(budgets):
+    token = _account.set(await budgets.account("user-1"))
+    yield budgets._usage["user-1"]
+    _account.reset(token)
+
+async def test_reserve_holds_the_estimate_and_max_tokens(budgets, usage):
+    reservation = budgets.reserve("chat", params())
+
+    assert reservation.user_id == "user-1"
+    assert reservation.reserved == reservation.estimated_tokens + 500
+    assert usage.reserved == reservation.reserved
+    assert usage.used == 0
+
+async def test_settle_charges_the_reported_usage(budgets, usage):
+    reservation = budgets.reserve("chat", params())
+
+    budgets.settle(reservation, reported(15, 120, cache_read=5))
+
+    assert usage.reserved == 0
+    assert (usage.input_tokens, usage.output_tokens, usage.messages) == (20, 120, 1)
+    assert budgets.charged_by_tier["free"] == 140
+    assert budgets.calibration["claude-test"] == pytest.approx(20 / reservation.raw_tokens)
+
+async def test_settle_without_usage_charges_the_input_estimate(budgets, usage):
+    reservation = budgets.reserve("analysis", params())
+
+    budgets.settle(reservation)
+
+    assert usage.reserved == 0
+    assert (usage.input_tokens, usage.output_tokens, usage.messages) == (reservation.estimated_tokens, 0, 0)
+
+async def test_release_charges_nothing_and_a_reservation_settles_once(budgets, usage):
+    reservation = budgets.reserve("chat", params())
+
+    budgets.release(reservation)
+    budgets.settle(reservation, reported(30, 120))
+
+    assert usage.reserved == 0
+    assert usage.used == 0
+
+async def test_output_is_trimmed_to_what_is_left_of_the_budget(budgets, usage):
+    usage.input_tokens = 1500
+
+    reservation = budgets.reserve("chat", params())
+
+    assert reservation.max_tokens == 500 - reservation.estimated_tokens
+    assert budgets.stats["output_trimmed"] == 1
+
+async def test_exhausted_budget_is_refused(budgets, usage):
+    usage.input_tokens = 1950
+
+    with pytest.raises(TokenBudgetExceeded) as exc_info:
+        budgets.reserve("chat", params())
+
+    assert exc_info.value.status_code == 429
+    assert exc_info.value.retry_after > 0
+    assert usage.reserved == 0
+
+async def test_reservations_in_flight_count_against_the_budget(budgets, usage):
+    first = budgets.reserve("chat", params(max_tokens=950))
+    budgets.reserve("chat", params(max_tokens=950))
+
+    with pytest.raises(TokenBudgetExceeded):
+        budgets.reserve("chat", params(max_tokens=950))
+
+    budgets.release(first)
+    budgets.reserve("chat", params(max_tokens=950))
+
+async def test_oversized_requests_are_refused_for_everyone(budgets):
+    with pytest.raises(RequestTooLargeError) as exc_info:
+        budgets.reserve("chat", params("word " * 2000))
+
+    assert exc_info.value.status_code == 413
+
+async def test_unbudgeted_tier_is_not_limited(budgets, usage):
+    await budgets.account("user-1", tier="pro")
+    usage.input_tokens = 10 ** 9
+
+    reservation = budgets.reserve("chat", params())
+
+    assert reservation.max_tokens == 500
+
+def test_calls_without_an_account_are_only_estimated(budgets):
+    reservation = budgets.reserve("chat", params())
+
+    assert reservation.user_id is None
+    assert reservation.reserved == 0
+    budgets.settle(reservation, reported(30, 120))
+    assert budgets.charged_by_tier["free"] == 0
+
+async def test_adjust_corrects_this_months_usage(budgets, usage):
+    budgets.settle(budgets.reserve("analysis", params()), reported(300, 200))
+
+    await budgets.adjust("user-1", current_month(), -100, 50)
+    assert (usage.input_tokens, usage.output_tokens) == (200, 250)
+    assert budgets.stats["adjusted_tokens"] == -50
+
+    await budgets.adjust("user-1", "2000-01", 500, 500)
+    assert (usage.input_tokens, usage.output_tokens) == (200, 250)
+
+async def test_usage_of_a_past_month_is_dropped(budgets, usage):
+    usage.input_tokens = 1950
+    usage.month = "2000-01"
+
+    reservation = budgets.reserve("chat", params())
+
+    assert usage.month == current_month()
+    assert reservation.max_tokens == 500
@@ -31,7 +31,11 @@ CREATE TABLE public.users (
     usage_stats JSONB DEFAULT '{
         "messages_this_month": 0,
         "websites_monitored": 0,
-        "last_active": null
+        "last_active": null,
+        "usage_month": null,
+        "tokens_this_month": 0,
+        "input_tokens_this_month": 0,
+        "output_tokens_this_month": 0
     }'
 );
 